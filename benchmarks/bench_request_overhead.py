@@ -0,0 +1,111 @@
+# ============================================
+# benchmarks/bench_request_overhead.py
+# Đo overhead của lớp HTTP (serialize + middleware) cho một bot reply
+# có product cards, không gồm LLM/DB:
+#   - BEFORE: BaseHTTPMiddleware sửa Content-Type + JSONResponse (json stdlib)
+#   - AFTER:  CharsetMiddleware (pure ASGI) + FastJSONResponse (orjson) + GZip
+#
+# Chạy:  python benchmarks/bench_request_overhead.py [requests] [products]
+# ============================================
+
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from src.utils.json_fast import CharsetMiddleware, FastJSONResponse  # noqa: E402
+
+
+def _payload(products: int) -> dict:
+    return {
+        "success": True,
+        "response": "Dạ chị ơi, em gửi chị mấy mẫu váy công sở đang còn size M ạ 🌸",
+        "products": [
+            {
+                "id": f"9f1c2d3e-0000-4000-8000-{i:012d}",
+                "name": f"Đầm công sở cổ vuông tay phồng mẫu {i}",
+                "price": 459000 + i * 1000,
+                "stock": 12,
+                "slug": f"dam-cong-so-co-vuong-{i}",
+                "description": "Chất liệu lụa cao cấp, thoáng mát, phù hợp đi làm và dự tiệc. " * 3,
+                "image_url": f"https://cdn.bewo.vn/products/{i}/main.jpg",
+                "sizes": ["S", "M", "L", "XL"],
+                "colors": ["Đen", "Trắng kem", "Xanh navy"],
+            }
+            for i in range(products)
+        ],
+        "recommendation_type": "showcase",
+        "message_type": "product_card",
+        "memory_stats": {"conversation_messages": 8, "memory_retrieved": 3, "has_summary": False},
+    }
+
+
+def _before_app(payload: dict) -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def add_charset_header(request, call_next):
+        response = await call_next(request)
+        if response.headers.get("Content-Type", "").startswith("application/json"):
+            response.headers["Content-Type"] = "application/json; charset=utf-8"
+        return response
+
+    @app.post("/chat/")
+    async def chat():
+        return JSONResponse(content=payload, media_type="application/json; charset=utf-8")
+
+    return app
+
+
+def _after_app(payload: dict) -> FastAPI:
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CharsetMiddleware)
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+    @app.post("/chat/")
+    async def chat():
+        return FastJSONResponse(content=payload)
+
+    return app
+
+
+async def _measure(app: FastAPI, requests: int) -> tuple:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm-up
+        for _ in range(20):
+            await client.post("/chat/", json={"message": "hi"})
+        latencies = []
+        wire_bytes = 0
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.post("/chat/", json={"message": "hi"})
+            latencies.append((time.perf_counter() - started) * 1_000_000)
+            wire_bytes = int(response.headers.get("content-length") or len(response.content))
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return statistics.mean(latencies), p99, wire_bytes
+
+
+async def _run(requests: int, products: int) -> None:
+    payload = _payload(products)
+    before = await _measure(_before_app(payload), requests)
+    after = await _measure(_after_app(payload), requests)
+
+    print(f"{requests} requests, {products} product cards per reply")
+    print(f"BEFORE (BaseHTTPMiddleware + json):      mean {before[0]:.0f}µs  p99 {before[1]:.0f}µs  {before[2]} bytes")
+    print(f"AFTER  (pure ASGI + orjson + gzip):      mean {after[0]:.0f}µs  p99 {after[1]:.0f}µs  {after[2]} bytes")
+    print(f"Speedup mean x{before[0] / after[0]:.2f}, p99 x{before[1] / after[1]:.2f}, size x{before[2] / after[2]:.1f} smaller")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    products = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(_run(requests, products))
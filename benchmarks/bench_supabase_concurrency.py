@@ -0,0 +1,87 @@
+# ============================================
+# benchmarks/bench_supabase_concurrency.py
+# So sánh throughput khi nhiều turn chạy đồng thời:
+#   - BEFORE: sync PostgREST client `.execute()` bên trong `async def`
+#   - AFTER:  AsyncPostgrestClient + httpx pool dùng chung
+#
+# Chạy:  python benchmarks/bench_supabase_concurrency.py [turns] [latency_ms]
+# Không cần Supabase thật: script dựng một fake PostgREST local
+# trả về sau `latency_ms` mili-giây cho mỗi request.
+# ============================================
+
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from postgrest import AsyncPostgrestClient, SyncPostgrestClient
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Số query PostgREST trong một turn của handle_message
+# (conversation RPC, insert message, build_context x3, insert bot, usage log, ...)
+QUERIES_PER_TURN = 8
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_postgrest(port: int, latency_s: float) -> uvicorn.Server:
+    async def table(request):
+        await asyncio.sleep(latency_s)
+        return JSONResponse([{"id": "1"}])
+
+    app = Starlette(routes=[Route("/rest/v1/{table}", table, methods=["GET", "POST"])])
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _turn_sync(client: SyncPostgrestClient) -> None:
+    for _ in range(QUERIES_PER_TURN):
+        client.from_("products").select("*").limit(1).execute()
+
+
+async def _turn_async(client: AsyncPostgrestClient) -> None:
+    for _ in range(QUERIES_PER_TURN):
+        await client.from_("products").select("*").limit(1).execute()
+
+
+async def _run(turns: int, base_url: str) -> None:
+    sync_client = SyncPostgrestClient(base_url)
+    started = time.perf_counter()
+    await asyncio.gather(*[_turn_sync(sync_client) for _ in range(turns)])
+    before = time.perf_counter() - started
+
+    http = httpx.AsyncClient(limits=httpx.Limits(max_connections=50, max_keepalive_connections=20))
+    async_client = AsyncPostgrestClient(base_url, http_client=http)
+    started = time.perf_counter()
+    await asyncio.gather(*[_turn_async(async_client) for _ in range(turns)])
+    after = time.perf_counter() - started
+    await http.aclose()
+
+    print(f"{turns} turns x {QUERIES_PER_TURN} queries")
+    print(f"BEFORE (sync .execute()): {before:.2f}s  -> {turns / before:.1f} turns/s")
+    print(f"AFTER  (async pool):      {after:.2f}s  -> {turns / after:.1f} turns/s")
+    print(f"Speedup: x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    port = _free_port()
+    server = _start_fake_postgrest(port, latency_ms / 1000)
+    try:
+        asyncio.run(_run(turns, f"http://127.0.0.1:{port}/rest/v1"))
+    finally:
+        server.should_exit = True
@@ -6,7 +6,9 @@
 import os
 import json
 import re
-from typing import List, Dict, Any, Optional
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, TypedDict
 from pydantic import Field
 from dotenv import load_dotenv
 from pathlib import Path
@@ -17,7 +19,9 @@ from ..utils.prompts import (
     get_order_manager_prompt,
     get_support_agent_prompt,
     get_triage_agent_prompt,
-    build_full_prompt_with_context
+    build_agent_instructions,
+    build_full_prompt_with_context,
+    prompt_fingerprint,
 )
 
 # Load env
@@ -30,13 +34,88 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 WEBSITE_URL = os.getenv("WEBSITE_URL", "https://bewo.vn")
 
 # Import OpenAI Agents
-from agents import Agent, Runner, function_tool, ModelSettings
-from agents.extensions.models.litellm_model import LitellmModel
+from agents import Agent, HandoffInputData, Runner, function_tool, handoff, ModelSettings, TracingProcessor, add_trace_processor
+from agents.items import HandoffCallItem, HandoffOutputItem, ReasoningItem
+from openai.types.responses import ResponseTextDeltaEvent
 
 # Import Supabase
-from ..utils.connect_supabase import get_supabase_client
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.json_fast import loads
+from ..config.env import settings
+from ..services.metrics_service import (
+    FUNCTION_CONTINUATIONS,
+    LLM_CALLS,
+    LLM_ERRORS,
+    LLM_INPUT_TOKENS,
+    LLM_TOKENS,
+    TOOL_CALLS,
+)
+from ..services.llm_resilience_service import LlmCircuitOpenError, llm_resilience
+from ..services.product_cache_service import product_cache
+from ..services.tracing_service import record_span
+from ..utils.structured_logger import get_logger
+from .intent_router import INTENT_ORDER, INTENT_PRODUCT, INTENT_SUPPORT, INTENT_TRIAGE, Route, intent_router
+from .model_tiers import (
+    TIER_CONTINUATION,
+    TIER_ORDER,
+    TIER_PRODUCT,
+    TIER_ROUTING,
+    TIER_SUPPORT,
+    begin_turn_models,
+    model_tiers,
+    turn_model_name,
+)
+
+log = get_logger("agent_service")
 
-supabase = get_supabase_client()
+supabase = get_async_supabase_client()
+
+
+# ============================================
+# TRACING: span của agents SDK (agent / handoff / function / generation)
+# → gắn vào trace hiện tại của turn
+# ============================================
+
+def _iso_to_ns(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    return int(datetime.fromisoformat(value).timestamp() * 1_000_000_000)
+
+
+class _AgentSpanBridge(TracingProcessor):
+    def on_trace_start(self, trace) -> None:
+        pass
+
+    def on_trace_end(self, trace) -> None:
+        pass
+
+    def on_span_start(self, span) -> None:
+        pass
+
+    def on_span_end(self, span) -> None:
+        try:
+            start_ns, end_ns = _iso_to_ns(span.started_at), _iso_to_ns(span.ended_at)
+            if start_ns is None or end_ns is None:
+                return
+            data = span.span_data.export() or {}
+            attributes = {
+                f"agent.{key}": value if isinstance(value, (str, int, float, bool)) else str(value)
+                for key, value in data.items()
+                if key in ("name", "from_agent", "to_agent", "model", "handoffs", "tools")
+            }
+            error = span.error.get("message") if span.error else None
+            record_span(f"agent.{span.span_data.type}", start_ns, end_ns, attributes, error=error)
+        except Exception as e:
+            log.warning("agent_span_bridge_failed", error=str(e))
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self) -> None:
+        pass
+
+
+add_trace_processor(_AgentSpanBridge())
 
 
 # ============================================
@@ -50,33 +129,32 @@ def validate_address_function_call(args: dict) -> bool:
     """
     # 1. Check address_line exists
     if not args.get("address_line"):
-        print("⚠️ save_address: Missing address_line")
+        log.warning("function_args_invalid", function="save_address", reason="missing_address_line")
         return False
     
     address_line = args["address_line"]
     
     # 2. Check if address_line có số nhà và tên đường
     if not re.match(r'^\d+[A-Z]?\s+.+', address_line):
-        print(f"⚠️ save_address: Invalid address_line format: {address_line}")
+        log.warning("function_args_invalid", function="save_address", reason="address_line_format", address_line=address_line)
         return False
     
     # 3. Check if address_line is only numbers
     if re.match(r'^[\d\s]+$', address_line):
-        print(f"⚠️ save_address: address_line is only numbers: {address_line}")
+        log.warning("function_args_invalid", function="save_address", reason="address_line_numeric", address_line=address_line)
         return False
     
     # 4. Validate city
     if not args.get("city"):
-        print("⚠️ save_address: Missing city")
+        log.warning("function_args_invalid", function="save_address", reason="missing_city")
         return False
     
     # 5. Check if address_line looks like product description
     product_keywords = ["cao cấp", "lớp", "set", "vest", "quần", "áo"]
     if any(keyword in address_line.lower() for keyword in product_keywords):
-        print(f"⚠️ save_address: address_line looks like product description: {address_line}")
+        log.warning("function_args_invalid", function="save_address", reason="address_line_is_product", address_line=address_line)
         return False
     
-    print("✅ save_address validation passed")
     return True
 
 
@@ -84,17 +162,16 @@ def validate_customer_info_function_call(args: dict) -> bool:
     """Validate customer info trước khi execute"""
     # Check if có ít nhất 1 thông tin hữu ích
     if not args.get("full_name") and not args.get("preferred_name") and not args.get("phone"):
-        print("⚠️ save_customer_info: No useful data provided")
+        log.warning("function_args_invalid", function="save_customer_info", reason="no_data")
         return False
     
     # Validate phone format nếu có
     if args.get("phone"):
         phone = args["phone"]
         if not re.match(r'^[0+][\d]{9,11}$', phone):
-            print(f"⚠️ save_customer_info: Invalid phone format: {phone}")
+            log.warning("function_args_invalid", function="save_customer_info", reason="phone_format", phone=phone)
             return False
     
-    print("✅ save_customer_info validation passed")
     return True
 
 
@@ -112,47 +189,89 @@ def _format_price(price: Optional[float]) -> str:
 # TOOLS - Product Management
 # ============================================
 
+async def _query_products(query: str, limit: int) -> List[Dict]:
+    """search_products trên Supabase (lỗi → raise để product cache không lưu kết quả rỗng)"""
+    response = await supabase.from_("products") \
+        .select("id, name, price, stock, slug, description, images:product_images(image_url, is_primary)") \
+        .eq("is_active", True) \
+        .text_search("name", query) \
+        .limit(limit) \
+        .execute()
+
+    products = []
+    for p in response.data or []:
+        images = p.get("images", [])
+        primary_image = next((img["image_url"] for img in images if img.get("is_primary")), None)
+        first_image = images[0]["image_url"] if images else None
+        
+        products.append({
+            "id": p["id"],
+            "name": p["name"],
+            "price": _format_price(p.get("price")),
+            "priceRaw": p.get("price", 0),
+            "stock": p.get("stock", 0),
+            "url": f"{WEBSITE_URL}/products/{p.get('slug', '')}",
+            "description": (p.get("description", "") or "")[:150],
+            "image": primary_image or first_image
+        })
+    return products
+
+
+async def _query_product_details(productId: str) -> Optional[Dict]:
+    response = await supabase.from_("products") \
+        .select("id, name, price, stock, slug, description, images:product_images(image_url, is_primary, display_order)") \
+        .eq("id", productId) \
+        .eq("is_active", True) \
+        .limit(1) \
+        .execute()
+
+    if not response.data or len(response.data) == 0:
+        return None
+
+    product = response.data[0]
+    images = product.get("images", [])
+    
+    images.sort(key=lambda img: (
+        not img.get("is_primary", False),
+        img.get("display_order", 999)
+    ))
+    
+    image_urls = [img["image_url"] for img in images]
+
+    return {
+        "id": product["id"],
+        "name": product["name"],
+        "price": _format_price(product.get("price")),
+        "priceRaw": product.get("price", 0),
+        "stock": product.get("stock", 0),
+        "url": f"{WEBSITE_URL}/products/{product.get('slug', '')}",
+        "description": product.get("description"),
+        "images": image_urls
+    }
+
+
+# Hàng trăm cuộc trò chuyện cùng tìm một query / xem một sản phẩm → cache dùng chung
+product_cache.register_loaders(_query_products, _query_product_details)
+
+
 @function_tool
 async def search_products(
     query: str = Field(..., description='Từ khóa tìm kiếm (VD: "váy dạ hội", "áo sơ mi")'),
     limit: int = Field(default=5, description='Số lượng sản phẩm tối đa')
 ) -> List[Dict]:
     """Tìm kiếm sản phẩm trong cửa hàng theo từ khóa"""
-    print(f"[Tool] search_products: query='{query}', limit={limit}")
+    log.info("tool_call", tool="search_products", query=query, limit=limit)
     
     if not supabase:
         return []
     
     try:
-        response = supabase.from_("products") \
-            .select("id, name, price, stock, slug, description, images:product_images(image_url, is_primary)") \
-            .eq("is_active", True) \
-            .text_search("name", query) \
-            .limit(limit) \
-            .execute()
-
-        products = []
-        for p in response.data or []:
-            images = p.get("images", [])
-            primary_image = next((img["image_url"] for img in images if img.get("is_primary")), None)
-            first_image = images[0]["image_url"] if images else None
-            
-            products.append({
-                "id": p["id"],
-                "name": p["name"],
-                "price": _format_price(p.get("price")),
-                "priceRaw": p.get("price", 0),
-                "stock": p.get("stock", 0),
-                "url": f"{WEBSITE_URL}/products/{p.get('slug', '')}",
-                "description": (p.get("description", "") or "")[:150],
-                "image": primary_image or first_image
-            })
-
-        print(f"[Tool] search_products: Found {len(products)} products")
+        products = await product_cache.search(query, limit)
+        log.debug("tool_result", tool="search_products", count=len(products))
         return products
         
     except Exception as e:
-        print(f"[Tool] search_products ERROR: {e}")
+        log.error("tool_failed", tool="search_products", error=str(e))
         return []
 
 
@@ -161,48 +280,19 @@ async def get_product_details(
     productId: str = Field(..., description='ID của sản phẩm')
 ) -> Optional[Dict]:
     """Lấy thông tin chi tiết của một sản phẩm cụ thể"""
-    print(f"[Tool] get_product_details: productId={productId}")
+    log.info("tool_call", tool="get_product_details", product_id=productId)
     
     if not supabase:
         return None
         
     try:
-        response = supabase.from_("products") \
-            .select("id, name, price, stock, slug, description, images:product_images(image_url, is_primary, display_order)") \
-            .eq("id", productId) \
-            .eq("is_active", True) \
-            .limit(1) \
-            .execute()
-
-        if not response.data or len(response.data) == 0:
-            return None
-
-        product = response.data[0]
-        images = product.get("images", [])
-        
-        images.sort(key=lambda img: (
-            not img.get("is_primary", False),
-            img.get("display_order", 999)
-        ))
-        
-        image_urls = [img["image_url"] for img in images]
-
-        result = {
-            "id": product["id"],
-            "name": product["name"],
-            "price": _format_price(product.get("price")),
-            "priceRaw": product.get("price", 0),
-            "stock": product.get("stock", 0),
-            "url": f"{WEBSITE_URL}/products/{product.get('slug', '')}",
-            "description": product.get("description"),
-            "images": image_urls
-        }
-        
-        print(f"[Tool] get_product_details: Found {product['name']}")
+        result = await product_cache.details(productId)
+        if result:
+            log.debug("tool_result", tool="get_product_details", product=result["name"])
         return result
         
     except Exception as e:
-        print(f"[Tool] get_product_details ERROR: {e}")
+        log.error("tool_failed", tool="get_product_details", error=str(e))
         return None
 
 
@@ -210,20 +300,44 @@ async def get_product_details(
 # TOOLS - Order Management
 # ============================================
 
-@function_tool
-async def get_order_status(
-    orderId: str = Field(..., description='Mã đơn hàng')
+ORDER_STATUS_LABELS = {
+    "pending": "Đang chờ xác nhận",
+    "confirmed": "Đã xác nhận",
+    "processing": "Đang xử lý",
+    "shipping": "Đang giao hàng",
+    "delivered": "Đã giao hàng",
+    "cancelled": "Đã hủy",
+}
+
+
+def _order_owned_by(order: Dict, conversation_id: Optional[str], customer_phone: Optional[str]) -> bool:
+    """Đơn thuộc hội thoại này (cùng conversation_id) hoặc cùng SĐT khách"""
+    if conversation_id and order.get("conversation_id") == conversation_id:
+        return True
+    phone = re.sub(r'\D', '', customer_phone or "")
+    if not phone:
+        return False
+    order_phones = (order.get("customer_phone"), order.get("phone"), order.get("shipping_phone"))
+    return any(re.sub(r'\D', '', p or "") == phone for p in order_phones)
+
+
+async def fetch_order_status(
+    orderId: str,
+    conversation_id: Optional[str] = None,
+    customer_phone: Optional[str] = None,
 ) -> Optional[Dict]:
-    """Tra cứu trạng thái đơn hàng theo mã đơn hàng"""
-    print(f"[Tool] get_order_status: orderId={orderId}")
-    
+    """
+    Tra cứu đơn hàng (dùng chung cho tool get_order_status và fast path).
+    Truyền conversation_id / customer_phone → chỉ trả đơn của chính khách đó,
+    đơn của người khác coi như không tìm thấy.
+    """
     if not supabase:
         return None
 
     try:
         cleaned_order_id = re.sub(r'\D', '', orderId)
         
-        response = supabase.from_("orders") \
+        response = await supabase.from_("orders") \
             .select("*") \
             .eq("id", int(cleaned_order_id) if cleaned_order_id.isdigit() else orderId) \
             .limit(1) \
@@ -233,30 +347,34 @@ async def get_order_status(
             return None
 
         order = response.data[0]
-        status_map = {
-            "pending": "Đang chờ xác nhận",
-            "confirmed": "Đã xác nhận",
-            "processing": "Đang xử lý",
-            "shipping": "Đang giao hàng",
-            "delivered": "Đã giao hàng",
-            "cancelled": "Đã hủy",
-        }
-        
+        if (conversation_id or customer_phone) and not _order_owned_by(order, conversation_id, customer_phone):
+            log.warning("order_status_not_owned", order_id=str(order["id"]), conversation_id=conversation_id)
+            return None
+
         result = {
             "id": str(order["id"]),
-            "status": status_map.get(order.get("status", "unknown"), order.get("status")),
+            "status": ORDER_STATUS_LABELS.get(order.get("status", "unknown"), order.get("status")),
             "total": _format_price(order.get("total_amount")),
             "createdAt": order.get("created_at", "")
         }
         
-        print(f"[Tool] get_order_status: Status={result['status']}")
+        log.debug("order_status_loaded", order_id=result["id"], status=result["status"])
         return result
         
     except Exception as e:
-        print(f"[Tool] get_order_status ERROR: {e}")
+        log.error("order_status_failed", error=str(e))
         return None
 
 
+@function_tool
+async def get_order_status(
+    orderId: str = Field(..., description='Mã đơn hàng')
+) -> Optional[Dict]:
+    """Tra cứu trạng thái đơn hàng theo mã đơn hàng"""
+    log.info("tool_call", tool="get_order_status", order_id=orderId)
+    return await fetch_order_status(orderId)
+
+
 # ============================================
 # TOOLS - Cart & Customer Management
 # ============================================
@@ -271,7 +389,7 @@ async def save_customer_info(
     usual_size: Optional[str] = Field(None, description='Size thường mặc')
 ) -> Dict[str, Any]:
     """Lưu thông tin cơ bản của khách hàng"""
-    print(f"[Tool] save_customer_info: conversationId={conversationId}")
+    log.info("tool_call", tool="save_customer_info", conversation_id=conversationId)
     
     # TODO: Implement logic to save customer info to database
     # For now, return success message
@@ -299,7 +417,7 @@ async def save_address(
     full_name: Optional[str] = Field(None, description='Tên người nhận')
 ) -> Dict[str, Any]:
     """Lưu địa chỉ giao hàng"""
-    print(f"[Tool] save_address: conversationId={conversationId}")
+    log.info("tool_call", tool="save_address", conversation_id=conversationId)
     
     # TODO: Implement logic to save address to database
     # For now, return success message
@@ -325,7 +443,7 @@ async def add_to_cart(
     quantity: int = Field(default=1, description='Số lượng')
 ) -> Dict[str, Any]:
     """Thêm sản phẩm vào giỏ hàng"""
-    print(f"[Tool] add_to_cart: product_id={product_id}, size={size}, quantity={quantity}")
+    log.info("tool_call", tool="add_to_cart", product_id=product_id, size=size, quantity=quantity)
     
     # TODO: Implement logic to add product to cart
     # For now, return success message
@@ -346,7 +464,7 @@ async def confirm_and_create_order(
     confirmed: bool = Field(..., description='Xác nhận đặt hàng')
 ) -> Dict[str, Any]:
     """Xác nhận và tạo đơn hàng"""
-    print(f"[Tool] confirm_and_create_order: confirmed={confirmed}")
+    log.info("tool_call", tool="confirm_and_create_order", confirmed=confirmed)
     
     if not confirmed:
         return {
@@ -364,33 +482,42 @@ async def confirm_and_create_order(
 
 
 # ============================================
-# DEFINE MODEL
+# DEFINE MODEL (theo tier, xem model_tiers.py)
 # ============================================
 
-gemini_model = LitellmModel(
-    model="gemini/gemini-2.0-flash-exp",
-    api_key=GEMINI_API_KEY
-)
-
 
 # ============================================
 # DEFINE AGENTS
 # ============================================
 
+_HANDOFF_NOISE = (HandoffCallItem, HandoffOutputItem, ReasoningItem)
+
+
+def _trim_handoff_input(data: HandoffInputData) -> HandoffInputData:
+    """
+    Agent nhận handoff không cần đọc lại phần điều phối của agent trước
+    (handoff call / output, reasoning); giữ tin của khách và kết quả tool (vd: product id)
+    """
+    return data.clone(
+        pre_handoff_items=tuple(item for item in data.pre_handoff_items if not isinstance(item, _HANDOFF_NOISE)),
+        new_items=tuple(item for item in data.new_items if not isinstance(item, _HANDOFF_NOISE)),
+    )
+
+
 productAgent = Agent(
     name='Product Consultant',
-    model=gemini_model,
+    model=model_tiers.model(TIER_PRODUCT),
     model_settings=ModelSettings(include_usage=True),
-    instructions=get_product_consultant_prompt(),
+    instructions=build_agent_instructions(get_product_consultant_prompt()),
     tools=[search_products, get_product_details],
     handoff_description='Chuyên gia tư vấn sản phẩm thời trang của BeWo'
 )
 
 orderAgent = Agent(
     name='Order Manager',
-    model=gemini_model,
+    model=model_tiers.model(TIER_ORDER),
     model_settings=ModelSettings(include_usage=True),
-    instructions=get_order_manager_prompt(),
+    instructions=build_agent_instructions(get_order_manager_prompt()),
     tools=[
         get_order_status,
         save_customer_info,
@@ -403,21 +530,137 @@ orderAgent = Agent(
 
 supportAgent = Agent(
     name='Customer Support',
-    model=gemini_model,
+    model=model_tiers.model(TIER_SUPPORT),
     model_settings=ModelSettings(include_usage=True),
-    instructions=get_support_agent_prompt(),
+    instructions=build_agent_instructions(get_support_agent_prompt()),
     tools=[],
     handoff_description='Nhân viên hỗ trợ khách hàng'
 )
 
 triageAgent = Agent(
     name='BeWo Assistant',
-    model=gemini_model,
+    model=model_tiers.model(TIER_ROUTING),
     model_settings=ModelSettings(include_usage=True),
-    instructions=get_triage_agent_prompt(),
-    handoffs=[productAgent, orderAgent, supportAgent]
+    instructions=build_agent_instructions(get_triage_agent_prompt()),
+    handoffs=[
+        handoff(productAgent, input_filter=_trim_handoff_input),
+        handoff(orderAgent, input_filter=_trim_handoff_input),
+        handoff(supportAgent, input_filter=_trim_handoff_input),
+    ]
 )
 
+# Intent router có thể bắt đầu turn thẳng ở specialist → specialist cần handoff
+# sang nhau khi route sai (thay vì trả lời ngoài chuyên môn)
+productAgent.handoffs = [
+    handoff(orderAgent, input_filter=_trim_handoff_input),
+    handoff(supportAgent, input_filter=_trim_handoff_input),
+]
+orderAgent.handoffs = [
+    handoff(productAgent, input_filter=_trim_handoff_input),
+    handoff(supportAgent, input_filter=_trim_handoff_input),
+]
+supportAgent.handoffs = [
+    handoff(productAgent, input_filter=_trim_handoff_input),
+    handoff(orderAgent, input_filter=_trim_handoff_input),
+]
+
+# Continuation sau function call: cùng instructions / handoff với triage, model tier riêng
+continuationAgent = triageAgent.clone(model=model_tiers.model(TIER_CONTINUATION))
+
+AGENTS_BY_INTENT = {
+    INTENT_TRIAGE: triageAgent,
+    INTENT_PRODUCT: productAgent,
+    INTENT_ORDER: orderAgent,
+    INTENT_SUPPORT: supportAgent,
+}
+_INTENT_OF_AGENT = {agent.name: intent for intent, agent in AGENTS_BY_INTENT.items()}
+
+
+def _route_turn(message: str, context: Optional[Dict[str, Any]]) -> Tuple[Route, Agent]:
+    route = intent_router.route(message, context)
+    return route, AGENTS_BY_INTENT[route.intent]
+
+
+def _record_route_outcome(route: Route, result: Any, started: float) -> None:
+    last_agent = getattr(result, "last_agent", None)
+    final_intent = _INTENT_OF_AGENT.get(getattr(last_agent, "name", ""), INTENT_TRIAGE)
+    intent_router.record_outcome(route, final_intent, time.perf_counter() - started, _requests_of(result))
+
+
+# ============================================
+# PROMPT CACHE: instructions (prefix tĩnh) giống hệt nhau mọi turn → provider cache
+# prefix; đo input token cached / uncached của từng call
+# ============================================
+
+class TokenUsage(TypedDict):
+    input_tokens: int
+    cached_input_tokens: int
+    uncached_input_tokens: int
+    output_tokens: int
+    total_tokens: int
+
+
+class PromptCacheStats(TypedDict):
+    requests: int
+    input_tokens: int
+    cached_input_tokens: int
+    uncached_input_tokens: int
+    cached_ratio: float
+    # agent → {"fingerprint", "chars"} của system instructions
+    prefixes: Dict[str, Dict[str, Any]]
+
+
+_STATIC_PREFIXES = {
+    agent.name: {"fingerprint": prompt_fingerprint(agent.instructions), "chars": len(agent.instructions)}
+    for agent in (triageAgent, productAgent, orderAgent, supportAgent)
+}
+_prompt_cache_totals = {"requests": 0, "input_tokens": 0, "cached_input_tokens": 0}
+
+log.info("agent_static_prefixes", prefixes=_STATIC_PREFIXES)
+
+
+def _usage_of(result: Any) -> TokenUsage:
+    """Usage cộng dồn mọi request của một Runner.run (kể cả handoff / tool round trip)"""
+    context_wrapper = getattr(result, "context_wrapper", None)
+    usage = getattr(context_wrapper, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_input_tokens": 0, "uncached_input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    cached = (usage.input_tokens_details.cached_tokens or 0) if usage.input_tokens_details else 0
+    return {
+        "input_tokens": usage.input_tokens,
+        "cached_input_tokens": cached,
+        "uncached_input_tokens": max(usage.input_tokens - cached, 0),
+        "output_tokens": usage.output_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+
+
+def _record_usage(kind: str, usage: TokenUsage, requests: int) -> None:
+    LLM_TOKENS.inc(kind, amount=usage["total_tokens"])
+    LLM_INPUT_TOKENS.inc(kind, "cached", amount=usage["cached_input_tokens"])
+    LLM_INPUT_TOKENS.inc(kind, "uncached", amount=usage["uncached_input_tokens"])
+    _prompt_cache_totals["requests"] += requests
+    _prompt_cache_totals["input_tokens"] += usage["input_tokens"]
+    _prompt_cache_totals["cached_input_tokens"] += usage["cached_input_tokens"]
+
+
+def _requests_of(result: Any) -> int:
+    usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+    return usage.requests if usage is not None else 0
+
+
+def prompt_cache_stats() -> PromptCacheStats:
+    input_tokens = _prompt_cache_totals["input_tokens"]
+    cached = _prompt_cache_totals["cached_input_tokens"]
+    return {
+        "requests": _prompt_cache_totals["requests"],
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached,
+        "uncached_input_tokens": input_tokens - cached,
+        "cached_ratio": round(cached / input_tokens, 4) if input_tokens else 0.0,
+        "prefixes": _STATIC_PREFIXES,
+    }
+
 
 # ============================================
 # FUNCTION CALL VALIDATION & FILTERING
@@ -437,26 +680,24 @@ def filter_and_validate_function_calls(function_calls: List[Dict]) -> List[Dict]
         # Validate save_address
         if fn_name == "save_address":
             if not validate_address_function_call(fn_args):
-                print(f"⚠️ Filtered invalid save_address call")
                 continue
         
         # Validate save_customer_info
         elif fn_name == "save_customer_info":
             if not validate_customer_info_function_call(fn_args):
-                print(f"⚠️ Filtered invalid save_customer_info call")
                 continue
         
         # Validate add_to_cart
         elif fn_name == "add_to_cart":
             if not fn_args.get("product_id"):
-                print(f"⚠️ Filtered invalid add_to_cart call: missing product_id")
+                log.warning("function_args_invalid", function="add_to_cart", reason="missing_product_id")
                 continue
         
         # Function call hợp lệ
         validated_calls.append(fc)
     
     if len(validated_calls) < len(function_calls):
-        print(f"⚠️ Filtered out {len(function_calls) - len(validated_calls)} invalid function calls")
+        log.warning("function_calls_filtered", count=len(function_calls) - len(validated_calls))
     
     return validated_calls
 
@@ -465,35 +706,88 @@ def filter_and_validate_function_calls(function_calls: List[Dict]) -> List[Dict]
 # CONTINUATION CALL (THIẾU Ở BẢN CŨ)
 # ============================================
 
-async def call_agent_with_function_result(
+# Template cố định cho kết quả function đơn giản (không cần gọi LLM)
+FUNCTION_SUCCESS_TEMPLATES: Dict[str, str] = {
+    "save_customer_info": "Dạ em đã ghi nhận thông tin của chị rồi ạ ✨",
+    "save_address": "Dạ em đã ghi nhận địa chỉ giao hàng của chị rồi ạ ✨",
+    "add_to_cart": "Dạ em đã thêm vào giỏ hàng cho chị rồi ạ 🛒",
+    # Tin nhắn chốt đơn đã đầy đủ → không thêm gì
+    "confirm_and_create_order": "",
+}
+# message lỗi có thể là exception thô → không đưa vào template, chỉ báo chung + hướng dẫn
+FUNCTION_FAILURE_TEMPLATES: Dict[str, str] = {
+    "save_customer_info": "Dạ xin lỗi chị, em chưa lưu được thông tin ạ 😊 Chị kiểm tra lại giúp em họ tên và số điện thoại nhé!",
+    "save_address": "Dạ xin lỗi chị, địa chỉ chưa đầy đủ ạ 😊 Chị vui lòng cung cấp đầy đủ: số nhà + tên đường + thành phố nhé!",
+    "add_to_cart": "Dạ xin lỗi chị, em chưa thêm được sản phẩm vào giỏ ạ 😊 Chị chọn lại giúp em mẫu và size nhé!",
+    # Lỗi tạo đơn đã có message đầy đủ (thay cho response)
+    "confirm_and_create_order": "",
+}
+
+
+def render_function_results(function_results: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Ghép response từ template khi MỌI kết quả đều là thành công / thất bại đơn giản
+    (function đã biết, có `success`). Returns None nếu cần gọi agent.
+    """
+    if not settings.FUNCTION_RESULT_TEMPLATES_ENABLED:
+        return None
+    lines: List[str] = []
+    all_success = True
+    for call in function_results:
+        name = call["name"]
+        result = call["result"] or {}
+        if name not in FUNCTION_SUCCESS_TEMPLATES or not isinstance(result.get("success"), bool):
+            return None
+        if result["success"]:
+            line = FUNCTION_SUCCESS_TEMPLATES[name]
+        else:
+            all_success = False
+            line = FUNCTION_FAILURE_TEMPLATES[name]
+        if line and line not in lines:
+            lines.append(line)
+    if all_success and lines:
+        lines.append("Chị cần em hỗ trợ gì thêm không ạ? 💕")
+    return "\n".join(lines)
+
+
+async def call_agent_with_function_results(
     context: Dict[str, Any],
     user_message: str,
-    function_name: str,
-    function_result: Dict[str, Any]
-) -> Dict[str, str]:
+    function_results: List[Dict[str, Any]],
+) -> Dict[str, Any]:
     """
-    Gọi agent SAU KHI function được execute để generate natural response
-    Tương đương callGeminiWithFunctionResult() trong TypeScript
+    MỘT continuation cho tất cả function đã thực thi trong turn:
+    kết quả đơn giản → template (0 LLM call), ngược lại một lần gọi agent.
+    `function_results`: [{"name", "args", "result"}, ...] theo thứ tự thực thi
     """
+    templated = render_function_results(function_results)
+    if templated is not None:
+        FUNCTION_CONTINUATIONS.inc("template")
+        return {"text": templated, "tokens": 0}
+
+    FUNCTION_CONTINUATIONS.inc("llm")
+    function_names = [call["name"] for call in function_results]
     try:
-        print(f"[Agent] Continuation call after function: {function_name}")
-        
+        log.debug("agent_continuation", functions=function_names)
+
         # Build continuation prompt
+        results_block = "\n\n".join(
+            f"""🔧 FUNCTION ĐÃ THỰC THI: {call['name']}
+📊 KẾT QUẢ: {json.dumps(call['result'], ensure_ascii=False, indent=2)}
+{'✅ Thành công!' if (call['result'] or {}).get('success') else '❌ Thất bại!'} {(call['result'] or {}).get('message', '')}"""
+            for call in function_results
+        )
         continuation_message = f"""
-🔧 FUNCTION ĐÃ THỰC THI: {function_name}
-📊 KẾT QUẢ: {json.dumps(function_result, ensure_ascii=False, indent=2)}
+⚠️ KẾT QUẢ THỰC THI {len(function_results)} FUNCTION:
 
-⚠️ KẾT QUẢ THỰC THI FUNCTION:
-{'✅ Thành công!' if function_result.get('success') else '❌ Thất bại!'}
-{function_result.get('message', '')}
+{results_block}
 
-NHIỆM VỤ:
-1. Nếu thành công → Thông báo cho khách một cách tự nhiên, thân thiện
-2. Nếu thất bại → Xin lỗi và hướng dẫn khách cung cấp đúng thông tin
+NHIỆM VỤ (trả lời MỘT tin nhắn duy nhất cho tất cả kết quả):
+1. Function thành công → Thông báo cho khách một cách tự nhiên, thân thiện
+2. Function thất bại → Xin lỗi và hướng dẫn khách cung cấp đúng thông tin
 
 VÍ DỤ RESPONSE THÀNH CÔNG (save_address):
 "Dạ em đã ghi nhận địa chỉ của chị rồi ạ! ✨
-Địa chỉ giao hàng: {function_result.get('data', {}).get('address_line', '[ĐỊA CHỈ]')}
 Chị cần em hỗ trợ gì thêm không ạ? 💕"
 
 VÍ DỤ RESPONSE THẤT BẠI:
@@ -506,24 +800,133 @@ Hãy tạo response TỰ NHIÊN dựa trên kết quả function!
 """
         
         # Run agent với continuation message
-        result = await Runner.run(triageAgent, continuation_message)
+        LLM_CALLS.inc("continuation")
+        models = begin_turn_models()
+        result = await llm_resilience.run(
+            "continuation",
+            lambda: Runner.run(continuationAgent, continuation_message),
+        )
+        usage = _usage_of(result)
+        _record_usage("continuation", usage, _requests_of(result))
         
         return {
-            "text": result.final_output or "Đã xử lý xong ạ! 💕"
+            "text": result.final_output or "Đã xử lý xong ạ! 💕",
+            "tokens": usage["total_tokens"],
+            "usage": usage,
+            "model": turn_model_name(models),
         }
         
     except Exception as e:
-        print(f"[Agent] Continuation call ERROR: {e}")
+        if isinstance(e, LlmCircuitOpenError):
+            log.warning("agent_continuation_short_circuited", functions=function_names)
+        else:
+            log.error("agent_continuation_failed", functions=function_names, error=repr(e))
+        LLM_ERRORS.inc("continuation")
         
-        # Fallback response based on function result
-        if function_result.get("success"):
-            if function_result.get("message"):
-                return {"text": function_result["message"]}
+        # Fallback response based on function results
+        messages = [
+            (call["result"] or {}).get("message")
+            for call in function_results
+            if (call["result"] or {}).get("message")
+        ]
+        if messages:
+            return {"text": "\n".join(messages)}
+        if all((call["result"] or {}).get("success") for call in function_results):
             return {"text": "Đã lưu thông tin thành công ạ! ✨"}
-        else:
-            if function_result.get("message"):
-                return {"text": function_result["message"]}
-            return {"text": "Có lỗi xảy ra, chị vui lòng thử lại nhé 😊"}
+        return {"text": "Có lỗi xảy ra, chị vui lòng thử lại nhé 😊"}
+
+
+async def call_agent_with_function_result(
+    context: Dict[str, Any],
+    user_message: str,
+    function_name: str,
+    function_result: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Continuation cho MỘT function (giữ cho code cũ).
+    Tương đương callGeminiWithFunctionResult() trong TypeScript
+    """
+    return await call_agent_with_function_results(
+        context,
+        user_message,
+        [{"name": function_name, "args": {}, "result": function_result}],
+    )
+
+
+# ============================================
+# RUN ITEM EXTRACTION
+# ============================================
+
+def _call_id(raw_item: Any) -> Optional[str]:
+    # Tool call là object (ResponseFunctionToolCall), tool output là dict (FunctionCallOutput)
+    if isinstance(raw_item, dict):
+        return raw_item.get("call_id")
+    return getattr(raw_item, "call_id", None)
+
+
+def _extract_tool_activity(items: List[Any]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Lấy products (từ search_products) và function calls từ RunItems của agents SDK
+    (`result.new_items` hoặc item của stream event)
+
+    Returns:
+        (products, function_calls)
+    """
+    products: List[Dict] = []
+    function_calls: List[Dict] = []
+    call_names: Dict[str, str] = {}
+
+    for item in items:
+        if item.type == "tool_call_item":
+            raw = item.raw_item
+            tool_name = getattr(raw, "name", None)
+            if not tool_name:
+                continue
+            call_names[_call_id(raw)] = tool_name
+            try:
+                tool_args = loads(getattr(raw, "arguments", None) or "{}")
+            except Exception as e:
+                log.warning("agent_tool_args_invalid", tool=tool_name, error=str(e))
+                tool_args = {}
+
+            log.info("agent_tool", tool=tool_name, args=tool_args)
+            TOOL_CALLS.inc(tool_name)
+            function_calls.append({
+                "name": tool_name,
+                "args": tool_args
+            })
+
+        elif item.type == "tool_call_output_item":
+            if call_names.get(_call_id(item.raw_item)) == "search_products" and isinstance(item.output, list):
+                products = item.output
+                log.debug("agent_products", count=len(products))
+
+    return products, function_calls
+
+
+def _classify_response_type(products: List, function_calls: List, response_text: str) -> str:
+    """Classify response type giống TypeScript"""
+    # Có products mới → showcase
+    if products and len(products) > 0:
+        return "showcase"
+
+    # Mention sản phẩm đã có trong context (không show card mới)
+    # Check keywords: "sản phẩm này", "mẫu đó", "giá", "màu"
+    mention_keywords = ["sản phẩm", "mẫu", "giá", "màu", "size", "còn hàng"]
+    if any(kw in (response_text or "").lower() for kw in mention_keywords):
+        return "mention"
+
+    return "none"
+
+
+def _fallback_result() -> Dict[str, Any]:
+    return {
+        "text": "Xin lỗi chị, hệ thống đang bận. Vui lòng thử lại sau ít phút nhé! 🙏",
+        "products": [],
+        "tokens": 0,
+        "type": "conversational",
+        "functionCalls": []
+    }
 
 
 # ============================================
@@ -552,7 +955,7 @@ async def run_bewo_agent(
         }
     """
     try:
-        print(f"[Agent] Processing message: \"{message}\"")
+        log.info("agent_turn", text=message)
         
         # Build full prompt with context (IMPROVEMENT: inject context vào agent)
         if context:
@@ -560,96 +963,150 @@ async def run_bewo_agent(
         else:
             full_message = message
         
-        # Run agent
-        result = await Runner.run(triageAgent, full_message)
+        # Run agent: intent router chọn thẳng specialist, không chắc → triage
+        route, starting_agent = _route_turn(message, context)
+        LLM_CALLS.inc("turn")
+        models = begin_turn_models()
+        started = time.perf_counter()
+        # Deadline + hedge + circuit breaker (tool của agent không ghi DB → chạy trùng an toàn)
+        result = await llm_resilience.run("turn", lambda: Runner.run(starting_agent, full_message))
+        _record_route_outcome(route, result, started)
 
         # Extract products & function calls
-        products = []
-        function_calls = []
-        
-        if hasattr(result, 'context_wrapper') and result.context_wrapper:
-            print(f"[Agent] Run completed: {result.run.id if hasattr(result, 'run') else 'N/A'}")
-            
-            if hasattr(result, 'run') and result.run:
-                run = result.run
-                for msg in run.messages:
-                    if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                        print(f"[Agent] 🔧 Found {len(msg.tool_calls)} tool call(s)")
-                        
-                        for tool_call in msg.tool_calls:
-                            tool_name = tool_call.function.name
-                            tool_args = json.loads(tool_call.function.arguments)
-                            
-                            print(f"[Agent] 🔧 Tool: {tool_name}({tool_args})")
-                            
-                            function_calls.append({
-                                "name": tool_name,
-                                "args": tool_args
-                            })
-                            
-                            # Extract products from search_products
-                            if tool_name == "search_products":
-                                tool_response = next(
-                                    (m for m in run.messages 
-                                     if hasattr(m, 'tool_call_id') and m.tool_call_id == tool_call.id),
-                                    None
-                                )
-                                if tool_response and hasattr(tool_response, 'content'):
-                                    try:
-                                        products = json.loads(tool_response.content)
-                                        print(f"[Agent] ✅ Extracted {len(products)} products")
-                                    except Exception as e:
-                                        print(f"[Agent] ❌ Failed to parse products: {e}")
+        products, function_calls = _extract_tool_activity(result.new_items)
 
         # IMPROVEMENT: Validate và filter function calls
         validated_function_calls = filter_and_validate_function_calls(function_calls)
         
-        # # Determine type (IMPROVEMENT: better type classification)
-        # rec_type = "showcase" if products else "conversational"
-        # AFTER
-        def classify_response_type(products: List, function_calls: List, response_text: str) -> str:
-            """Classify response type giống TypeScript"""
-            # Có products mới → showcase
-            if products and len(products) > 0:
-                return "showcase"
-            
-            # Mention sản phẩm đã có trong context (không show card mới)
-            # Check keywords: "sản phẩm này", "mẫu đó", "giá", "màu"
-            mention_keywords = ["sản phẩm", "mẫu", "giá", "màu", "size", "còn hàng"]
-            if any(kw in response_text.lower() for kw in mention_keywords):
-                return "mention"
-            
-            return "none"
-        rec_type = classify_response_type(products, validated_function_calls, result.final_output)
-        # Get tokens
-        tokens = 0
-        if hasattr(result, 'context_wrapper') and hasattr(result.context_wrapper, 'usage'):
-            tokens = result.context_wrapper.usage.total_tokens
-
-        print(f"[Agent] Response: {len(products)} products, {len(validated_function_calls)} function calls, {tokens} tokens")
+        rec_type = _classify_response_type(products, validated_function_calls, result.final_output)
+        # Get tokens (cached = phần prefix tĩnh hit prompt cache của provider)
+        usage = _usage_of(result)
+        _record_usage("turn", usage, _requests_of(result))
+
+        log.info(
+            "agent_response",
+            products=len(products),
+            function_calls=len(validated_function_calls),
+            tokens=usage["total_tokens"],
+            cached_input_tokens=usage["cached_input_tokens"],
+            uncached_input_tokens=usage["uncached_input_tokens"],
+            agent=result.last_agent.name,
+            route_source=route.source,
+        )
         
         return {
             "text": result.final_output,
             "products": products,
-            "tokens": tokens,
+            "tokens": usage["total_tokens"],
+            "usage": usage,
+            "model": turn_model_name(models),
             "type": rec_type,
             "functionCalls": validated_function_calls
         }
         
+    except LlmCircuitOpenError:
+        # Provider đang lỗi → fallback ngay, không chờ timeout
+        LLM_ERRORS.inc("turn")
+        log.warning("agent_short_circuited")
+        return _fallback_result()
+
     except Exception as e:
-        print(f"[Agent] ERROR: {e}")
+        LLM_ERRORS.inc("turn")
         import traceback
-        traceback.print_exc()
+        log.error("agent_failed", error=repr(e), traceback=traceback.format_exc())
         
         # IMPROVEMENT: Better fallback response
-        return {
-            "text": "Xin lỗi chị, hệ thống đang bận. Vui lòng thử lại sau ít phút nhé! 🙏",
-            "products": [],
-            "tokens": 0,
-            "type": "conversational",
-            "functionCalls": []
-        }
+        return _fallback_result()
+
+
+async def run_bewo_agent_streamed(
+    message: str,
+    context: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Phiên bản streaming của run_bewo_agent (Runner.run_streamed)
+
+    Yields:
+        {"type": "token", "delta": str}          - từng đoạn text của model
+        {"type": "products", "products": [...]}  - ngay khi search_products trả về
+        {"type": "result", "result": {...}}      - cuối cùng, cùng format với run_bewo_agent
+    """
+    result = None
+    stream_finished = False
+    try:
+        log.info("agent_turn_streamed", text=message)
+
+        if context:
+            full_message = await build_full_prompt_with_context(context, message)
+        else:
+            full_message = message
+
+        route, starting_agent = _route_turn(message, context)
+        LLM_CALLS.inc("turn_streamed")
+        models = begin_turn_models()
+        started = time.perf_counter()
+        result = Runner.run_streamed(starting_agent, full_message)
+        items: List[Any] = []
+        call_names: Dict[str, str] = {}
+
+        async for event in llm_resilience.stream("turn_streamed", result.stream_events()):
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                if event.data.delta:
+                    yield {"type": "token", "delta": event.data.delta}
+            elif event.type == "run_item_stream_event":
+                items.append(event.item)
+                if event.name == "tool_called":
+                    call_names[_call_id(event.item.raw_item)] = getattr(event.item.raw_item, "name", "")
+                elif event.name == "tool_output" and isinstance(event.item.output, list):
+                    # Gửi product cards ngay khi search_products trả về
+                    if call_names.get(_call_id(event.item.raw_item)) == "search_products":
+                        yield {"type": "products", "products": event.item.output}
+        stream_finished = True
+
+        _record_route_outcome(route, result, started)
+        products, function_calls = _extract_tool_activity(items)
+        validated_function_calls = filter_and_validate_function_calls(function_calls)
+        final_output = result.final_output or ""
+        usage = _usage_of(result)
+        _record_usage("turn_streamed", usage, _requests_of(result))
+
+        log.info(
+            "agent_response",
+            streamed=True,
+            products=len(products),
+            function_calls=len(validated_function_calls),
+            tokens=usage["total_tokens"],
+            cached_input_tokens=usage["cached_input_tokens"],
+            uncached_input_tokens=usage["uncached_input_tokens"],
+        )
+
+        yield {"type": "result", "result": {
+            "text": final_output,
+            "products": products,
+            "tokens": usage["total_tokens"],
+            "usage": usage,
+            "model": turn_model_name(models),
+            "type": _classify_response_type(products, validated_function_calls, final_output),
+            "functionCalls": validated_function_calls
+        }}
+
+    except Exception as e:
+        LLM_ERRORS.inc("turn_streamed")
+        if isinstance(e, LlmCircuitOpenError):
+            log.warning("agent_short_circuited", streamed=True)
+        else:
+            import traceback
+            log.error("agent_stream_failed", error=repr(e), traceback=traceback.format_exc())
+
+        fallback = _fallback_result()
+        yield {"type": "token", "delta": fallback["text"]}
+        yield {"type": "result", "result": fallback}
 
+    finally:
+        if result is not None and not stream_finished:
+            # Timeout / lỗi giữa stream / client ngắt (GeneratorExit, CancelledError)
+            # → dừng run nền của SDK, không để nó tiếp tục gọi model / tool
+            result.cancel()
 
 # ============================================
 # EXPORT
@@ -657,7 +1114,11 @@ async def run_bewo_agent(
 
 __all__ = [
     'run_bewo_agent',
+    'run_bewo_agent_streamed',
     'call_agent_with_function_result',
+    'call_agent_with_function_results',
+    'fetch_order_status',
+    'prompt_cache_stats',
     'validate_address_function_call',
     'validate_customer_info_function_call',
     'filter_and_validate_function_calls'
@@ -0,0 +1,426 @@
+# ============================================
+# agent/intent_router.py
+# Chọn thẳng agent chuyên môn (product / order / support) cho turn, bỏ qua
+# bước triage (một lần gọi LLM chỉ để handoff). CPU-only, ~0.1ms/tin:
+# 1. Rules: từ khóa rõ ràng + ngữ cảnh (bot vừa hỏi địa chỉ / SĐT / xác nhận)
+# 2. Linear model trên hashed n-gram (word 1-2 gram + char 3-gram bỏ dấu),
+#    train offline từ chatbot_messages (không commit sẵn → mặc định rules-only):
+#       python -m src.agent.intent_router train [output.json] [max_messages]
+# Không chắc (rules mâu thuẫn, model dưới INTENT_ROUTER_THRESHOLD) → triage như cũ.
+# Đo độ chính xác: một phần turn tự tin vẫn chạy qua triage (shadow) và so agent
+# triage chọn với dự đoán; turn đi thẳng mà specialist phải handoff tiếp = route sai.
+# ============================================
+
+import asyncio
+import math
+import random
+import re
+import sys
+import time
+import unicodedata
+import zlib
+from collections import Counter as TallyCounter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from ..services.metrics_service import INTENT_ROUTE_CHECKS, INTENT_ROUTES
+from ..utils.json_fast import dumps, loads
+from ..utils.structured_logger import get_logger
+
+log = get_logger("intent_router")
+
+INTENT_PRODUCT = "product"
+INTENT_ORDER = "order"
+INTENT_SUPPORT = "support"
+# Không route được / chào hỏi chung → triage tự trả lời hoặc tự handoff
+INTENT_TRIAGE = "triage"
+
+SPECIALIST_INTENTS = (INTENT_PRODUCT, INTENT_ORDER, INTENT_SUPPORT)
+
+# Repo không kèm model đã train: thiếu file này router chạy rules-only (mặc định khi deploy),
+# turn rules không chắc đi qua triage như cũ. Train xong đặt file ở đây hoặc trỏ
+# INTENT_ROUTER_MODEL_PATH tới nó.
+DEFAULT_MODEL_PATH = Path(__file__).resolve().parent / "intent_model.json"
+# Khớp limit history của build_context
+HISTORY_LIMIT = 10
+HASH_BUCKETS = 1 << 18
+
+# ============================================
+# RULES
+# ============================================
+
+_RULES = {
+    INTENT_ORDER: re.compile(
+        r"đặt\s*(?:hàng|mua|đơn)|chốt\s*đơn|mua\s*luôn|lấy\s*luôn|giỏ\s*hàng|thêm\s*vào\s*giỏ"
+        r"|địa\s*chỉ|giao\s*về|ship\s*về|gửi\s*về|số\s*điện\s*thoại|\bsđt\b|(?<!\d)0\d{9}(?!\d)"
+        r"|đơn\s*hàng|mã\s*đơn|hủy\s*đơn|huỷ\s*đơn"
+    ),
+    INTENT_PRODUCT: re.compile(
+        r"\b(?:áo|váy|đầm|quần|set|sơ\s*mi|linen|mẫu|sản\s*phẩm|size|màu|chất\s*liệu|vải)\b"
+        r"|còn\s*hàng|hết\s*hàng|bao\s*nhiêu\s*tiền|giá|tư\s*vấn|gợi\s*ý|phối\s*đồ"
+    ),
+    INTENT_SUPPORT: re.compile(
+        r"đổi\s*trả|đổi\s*hàng|trả\s*hàng|hoàn\s*tiền|khiếu\s*nại|phàn\s*nàn|bị\s*lỗi|\bhỏng\b|\brách\b"
+        r"|giao\s*(?:sai|thiếu|nhầm)|chưa\s*nhận\s*được|bảo\s*hành|chính\s*sách|phí\s*ship|miễn\s*phí\s*ship"
+    ),
+}
+# Bot vừa hỏi thông tin giao hàng → câu trả lời của khách (địa chỉ, SĐT, "ok") thuộc về đơn hàng
+_BOT_ASKED_ORDER_INFO = re.compile(r"địa\s*chỉ|số\s*điện\s*thoại|\bsđt\b|giao\s*về.*phải\s*không|xác\s*nhận")
+
+_WORD = re.compile(r"\w+")
+
+
+# ============================================
+# FEATURES (hashed n-gram)
+# ============================================
+
+def _fold(text: str) -> str:
+    text = text.replace("đ", "d").replace("Đ", "D")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def _bucket(feature: str) -> int:
+    # crc32 ổn định giữa các process (hash() của Python có salt)
+    return zlib.crc32(feature.encode("utf-8")) % HASH_BUCKETS
+
+
+def _last_bot_text(history: List[Dict[str, Any]]) -> str:
+    for message in reversed(history or []):
+        if message.get("sender_type") == "bot":
+            return ((message.get("content") or {}).get("text") or "").lower()
+    return ""
+
+
+def _bot_asked_order_info(context: Optional[Dict[str, Any]]) -> bool:
+    last_bot = _last_bot_text((context or {}).get("history", []))
+    return "?" in last_bot and _BOT_ASKED_ORDER_INFO.search(last_bot) is not None
+
+
+def extract_features(message_text: str, context: Optional[Dict[str, Any]] = None) -> Dict[int, float]:
+    """Sparse vector {bucket: value}, chuẩn hóa L2"""
+    text = message_text.lower()
+    words = _WORD.findall(text)
+    features = TallyCounter()
+    for i, word in enumerate(words):
+        features[f"w:{word}"] += 1
+        if i:
+            features[f"b:{words[i - 1]}_{word}"] += 1
+        folded = f"#{_fold(word)}#"
+        for j in range(len(folded) - 2):
+            features[f"c:{folded[j:j + 3]}"] += 1
+    # Chỉ dùng ngữ cảnh tái tạo được lúc train từ chatbot_messages (history) —
+    # giỏ hàng không lưu theo từng tin nên không đưa vào feature
+    if _bot_asked_order_info(context):
+        features["ctx:bot_asked_order_info"] += 1
+    if not features:
+        return {}
+    vector: Dict[int, float] = {}
+    for feature, count in features.items():
+        bucket = _bucket(feature)
+        vector[bucket] = vector.get(bucket, 0.0) + count
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {bucket: value / norm for bucket, value in vector.items()}
+
+
+# ============================================
+# LINEAR MODEL (softmax, weight thưa)
+# ============================================
+
+class IntentModel:
+    def __init__(self, classes: List[str], weights: Dict[str, Dict[int, float]], bias: Dict[str, float]):
+        self.classes = classes
+        self.weights = weights
+        self.bias = bias
+
+    def predict(self, vector: Dict[int, float]) -> Tuple[str, float]:
+        scores = {
+            cls: self.bias.get(cls, 0.0) + sum(self.weights[cls].get(b, 0.0) * v for b, v in vector.items())
+            for cls in self.classes
+        }
+        top = max(scores.values())
+        exp = {cls: math.exp(score - top) for cls, score in scores.items()}
+        total = sum(exp.values())
+        best = max(exp, key=exp.get)
+        return best, exp[best] / total
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentModel":
+        data = loads(path.read_bytes())
+        return cls(
+            classes=data["classes"],
+            weights={c: {int(b): w for b, w in ws.items()} for c, ws in data["weights"].items()},
+            bias=data["bias"],
+        )
+
+    def dump(self, path: Path, samples: int) -> None:
+        path.write_text(dumps({
+            "classes": self.classes,
+            "weights": {c: {str(b): round(w, 5) for b, w in ws.items() if abs(w) >= 1e-4} for c, ws in self.weights.items()},
+            "bias": self.bias,
+            "buckets": HASH_BUCKETS,
+            "samples": samples,
+            "trained_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }), encoding="utf-8")
+
+
+def train_model(
+    samples: List[Tuple[Dict[int, float], str]],
+    epochs: int = 8,
+    learning_rate: float = 0.5,
+    l2: float = 1e-5,
+) -> IntentModel:
+    """SGD cho multinomial logistic regression (thuần Python, vài nghìn tin → vài giây)"""
+    classes = sorted({label for _, label in samples})
+    model = IntentModel(classes, {cls: {} for cls in classes}, {cls: 0.0 for cls in classes})
+    rng = random.Random(0)
+    order = list(range(len(samples)))
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        rate = learning_rate / (1 + epoch)
+        for index in order:
+            vector, label = samples[index]
+            scores = {
+                cls: model.bias[cls] + sum(model.weights[cls].get(b, 0.0) * v for b, v in vector.items())
+                for cls in classes
+            }
+            top = max(scores.values())
+            exp = {cls: math.exp(s - top) for cls, s in scores.items()}
+            total = sum(exp.values())
+            for cls in classes:
+                gradient = exp[cls] / total - (1.0 if cls == label else 0.0)
+                weights = model.weights[cls]
+                for b, v in vector.items():
+                    weights[b] = weights.get(b, 0.0) * (1 - rate * l2) - rate * gradient * v
+                model.bias[cls] -= rate * gradient
+    return model
+
+
+# ============================================
+# ROUTER
+# ============================================
+
+@dataclass
+class Route:
+    intent: str          # agent chạy turn (triage = fallback)
+    predicted: str       # dự đoán của router (có thể khác intent khi fallback / shadow)
+    confidence: float
+    source: str          # rule | model | fallback | disabled
+    shadow: bool = False  # dự đoán tự tin nhưng vẫn chạy triage để đo độ chính xác
+
+
+class IntentRouterStats(TypedDict):
+    enabled: bool
+    model_loaded: bool
+    routes: Dict[str, int]
+    direct_ratio: float
+    triage_hops_skipped: int
+    rerouted: int
+    shadow_checks: int
+    shadow_correct: int
+    accuracy: Optional[float]
+    avg_llm_request_ms: float
+    estimated_latency_saved_ms: float
+
+
+class IntentRouter:
+    def __init__(self, threshold: float, shadow_rate: float, model_path: str = ""):
+        self._threshold = threshold
+        self._shadow_rate = shadow_rate
+        self._model = self._load_model(Path(model_path) if model_path else DEFAULT_MODEL_PATH)
+        self._routes: Dict[str, int] = {}
+        self._hops_skipped = 0
+        self._rerouted = 0
+        self._shadow_checks = 0
+        self._shadow_correct = 0
+        # EWMA latency của một request LLM (≈ latency một hop triage)
+        self._request_ms = 0.0
+
+    @staticmethod
+    def _load_model(path: Path) -> Optional[IntentModel]:
+        if not path.exists():
+            log.info("intent_model_missing", path=str(path), mode="rules_only")
+            return None
+        try:
+            model = IntentModel.load(path)
+            log.info("intent_model_loaded", path=str(path), classes=model.classes)
+            return model
+        except Exception as e:
+            log.error("intent_model_load_failed", path=str(path), error=str(e))
+            return None
+
+    def predict(self, message_text: str, context: Optional[Dict[str, Any]] = None) -> Tuple[str, float, str]:
+        """(intent, confidence, source)"""
+        text = (message_text or "").lower()
+        if _bot_asked_order_info(context) and not _RULES[INTENT_SUPPORT].search(text):
+            return INTENT_ORDER, 1.0, "rule"
+        matched = [intent for intent, pattern in _RULES.items() if pattern.search(text)]
+        # "áo này size M, chốt đơn luôn" → order thắng product (order agent cũng biết sản phẩm trong giỏ)
+        if set(matched) == {INTENT_ORDER, INTENT_PRODUCT}:
+            matched = [INTENT_ORDER]
+        if len(matched) == 1:
+            return matched[0], 1.0, "rule"
+        if self._model is not None and text.strip():
+            intent, confidence = self._model.predict(extract_features(text, context))
+            return intent, confidence, "model"
+        return INTENT_TRIAGE, 0.0, "fallback"
+
+    def route(self, message_text: str, context: Optional[Dict[str, Any]] = None) -> Route:
+        if not settings.INTENT_ROUTER_ENABLED:
+            return Route(INTENT_TRIAGE, INTENT_TRIAGE, 0.0, "disabled")
+        started = time.perf_counter()
+        predicted, confidence, source = self.predict(message_text, context)
+        if predicted not in SPECIALIST_INTENTS or confidence < self._threshold:
+            route = Route(INTENT_TRIAGE, predicted, confidence, "fallback")
+        elif random.random() < self._shadow_rate:
+            route = Route(INTENT_TRIAGE, predicted, confidence, source, shadow=True)
+        else:
+            route = Route(predicted, predicted, confidence, source)
+        self._routes[route.intent] = self._routes.get(route.intent, 0) + 1
+        INTENT_ROUTES.inc(route.intent, route.source)
+        log.debug(
+            "intent_routed",
+            intent=route.intent,
+            predicted=predicted,
+            confidence=round(confidence, 3),
+            source=route.source,
+            shadow=route.shadow,
+            latency_ms=round((time.perf_counter() - started) * 1000, 3),
+        )
+        return route
+
+    def record_outcome(self, route: Route, final_intent: str, duration_s: float, llm_requests: int) -> None:
+        """Sau Runner.run: `final_intent` = agent cuối cùng trả lời (triage nếu tự trả lời)"""
+        if llm_requests > 0:
+            request_ms = duration_s * 1000 / llm_requests
+            self._request_ms = request_ms if not self._request_ms else 0.9 * self._request_ms + 0.1 * request_ms
+        if route.intent != INTENT_TRIAGE:
+            self._hops_skipped += 1
+            if final_intent != route.intent:
+                # Specialist phải handoff sang agent khác → route sai (tốn lại đúng một hop)
+                self._rerouted += 1
+                INTENT_ROUTE_CHECKS.inc("rerouted")
+                log.info("intent_rerouted", predicted=route.intent, actual=final_intent, source=route.source)
+        elif route.shadow:
+            self._shadow_checks += 1
+            correct = final_intent == route.predicted
+            self._shadow_correct += int(correct)
+            INTENT_ROUTE_CHECKS.inc("correct" if correct else "wrong")
+            if not correct:
+                log.info("intent_shadow_mismatch", predicted=route.predicted, actual=final_intent, source=route.source)
+
+    def stats(self) -> IntentRouterStats:
+        total = sum(self._routes.values())
+        direct = total - self._routes.get(INTENT_TRIAGE, 0)
+        return {
+            "enabled": settings.INTENT_ROUTER_ENABLED,
+            "model_loaded": self._model is not None,
+            "routes": dict(self._routes),
+            "direct_ratio": round(direct / total, 4) if total else 0.0,
+            "triage_hops_skipped": self._hops_skipped,
+            "rerouted": self._rerouted,
+            "shadow_checks": self._shadow_checks,
+            "shadow_correct": self._shadow_correct,
+            "accuracy": round(self._shadow_correct / self._shadow_checks, 4) if self._shadow_checks else None,
+            "avg_llm_request_ms": round(self._request_ms, 2),
+            # Đi thẳng đúng chỗ bỏ được hop triage; route sai thì specialist handoff tiếp
+            # (vẫn 2 request như đi qua triage) → không tiết kiệm
+            "estimated_latency_saved_ms": round((self._hops_skipped - self._rerouted) * self._request_ms, 2),
+        }
+
+
+intent_router = IntentRouter(
+    threshold=settings.INTENT_ROUTER_THRESHOLD,
+    shadow_rate=settings.INTENT_ROUTER_SHADOW_RATE,
+    model_path=settings.INTENT_ROUTER_MODEL_PATH,
+)
+
+
+# ============================================
+# OFFLINE TRAINING (chatbot_messages → intent_model.json)
+# Nhãn yếu lấy từ tin bot trả lời ngay sau tin khách:
+#   - bot gửi product card / nhắc sản phẩm → product
+#   - bot hỏi / xác nhận địa chỉ, SĐT, đơn hàng, giỏ hàng → order
+#   - rules support khớp tin khách → support
+#   - còn lại (chào hỏi, cảm ơn) → triage
+# ============================================
+
+_BOT_ORDER_CUES = re.compile(r"đơn\s*hàng|địa\s*chỉ|số\s*điện\s*thoại|giỏ\s*hàng|xác\s*nhận|giao\s*về")
+
+
+def _weak_label(customer_text: str, bot_content: Dict[str, Any]) -> Optional[str]:
+    text = customer_text.lower()
+    if _RULES[INTENT_SUPPORT].search(text):
+        return INTENT_SUPPORT
+    bot_text = (bot_content.get("text") or "").lower()
+    if bot_content.get("products") or bot_content.get("recommendation_type") in ("showcase", "mention"):
+        return INTENT_PRODUCT
+    if _BOT_ORDER_CUES.search(bot_text):
+        return INTENT_ORDER
+    if len(_WORD.findall(text)) <= 4:
+        return INTENT_TRIAGE
+    return None
+
+
+async def _load_training_samples(max_messages: int) -> List[Tuple[Dict[int, float], str]]:
+    from ..utils.connect_supabase import get_async_supabase_client
+
+    supabase = get_async_supabase_client()
+    rows: List[Dict[str, Any]] = []
+    page = 1000
+    while len(rows) < max_messages:
+        resp = await supabase.from_("chatbot_messages") \
+            .select("conversation_id, sender_type, content, created_at") \
+            .order("conversation_id") \
+            .order("created_at") \
+            .range(len(rows), len(rows) + page - 1) \
+            .execute()
+        rows.extend(resp.data or [])
+        if len(resp.data or []) < page:
+            break
+
+    samples = []
+    history: List[Dict[str, Any]] = []
+    for previous, current, following in zip([None] + rows, rows, rows[1:] + [None]):
+        if previous is None or previous["conversation_id"] != current["conversation_id"]:
+            history = []
+        if (
+            following is not None
+            and current["sender_type"] == "customer"
+            and following["sender_type"] == "bot"
+            and current["conversation_id"] == following["conversation_id"]
+        ):
+            text = (current.get("content") or {}).get("text") or ""
+            label = _weak_label(text, following.get("content") or {})
+            if text.strip() and label:
+                # Cùng ngữ cảnh lúc serve: history (HISTORY_LIMIT tin) tính cả tin khách hiện tại
+                context = {"history": (history + [current])[-HISTORY_LIMIT:]}
+                samples.append((extract_features(text, context), label))
+        history.append(current)
+    return samples
+
+
+def _main(argv: List[str]) -> None:
+    if not argv or argv[0] != "train":
+        print("Usage: python -m src.agent.intent_router train [output.json] [max_messages]")
+        return
+    output = Path(argv[1]) if len(argv) > 1 else DEFAULT_MODEL_PATH
+    max_messages = int(argv[2]) if len(argv) > 2 else 200000
+    samples = asyncio.run(_load_training_samples(max_messages))
+    if not samples:
+        print("Không có dữ liệu train")
+        return
+    rng = random.Random(1)
+    rng.shuffle(samples)
+    holdout = samples[: len(samples) // 10]
+    model = train_model(samples[len(holdout):])
+    correct = sum(model.predict(vector)[0] == label for vector, label in holdout)
+    model.dump(output, samples=len(samples))
+    print(f"Train {len(samples) - len(holdout)} mẫu, holdout accuracy {correct}/{len(holdout)}")
+    print(f"Phân bố nhãn: {dict(TallyCounter(label for _, label in samples))}")
+    print(f"Đã ghi model: {output}")
+
+
+if __name__ == "__main__":
+    _main(sys.argv[1:])
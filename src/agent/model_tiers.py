@@ -0,0 +1,220 @@
+# ============================================
+# agent/model_tiers.py
+# Model theo tier (agent / loại call) thay vì một gemini_model dùng chung:
+#   routing (triage), product, order, support, continuation, summary
+# - Model từng tier: LLM_TIER_MODELS ("tier=model,..."), thiếu → LLM_DEFAULT_MODEL
+# - Latency budget từng tier: LLM_TIER_BUDGETS ("tier=giây,...")
+# - Vượt budget LLM_DOWNGRADE_AFTER_BREACHES lần liên tiếp → tier chuyển sang
+#   LLM_FAST_MODEL trong LLM_DOWNGRADE_COOLDOWN_SECONDS, hết cooldown thử lại
+#   model chính (vượt budget thêm một lần → hạ cấp lại ngay)
+# - Đo latency / token theo model và tier cho từng request LLM
+# ============================================
+
+import contextvars
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, TypedDict
+
+from agents.extensions.models.litellm_model import LitellmModel
+from agents.models.interface import Model
+
+from ..config.env import settings
+from ..services.metrics_service import LLM_MODEL_DOWNGRADES, LLM_MODEL_LATENCY, LLM_MODEL_TOKENS
+from ..utils.structured_logger import get_logger
+
+log = get_logger("model_tiers")
+
+TIER_ROUTING = "routing"
+TIER_PRODUCT = "product"
+TIER_ORDER = "order"
+TIER_SUPPORT = "support"
+TIER_CONTINUATION = "continuation"
+# Dành cho tóm tắt hội thoại bằng LLM (create_conversation_summary hiện chưa gọi LLM)
+TIER_SUMMARY = "summary"
+
+TIERS = (TIER_ROUTING, TIER_PRODUCT, TIER_ORDER, TIER_SUPPORT, TIER_CONTINUATION, TIER_SUMMARY)
+
+# Model đã dùng trong turn hiện tại (list dùng chung → thấy được cả từ task của run_streamed)
+_turn_models: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("turn_models", default=None)
+
+
+def _parse_pairs(raw: str) -> Dict[str, str]:
+    pairs: Dict[str, str] = {}
+    for pair in raw.split(","):
+        if "=" not in pair:
+            continue
+        key, value = pair.split("=", 1)
+        if key.strip() and value.strip():
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+class TierStats(TypedDict):
+    model: str
+    primary: str
+    fallback: str
+    budget_s: Optional[float]
+    ewma_ms: float
+    requests: int
+    breaches: int
+    downgrades: int
+    downgraded_for_s: float
+
+
+class _Tier:
+    def __init__(self, name: str, primary: str, fallback: str, budget: Optional[float]):
+        self.name = name
+        self.primary = primary
+        self.fallback = fallback
+        self.budget = budget
+        self.consecutive_breaches = 0
+        self.downgraded_until = 0.0
+        self.ewma_ms = 0.0
+        self.requests = 0
+        self.breaches = 0
+        self.downgrades = 0
+
+    def current_model(self) -> str:
+        if self.downgraded_until and time.monotonic() >= self.downgraded_until:
+            # Hết cooldown → thử lại model chính, vượt budget thêm một lần là hạ cấp lại
+            self.downgraded_until = 0.0
+            self.consecutive_breaches = settings.LLM_DOWNGRADE_AFTER_BREACHES - 1
+            log.info("llm_tier_restored", tier=self.name, model=self.primary)
+        return self.fallback if self.downgraded_until else self.primary
+
+    def record(self, model_name: str, elapsed: float) -> None:
+        self.requests += 1
+        elapsed_ms = elapsed * 1000
+        self.ewma_ms = elapsed_ms if not self.ewma_ms else 0.8 * self.ewma_ms + 0.2 * elapsed_ms
+        if self.budget is None or model_name != self.primary or self.primary == self.fallback:
+            return
+        if elapsed <= self.budget:
+            self.consecutive_breaches = 0
+            return
+        self.breaches += 1
+        self.consecutive_breaches += 1
+        if self.consecutive_breaches >= settings.LLM_DOWNGRADE_AFTER_BREACHES and not self.downgraded_until:
+            self.downgraded_until = time.monotonic() + settings.LLM_DOWNGRADE_COOLDOWN_SECONDS
+            self.consecutive_breaches = 0
+            self.downgrades += 1
+            LLM_MODEL_DOWNGRADES.inc(self.name)
+            log.warning(
+                "llm_tier_downgraded",
+                tier=self.name,
+                model=self.primary,
+                fallback=self.fallback,
+                budget_s=self.budget,
+                elapsed_s=round(elapsed, 3),
+                cooldown_s=settings.LLM_DOWNGRADE_COOLDOWN_SECONDS,
+            )
+
+    def stats(self) -> TierStats:
+        return {
+            "model": self.fallback if self.downgraded_until else self.primary,
+            "primary": self.primary,
+            "fallback": self.fallback,
+            "budget_s": self.budget,
+            "ewma_ms": round(self.ewma_ms, 2),
+            "requests": self.requests,
+            "breaches": self.breaches,
+            "downgrades": self.downgrades,
+            "downgraded_for_s": round(max(self.downgraded_until - time.monotonic(), 0.0), 1) if self.downgraded_until else 0.0,
+        }
+
+
+class ModelTiers:
+    def __init__(self, default_model: str, fast_model: str, tier_models: str, tier_budgets: str, api_key: str):
+        self._api_key = api_key
+        models = _parse_pairs(tier_models)
+        budgets: Dict[str, float] = {}
+        for tier, raw in _parse_pairs(tier_budgets).items():
+            try:
+                budgets[tier] = float(raw)
+            except ValueError:
+                log.warning("llm_tier_budget_invalid", tier=tier, value=raw)
+        self._tiers = {
+            tier: _Tier(tier, models.get(tier, default_model), fast_model or models.get(tier, default_model), budgets.get(tier))
+            for tier in TIERS
+        }
+        # Một LitellmModel cho mỗi tên model (dùng chung giữa các tier)
+        self._models: Dict[str, LitellmModel] = {}
+
+    def model(self, tier: str) -> "TieredModel":
+        return TieredModel(self, tier)
+
+    def select(self, tier: str) -> Tuple[str, LitellmModel]:
+        model_name = self._tiers[tier].current_model()
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = LitellmModel(model=model_name, api_key=self._api_key)
+        return model_name, model
+
+    def record(self, tier: str, model_name: str, elapsed: float, usage: Any, failed: bool = False) -> None:
+        self._tiers[tier].record(model_name, elapsed)
+        LLM_MODEL_LATENCY.observe(elapsed, model_name, tier)
+        turn_models = _turn_models.get()
+        if turn_models is not None:
+            turn_models.append(model_name)
+        if usage is None or failed:
+            return
+        details = getattr(usage, "input_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        LLM_MODEL_TOKENS.inc(model_name, "input", amount=usage.input_tokens or 0)
+        LLM_MODEL_TOKENS.inc(model_name, "cached_input", amount=cached)
+        LLM_MODEL_TOKENS.inc(model_name, "output", amount=usage.output_tokens or 0)
+
+    def stats(self) -> Dict[str, TierStats]:
+        return {tier: state.stats() for tier, state in self._tiers.items()}
+
+
+class TieredModel(Model):
+    """Model của agents SDK: mỗi request chọn model theo trạng thái tier, đo latency + usage"""
+
+    def __init__(self, tiers: ModelTiers, tier: str):
+        self._tiers = tiers
+        self.tier = tier
+
+    async def get_response(self, *args: Any, **kwargs: Any):
+        model_name, model = self._tiers.select(self.tier)
+        started = time.perf_counter()
+        try:
+            response = await model.get_response(*args, **kwargs)
+        except Exception:
+            self._tiers.record(self.tier, model_name, time.perf_counter() - started, None, failed=True)
+            raise
+        self._tiers.record(self.tier, model_name, time.perf_counter() - started, response.usage)
+        return response
+
+    async def stream_response(self, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        model_name, model = self._tiers.select(self.tier)
+        started = time.perf_counter()
+        usage = None
+        try:
+            async for event in model.stream_response(*args, **kwargs):
+                if getattr(event, "type", None) == "response.completed":
+                    usage = event.response.usage
+                yield event
+        except Exception:
+            self._tiers.record(self.tier, model_name, time.perf_counter() - started, None, failed=True)
+            raise
+        self._tiers.record(self.tier, model_name, time.perf_counter() - started, usage)
+
+
+def begin_turn_models() -> List[str]:
+    """Bắt đầu ghi lại các model được gọi trong turn (gọi trước Runner.run)"""
+    models: List[str] = []
+    _turn_models.set(models)
+    return models
+
+
+def turn_model_name(models: List[str]) -> Optional[str]:
+    """Model trả lời cuối cùng, dạng "gemini-2.0-flash-exp" (không prefix provider) cho usage log"""
+    return models[-1].split("/", 1)[-1] if models else None
+
+
+model_tiers = ModelTiers(
+    default_model=settings.LLM_DEFAULT_MODEL,
+    fast_model=settings.LLM_FAST_MODEL,
+    tier_models=settings.LLM_TIER_MODELS,
+    tier_budgets=settings.LLM_TIER_BUDGETS,
+    api_key=settings.GEMINI_API_KEY,
+)
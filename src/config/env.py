@@ -33,10 +33,18 @@ class Settings(BaseSettings):
     NODE_ENV: str = Field(default="development")
     WEBSITE_URL: str = Field(default="https://bewo.vn")
     CORS_ORIGINS: str = Field(default="http://localhost:3000")
+    # Proxy được tin X-Forwarded-For (Render đứng trước app) → request.client.host là IP thật
+    # của khách, rate limit theo IP không gộp mọi người vào IP của proxy
+    FORWARDED_ALLOW_IPS: str = Field(default="127.0.0.1")
     
     # Supabase (Bắt buộc)
     SUPABASE_URL: str
     SUPABASE_SERVICE_KEY: str
+
+    # Supabase async HTTP pool (dùng chung cho mọi query trong message path)
+    SUPABASE_POOL_MAX_CONNECTIONS: int = Field(default=50)
+    SUPABASE_POOL_MAX_KEEPALIVE: int = Field(default=20)
+    SUPABASE_HTTP_TIMEOUT: float = Field(default=10.0)
     
     # Gemini (Bắt buộc)
     GEMINI_API_KEY: str
@@ -45,6 +53,149 @@ class Settings(BaseSettings):
     WEBHOOK_VERIFY_TOKEN: str = Field(default="default_token")
     FACEBOOK_PAGE_ACCESS_TOKEN: str = Field(default="")
 
+    # Webhook work queue (ack ngay, xử lý nền theo thứ tự từng sender)
+    WEBHOOK_WORKERS: int = Field(default=8)
+    WEBHOOK_QUEUE_MAX_SIZE: int = Field(default=1000)
+
+    # Website chat queue (POST /chat/): tuần tự theo cuộc trò chuyện
+    WEBSITE_WORKERS: int = Field(default=32)
+    WEBSITE_QUEUE_MAX_SIZE: int = Field(default=1000)
+
+    # Gom tin nhắn gửi liên tiếp thành một turn (debounce tính từ tin cuối)
+    MESSENGER_DEBOUNCE_SECONDS: float = Field(default=1.5)
+    WEBSITE_DEBOUNCE_SECONDS: float = Field(default=0.0)
+    COALESCE_MAX_WAIT_SECONDS: float = Field(default=4.0)
+    COALESCE_MAX_MESSAGES: int = Field(default=5)
+
+    # Idempotency (chống xử lý trùng theo Messenger mid / clientMessageId)
+    IDEMPOTENCY_TTL_SECONDS: float = Field(default=3600.0)
+    IDEMPOTENCY_MAX_KEYS: int = Field(default=50000)
+    IDEMPOTENCY_PERSIST: bool = Field(default=False)
+
+    # Rate limit (token bucket) + spam filter cho tin nhắn đến
+    RATE_LIMIT_ENABLED: bool = Field(default=True)
+    RATE_LIMIT_SENDER_PER_SECOND: float = Field(default=0.5)
+    RATE_LIMIT_SENDER_BURST: float = Field(default=8)
+    RATE_LIMIT_PAGE_PER_SECOND: float = Field(default=50.0)
+    RATE_LIMIT_PAGE_BURST: float = Field(default=200)
+    RATE_LIMIT_IP_PER_SECOND: float = Field(default=2.0)
+    RATE_LIMIT_IP_BURST: float = Field(default=30)
+    RATE_LIMIT_MAX_KEYS: int = Field(default=100000)
+    SPAM_MAX_MESSAGE_CHARS: int = Field(default=2000)
+    SPAM_MAX_LINKS: int = Field(default=3)
+    SPAM_MAX_REPEATS: int = Field(default=3)
+    # Chỉ tính là lặp khi các tin giống nhau cách nhau không quá N giây (≈ burst / rate của sender)
+    SPAM_REPEAT_WINDOW_SECONDS: float = Field(default=16.0)
+    # Danh sách từ khóa chặn, phân cách bằng dấu phẩy
+    SPAM_BLOCKED_KEYWORDS: str = Field(default="")
+
+    # Admission control cho LLM (run_bewo_agent)
+    AGENT_MAX_CONCURRENT_TURNS: int = Field(default=16)
+    AGENT_ADMISSION_QUEUE_SIZE: int = Field(default=64)
+    AGENT_ADMISSION_TIMEOUT: float = Field(default=8.0)
+
+    # WebSocket chat (/chat/ws)
+    WS_HEARTBEAT_INTERVAL: float = Field(default=25.0)
+    WS_IDLE_TIMEOUT: float = Field(default=90.0)
+    WS_SEND_TIMEOUT: float = Field(default=5.0)
+    WS_MAX_PENDING_MESSAGES: int = Field(default=5)
+    WS_CONTEXT_REFRESH_TURNS: int = Field(default=10)
+
+    # Batch chat (/chat/batch)
+    BATCH_MAX_CONCURRENCY: int = Field(default=8)
+    BATCH_MAX_MESSAGES: int = Field(default=1000)
+
+    # Nén response (bytes tối thiểu để gzip, mức nén 1-9)
+    GZIP_MINIMUM_SIZE: int = Field(default=1024)
+    GZIP_COMPRESS_LEVEL: int = Field(default=5)
+
+    # Tracing (OTLP/JSON): ghi file JSONL và/hoặc gửi tới collector (vd: http://localhost:4318)
+    TRACING_ENABLED: bool = Field(default=True)
+    TRACING_SAMPLE_RATE: float = Field(default=1.0)
+    TRACING_FILE_PATH: str = Field(default="")
+    TRACING_OTLP_ENDPOINT: str = Field(default="")
+    TRACING_MAX_QUEUE: int = Field(default=10000)
+    TRACING_BATCH_SIZE: int = Field(default=256)
+    TRACING_FLUSH_INTERVAL: float = Field(default=2.0)
+
+    # Structured logging: level, json|text, sampling theo event ("tool_call=0.1,agent_tool=0.5"),
+    # che SĐT / địa chỉ trong log
+    LOG_LEVEL: str = Field(default="INFO")
+    LOG_FORMAT: str = Field(default="json")
+    LOG_SAMPLE_RATES: str = Field(default="")
+    LOG_REDACT_PII: bool = Field(default=True)
+    LOG_QUEUE_MAX_SIZE: int = Field(default=10000)
+
+    # Continuation sau function call: kết quả đơn giản → template cố định (không gọi LLM)
+    FUNCTION_RESULT_TEMPLATES_ENABLED: bool = Field(default=True)
+
+    # Fast path không gọi LLM (chào hỏi, ack, sticker, chính sách, tra đơn); tin dài hơn → agent
+    FAST_PATH_ENABLED: bool = Field(default=True)
+    FAST_PATH_MAX_CHARS: int = Field(default=80)
+
+    # Answer cache cho câu hỏi kiểu FAQ: TTL, số entry, ngưỡng gần giống (trigram Jaccard), độ dài tin tối đa
+    ANSWER_CACHE_ENABLED: bool = Field(default=True)
+    ANSWER_CACHE_TTL_SECONDS: float = Field(default=3600.0)
+    ANSWER_CACHE_MAX_ENTRIES: int = Field(default=2000)
+    ANSWER_CACHE_SIMILARITY: float = Field(default=0.8)
+    ANSWER_CACHE_MAX_CHARS: int = Field(default=120)
+
+    # Model theo tier (routing, product, order, support, continuation, summary): "tier=model,...",
+    # tier không khai báo dùng LLM_DEFAULT_MODEL; vượt latency budget (giây) liên tiếp → LLM_FAST_MODEL
+    LLM_DEFAULT_MODEL: str = Field(default="gemini/gemini-2.0-flash-exp")
+    LLM_FAST_MODEL: str = Field(default="gemini/gemini-2.0-flash-lite")
+    LLM_TIER_MODELS: str = Field(
+        default="support=gemini/gemini-2.0-flash-lite,continuation=gemini/gemini-2.0-flash-lite,summary=gemini/gemini-2.0-flash-lite"
+    )
+    LLM_TIER_BUDGETS: str = Field(default="routing=2.0,product=6.0,order=6.0,support=4.0,continuation=3.0,summary=10.0")
+    LLM_DOWNGRADE_AFTER_BREACHES: int = Field(default=3)
+    LLM_DOWNGRADE_COOLDOWN_SECONDS: float = Field(default=120.0)
+
+    # LLM resilience: deadline mỗi lần chạy agent, hedge request thứ hai sau max(p95, MIN_DELAY)
+    # (cần đủ MIN_SAMPLES), circuit breaker: N lỗi / timeout liên tiếp → fallback ngay trong RESET giây
+    LLM_RUN_TIMEOUT_SECONDS: float = Field(default=20.0)
+    LLM_HEDGE_ENABLED: bool = Field(default=True)
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = Field(default=3.0)
+    LLM_HEDGE_MIN_SAMPLES: int = Field(default=20)
+    LLM_BREAKER_FAILURES: int = Field(default=5)
+    LLM_BREAKER_RESET_SECONDS: float = Field(default=30.0)
+
+    # Intent router: chọn thẳng agent chuyên môn, bỏ hop triage; dưới ngưỡng tin cậy → triage.
+    # SHADOW_RATE = tỉ lệ turn tự tin vẫn chạy qua triage để đo độ chính xác; MODEL_PATH trống = src/agent/intent_model.json
+    INTENT_ROUTER_ENABLED: bool = Field(default=True)
+    INTENT_ROUTER_THRESHOLD: float = Field(default=0.75)
+    INTENT_ROUTER_SHADOW_RATE: float = Field(default=0.05)
+    INTENT_ROUTER_MODEL_PATH: str = Field(default="")
+
+    # Cache kết quả tool search_products / get_product_details (TTL + LRU, 0 = tắt); pre-warm top query
+    # phổ biến (lưu ở WARM_PATH giữa các lần restart); poll fingerprint catalog mỗi WATCH giây (0 = tắt)
+    PRODUCT_CACHE_TTL_SECONDS: float = Field(default=300.0)
+    PRODUCT_CACHE_MAX_ENTRIES: int = Field(default=5000)
+    PRODUCT_CACHE_WARM_TOP: int = Field(default=20)
+    PRODUCT_CACHE_WARM_PATH: str = Field(default="")
+    PRODUCT_CACHE_WATCH_SECONDS: float = Field(default=60.0)
+
+    # Cache định danh: (platform, fb_id/phone/session) → conversation_id → profile_id (0 = tắt)
+    IDENTITY_CACHE_TTL_SECONDS: float = Field(default=21600.0)
+    IDENTITY_CACHE_MAX_KEYS: int = Field(default=100000)
+
+    # Background job runner (embedding, memory, summary, địa chỉ): worker, retry backoff,
+    # hoãn khi live turn đầy slot, thời gian drain khi shutdown
+    JOB_WORKERS: int = Field(default=4)
+    JOB_QUEUE_MAX_SIZE: int = Field(default=5000)
+    JOB_MAX_RETRIES: int = Field(default=3)
+    JOB_RETRY_BACKOFF_SECONDS: float = Field(default=1.0)
+    JOB_RETRY_BACKOFF_MAX_SECONDS: float = Field(default=30.0)
+    JOB_MAX_DEFER_SECONDS: float = Field(default=5.0)
+    JOB_DRAIN_TIMEOUT: float = Field(default=20.0)
+
+    # Write-behind (embedding, usage log, memory fact): bulk insert khi đủ batch hoặc quá max age;
+    # journal JSONL để replay sau crash (trống = không journal, mất tối đa một cửa sổ max age)
+    WRITE_BEHIND_BATCH_SIZE: int = Field(default=200)
+    WRITE_BEHIND_MAX_AGE_SECONDS: float = Field(default=2.0)
+    WRITE_BEHIND_MAX_ROWS: int = Field(default=20000)
+    WRITE_BEHIND_JOURNAL_PATH: str = Field(default="")
+
 # Khởi tạo settings
 # Biến này sẽ được import bởi các file khác (như main.py, supabase.py)
 try:
@@ -0,0 +1,12 @@
+# ============================================
+# conftest.py - pytest chạy được không cần file .env
+# (Settings bắt buộc SUPABASE_URL / SUPABASE_SERVICE_KEY / GEMINI_API_KEY;
+#  test không gọi Supabase / Gemini thật)
+# ============================================
+
+import os
+
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test-service-key")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
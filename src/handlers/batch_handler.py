@@ -0,0 +1,97 @@
+# ============================================
+# handlers/batch_handler.py
+# Xử lý hàng loạt tin nhắn qua cùng pipeline với handle_message
+# (offline evaluation, migration, replay cho team support)
+# - Tối đa `concurrency` tin chạy song song
+# - Tin của CÙNG một cuộc trò chuyện chạy tuần tự, đúng thứ tự đầu vào, qua website_queue
+#   (cùng mailbox với POST /chat/ + /chat/stream → không chạy xen với turn đang diễn ra)
+# - Kết quả trả về theo thứ tự hoàn thành (kèm `index` của tin đầu vào)
+#
+# Dùng trong Python:
+#   async for item in process_batch(bodies, concurrency=4):
+#       print(item["index"], item["success"])
+# ============================================
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, TypedDict
+
+from ..config.env import settings
+from ..services.tracing_service import current_trace_context, start_span
+from ..services.webhook_queue_service import website_queue
+from .message_handler import conversation_key
+from ..utils.structured_logger import get_logger
+
+log = get_logger("batch")
+
+
+class BatchItemResult(TypedDict, total=False):
+    index: int
+    conversation_key: str
+    success: bool
+    result: Dict[str, Any]
+    error: str
+    latency_ms: float
+    trace_id: str
+
+
+async def process_batch(
+    bodies: List[Dict[str, Any]],
+    concurrency: Optional[int] = None,
+    rejected: Optional[Dict[int, str]] = None,
+) -> AsyncIterator[BatchItemResult]:
+    """
+    Chạy từng body qua website_queue (như POST /chat/), yield kết quả ngay khi mỗi tin xong.
+    Lỗi của một tin không dừng cả batch (success=False, error=...).
+    `rejected`: index → lý do bị inbound filter chặn; các tin này trả lỗi ngay, không chạy.
+    """
+    rejected = rejected or {}
+    limit = max(1, min(concurrency or settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+    results: "asyncio.Queue[BatchItemResult]" = asyncio.Queue()
+
+    # Gom theo cuộc trò chuyện, giữ thứ tự đầu vào trong từng nhóm
+    groups: Dict[str, List[int]] = {}
+    for index, body in enumerate(bodies):
+        if index in rejected:
+            results.put_nowait({
+                "index": index,
+                "conversation_key": conversation_key(body),
+                "success": False,
+                "error": rejected[index],
+                "latency_ms": 0.0,
+            })
+            continue
+        groups.setdefault(conversation_key(body), []).append(index)
+
+    async def run_group(key: str, indexes: List[int]) -> None:
+        for index in indexes:
+            # Giữ slot chỉ trong lúc chạy một tin → nhóm dài không chiếm slot khi chờ
+            async with semaphore:
+                started = time.perf_counter()
+                item: BatchItemResult = {"index": index, "conversation_key": key}
+                # Mỗi tin trong batch = một trace riêng
+                with start_span("chat.batch_item", {"platform": "website", "batch.index": index}, new_trace=True) as span:
+                    item["trace_id"] = span.trace_id
+                    try:
+                        body = {**bodies[index], "trace": current_trace_context()}
+                        item["result"] = await website_queue.call(key, body)
+                        item["success"] = True
+                    except Exception as e:
+                        log.error("batch_message_failed", index=index, conversation_key=key, error=str(e))
+                        span.record_error(e)
+                        item["success"] = False
+                        item["error"] = str(e)
+                item["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            await results.put(item)
+
+    log.info("batch_started", messages=len(bodies), conversations=len(groups), rejected=len(rejected), concurrency=limit)
+    tasks = [asyncio.create_task(run_group(key, indexes)) for key, indexes in groups.items()]
+    try:
+        for _ in range(len(bodies)):
+            yield await results.get()
+    finally:
+        # Client ngắt stream giữa chừng → hủy các tin chưa chạy
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,266 @@
+# ============================================
+# handlers/fast_path_handler.py
+# Fast path KHÔNG gọi LLM cho tin đơn giản / tất định, chạy trước run_bewo_agent:
+# - Sticker không kèm text
+# - Chào hỏi ("chào shop", "shop ơi")
+# - Ack / cảm ơn ("ok", "vâng ạ", "cảm ơn shop") khi bot KHÔNG vừa hỏi gì
+# - Câu hỏi chính sách ship / đổi trả / thanh toán (STORE_INFO)
+# - Tra cứu đơn "đơn hàng #123 đâu rồi"
+# Không chắc (ý định đặt hàng, bot đang chờ xác nhận, tin dài...) → None → agent.
+# Trả về cùng format với run_bewo_agent (+ "fast_path": intent).
+# ============================================
+
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, TypedDict
+
+from ..agent.agent_service import fetch_order_status
+from ..config.env import settings
+from ..services.metrics_service import FAST_PATH_RESULTS
+from ..utils.prompts import BOT_CONFIG, STORE_INFO
+from ..utils.structured_logger import get_logger
+
+log = get_logger("fast_path")
+
+# ============================================
+# HELPERS DÙNG CHUNG VỚI message_handler (bước 4.5 / 4.6)
+# ============================================
+
+_CONFIRMATION_WORDS = frozenset(["đúng rồi", "ok", "confirm", "chốt", "vâng ạ", "đúng", "vâng", "được", "ừ", "có"])
+_ORDER_INTENT_PATTERN = re.compile("|".join(
+    re.escape(keyword) for keyword in ["đặt hàng", "mua hàng", "chốt đơn", "gửi về", "ship về"]
+))
+
+
+def is_confirmation(message_text: str) -> bool:
+    return message_text.lower().strip() in _CONFIRMATION_WORDS
+
+
+def is_order_intent(message_text: str) -> bool:
+    return _ORDER_INTENT_PATTERN.search(message_text.lower()) is not None
+
+
+def last_bot_text(history: List[Dict[str, Any]]) -> str:
+    for message in reversed(history or []):
+        if message.get("sender_type") == "bot":
+            return (message.get("content") or {}).get("text", "") or ""
+    return ""
+
+
+def bot_asked_confirmation(history: List[Dict[str, Any]]) -> bool:
+    """Bot vừa hỏi xác nhận địa chỉ giao hàng ("... giao về ... phải không ạ?")"""
+    recent_bot_messages = [m for m in history or [] if m.get("sender_type") == "bot"][-2:]
+    for message in recent_bot_messages:
+        text = (message.get("content") or {}).get("text", "") or ""
+        if "giao về" in text and "phải không" in text:
+            return True
+    return False
+
+
+# ============================================
+# PATTERNS (compile một lần)
+# ============================================
+
+# Bỏ dấu câu / emoji ở hai đầu: "Ok ạ!!! 😊" → "ok ạ"
+_EDGE_PUNCTUATION = re.compile(r"^[\W_]+|[\W_]+$")
+_SPACES = re.compile(r"\s+")
+
+_GREETING_PATTERN = re.compile(
+    r"^(?:(?:xin\s+)?chào|hello|helo|hi|hey|alo|a\s+lô)"
+    r"(?:\s+(?:shop|bạn|em|ad|admin|chị|anh|mọi\s+người|ạ|nhé|nha))*$"
+    r"|^(?:shop|ad|admin|em|bạn)\s+ơi(?:\s+(?:ạ|cho\s+mình\s+hỏi|cho\s+em\s+hỏi))?$"
+)
+_ACK_WORDS = frozenset([
+    "ok", "oke", "okie", "okay", "ok ạ", "oke ạ", "ok shop", "ok em", "ok nhé",
+    "vâng", "vâng ạ", "dạ", "dạ vâng", "dạ ok", "ừ", "ừm", "uh", "được", "được ạ",
+])
+_THANKS_PATTERN = re.compile(
+    r"^(?:dạ\s+)?(?:cảm\s+ơn|cám\s+ơn|thanks|thank\s+you|tks|thank)"
+    r"(?:\s+(?:shop|em|bạn|nhiều|nha|nhé|ạ))*$"
+)
+
+_POLICY_PATTERNS = {
+    "shipping": re.compile(
+        r"phí\s*ship|ship\s*(?:bao\s*nhiêu|mấy\s*ngày|bao\s*lâu)|phí\s*(?:giao|vận\s*chuyển)"
+        r"|giao\s*(?:hàng\s*)?(?:mấy\s*ngày|bao\s*lâu)|freeship|miễn\s*phí\s*(?:ship|giao)"
+        r"|mấy\s*ngày\s*(?:thì\s*)?(?:nhận|tới|đến)"
+    ),
+    "return": re.compile(r"đổi\s*trả|đổi\s*hàng|trả\s*hàng|hoàn\s*(?:tiền|hàng)|đổi\s*size|bảo\s*hành"),
+    "payment": re.compile(
+        r"thanh\s*toán|\bcod\b|chuyển\s*khoản|trả\s*tiền\s*khi\s*nhận|kiểm\s*tra\s*hàng|xem\s*hàng\s*trước"
+    ),
+}
+# Chỉ trả lời chính sách khi tin là câu hỏi (tránh "đổi size M sang L giúp em")
+_QUESTION_PATTERN = re.compile(
+    r"\?|\b(?:không|ko|hông|sao|thế\s*nào|như\s*nào|ra\s*sao|bao\s*nhiêu|bao\s*lâu|mấy|chưa|gì|nào)\b"
+)
+_POLICY_ANSWER_ICONS = {"shipping": "🚚", "return": "🔄", "payment": "💳"}
+
+_ORDER_LOOKUP_PATTERN = re.compile(
+    r"(?:(?:đơn(?:\s*hàng)?|mã\s*đơn|order)\s*(?:số\s*|mã\s*)?#?\s*|#)(\d{1,12})"
+)
+_ORDER_STATUS_CUE = re.compile(
+    r"\?|đâu|tới\s*đâu|khi\s*nào|trạng\s*thái|giao\s*chưa|sao\s*rồi|thế\s*nào|chưa|kiểm\s*tra|check|tra\s*cứu"
+)
+
+
+class FastPathStats(TypedDict):
+    enabled: bool
+    hits: int
+    misses: int
+    hit_rate: float
+    hits_by_intent: Dict[str, int]
+
+
+_hits: Dict[str, int] = {}
+_misses = 0
+
+
+def _normalize(text: str) -> str:
+    return _EDGE_PUNCTUATION.sub("", _SPACES.sub(" ", text.lower().strip()))
+
+
+def _customer_name(context: Dict[str, Any]) -> str:
+    profile = context.get("profile") or {}
+    name = profile.get("preferred_name") or profile.get("full_name")
+    return f" {name}" if name else ""
+
+
+def _format_order_date(created_at: str) -> str:
+    try:
+        return datetime.fromisoformat(created_at.replace("Z", "+00:00")).strftime("%d/%m/%Y")
+    except (ValueError, AttributeError):
+        return ""
+
+
+# ============================================
+# RULES
+# ============================================
+
+def _answer_sticker(context: Dict[str, Any]) -> str:
+    if "?" in last_bot_text(context.get("history", [])):
+        # Sticker trả lời câu hỏi của bot → không đoán ý, xin khách nhắn lại
+        return "Dạ chị nhắn giúp em câu trả lời để em hỗ trợ chính xác nhé 🌷"
+    return f"Dạ em cảm ơn chị{_customer_name(context)} ạ 🌷 Chị cần em tư vấn thêm gì cứ nhắn em nhé!"
+
+
+def _answer_policy(normalized: str) -> Optional[str]:
+    matched = [topic for topic, pattern in _POLICY_PATTERNS.items() if pattern.search(normalized)]
+    if not matched or not _QUESTION_PATTERN.search(normalized):
+        return None
+    lines = [f"{_POLICY_ANSWER_ICONS[topic]} {STORE_INFO['policies'][topic]}" for topic in matched]
+    return "Dạ chính sách của " + STORE_INFO["name"] + " ạ:\n" + "\n".join(lines) + "\nChị cần em hỗ trợ thêm gì không ạ? 🌷"
+
+
+async def _answer_order_lookup(normalized: str, turn: Dict[str, Any]) -> Optional[str]:
+    match = _ORDER_LOOKUP_PATTERN.search(normalized)
+    if not match or not _ORDER_STATUS_CUE.search(normalized):
+        return None
+    # Chỉ trả lời đơn của chính hội thoại / SĐT này, không cho dò mã đơn người khác
+    customer = turn["context"].get("customer") or {}
+    order = await fetch_order_status(
+        match.group(1),
+        conversation_id=turn.get("conversation_id"),
+        customer_phone=customer.get("phone"),
+    )
+    if not order:
+        # Không tìm thấy / không phải đơn của khách → agent hỏi lại / giải thích
+        return None
+    text = f"Dạ đơn hàng #{order['id']} của chị: {order['status']} ạ 🚚\nTổng tiền: {order['total']}"
+    created = _format_order_date(order.get("createdAt", ""))
+    if created:
+        text += f"\nNgày đặt: {created}"
+    return text
+
+
+async def _match(turn: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    message_text = turn["message_text"] or ""
+    context = turn["context"]
+    history = context.get("history", [])
+
+    if not message_text.strip():
+        if turn.get("sticker_id"):
+            return {"intent": "sticker", "text": _answer_sticker(context)}
+        return None
+
+    if len(message_text) > settings.FAST_PATH_MAX_CHARS or is_order_intent(message_text):
+        return None
+    # Bot đang chờ khách xác nhận đơn → bước 4.5 của message_handler cần "ok/vâng"
+    if is_confirmation(message_text) and bot_asked_confirmation(history):
+        return None
+
+    normalized = _normalize(message_text)
+    bot_asked_question = "?" in last_bot_text(history)
+
+    if _GREETING_PATTERN.match(normalized):
+        return {
+            "intent": "greeting",
+            "text": (
+                f"Dạ em chào chị{_customer_name(context)} ạ 🌷 Em là {BOT_CONFIG['bot_name']} của "
+                f"{STORE_INFO['name']}, chị cần em tư vấn gì ạ?"
+            ),
+        }
+    # "ok" sau câu hỏi của bot (vd: "lấy size M nhé chị?") là câu trả lời → agent
+    if normalized in _ACK_WORDS and not bot_asked_question:
+        return {"intent": "ack", "text": "Dạ vâng ạ 🌷 Chị cần em hỗ trợ thêm gì cứ nhắn em nhé!"}
+    if _THANKS_PATTERN.match(normalized) and not bot_asked_question:
+        return {"intent": "thanks", "text": "Dạ em cảm ơn chị ạ 💕 Chúc chị một ngày thật vui!"}
+
+    policy = _answer_policy(normalized)
+    if policy:
+        return {"intent": "policy", "text": policy}
+
+    order = await _answer_order_lookup(normalized, turn)
+    if order:
+        return {"intent": "order_lookup", "text": order}
+    return None
+
+
+async def try_fast_path(turn: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Kết quả cùng format run_bewo_agent nếu trả lời được không cần LLM, ngược lại None"""
+    global _misses
+    if not settings.FAST_PATH_ENABLED:
+        return None
+    started = time.perf_counter()
+    try:
+        matched = await _match(turn)
+    except Exception as e:
+        log.error("fast_path_failed", error=str(e))
+        matched = None
+
+    if matched is None:
+        _misses += 1
+        FAST_PATH_RESULTS.inc("miss")
+        return None
+
+    intent = matched["intent"]
+    _hits[intent] = _hits.get(intent, 0) + 1
+    FAST_PATH_RESULTS.inc(intent)
+    log.info(
+        "fast_path_hit",
+        intent=intent,
+        conversation_id=turn.get("conversation_id"),
+        latency_ms=round((time.perf_counter() - started) * 1000, 2),
+        hit_rate=stats()["hit_rate"],
+    )
+    return {
+        "text": matched["text"],
+        "tokens": 0,
+        "type": "conversational",
+        "products": [],
+        "functionCalls": [],
+        "fast_path": intent,
+    }
+
+
+def stats() -> FastPathStats:
+    hits = sum(_hits.values())
+    total = hits + _misses
+    return {
+        "enabled": settings.FAST_PATH_ENABLED,
+        "hits": hits,
+        "misses": _misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "hits_by_intent": dict(_hits),
+    }
@@ -1,11 +1,13 @@
 import asyncio
+import functools
 import re
-from typing import Dict, Any, Optional, List
-from supabase import Client
+import time
+from typing import Dict, Any, Optional, List, AsyncIterator, Set
+from supabase import AsyncClient
 
 # Import dịch vụ và helpers
 from ..services.context_service import build_context
-from ..agent.agent_service import run_bewo_agent, call_agent_with_function_result # Đã import call_agent_with_function_result
+from ..agent.agent_service import run_bewo_agent, run_bewo_agent_streamed, call_agent_with_function_results
 from ..services.facebook_service import send_facebook_message
 from ..services.address_extraction_service import extract_and_save_address
 from ..services.customer_profile_service import save_customer_profile
@@ -13,22 +15,35 @@ from ..services.address_service import save_address_standardized
 from ..services.cart_service import add_to_cart, get_cart_summary, get_or_create_cart, clear_cart
 from ..services.embedding_service import create_message_embedding, create_summary_embedding
 from ..services.memory_service import create_conversation_summary, extract_and_save_memory, extract_memory_facts
-from ..utils.connect_supabase import get_supabase_client
+from ..services.idempotency_service import build_idempotency_key, message_dedupe
+from ..services.admission_service import agent_admission, turn_priority
+from ..services.metrics_service import TURNS, observe_stage
+from ..services.job_runner_service import JOB_PRIORITY_HIGH, JOB_PRIORITY_LOW, job_runner
+from ..services.write_behind_service import write_behind
+from ..services.answer_cache_service import answer_cache
+from ..services.identity_cache_service import identity_cache
+from .fast_path_handler import bot_asked_confirmation, is_confirmation, is_order_intent, try_fast_path
+from ..services.stage_graph import StageGraph, report_critical_path, sequential_stage
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+from ..config.env import settings
 
-def calculate_cost(tokens: int) -> float:
-    return (tokens / 1_000_000) * 0.5
+log = get_logger("message_handler")
 
-def is_confirmation(message_text: str) -> bool:
-    text = message_text.lower().strip()
-    return any(kw == text for kw in ["đúng rồi", "ok", "confirm", "chốt", "vâng ạ", "đúng", "vâng", "được", "ừ", "có"])
+# Số tin nhắn giữ trong context["history"] (khớp limit của build_context)
+HISTORY_LIMIT = 10
+BUSY_RESPONSE_TEXT = "Dạ hiện tại shop đang nhận rất nhiều tin nhắn, chị chờ em vài phút rồi nhắn lại giúp em nhé! 🙏"
 
-def is_order_intent(message_text: str) -> bool:
-    text = message_text.lower()
-    return any(kw in text for kw in ["đặt hàng", "mua hàng", "chốt đơn", "gửi về", "ship về"])
+def calculate_cost(tokens: int) -> float:
+    return (tokens / 1_000_000) * 0.5
 
 async def handle_order_creation(params: dict) -> dict:
+    async with observe_stage("create_order"):
+        return await _create_order(params)
+
+async def _create_order(params: dict) -> dict:
     from ..services.chatbot_order_service import create_chatbot_order
-    print("--- Đang xử lý tạo đơn hàng ---")
+    log.info("order_creation_started", conversation_id=params.get("conversationId"))
     context = params.get("context", {})
     conversation_id = params.get("conversationId")
     cart = await get_or_create_cart(conversation_id)
@@ -80,10 +95,10 @@ async def handle_order_creation(params: dict) -> dict:
             "message": result.get("error", "Có lỗi xảy ra khi tạo đơn hàng. Vui lòng thử lại.")
         }
 
-async def _create_summary_and_embedding(conversation_id: str, supabase: Client):
+async def _create_summary_and_embedding(conversation_id: str, supabase: AsyncClient):
     try:
         await create_conversation_summary(conversation_id)
-        summary_resp = supabase.from_("conversation_summaries") \
+        summary_resp = await supabase.from_("conversation_summaries") \
             .select("summary_text, key_points") \
             .eq("conversation_id", conversation_id) \
             .order("summary_created_at", desc=True) \
@@ -96,11 +111,276 @@ async def _create_summary_and_embedding(conversation_id: str, supabase: Client):
                 summary.get("summary_text", ""),
                 summary.get("key_points", []),
             )
-        print("✅ Summary embedding created")
+        log.info("summary_embedding_created", conversation_id=conversation_id)
     except Exception as e:
-        print(f"❌ Summary/Embedding creation error: {e}")
+        log.error("summary_embedding_failed", conversation_id=conversation_id, error=str(e))
+
+def _duplicate_response(cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if cached:
+        return {**cached, "duplicate": True}
+    # Tin trùng đang/đã được process khác xử lý → bỏ qua
+    return {
+        "success": True,
+        "duplicate": True,
+        "response": "",
+        "products": [],
+        "recommendation_type": "none",
+        "message_type": "text",
+    }
 
 async def handle_message(body: Dict[str, Any]):
+    # 0. Idempotency: Messenger mid / website clientMessageId
+    # Tin trùng KHÔNG chạy lại bất kỳ bước nào (insert, context, LLM, gửi FB)
+    idempotency_key = build_idempotency_key(body)
+    if idempotency_key:
+        return await message_dedupe.run_once(
+            idempotency_key,
+            lambda: _process_message(body),
+            _duplicate_response,
+        )
+    return await _process_message(body)
+
+def conversation_key(body: Dict[str, Any]) -> str:
+    """Khóa mailbox/thứ tự: các tin cùng khóa luôn thuộc cùng một cuộc trò chuyện"""
+    if body.get("conversation_id"):
+        return f"conversation:{body['conversation_id']}"
+    platform = body.get("platform")
+    for field in ("customer_fb_id", "customer_phone", "user_id", "session_id"):
+        if body.get(field):
+            return f"{platform}:{field}:{body[field]}"
+    return f"{platform}:anonymous"
+
+def _merge_bodies(bodies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    texts = [b.get("message_text", "") for b in bodies]
+    return {
+        **bodies[-1],
+        "message_text": "\n".join(t for t in texts if t),
+        # Mỗi tin vẫn được lưu thành một chatbot_messages riêng
+        "merged_texts": texts,
+    }
+
+async def handle_message_batch(bodies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Một turn cho nhiều tin liên tiếp của CÙNG một cuộc trò chuyện (mailbox debounce):
+    một lần LLM, một lần đọc/ghi giỏ hàng. Trả về kết quả theo từng tin:
+    mọi tin trong nhóm nhận câu trả lời của turn gộp (tin phía trước có `coalesced`),
+    tin trùng key với tin khác trong nhóm nhận `duplicate`.
+    """
+    if len(bodies) == 1:
+        return [await handle_message(bodies[0])]
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(bodies)
+    fresh: List[int] = []
+    duplicates: List[int] = []
+    batch_keys: Set[str] = set()
+    for i, body in enumerate(bodies):
+        key = build_idempotency_key(body)
+        if key and message_dedupe.seen(key):
+            # Facebook gửi lại tin đã xử lý → trả kết quả cũ, không gộp
+            results[i] = await handle_message(body)
+        elif key and key in batch_keys:
+            # Double-submit / redelivery trong cùng cửa sổ debounce → không gộp, không lưu lại
+            duplicates.append(i)
+        else:
+            if key:
+                batch_keys.add(key)
+            fresh.append(i)
+
+    if not fresh:
+        return results
+    if len(fresh) == 1:
+        result = await handle_message(bodies[fresh[0]])
+    else:
+        merged = _merge_bodies([bodies[i] for i in fresh])
+        log.info("messages_coalesced", conversation_key=conversation_key(merged), count=len(fresh))
+        keys = [k for k in (build_idempotency_key(bodies[i]) for i in fresh) if k]
+        if keys:
+            result = await message_dedupe.run_once(
+                keys[-1],
+                lambda: _process_message(merged),
+                _duplicate_response,
+                aliases=keys[:-1],
+            )
+        else:
+            result = await _process_message(merged)
+    for i in fresh[:-1]:
+        results[i] = {**result, "coalesced": True}
+    results[fresh[-1]] = result
+    for i in duplicates:
+        results[i] = _duplicate_response(result)
+    return results
+
+async def _process_message(body: Dict[str, Any]):
+    started = time.perf_counter()
+    async with observe_stage("turn"):
+        try:
+            turn = await _prepare_turn(body)
+            # 3.5. Fast path: tin đơn giản / tất định → trả lời không cần LLM
+            # 3.6. Answer cache: câu hỏi FAQ đã trả lời với cùng catalog/chính sách
+            async with sequential_stage(turn["critical_path"], "fast_path"):
+                shortcut = await try_fast_path(turn)
+                outcome = "fast_path"
+                if shortcut is None:
+                    shortcut = answer_cache.lookup(turn["message_text"], turn["context"])
+                    outcome = "cached"
+            if shortcut is not None:
+                result = await _finalize_turn(turn, shortcut)
+                TURNS.inc(turn["platform"], outcome)
+                report_critical_path(turn["critical_path"], turn["platform"], time.perf_counter() - started)
+                return result
+            # 4. Multi-Agent response (LLM) - qua admission control
+            # Catalog invalidate trong lúc agent chạy → không cache câu trả lời cũ
+            catalog_version = answer_cache.catalog_version
+            if not await agent_admission.acquire(turn_priority(turn["context"])):
+                TURNS.inc(turn["platform"], "shed")
+                return await _shed_turn(turn)
+            try:
+                async with sequential_stage(turn["critical_path"], "agent"):
+                    llm_result = await run_bewo_agent(turn["message_text"], turn["context"])
+            finally:
+                agent_admission.release()
+            answer_cache.store(turn["message_text"], turn["context"], llm_result, catalog_version)
+            result = await _finalize_turn(turn, llm_result)
+        except Exception:
+            TURNS.inc(body.get("platform"), "error")
+            raise
+    TURNS.inc(turn["platform"], "ok")
+    report_critical_path(turn["critical_path"], turn["platform"], time.perf_counter() - started)
+    return result
+
+async def stream_message(
+    body: Dict[str, Any],
+    session: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Giống handle_message nhưng stream kết quả LLM:
+    yield {"type": "token"} / {"type": "products"} trong lúc agent chạy,
+    các bước lưu DB / function calls chạy SAU khi stream LLM kết thúc,
+    cuối cùng yield {"type": "done", "result": ...} (cùng format với handle_message).
+    Tin trùng (clientMessageId gửi lại) chỉ nhận event "done" với kết quả cũ.
+    Caller giữ lượt của cuộc trò chuyện (website_queue.exclusive) như POST /chat/.
+    """
+    idempotency_key = build_idempotency_key(body)
+    if not idempotency_key:
+        async for event in _stream_turn(body, session):
+            yield event
+        return
+
+    claim = await message_dedupe.claim(idempotency_key)
+    if not claim.owner:
+        yield {"type": "done", "result": _duplicate_response(claim.result)}
+        return
+    completed = False
+    try:
+        async for event in _stream_turn(body, session):
+            if event["type"] == "done":
+                # Turn đã lưu DB → client ngắt ngay sau đó thì tin gửi lại vẫn nhận kết quả này
+                await claim.complete(event["result"])
+                completed = True
+            yield event
+    except BaseException as e:
+        if not completed:
+            await claim.fail(e)
+        raise
+
+async def _stream_turn(
+    body: Dict[str, Any],
+    session: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    started = time.perf_counter()
+    turn = await _prepare_turn(body, session)
+    async with sequential_stage(turn["critical_path"], "fast_path"):
+        shortcut = await try_fast_path(turn)
+        outcome = "fast_path"
+        if shortcut is None:
+            shortcut = answer_cache.lookup(turn["message_text"], turn["context"])
+            outcome = "cached"
+    if shortcut is not None:
+        if shortcut["products"]:
+            yield {"type": "products", "products": shortcut["products"]}
+        yield {"type": "token", "delta": shortcut["text"]}
+        result = await _finalize_turn(turn, shortcut)
+        TURNS.inc(turn["platform"], outcome)
+        report_critical_path(turn["critical_path"], turn["platform"], time.perf_counter() - started)
+        yield {"type": "done", "result": result}
+        return
+    catalog_version = answer_cache.catalog_version
+    if not await agent_admission.acquire(turn_priority(turn["context"])):
+        TURNS.inc(turn["platform"], "shed")
+        result = await _shed_turn(turn)
+        yield {"type": "token", "delta": result["response"]}
+        yield {"type": "done", "result": result}
+        return
+    llm_result: Dict[str, Any] = {}
+    try:
+        # Thời gian stage gồm cả thời gian client đọc stream
+        async with sequential_stage(turn["critical_path"], "agent_streamed"):
+            async for event in run_bewo_agent_streamed(turn["message_text"], turn["context"]):
+                if event["type"] == "result":
+                    llm_result = event["result"]
+                else:
+                    yield event
+    finally:
+        agent_admission.release()
+    answer_cache.store(turn["message_text"], turn["context"], llm_result, catalog_version)
+    result = await _finalize_turn(turn, llm_result)
+    TURNS.inc(turn["platform"], "ok")
+    report_critical_path(turn["critical_path"], turn["platform"], time.perf_counter() - started)
+    yield {"type": "done", "result": result}
+
+async def _shed_turn(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Quá tải: trả lời "đang bận" ngay, KHÔNG gọi LLM / lưu bot message /
+    trích xuất memory (tin của khách đã được lưu ở bước 2).
+    """
+    if turn.get("session") is not None:
+        turn["session"]["context"] = None
+    if turn["platform"] == "facebook" and turn["access_token"] and turn["customer_fb_id"]:
+        await asyncio.to_thread(
+            send_facebook_message,
+            turn["customer_fb_id"],
+            BUSY_RESPONSE_TEXT,
+            turn["access_token"],
+            [],
+        )
+    return {
+        "success": True,
+        "busy": True,
+        "response": BUSY_RESPONSE_TEXT,
+        "products": [],
+        "recommendation_type": "none",
+        "message_type": "text",
+    }
+
+def _extend_history(context: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    # Copy nông để turn đang chạy không bị ảnh hưởng khi snapshot được cập nhật
+    history = (context.get("history") or []) + [message]
+    return {**context, "history": history[-HISTORY_LIMIT:]}
+
+def _merge_saved_messages(context: Dict[str, Any], saved: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    build_context chạy song song với insert tin của khách: nếu query history
+    chạy trước insert thì thêm các tin vừa lưu (giữ kết quả như khi chạy tuần tự).
+    """
+    history = list(context.get("history") or [])
+    seen = {(m.get("sender_type"), m.get("created_at")) for m in history}
+    for row in saved:
+        if len(history) >= HISTORY_LIMIT:
+            break
+        if ("customer", row.get("created_at")) not in seen:
+            history.append({
+                "sender_type": row.get("sender_type", "customer"),
+                "content": row.get("content"),
+                "created_at": row.get("created_at"),
+            })
+    context["history"] = history
+    return context
+
+async def _prepare_turn(body: Dict[str, Any], session: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Bước 1-3: conversation, lưu tin nhắn khách, build context.
+    `session` (WebSocket): giữ conversation_id + context snapshot giữa các turn.
+    """
     platform = body.get("platform")
     customer_fb_id = body.get("customer_fb_id")
     customer_phone = body.get("customer_phone")
@@ -112,13 +392,17 @@ async def handle_message(body: Dict[str, Any]):
     if platform == "web":
         platform = "website"
     db_platform = platform
-    print(f"Processing message: {{'platform': '{db_platform}', 'message': '{message_text[:50]}...'}}")
-    supabase = get_supabase_client()
+    log.info("message_processing", platform=db_platform, text=message_text[:50])
+    supabase = get_async_supabase_client()
     if not supabase:
         raise ValueError("Không thể khởi tạo Supabase client.")
 
-    # 1. Get or Create Conversation
-    try:
+    # Đồ thị stage: conversation → (save_customer_message ‖ build_context)
+    # build_context không cần row tin nhắn vừa lưu → chạy song song với insert
+    graph = StageGraph()
+
+    # 1. Get or Create Conversation (live session đã resolve / identity cache → bỏ qua RPC)
+    async def get_or_create_conversation() -> Optional[str]:
         rpc_params = {
             "p_platform": platform,
             "p_customer_fb_id": customer_fb_id,
@@ -128,187 +412,334 @@ async def handle_message(body: Dict[str, Any]):
             "p_customer_name": "Guest",
             "p_customer_avatar": None,
         }
-        conv_resp = supabase.rpc("get_or_create_conversation", rpc_params).execute()
-        if not conv_resp.data:
-            raise Exception("Could not create/get conversation")
-        conversation_id = conv_resp.data
-        print(f"✅ Conversation ID: {conversation_id}")
-    except Exception as e:
-        print(f"❌ Conversation error: {e}")
-        raise
+        conv_resp = await supabase.rpc("get_or_create_conversation", rpc_params).execute()
+        log.debug("conversation_resolved", conversation_id=conv_resp.data)
+        return conv_resp.data
 
-    # 2. Save customer message
-    try:
-        msg_resp = supabase.from_("chatbot_messages") \
-            .insert({
-                "conversation_id": conversation_id,
-                "sender_type": "customer",
-                "message_type": "text",
-                "content": {"text": message_text},
-            }) \
-            .execute()
-        if not msg_resp.data or len(msg_resp.data) == 0:
-            raise Exception("Could not save customer message")
-        customer_message = msg_resp.data[0]
-    except Exception as e:
-        print(f"❌ Error saving customer message: {e}")
-        raise
-
-    # 2.1. Create customer embedding (async)
-    embedding_metadata = {
-        "sender_type": "customer",
-        "platform": db_platform,
+    identity_key = identity_cache.identity_key({
+        "platform": platform,
         "customer_fb_id": customer_fb_id,
+        "customer_phone": customer_phone,
         "user_id": user_id,
         "session_id": session_id,
-    }
-    asyncio.create_task(
-        create_message_embedding(
-            conversation_id,
-            customer_message["id"],
-            message_text,
-            embedding_metadata,
-        )
+    })
+
+    async def resolve_conversation(_: Dict[str, Any]) -> str:
+        try:
+            conversation_id = await identity_cache.resolve_conversation(identity_key, get_or_create_conversation)
+            if not conversation_id:
+                raise Exception("Could not create/get conversation")
+            return conversation_id
+        except Exception as e:
+            log.error("conversation_failed", platform=platform, error=str(e))
+            raise
+
+    async def session_conversation(_: Dict[str, Any]) -> str:
+        return session["conversation_id"]
+
+    if session is not None and session.get("conversation_id"):
+        graph.add("conversation", session_conversation, observe=False)
+    else:
+        graph.add("conversation", resolve_conversation)
+
+    # 2. Save customer message (tin gộp → mỗi tin một row, một lần insert)
+    merged_texts = body.get("merged_texts") or [message_text]
+
+    async def save_customer_messages(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        conversation_id = results["conversation"]
+        try:
+            msg_resp = await supabase.from_("chatbot_messages") \
+                .insert([
+                    {
+                        "conversation_id": conversation_id,
+                        "sender_type": "customer",
+                        "message_type": "text",
+                        "content": {"text": text},
+                    }
+                    for text in merged_texts
+                ]) \
+                .execute()
+            if not msg_resp.data or len(msg_resp.data) == 0:
+                raise Exception("Could not save customer message")
+        except Exception as e:
+            log.error("save_customer_message_failed", conversation_id=conversation_id, error=str(e))
+            # Conversation có thể đã bị xóa → lần sau resolve lại bằng RPC
+            identity_cache.forget_conversation(conversation_id)
+            raise
+
+        # 2.1. Create customer embedding (write-behind)
+        embedding_metadata = {
+            "sender_type": "customer",
+            "platform": db_platform,
+            "customer_fb_id": customer_fb_id,
+            "user_id": user_id,
+            "session_id": session_id,
+        }
+        for saved, text in zip(msg_resp.data, merged_texts):
+            await create_message_embedding(
+                conversation_id,
+                saved["id"],
+                text,
+                embedding_metadata,
+            )
+        return msg_resp.data
+
+    graph.add("save_customer_message", save_customer_messages, after=["conversation"])
+
+    # 3. Build context (live session còn snapshot → dùng lại, chỉ nối history)
+    async def load_context(results: Dict[str, Any]) -> Dict[str, Any]:
+        return await build_context(supabase, results["conversation"], message_text)
+
+    async def extend_snapshot(results: Dict[str, Any]) -> Dict[str, Any]:
+        return _extend_history(session["context"], {
+            "sender_type": "customer",
+            "content": {"text": message_text},
+            "created_at": results["save_customer_message"][-1].get("created_at"),
+        })
+
+    reuse_snapshot = session is not None and bool(session.get("context"))
+    if reuse_snapshot:
+        graph.add("build_context", extend_snapshot, after=["save_customer_message"], observe=False)
+    else:
+        graph.add("build_context", load_context, after=["conversation"])
+
+    results = await graph.run()
+    critical_path = graph.critical_path()
+    conversation_id = results["conversation"]
+    context = results["build_context"]
+    if not reuse_snapshot:
+        # History có thể được đọc trước khi insert xong → bổ sung tin vừa lưu
+        context = _merge_saved_messages(context, results["save_customer_message"])
+    if session is not None:
+        session["conversation_id"] = conversation_id
+        session["context"] = context
+    log.info(
+        "context_built",
+        conversation_id=conversation_id,
+        has_profile=bool(context.get("profile")),
+        has_saved_address=bool(context.get("saved_address")),
+        history_count=len(context.get("history", [])),
+        memory_count=len(context.get("memory_facts", [])),
+        cart_count=len(context.get("cart", [])),
     )
 
-    # 3. Build context
-    context = await build_context(supabase, conversation_id, message_text)
-    print("Context built:", {
-        "hasProfile": bool(context.get("profile")),
-        "hasSavedAddress": bool(context.get("saved_address")),
-        "historyCount": len(context.get("history", [])),
-        "memoryCount": len(context.get("memory_facts", [])),
-        "cartCount": len(context.get("cart", [])),
-    })
+    return {
+        "platform": platform,
+        "db_platform": db_platform,
+        "customer_fb_id": customer_fb_id,
+        "access_token": access_token,
+        "message_text": message_text,
+        "sticker_id": body.get("sticker_id"),
+        "supabase": supabase,
+        "conversation_id": conversation_id,
+        "context": context,
+        "session": session,
+        "critical_path": critical_path,
+    }
+
+# Function call dùng chung tài nguyên → chạy tuần tự trong cùng nhóm (đúng thứ tự agent gọi);
+# các nhóm khác nhau chạy song song. confirm_and_create_order chạy sau tất cả call trước nó.
+FUNCTION_RESOURCE = {
+    "save_customer_info": "profile",
+    "save_address": "profile",
+    "add_to_cart": "cart",
+}
+
+async def _execute_function_calls(
+    turn: Dict[str, Any],
+    function_calls: List[Dict[str, Any]],
+    llm_result: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    """
+    Chạy các function call đã validate theo đồ thị phụ thuộc.
+    Returns: theo thứ tự gốc, mỗi call một dict {name, args, result, append_text, replace_text}
+    (result=None: call bị bỏ qua hoặc lỗi).
+    """
+    graph = StageGraph()
+    stages: List[str] = []
+    last_in_group: Dict[str, str] = {}
+    for index, fn_call in enumerate(function_calls):
+        stage = f"function.{index}.{fn_call['name']}"
+        resource = FUNCTION_RESOURCE.get(fn_call["name"])
+        if resource is None:
+            after = list(stages)
+        else:
+            after = [last_in_group[resource]] if resource in last_in_group else []
+            last_in_group[resource] = stage
+        graph.add(stage, _function_call_runner(turn, fn_call, llm_result), after=after, observe=False)
+        stages.append(stage)
+
+    results = await graph.run()
+    return [results[stage] for stage in stages]
+
+def _function_call_runner(turn: Dict[str, Any], fn_call: Dict[str, Any], llm_result: Dict[str, Any]):
+    async def run(_: Dict[str, Any]) -> Dict[str, Any]:
+        executed = {
+            "name": fn_call.get("name"),
+            "args": fn_call.get("args", {}),
+            "result": None,
+            "append_text": "",
+            "replace_text": None,
+        }
+        try:
+            await _execute_function_call(turn, executed, llm_result)
+        except Exception as e:
+            # Lỗi của một call không làm hỏng các call khác
+            executed["result"] = None
+            log.error("function_call_failed", conversation_id=turn["conversation_id"], function=executed["name"], error=str(e))
+        return executed
+    return run
+
+async def _execute_function_call(turn: Dict[str, Any], executed: Dict[str, Any], llm_result: Dict[str, Any]) -> None:
+    supabase = turn["supabase"]
+    conversation_id = turn["conversation_id"]
+    message_text = turn["message_text"]
+    fn_name = executed["name"]
+    fn_args = executed["args"]
+
+    log.info("function_call", conversation_id=conversation_id, function=fn_name, args=dict(fn_args))
+    function_result: Optional[Dict[str, Any]] = {"success": False}
+    if fn_name == "save_customer_info":
+        function_result = await save_customer_profile(conversation_id, fn_args)
+        if function_result.get("success"):
+            executed["append_text"] = f"\n\n✅ Đã lưu thông tin: {fn_args.get('full_name', '')}"
+    elif fn_name == "save_address":
+        if not fn_args.get("address_line") or not fn_args.get("city"):
+            return
+        if re.match(r'^[\d\s]+$', fn_args.get("address_line", "")):
+            fix_result = await extract_and_save_address(conversation_id, message_text)
+            function_result = {
+                "success": fix_result,
+                "message": "Đã lưu địa chỉ" if fix_result else "Không thể lưu địa chỉ"
+            }
+        else:
+            function_result = await save_address_standardized(conversation_id, {
+                "full_name": fn_args.get("full_name"),
+                "phone": fn_args.get("phone"),
+                "address_line": fn_args["address_line"],
+                "ward": fn_args.get("ward"),
+                "district": fn_args.get("district"),
+                "city": fn_args["city"]
+            })
+        if function_result.get("success"):
+            executed["append_text"] = f"\n\n✅ Đã lưu địa chỉ giao hàng"
+    elif fn_name == "add_to_cart":
+        product_id = fn_args.get("product_id")
+        size = fn_args.get("size")
+        quantity = fn_args.get("quantity", 1)
+        prod_resp = await supabase.from_("products").select(
+             "id, name, price, images:product_images(image_url, is_primary)"
+        ).eq("id", product_id).limit(1).execute()
+        if prod_resp.data and len(prod_resp.data) > 0:
+            product = prod_resp.data[0]
+            images = product.get("images", [])
+            primary_image = next((img["image_url"] for img in images if img.get("is_primary")), None)
+            first_image = images[0]["image_url"] if images else None
+            cart_item = {
+                "product_id": product_id,
+                "name": product["name"],
+                "price": product.get("price", 0),
+                "size": size,
+                "quantity": quantity,
+                "image": primary_image or first_image
+            }
+            updated_cart = await add_to_cart(conversation_id, cart_item)
+            function_result = {
+                "success": True,
+                "message": f"Đã thêm {product['name']} vào giỏ hàng",
+                "cart_count": len(updated_cart)
+            }
+            executed["append_text"] = f"\n\n🛒 Đã thêm vào giỏ: {product['name']} (Size {size}) x{quantity}"
+        else:
+            function_result = {
+                "success": False,
+                "message": "Không tìm thấy sản phẩm"
+            }
+    elif fn_name == "confirm_and_create_order":
+        if fn_args.get("confirmed"):
+            order_result = await handle_order_creation({
+                "conversationId": conversation_id,
+                "message_text": message_text,
+                "aiResponse": llm_result,
+                "context": turn["context"]
+            })
+            function_result = order_result
+            executed["replace_text"] = order_result["message"]
+    else:
+        log.warning("function_unknown", function=fn_name)
+    executed["result"] = function_result
+
+async def _finalize_turn(turn: Dict[str, Any], llm_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Bước 4.1-11: function calls, lưu bot message, usage, memory, gửi FB"""
+    platform = turn["platform"]
+    db_platform = turn["db_platform"]
+    customer_fb_id = turn["customer_fb_id"]
+    access_token = turn["access_token"]
+    message_text = turn["message_text"]
+    supabase = turn["supabase"]
+    conversation_id = turn["conversation_id"]
+    context = turn["context"]
 
-    # 4. Multi-Agent response (LLM)
-    llm_result = await run_bewo_agent(message_text, context)
     response_text = llm_result["text"]
     tokens_used = llm_result.get("tokens", 0)
     recommendation_type = llm_result.get("type", "conversational")
     product_cards = llm_result.get("products", [])
     function_calls = llm_result.get("functionCalls", [])
 
-    if tokens_used == 0:
+    # Usage thật từ provider (input cached / uncached, output); None → chỉ có ước lượng
+    usage = dict(llm_result["usage"]) if llm_result.get("usage") else None
+
+    if tokens_used == 0 and not (llm_result.get("fast_path") or llm_result.get("cache")):
         tokens_used = (len(message_text) + len(response_text)) // 4
 
-    print("Response generated:", {
-        "type": recommendation_type,
-        "products": len(product_cards),
-        "tokens": tokens_used,
-        "functionCalls": len(function_calls)
-    })
+    log.info(
+        "response_generated",
+        conversation_id=conversation_id,
+        type=recommendation_type,
+        products=len(product_cards),
+        tokens=tokens_used,
+        cached_input_tokens=usage["cached_input_tokens"] if usage else None,
+        uncached_input_tokens=usage["uncached_input_tokens"] if usage else None,
+        function_calls=len(function_calls),
+    )
 
     # 4.1. Execute functionCalls (save_customer_info, save_address, add_to_cart, confirm_and_create_order)
     if function_calls:
-        print(f"🔧 Executing {len(function_calls)} function call(s)")
-        for fn_call in function_calls:
-            try:
-                function_result = {"success": False}
-                fn_name = fn_call["name"]
-                fn_args = fn_call["args"]
-                
-                print(f"🔧 Executing: {fn_name}({fn_args})")
-                if fn_name == "save_customer_info":
-                    function_result = await save_customer_profile(conversation_id, fn_args)
-                    if function_result.get("success"):
-                        response_text += f"\n\n✅ Đã lưu thông tin: {fn_args.get('full_name', '')}"
-                elif fn_name == "save_address":
-                    if not fn_args.get("address_line") or not fn_args.get("city"):
-                        continue
-                    if re.match(r'^[\d\s]+$', fn_args.get("address_line", "")):
-                        fix_result = await extract_and_save_address(conversation_id, message_text)
-                        function_result = {
-                            "success": fix_result,
-                            "message": "Đã lưu địa chỉ" if fix_result else "Không thể lưu địa chỉ"
-                        }
-                    else:
-                        result = await save_address_standardized(conversation_id, {
-                            "full_name": fn_args.get("full_name"),
-                            "phone": fn_args.get("phone"),
-                            "address_line": fn_args["address_line"],
-                            "ward": fn_args.get("ward"),
-                            "district": fn_args.get("district"),
-                            "city": fn_args["city"]
-                        })
-                        function_result = result
-                    if function_result.get("success"):
-                        response_text += f"\n\n✅ Đã lưu địa chỉ giao hàng"
-                elif fn_name == "add_to_cart":
-                    product_id = fn_args.get("product_id")
-                    size = fn_args.get("size")
-                    quantity = fn_args.get("quantity", 1)
-                    prod_resp = supabase.from_("products").select(
-                         "id, name, price, images:product_images(image_url, is_primary)"
-                    ).eq("id", product_id).limit(1).execute()
-                    if prod_resp.data and len(prod_resp.data) > 0:
-                        product = prod_resp.data[0]
-                        images = product.get("images", [])
-                        primary_image = next((img["image_url"] for img in images if img.get("is_primary")), None)
-                        first_image = images[0]["image_url"] if images else None
-                        cart_item = {
-                            "product_id": product_id,
-                            "name": product["name"],
-                            "price": product.get("price", 0),
-                            "size": size,
-                            "quantity": quantity,
-                            "image": primary_image or first_image
-                        }
-                        updated_cart = await add_to_cart(conversation_id, cart_item)
-                        function_result = {
-                            "success": True,
-                            "message": f"Đã thêm {product['name']} vào giỏ hàng",
-                            "cart_count": len(updated_cart)
-                        }
-                        response_text += f"\n\n🛒 Đã thêm vào giỏ: {product['name']} (Size {size}) x{quantity}"
-                    else:
-                        function_result = {
-                            "success": False,
-                            "message": "Không tìm thấy sản phẩm"
-                        }
-                elif fn_name == "confirm_and_create_order":
-                    if fn_args.get("confirmed"):
-                        order_result = await handle_order_creation({
-                            "conversationId": conversation_id,
-                            "message_text": message_text,
-                            "aiResponse": llm_result,
-                            "context": context
-                        })
-                        function_result = order_result
-                        response_text = order_result["message"]
-                else:
-                    print(f"⚠️ Unknown function: {fn_name}")
-
-                # ⭐ [BỔ SUNG] THỰC HIỆN CONTINUATION CALL SAU KHI CHẠY FUNCTION
-                # Gửi kết quả function về Agent để Agent tạo ra phản hồi tự nhiên tiếp theo
-                if function_result and (function_result.get("success") or function_result.get("message")):
-                    print(f"➡️ Calling agent for continuation after {fn_name}")
-                    continuation_response = await call_agent_with_function_result(
-                        context=context,
-                        user_message=message_text,
-                        function_name=fn_name,
-                        function_result=function_result
-                    )
-                    
-                    # Cập nhật response_text và tokens_used từ Agent Continuation
-                    if continuation_response.get("text"):
-                        response_text += "\n\n" + continuation_response["text"]
-                        tokens_used += continuation_response.get("tokens", 0)
-
-            except Exception as e:
-                print(f"❌ Function execution error ({fn_name}): {e}")
+        async with sequential_stage(turn["critical_path"], "function_calls"):
+            executed = await _execute_function_calls(turn, function_calls, llm_result)
+
+            # Áp dụng thay đổi response theo đúng thứ tự function call
+            for call in executed:
+                if call["replace_text"] is not None:
+                    response_text = call["replace_text"]
+                elif call["append_text"]:
+                    response_text += call["append_text"]
+
+            # ⭐ MỘT continuation cho TẤT CẢ kết quả: template cố định nếu kết quả đơn giản,
+            # ngược lại một lần gọi agent
+            results_for_agent = [
+                call for call in executed
+                if call["result"] and (call["result"].get("success") or call["result"].get("message"))
+            ]
+            if results_for_agent:
+                continuation_response = await call_agent_with_function_results(
+                    context=context,
+                    user_message=message_text,
+                    function_results=results_for_agent,
+                )
+                if continuation_response.get("text"):
+                    response_text += "\n\n" + continuation_response["text"]
+                    tokens_used += continuation_response.get("tokens", 0)
+                    if usage and continuation_response.get("usage"):
+                        for key, value in continuation_response["usage"].items():
+                            usage[key] += value
+
+    # Function call / tạo đơn làm thay đổi profile, địa chỉ, giỏ hàng → snapshot context cũ
+    state_changed = bool(function_calls)
 
     # 4.5. Check order confirmation
     if is_confirmation(message_text):
-        history = context.get("history", [])
-        recent_bot_messages = [m for m in history if m.get("sender_type") == "bot"][-2:]
-        just_asked_for_confirmation = False
-        for msg in recent_bot_messages:
-            text = msg.get("content", {}).get("text", "")
-            if "giao về" in text and "phải không" in text:
-                just_asked_for_confirmation = True
-                break
-        if just_asked_for_confirmation:
+        if bot_asked_confirmation(context.get("history", [])):
             order_result = await handle_order_creation({
                 "conversationId": conversation_id,
                 "message_text": message_text,
@@ -316,6 +747,7 @@ async def handle_message(body: Dict[str, Any]):
                 "context": context
             })
             response_text = order_result["message"]
+            state_changed = True
     # 4.6. Check if order intent
     elif is_order_intent(message_text):
         order_result = await handle_order_creation({
@@ -325,57 +757,82 @@ async def handle_message(body: Dict[str, Any]):
             "context": context
         })
         response_text = order_result["message"]
+        state_changed = True
 
-    # 5. Save bot response
-    try:
-        bot_msg_content = {
-            "text": response_text,
-            "products": product_cards,
-            "recommendation_type": recommendation_type,
-        }
-        bot_msg_resp = supabase.from_("chatbot_messages") \
-            .insert({
-                "conversation_id": conversation_id,
-                "sender_type": "bot",
-                "message_type": "product_card" if product_cards else "text",
-                "content": bot_msg_content,
-                "tokens_used": tokens_used,
-            }) \
-            .execute()
-        if not bot_msg_resp.data or len(bot_msg_resp.data) == 0:
-            raise Exception("Could not save bot message")
-        bot_message = bot_msg_resp.data[0]
-    except Exception as e:
-        print(f"❌ Error saving bot message: {e}")
-        raise
+    # 5, 10: lưu bot message ‖ gửi Facebook (độc lập nhau, chạy song song)
+    graph = StageGraph()
 
-    # 5.1. Bot embedding (async)
-    bot_embedding_metadata = {
-        "sender_type": "bot",
-        "platform": db_platform,
-        "has_products": bool(product_cards),
-        "product_count": len(product_cards),
+    # 5. Save bot response
+    bot_msg_content = {
+        "text": response_text,
+        "products": product_cards,
         "recommendation_type": recommendation_type,
-        "product_ids": [p.get("id") for p in product_cards],
     }
-    asyncio.create_task(
-        create_message_embedding(
+
+    async def save_bot_message(_: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            bot_msg_resp = await supabase.from_("chatbot_messages") \
+                .insert({
+                    "conversation_id": conversation_id,
+                    "sender_type": "bot",
+                    "message_type": "product_card" if product_cards else "text",
+                    "content": bot_msg_content,
+                    "tokens_used": tokens_used,
+                }) \
+                .execute()
+            if not bot_msg_resp.data or len(bot_msg_resp.data) == 0:
+                raise Exception("Could not save bot message")
+            bot_message = bot_msg_resp.data[0]
+        except Exception as e:
+            log.error("save_bot_message_failed", conversation_id=conversation_id, error=str(e))
+            raise
+
+        # 5.1. Bot embedding (write-behind)
+        bot_embedding_metadata = {
+            "sender_type": "bot",
+            "platform": db_platform,
+            "has_products": bool(product_cards),
+            "product_count": len(product_cards),
+            "recommendation_type": recommendation_type,
+            "product_ids": [p.get("id") for p in product_cards],
+        }
+        await create_message_embedding(
             conversation_id,
             bot_message["id"],
             response_text,
             bot_embedding_metadata,
         )
-    )
+        return bot_message
+
+    graph.add("save_bot_message", save_bot_message)
 
-    # 6. Log usage
+    # 6. Log usage (write-behind: gom bulk insert, không round trip trong turn)
     if tokens_used > 0:
-        supabase.from_("chatbot_usage_logs").insert({
+        write_behind.add("chatbot_usage_logs", {
             "conversation_id": conversation_id,
-            "input_tokens": tokens_used // 2,
-            "output_tokens": tokens_used // 2,
+            "input_tokens": usage["input_tokens"] if usage else tokens_used // 2,
+            "output_tokens": usage["output_tokens"] if usage else tokens_used // 2,
             "cost": calculate_cost(tokens_used),
-            "model": "gemini-2.0-flash-exp",
-        }).execute()
+            "model": llm_result.get("model") or settings.LLM_DEFAULT_MODEL.split("/", 1)[-1],
+        })
+
+    # 10. Send to Facebook Messenger (nếu có)
+    async def send_to_facebook(_: Dict[str, Any]) -> None:
+        # send_facebook_message dùng requests (sync) → chạy trong thread
+        await asyncio.to_thread(
+            send_facebook_message,
+            customer_fb_id,
+            response_text,
+            access_token,
+            product_cards,
+        )
+
+    if platform == "facebook" and access_token and customer_fb_id:
+        graph.add("facebook_send", send_to_facebook)
+
+    results = await graph.run()
+    turn["critical_path"].extend(graph.critical_path())
+    bot_message = results["save_bot_message"]
 
     # 6.5. Extract address automatic
     has_address_keywords = re.search(
@@ -384,32 +841,45 @@ async def handle_message(body: Dict[str, Any]):
         re.IGNORECASE
     )
     if has_address_keywords:
-        asyncio.create_task(
-            extract_and_save_address(conversation_id, message_text)
+        job_runner.submit(
+            "extract_address",
+            functools.partial(extract_and_save_address, conversation_id, message_text),
+            priority=JOB_PRIORITY_HIGH,
         )
+        state_changed = True
     # 7-8. Memory processing (async)
-    asyncio.create_task(
-        extract_and_save_memory(conversation_id, message_text, llm_result)
+    job_runner.submit(
+        "extract_memory",
+        functools.partial(extract_and_save_memory, conversation_id, message_text, llm_result),
     )
     profile_id = context.get("profile", {}).get("id")
     if profile_id:
-        asyncio.create_task(
-            extract_memory_facts(profile_id, message_text, conversation_id)
+        job_runner.submit(
+            "extract_memory_facts",
+            functools.partial(extract_memory_facts, profile_id, message_text, conversation_id),
         )
     # 9. Conversation summary (async)
     message_count = len(context.get("history", []))
     if message_count > 0 and message_count % 20 == 0:
-        asyncio.create_task(
-            _create_summary_and_embedding(conversation_id, supabase)
-        )
-    # 10. Send to Facebook Messenger (nếu có)
-    if platform == "facebook" and access_token and customer_fb_id:
-        await send_facebook_message(
-            customer_fb_id,
-            response_text,
-            access_token,
-            product_cards,
+        job_runner.submit(
+            "conversation_summary",
+            functools.partial(_create_summary_and_embedding, conversation_id, supabase),
+            priority=JOB_PRIORITY_LOW,
         )
+    # 10.5. Cập nhật context snapshot của live session (WebSocket)
+    session = turn.get("session")
+    if session is not None:
+        session["turns"] = session.get("turns", 0) + 1
+        if state_changed or session["turns"] % settings.WS_CONTEXT_REFRESH_TURNS == 0:
+            # Build lại context đầy đủ ở turn sau
+            session["context"] = None
+        else:
+            session["context"] = _extend_history(context, {
+                "sender_type": "bot",
+                "content": bot_msg_content,
+                "created_at": bot_message.get("created_at"),
+            })
+
     # 11. Return API result
     return {
         "success": True,
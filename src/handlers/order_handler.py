@@ -4,8 +4,9 @@
 
 import re
 import asyncio
+import functools
 from typing import Dict, Any, Optional, List
-from supabase import Client
+from supabase import AsyncClient
 from postgrest.exceptions import APIError
 # --- 1. Import Services ---
 
@@ -14,8 +15,9 @@ try:
     from ..services.chatbot_order_service import create_chatbot_order
     from ..services.address_service import get_standardized_address
     from ..services.cart_service import clear_cart, get_or_create_cart
+    from ..services.job_runner_service import JOB_PRIORITY_HIGH, job_runner
     # Import connect_supabase từ thư mục gốc
-    from ..utils.connect_supabase import create_async_supabase_client
+    from ..utils.connect_supabase import get_async_supabase_client
 
 except ImportError:
     # Fallback nếu cấu trúc file bị dẹt (flat)
@@ -23,7 +25,8 @@ except ImportError:
     from services.chatbot_order_service import create_chatbot_order
     from services.address_service import get_standardized_address
     from services.cart_service import clear_cart, get_or_create_cart
-    from ..utils.connect_supabase import create_async_supabase_client
+    from services.job_runner_service import JOB_PRIORITY_HIGH, job_runner
+    from ..utils.connect_supabase import get_async_supabase_client
 
 # --- 2. Stubs & Helpers ---
 
@@ -104,7 +107,7 @@ async def handle_order_creation(body: Dict[str, Any]) -> Dict[str, Any]:
     message_text = body.get("message_text", "")
     # ai_response = body.get("aiResponse") # Không dùng trực tiếp
 
-    supabase = create_async_supabase_client()
+    supabase = get_async_supabase_client()
     if not supabase:
         return {"success": False, "message": "Lỗi kết nối."}
 
@@ -115,7 +118,7 @@ async def handle_order_creation(body: Dict[str, Any]) -> Dict[str, Any]:
         # ========================================
         # 1. GET CUSTOMER PROFILE
         # ========================================
-        profile_resp = supabase.from_("customer_profiles") \
+        profile_resp = await supabase.from_("customer_profiles") \
             .select("id, full_name, preferred_name, phone, customer_fb_id") \
             .eq("conversation_id", conversation_id) \
             .single() \
@@ -223,8 +226,10 @@ async def handle_order_creation(body: Dict[str, Any]) -> Dict[str, Any]:
         # ========================================
         # 4.6. SYNC TO MAIN ORDERS (NON-BLOCKING)
         # ========================================
-        asyncio.create_task(
-            sync_chatbot_order_to_main_orders(order.get('id'))
+        job_runner.submit(
+            "sync_main_order",
+            functools.partial(sync_chatbot_order_to_main_orders, order.get('id')),
+            priority=JOB_PRIORITY_HIGH,
         )
 
         # ========================================
@@ -288,7 +293,7 @@ Chị cần em hỗ trợ thêm gì không ạ? 💕
         }
 
 async def get_products_from_conversation(
-    supabase: Client,
+    supabase: AsyncClient,
     conversation_id: str,
 ) -> List[Dict[str, Any]]:
     """
@@ -297,7 +302,7 @@ async def get_products_from_conversation(
     print("⚠️ getProductsFromConversation is deprecated. Use getOrCreateCart().")
     
     # Get recent messages with products
-    msg_resp = supabase.from_("chatbot_messages") \
+    msg_resp = await supabase.from_("chatbot_messages") \
         .select("content") \
         .eq("conversation_id", conversation_id) \
         .eq("sender_type", "bot") \
@@ -314,7 +319,7 @@ async def get_products_from_conversation(
             for product in content["products"]:
                 if product.get("id") not in seen_product_ids:
                     
-                    prod_resp = supabase.from_("products") \
+                    prod_resp = await supabase.from_("products") \
                         .select("id, name, price, images:product_images(image_url, is_primary)") \
                         .eq("id", product["id"]) \
                         .single() \
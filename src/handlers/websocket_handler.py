@@ -0,0 +1,315 @@
+# ============================================
+# handlers/websocket_handler.py
+# Kênh chat WebSocket (/chat/ws) cho website:
+# - Session "ấm": conversation_id + context snapshot giữ giữa các turn
+# - Server push: typing, token, products, message (kết quả cuối)
+# - Heartbeat dùng chung cho mọi connection (không tốn task cho connection idle)
+# - Backpressure: inbox giới hạn, gộp token khi client đọc chậm,
+#   đóng connection nếu một lần gửi quá WS_SEND_TIMEOUT
+#
+# Turn đi qua cùng dedupe (clientMessageId) + mailbox theo cuộc trò chuyện với POST /chat/
+#
+# Client → server:  {"type": "message", "message": "...", "clientMessageId": "..."}
+#                   {"type": "ping"}
+# Server → client:  {"type": "typing", "active": true/false}
+#                   {"type": "token", "delta": "..."}
+#                   {"type": "products", "products": [...]}
+#                   {"type": "message", "result": {...}}  (cùng format POST /chat/)
+#                   {"type": "error", "error": "..."} / {"type": "ping"} / {"type": "pong"}
+# ============================================
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, TypedDict
+from uuid import uuid4
+
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from ..config.env import settings
+from ..utils.json_fast import dumps, loads
+from ..services.rate_limit_service import inbound_filter
+from ..services.tracing_service import SPAN_KIND_SERVER, start_span
+from ..services.webhook_queue_service import QueueFullError, website_queue
+from .message_handler import conversation_key, stream_message
+from ..utils.structured_logger import get_logger
+
+log = get_logger("websocket")
+
+
+class WebSocketStats(TypedDict):
+    connections: int
+    busy_sessions: int
+    connections_total: int
+    messages: int
+    rejected_messages: int
+    tokens_coalesced: int
+    slow_client_closes: int
+    idle_closes: int
+
+
+class ChatSession:
+    """
+    Một connection WebSocket.
+    Tin nhắn của session xử lý tuần tự qua một worker task, worker chỉ tồn tại
+    khi inbox có tin → connection idle chỉ tốn receive loop.
+    """
+
+    def __init__(self, hub: "WebSocketHub", websocket: WebSocket, base_body: Dict[str, Any]):
+        self._hub = hub
+        self.websocket = websocket
+        self._base_body = base_body
+        # conversation_id / context / turns (xem message_handler._prepare_turn)
+        self.state: Dict[str, Any] = {}
+        self._inbox: Deque[Dict[str, Any]] = deque()
+        self._worker: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+        self._pending_delta = ""
+        self._closed = False
+        self.last_seen = time.monotonic()
+
+    @property
+    def busy(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    # ========================================
+    # RECEIVE
+    # ========================================
+
+    async def run(self) -> None:
+        try:
+            while True:
+                raw = await self.websocket.receive_text()
+                self.last_seen = time.monotonic()
+                try:
+                    data = loads(raw)
+                except ValueError:
+                    await self.send({"type": "error", "error": "Invalid JSON"})
+                    continue
+                if not isinstance(data, dict):
+                    await self.send({"type": "error", "error": "Invalid payload"})
+                    continue
+
+                msg_type = data.get("type", "message")
+                if msg_type == "ping":
+                    await self.send({"type": "pong"})
+                elif msg_type == "pong":
+                    continue
+                elif msg_type == "message":
+                    await self._enqueue(data)
+                else:
+                    await self.send({"type": "error", "error": f"Unknown type: {msg_type}"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closed = True
+            if self._worker and not self._worker.done():
+                # Turn đang chạy vẫn lưu DB bình thường, chỉ không gửi được nữa
+                self._inbox.clear()
+
+    async def _enqueue(self, data: Dict[str, Any]) -> None:
+        # Lỗi gửi thẳng trong receive loop (send() có timeout riêng), không tạo task rời
+        message = str(data.get("message") or "").strip()
+        if not message:
+            await self.send({"type": "error", "error": "Empty message"})
+            return
+        if len(self._inbox) >= settings.WS_MAX_PENDING_MESSAGES:
+            self._hub.rejected_messages += 1
+            await self.send({
+                "type": "error",
+                "error": "busy",
+                "clientMessageId": data.get("clientMessageId"),
+            })
+            return
+
+        body = {**self._base_body, "message_text": message}
+        reason = inbound_filter.check(
+            conversation_key(body),
+            message,
+            client_ip=self.websocket.client.host if self.websocket.client else None,
+        )
+        if reason:
+            await self.send({
+                "type": "error",
+                "error": reason,
+                "clientMessageId": data.get("clientMessageId"),
+            })
+            return
+        if data.get("clientMessageId"):
+            body["message_id"] = data["clientMessageId"]
+        self._inbox.append(body)
+        self._hub.messages += 1
+
+        if not self.busy:
+            self._worker = asyncio.create_task(self._drain())
+
+    # ========================================
+    # TURN PROCESSING
+    # ========================================
+
+    async def _drain(self) -> None:
+        while self._inbox and not self._closed:
+            body = self._inbox.popleft()
+            await self._run_turn(body)
+
+    async def _run_turn(self, body: Dict[str, Any]) -> None:
+        client_message_id = body.get("message_id")
+        await self.send({"type": "typing", "active": True})
+        # Mỗi tin nhắn WebSocket = một trace
+        with start_span("chat.ws_message", {"platform": "website"}, kind=SPAN_KIND_SERVER, new_trace=True):
+            await self._stream_turn(body, client_message_id)
+
+    async def _stream_turn(self, body: Dict[str, Any], client_message_id: Optional[str]) -> None:
+        try:
+            # Cùng mailbox với POST /chat/ + SSE: tuần tự theo cuộc trò chuyện;
+            # clientMessageId gửi lại (reconnect) → stream_message trả kết quả cũ
+            async with website_queue.exclusive(conversation_key(body)):
+                async for event in stream_message(body, self.state):
+                    if event["type"] == "token":
+                        await self._push_token(event["delta"])
+                    elif event["type"] == "products":
+                        await self.send(event)
+                    elif event["type"] == "done":
+                        # Token chưa gửi đã nằm trong kết quả cuối → bỏ
+                        self._pending_delta = ""
+                        await self.send({
+                            "type": "message",
+                            "clientMessageId": client_message_id,
+                            "result": event["result"],
+                        })
+        except QueueFullError:
+            self._hub.rejected_messages += 1
+            await self.send({"type": "error", "error": "busy", "clientMessageId": client_message_id})
+        except Exception as e:
+            log.error("ws_turn_failed", error=str(e), client_message_id=client_message_id)
+            # Lỗi giữa chừng → build lại context đầy đủ ở turn sau
+            self.state["context"] = None
+            await self.send({"type": "error", "error": str(e), "clientMessageId": client_message_id})
+        finally:
+            await self.send({"type": "typing", "active": False})
+
+    async def _push_token(self, delta: str) -> None:
+        """Client đọc chậm (đang có lần gửi chưa xong) → gộp token vào lần gửi sau"""
+        self._pending_delta += delta
+        if self._send_lock.locked():
+            self._hub.tokens_coalesced += 1
+            return
+        delta, self._pending_delta = self._pending_delta, ""
+        await self.send({"type": "token", "delta": delta})
+
+    # ========================================
+    # SEND
+    # ========================================
+
+    async def send(self, payload: Dict[str, Any]) -> bool:
+        if self._closed or self.websocket.application_state != WebSocketState.CONNECTED:
+            return False
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send_text(dumps(payload)),
+                    timeout=settings.WS_SEND_TIMEOUT,
+                )
+                return True
+            except asyncio.TimeoutError:
+                self._hub.slow_client_closes += 1
+                log.warning("ws_slow_client_closed", timeout_s=settings.WS_SEND_TIMEOUT)
+                await self.close(code=1013)
+                return False
+            except Exception:
+                self._closed = True
+                return False
+
+    async def close(self, code: int = 1000) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=settings.WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+
+class WebSocketHub:
+    """Quản lý toàn bộ session: heartbeat dùng chung, đóng session idle, metrics"""
+
+    def __init__(self):
+        self._sessions: Set[ChatSession] = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.connections_total = 0
+        self.messages = 0
+        self.rejected_messages = 0
+        self.tokens_coalesced = 0
+        self.slow_client_closes = 0
+        self.idle_closes = 0
+
+    async def serve(self, websocket: WebSocket) -> None:
+        await websocket.accept()
+        session = ChatSession(self, websocket, _build_base_body(websocket))
+        self._sessions.add(session)
+        self.connections_total += 1
+        self._ensure_heartbeat()
+        try:
+            await session.run()
+        finally:
+            self._sessions.discard(session)
+
+    def _ensure_heartbeat(self) -> None:
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop(), name="ws-heartbeat")
+
+    async def _heartbeat_loop(self) -> None:
+        while self._sessions:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            pending = []
+            for session in list(self._sessions):
+                if not session.busy and now - session.last_seen > settings.WS_IDLE_TIMEOUT:
+                    self.idle_closes += 1
+                    pending.append(session.close(code=1001))
+                else:
+                    pending.append(session.send({"type": "ping"}))
+            # Gửi song song (một client chậm không giữ ping của client khác), chờ xong trong vòng này
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close_all(self) -> None:
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        await asyncio.gather(
+            *[session.close(code=1001) for session in list(self._sessions)],
+            return_exceptions=True,
+        )
+
+    def stats(self) -> WebSocketStats:
+        return {
+            "connections": len(self._sessions),
+            "busy_sessions": sum(1 for s in self._sessions if s.busy),
+            "connections_total": self.connections_total,
+            "messages": self.messages,
+            "rejected_messages": self.rejected_messages,
+            "tokens_coalesced": self.tokens_coalesced,
+            "slow_client_closes": self.slow_client_closes,
+            "idle_closes": self.idle_closes,
+        }
+
+
+def _build_base_body(websocket: WebSocket) -> Dict[str, Any]:
+    # Cùng thứ tự ưu tiên với POST /chat/: conversationId > phone > session_id
+    params = websocket.query_params
+    body: Dict[str, Any] = {"platform": "website"}
+    if params.get("conversationId"):
+        body["conversation_id"] = params["conversationId"]
+    elif params.get("phone"):
+        body["customer_phone"] = params["phone"]
+    else:
+        body["session_id"] = (
+            params.get("session_id")
+            or websocket.headers.get("x-session-id")
+            or str(uuid4())
+        )
+    return body
+
+
+ws_hub = WebSocketHub()
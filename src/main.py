@@ -1,26 +1,53 @@
 # src/main.py
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import uvicorn
 
 # ✅ Import với relative imports (dấu chấm)
 from .config.env import settings
 from .routes.chat import router as chat_router
 from .routes.facebook import router as facebook_router
+from .utils.connect_supabase import close_async_supabase_client
+from .services.webhook_queue_service import webhook_queue, website_queue
+from .services.job_runner_service import job_runner
+from .services.answer_cache_service import answer_cache
+from .services.identity_cache_service import identity_cache
+from .services.product_cache_service import product_cache
+from .services.write_behind_service import write_behind
+from .utils.json_fast import CharsetMiddleware, FastJSONResponse, StreamingSafeGZipMiddleware
+from .handlers.websocket_handler import ws_hub
+from .services.admission_service import agent_admission
+from .services.idempotency_service import message_dedupe
+from .services.metrics_service import registry
+from .services.rate_limit_service import inbound_filter
+from .services import tracing_service
+from .handlers import fast_path_handler
+from .agent.agent_service import prompt_cache_stats
+from .agent.intent_router import intent_router
+from .agent.model_tiers import model_tiers
+from .services.llm_resilience_service import llm_resilience
+from .utils import structured_logger
 
 # Create FastAPI app
 app = FastAPI(
     title="BeWo Chatbot API",
     description="AI Chatbot for BeWo Fashion",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson cho mọi response JSON
+    default_response_class=FastJSONResponse,
 )
 
 # Thêm middleware để force UTF-8
-@app.middleware("http")
-async def add_charset_header(request, call_next):
-    response = await call_next(request)
-    response.headers["Content-Type"] = "application/json; charset=utf-8"
-    return response
+app.add_middleware(CharsetMiddleware)
+
+# Nén response lớn (product cards); SSE / NDJSON stream không nén để gửi từng chunk ngay
+app.add_middleware(
+    StreamingSafeGZipMiddleware,
+    minimum_size=settings.GZIP_MINIMUM_SIZE,
+    compresslevel=settings.GZIP_COMPRESS_LEVEL,
+)
 
 # Add CORS
 origins = settings.CORS_ORIGINS.split(",")
@@ -45,6 +72,36 @@ async def root():
 async def health():
     return {"status": "healthy", "version": "1.0.0"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint (histogram theo stage, counters, gauges từ các stats)"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Số turn LLM đang chạy / đang chờ / bị shed"""
+    return agent_admission.stats()
+
+# Export các stats() sẵn có thành gauge trên /metrics
+registry.register_collector("webhook_queue", webhook_queue.stats)
+registry.register_collector("website_queue", website_queue.stats)
+registry.register_collector("jobs", job_runner.stats)
+registry.register_collector("fast_path", fast_path_handler.stats)
+registry.register_collector("answer_cache", answer_cache.stats)
+registry.register_collector("identity_cache", identity_cache.stats)
+registry.register_collector("product_cache", product_cache.stats)
+registry.register_collector("prompt_cache", prompt_cache_stats)
+registry.register_collector("intent_router", intent_router.stats)
+registry.register_collector("model_tiers", model_tiers.stats)
+registry.register_collector("llm_breaker", llm_resilience.stats)
+registry.register_collector("write_behind", write_behind.stats)
+registry.register_collector("admission", agent_admission.stats)
+registry.register_collector("inbound", inbound_filter.stats)
+registry.register_collector("dedupe", message_dedupe.stats)
+registry.register_collector("websocket", ws_hub.stats)
+registry.register_collector("tracing", tracing_service.stats)
+registry.register_collector("logging", structured_logger.stats)
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -54,8 +111,37 @@ async def startup_event():
     print(f"🌍 Environment: {settings.NODE_ENV}")
     print(f"✅ Health check: http://localhost:{settings.PORT}/health")
     print(f"💬 Chat endpoint: http://localhost:{settings.PORT}/chat/")
+    print(f"🔌 Chat WebSocket: ws://localhost:{settings.PORT}/chat/ws")
     print(f"🔵 Facebook webhook: http://localhost:{settings.PORT}/facebook/webhook")
     print("=" * 50)
+    webhook_queue.start()
+    website_queue.start()
+    job_runner.start()
+    # Replay journal write-behind (nếu có) + bắt đầu flush định kỳ
+    write_behind.start()
+    # Pre-warm query sản phẩm phổ biến (job nền) + watcher catalog
+    product_cache.start()
+
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Đóng các WebSocket đang mở
+    await ws_hub.close_all()
+    # Xử lý nốt tin nhắn webhook đang chờ trước khi đóng connection pool
+    await webhook_queue.stop()
+    await website_queue.stop()
+    # Dừng watcher catalog, lưu độ phổ biến query cho lần pre-warm sau
+    await product_cache.stop()
+    # Chạy nốt background job (embedding, memory...) mà các turn trên vừa đẩy vào
+    await job_runner.drain(settings.JOB_DRAIN_TIMEOUT)
+    # Bulk insert nốt embedding / usage log / memory fact đang buffer
+    await write_behind.stop()
+    # Đóng connection pool Supabase async
+    await close_async_supabase_client()
+    # Export nốt span còn trong hàng đợi
+    await asyncio.to_thread(tracing_service.exporter.shutdown)
+    # Ghi nốt log còn trong hàng đợi
+    await asyncio.to_thread(structured_logger.shutdown_logging)
 
 # Run server (chỉ khi chạy trực tiếp file này)
 if __name__ == "__main__":
@@ -63,5 +149,7 @@ if __name__ == "__main__":
         "src.main:app",  # ✅ Đường dẫn đúng
         host="0.0.0.0",
         port=settings.PORT,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.FORWARDED_ALLOW_IPS,
         reload=True if settings.NODE_ENV == "development" else False
     )
\ No newline at end of file
@@ -6,6 +6,14 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="Nội dung tin nhắn")
     phone: Optional[str] = Field(default=None, description="SĐT khách hàng")
     conversationId: Optional[str] = Field(default=None, description="ID cuộc trò chuyện")
+    clientMessageId: Optional[str] = Field(default=None, description="ID tin nhắn phía client (chống gửi trùng)")
+
+class BatchChatItem(ChatRequest):
+    sessionId: Optional[str] = Field(default=None, description="Session website (khi không có phone/conversationId)")
+
+class BatchChatRequest(BaseModel):
+    messages: List[BatchChatItem] = Field(..., description="Tin nhắn, theo đúng thứ tự trong từng cuộc trò chuyện")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="Số tin xử lý song song tối đa")
 
 class ChatResponse(BaseModel):
     success: bool
@@ -2,13 +2,26 @@
 # routes/chat.py
 # ============================================
 
-from fastapi import APIRouter, HTTPException, Header
+import time
+from fastapi import APIRouter, HTTPException, Header, Request, WebSocket
 from typing import Optional, Dict, Any
 from uuid import uuid4
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from sse_starlette.sse import EventSourceResponse
 
-from ..handlers.message_handler import handle_message
-from ..models.types import ChatRequest
+from ..handlers.message_handler import conversation_key, stream_message
+from ..handlers.websocket_handler import ws_hub
+from ..handlers.batch_handler import process_batch
+from ..models.types import BatchChatRequest, ChatRequest
+from ..config.env import settings
+from ..utils.json_fast import FastJSONResponse, dumps
+from ..services.idempotency_service import message_dedupe
+from ..services.webhook_queue_service import QueueFullError, website_queue
+from ..services.rate_limit_service import inbound_filter
+from ..services.tracing_service import SPAN_KIND_SERVER, current_trace_context, start_span
+from ..utils.structured_logger import get_logger
+
+log = get_logger("chat")
 
 # --- Khởi tạo Router ---
 router = APIRouter(
@@ -16,47 +29,217 @@ router = APIRouter(
     tags=["Website Chat"]
 )
 
+def _build_message_body(chat_request: ChatRequest, x_session_id: Optional[str]) -> Dict[str, Any]:
+    # 1. Xây dựng body cho handleMessage
+    body: Dict[str, Any] = {
+        "platform": "website",
+        "message_text": chat_request.message,
+    }
+
+    # 2. Logic ưu tiên: conversationId > phone > session_id
+    if chat_request.conversationId:
+        body["conversation_id"] = chat_request.conversationId
+    elif chat_request.phone:
+        body["customer_phone"] = chat_request.phone
+    else:
+        body["session_id"] = x_session_id or str(uuid4())
+
+    if chat_request.clientMessageId:
+        # Key dedupe của website = clientMessageId trong phạm vi conversation / phone / session.
+        # Session tự sinh (uuid4) đổi mỗi request → tin gửi lại không bao giờ bị nhận là trùng
+        if not (chat_request.conversationId or chat_request.phone or x_session_id):
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "success": False,
+                    "error": "clientMessageId cần kèm conversationId, phone hoặc header x-session-id",
+                }
+            )
+        body["message_id"] = chat_request.clientMessageId
+
+    return body
+
+def _inbound_rejection(body: Dict[str, Any], request: Request) -> Optional[str]:
+    """Rate limit + spam filter TRƯỚC khi chạm DB / LLM → lý do chặn hoặc None"""
+    return inbound_filter.check(
+        conversation_key(body),
+        body.get("message_text", ""),
+        client_ip=request.client.host if request.client else None,
+    )
+
+def _check_inbound(body: Dict[str, Any], request: Request) -> None:
+    reason = _inbound_rejection(body, request)
+    if reason:
+        raise HTTPException(
+            status_code=429 if reason.startswith("rate_limited") else 400,
+            detail={
+                "success": False,
+                "error": reason
+            }
+        )
+
 # --- Định nghĩa Endpoint ---
 @router.post("/")
 async def handle_chat_message(
     chat_request: ChatRequest,
+    request: Request,
     x_session_id: Optional[str] = Header(default=None, alias="x-session-id")
-) -> JSONResponse:
+) -> FastJSONResponse:
     """
     Endpoint cho website chat.
     """
+    # 1-2. Xây dựng body cho handleMessage
+    body = _build_message_body(chat_request, x_session_id)
+    _check_inbound(body, request)
+
     try:
-        # 1. Xây dựng body cho handleMessage
-        body: Dict[str, Any] = {
-            "platform": "website",
-            "message_text": chat_request.message,
-        }
-
-        # 2. Logic ưu tiên: conversationId > phone > session_id
-        if chat_request.conversationId:
-            body["conversation_id"] = chat_request.conversationId
-        elif chat_request.phone:
-            body["customer_phone"] = chat_request.phone
-        else:
-            body["session_id"] = x_session_id or str(uuid4())
-
-        print(f"[Chat] Request body: {body}")
-
-        # 3. Gọi handler chính
-        result = await handle_message(body)
+        log.info("chat_request", conversation_key=conversation_key(body), text=body["message_text"])
+
+        # 3. Gọi handler chính qua mailbox của cuộc trò chuyện
+        # (tuần tự theo conversation, gom tin gửi dồn dập)
+        # Trace mới cho request, mang qua hàng đợi bằng body["trace"]
+        with start_span("chat.message", {"platform": "website"}, kind=SPAN_KIND_SERVER, new_trace=True) as span:
+            body["trace"] = current_trace_context()
+            result = await website_queue.call(conversation_key(body), body)
         
         # 4. Trả về kết quả với UTF-8
-        return JSONResponse(
-            content=result,
-            media_type="application/json; charset=utf-8"
-        )
+        return FastJSONResponse(content=result, headers={"X-Trace-Id": span.trace_id})
 
+    except QueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "success": False,
+                "error": "Hệ thống đang bận, vui lòng thử lại sau"
+            }
+        )
     except Exception as error:
-        print(f"[Chat] Error: {error}")
+        log.error("chat_error", error=str(error))
         raise HTTPException(
             status_code=500,
             detail={
                 "success": False, 
                 "error": str(error)
             }
-        )
\ No newline at end of file
+        )
+
+@router.post("/stream")
+async def stream_chat_message(
+    chat_request: ChatRequest,
+    request: Request,
+    x_session_id: Optional[str] = Header(default=None, alias="x-session-id")
+) -> EventSourceResponse:
+    """
+    Website chat dạng Server-Sent Events.
+    Events: `token` (text delta), `products` (product cards),
+    `done` (kết quả cuối, cùng format POST /chat/), `error`.
+    """
+    body = _build_message_body(chat_request, x_session_id)
+    _check_inbound(body, request)
+    log.info("chat_stream_request", conversation_key=conversation_key(body), text=body["message_text"])
+
+    async def event_generator():
+        # Span mở trong generator: response stream chạy sau khi endpoint đã return
+        with start_span("chat.stream", {"platform": "website"}, kind=SPAN_KIND_SERVER, new_trace=True) as span:
+            try:
+                # Cùng mailbox với POST /chat/: tuần tự theo cuộc trò chuyện
+                async with website_queue.exclusive(conversation_key(body)):
+                    async for event in stream_message(body):
+                        event_type = event.pop("type")
+                        payload = event["result"] if event_type == "done" else event
+                        yield {
+                            "event": event_type,
+                            "data": dumps(payload),
+                        }
+            except QueueFullError:
+                yield {
+                    "event": "error",
+                    "data": dumps({"success": False, "error": "Hệ thống đang bận, vui lòng thử lại sau"}),
+                }
+            except Exception as error:
+                log.error("chat_stream_error", error=str(error))
+                span.record_error(error)
+                yield {
+                    "event": "error",
+                    "data": dumps({"success": False, "error": str(error)}),
+                }
+
+    return EventSourceResponse(event_generator())
+
+@router.post("/batch")
+async def batch_chat_messages(
+    batch_request: BatchChatRequest,
+    request: Request,
+) -> StreamingResponse:
+    """
+    Xử lý nhiều tin nhắn (nhiều cuộc trò chuyện) qua cùng pipeline POST /chat/.
+    Trả về NDJSON: mỗi dòng một kết quả theo thứ tự hoàn thành
+    ({index, conversation_key, success, result|error, latency_ms}),
+    dòng cuối là tổng kết ({done: true, total, succeeded, failed, elapsed_ms}).
+    Tin bị rate limit / spam filter chặn: success=false, error=lý do, không chạy pipeline.
+    Cuộc trò chuyện xác định CHỈ từ từng tin (conversationId > phone > sessionId);
+    tin không có cả ba là một cuộc trò chuyện mới riêng (không dùng header x-session-id).
+    """
+    if len(batch_request.messages) > settings.BATCH_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=413,
+            detail={
+                "success": False,
+                "error": f"Batch tối đa {settings.BATCH_MAX_MESSAGES} tin nhắn",
+            }
+        )
+
+    bodies = [
+        _build_message_body(item, item.sessionId)
+        for item in batch_request.messages
+    ]
+    # Mỗi tin qua cùng bộ lọc với POST /chat/ → batch không vượt được bucket sender / IP
+    rejected = {
+        index: reason
+        for index, body in enumerate(bodies)
+        if (reason := _inbound_rejection(body, request))
+    }
+
+    async def ndjson_generator():
+        started = time.perf_counter()
+        succeeded = 0
+        async for item in process_batch(bodies, batch_request.concurrency, rejected=rejected):
+            succeeded += 1 if item["success"] else 0
+            yield dumps(item) + "\n"
+        yield dumps({
+            "done": True,
+            "total": len(bodies),
+            "succeeded": succeeded,
+            "failed": len(bodies) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }) + "\n"
+
+    return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
+
+@router.get("/queue/stats")
+async def website_queue_stats():
+    """Queue depth, số tin được gộp (coalesced) của website chat"""
+    return website_queue.stats()
+
+@router.get("/ratelimit/stats")
+async def rate_limit_stats():
+    """Số tin bị chặn theo lý do (rate limit sender/page/IP, spam, empty)"""
+    return inbound_filter.stats()
+
+@router.get("/dedupe/stats")
+async def dedupe_stats():
+    """Hit rate của idempotency index (website + Facebook)"""
+    return message_dedupe.stats()
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Website chat qua WebSocket (session giữ context giữa các turn).
+    Query params: conversationId | phone | session_id
+    """
+    await ws_hub.serve(websocket)
+
+@router.get("/ws/stats")
+async def websocket_stats():
+    """Số connection, tin nhắn, backpressure của kênh WebSocket"""
+    return ws_hub.stats()
@@ -1,6 +1,11 @@
 from fastapi import APIRouter, Request, HTTPException
 from ..config.env import settings
-from ..handlers.message_handler import handle_message
+from ..services.webhook_queue_service import webhook_queue
+from ..services.rate_limit_service import inbound_filter
+from ..services.tracing_service import SPAN_KIND_SERVER, current_trace_context, start_span
+from ..utils.structured_logger import get_logger
+
+log = get_logger("facebook")
 
 router = APIRouter(prefix="/facebook", tags=["Facebook"])
 
@@ -14,14 +19,17 @@ async def verify_webhook(
     challenge = request.query_params.get("hub.challenge")
     
     if mode == "subscribe" and token == settings.WEBHOOK_VERIFY_TOKEN:
-        print("✅ Webhook verified")
+        log.info("webhook_verified")
         return int(challenge)
     else:
         raise HTTPException(status_code=403, detail="Verification failed")
 
 @router.post("/webhook")
 async def receive_webhook(request: Request):
-    """Receive messages from Facebook"""
+    """
+    Receive messages from Facebook.
+    Chỉ enqueue rồi trả 200 ngay; worker xử lý nền, đúng thứ tự theo từng sender.
+    """
     body = await request.json()
     
     if body.get("object") == "page":
@@ -30,16 +38,46 @@ async def receive_webhook(request: Request):
                 if messaging_event.get("message"):
                     sender_id = messaging_event["sender"]["id"]
                     message_text = messaging_event["message"].get("text", "")
-                    
-                    # Process message
-                    await handle_message({
-                        "platform": "facebook",
-                        "customer_fb_id": sender_id,
-                        "message_text": message_text,
-                        "page_id": entry["id"],
-                        "access_token": settings.FACEBOOK_PAGE_ACCESS_TOKEN
-                    })
+                    # Sticker (vd: nút like) không có text → fast path trả lời, không qua LLM
+                    sticker_id = messaging_event["message"].get("sticker_id")
+
+                    # Mỗi tin nhắn = một trace (trace id đi theo body["trace"] qua hàng đợi)
+                    with start_span(
+                        "facebook.webhook",
+                        {"platform": "facebook", "page_id": entry["id"]},
+                        kind=SPAN_KIND_SERVER,
+                        new_trace=True,
+                    ) as span:
+                        # Rate limit + spam/empty filter (attachment không text, flood) → bỏ qua
+                        blocked = inbound_filter.check(
+                            f"facebook:{sender_id}",
+                            message_text or (f"[sticker:{sticker_id}]" if sticker_id else ""),
+                            page_id=entry["id"],
+                        )
+                        if blocked:
+                            span.set_attribute("inbound.blocked", blocked)
+                            continue
+
+                        # Enqueue message (xử lý nền)
+                        accepted = webhook_queue.submit(f"{entry['id']}:{sender_id}", {
+                            "platform": "facebook",
+                            "customer_fb_id": sender_id,
+                            "message_text": message_text,
+                            "sticker_id": sticker_id,
+                            "message_id": messaging_event["message"].get("mid"),
+                            "page_id": entry["id"],
+                            "access_token": settings.FACEBOOK_PAGE_ACCESS_TOKEN,
+                            "trace": current_trace_context(),
+                        })
+                    if not accepted:
+                        # Queue đầy → 503 để Facebook gửi lại sau
+                        raise HTTPException(status_code=503, detail="Webhook queue full")
         
         return {"status": "ok"}
     
-    raise HTTPException(status_code=404)
\ No newline at end of file
+    raise HTTPException(status_code=404)
+
+@router.get("/webhook/stats")
+async def webhook_stats():
+    """Queue depth, wait time và counters của webhook queue"""
+    return webhook_queue.stats()
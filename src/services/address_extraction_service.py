@@ -8,6 +8,9 @@ import asyncio
 # Giả định file 'address_service.py' nằm cùng cấp
 # và chứa hàm 'get_standardized_address'
 from .address_service import get_standardized_address
+from ..utils.structured_logger import get_logger
+
+log = get_logger("address_extraction_service")
 
 # Lưu ý: createSupabaseClient và saveAddressStandardized đã được import
 # trong file .ts gốc nhưng không được sử dụng,
@@ -22,9 +25,7 @@ async def get_saved_address(conversation_id: str) -> Any:
     Lấy địa chỉ đã lưu (ĐÃ CHUẨN HÓA).
     Hàm này đã cũ (deprecated) và chỉ chuyển tiếp cuộc gọi.
     """
-    print(
-        "⚠️ get_saved_address() is deprecated. Use get_standardized_address() from address_service.py",
-    )
+    log.debug("deprecated_call", function="get_saved_address", use="address_service.get_standardized_address")
     # ✅ Delegate to the correct function
     return await get_standardized_address(conversation_id)
 
@@ -40,8 +41,6 @@ async def extract_and_save_address(
     """
     Hàm này đã cũ (deprecated) và không còn chức năng.
     """
-    print(
-        "⚠️ extract_and_save_address is deprecated. Use LLM function calling instead.",
-    )
+    log.debug("deprecated_call", function="extract_and_save_address", use="save_address function call")
     return False
 
@@ -3,7 +3,10 @@
 import asyncio
 import re
 from typing import Any, Dict, Optional, TypedDict
-from ..utils.connect_supabase import create_supabase_client
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+
+log = get_logger("address_service")
 
 # Định nghĩa kiểu cho dữ liệu địa chỉ trả về
 class StandardizedAddress(TypedDict, total=False):
@@ -38,9 +41,9 @@ async def get_standardized_address(
     conversation_id: str,
     retries: int = 2,
 ) -> Optional[StandardizedAddress]:
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
-    print(f"🔍 Getting address for conversation: {conversation_id}")
+    log.debug("address_lookup", conversation_id=conversation_id)
 
     for attempt in range(1, retries + 1):
         try:
@@ -59,25 +62,31 @@ async def get_standardized_address(
                 shipping_city
             """
             
-            # Giả định v2: .maybe_single() không cần .execute() và trả về data
-            profile = supabase.from_("customer_profiles") \
+            # maybe_single().execute() trả về None nếu không có row
+            profile_resp = await supabase.from_("customer_profiles") \
                 .select(profile_select_query) \
                 .eq("conversation_id", conversation_id) \
-                .maybe_single()
+                .maybe_single() \
+                .execute()
+            profile = profile_resp.data if profile_resp else None
 
             if not profile:
-                print("⚠️ No profile found")
+                log.debug("address_profile_missing", conversation_id=conversation_id)
                 # Không cần retry nếu không tìm thấy profile
                 return None
 
-            print(f"📋 Profile found: {{'id': {profile.get('id')}, 'has_shipping_address': {bool(profile.get('shipping_address_line'))}, 'has_city': {bool(profile.get('shipping_city'))}, 'attempt': {attempt}}}")
+            log.debug(
+                "address_profile_found",
+                profile_id=profile.get("id"),
+                has_shipping_address=bool(profile.get("shipping_address_line")),
+                has_city=bool(profile.get("shipping_city")),
+                attempt=attempt,
+            )
 
             # ========================================
             # 2. Try customer_profiles structured fields FIRST
             # ========================================
             if profile.get("shipping_address_line") and profile.get("shipping_city"):
-                print("✅ Loaded address from customer_profiles (structured)")
-
                 address: StandardizedAddress = {
                     "address_line": profile["shipping_address_line"],
                     "ward": profile.get("shipping_ward"),
@@ -87,27 +96,29 @@ async def get_standardized_address(
                     "full_name": profile.get("preferred_name") or profile.get("full_name"),
                 }
                 
-                print(f"📍 Address data: {address}")
+                log.debug("address_loaded", source="customer_profiles", address=address)
                 return address
 
             # ========================================
             # 3. Fallback: addresses table (for logged users)
             # ========================================
             if profile.get("user_id"):
-                print(f"🔍 Checking addresses table for user_id: {profile['user_id']}")
+                log.debug("address_fallback_lookup", user_id=profile["user_id"])
 
-                address = supabase.from_("addresses") \
+                address_resp = await supabase.from_("addresses") \
                     .select("*") \
                     .eq("user_id", profile["user_id"]) \
                     .eq("is_default", True) \
-                    .maybe_single()
+                    .maybe_single() \
+                    .execute()
+                address = address_resp.data if address_resp else None
 
                 if address:
-                    print("✅ Loaded address from addresses table (fallback)")
+                    log.debug("address_loaded", source="addresses", user_id=profile["user_id"])
 
                     # Sync to customer_profiles for faster access next time
                     # .update() cần .execute()
-                    supabase.from_("customer_profiles") \
+                    await supabase.from_("customer_profiles") \
                         .update({
                             "shipping_address_line": address.get("address_line"),
                             "shipping_ward": address.get("ward"),
@@ -129,15 +140,15 @@ async def get_standardized_address(
 
             # ✅ No address found (or no user_id for fallback), retry if allowed
             if attempt < retries:
-                print(f"⏳ No address found, retry {attempt}/{retries} in 100ms...")
+                log.debug("address_lookup_retry", conversation_id=conversation_id, attempt=attempt, retries=retries)
                 await asyncio.sleep(0.1)
                 continue
 
-            print("⚠️ No saved address found after all retries")
+            log.debug("address_not_found", conversation_id=conversation_id)
             return None
 
         except Exception as error:
-            print(f"❌ Error in get_standardized_address (attempt {attempt}): {error}")
+            log.error("address_lookup_failed", conversation_id=conversation_id, attempt=attempt, error=str(error))
             
             if attempt < retries:
                 await asyncio.sleep(0.1)
@@ -195,21 +206,23 @@ async def save_address_standardized(
             "message": "Thiếu thông tin thành phố",
         }
 
-    print(f"✅ Address validation passed: {address_data}")
+    log.info("address_validated", conversation_id=conversation_id, address_data=address_data)
 
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
         # ========================================
         # 1. GET PROFILE
         # ========================================
-        profile = supabase.from_("customer_profiles") \
+        profile_resp = await supabase.from_("customer_profiles") \
             .select("id, user_id, conversation_id, full_name, phone") \
             .eq("conversation_id", conversation_id) \
-            .maybe_single()
+            .maybe_single() \
+            .execute()
+        profile = profile_resp.data if profile_resp else None
 
         if not profile:
-            print("❌ Profile error: Not found")
+            log.warning("address_profile_missing", conversation_id=conversation_id)
             return {
                 "success": False,
                 "message": "Không tìm thấy profile khách hàng",
@@ -223,13 +236,15 @@ async def save_address_standardized(
         # 2. LOGGED USER → Save to addresses table
         # ========================================
         if profile.get("user_id"):
-            print("✅ Logged user, saving to addresses table")
+            log.debug("address_save_target", target="addresses", user_id=profile["user_id"])
 
-            existing_address = supabase.from_("addresses") \
+            existing_resp = await supabase.from_("addresses") \
                 .select("id") \
                 .eq("user_id", profile["user_id"]) \
                 .eq("is_default", True) \
-                .maybe_single()
+                .maybe_single() \
+                .execute()
+            existing_address = existing_resp.data if existing_resp else None
 
             address_payload = {
                 "user_id": profile["user_id"],
@@ -243,26 +258,27 @@ async def save_address_standardized(
             }
 ##
             if existing_address:
-                response = supabase.from_("addresses") \
+                response = await supabase.from_("addresses") \
                     .update(address_payload) \
                     .eq("id", existing_address["id"]) \
                     .execute()
                 
                 if response.data:
-                    address_id = response.data.get("id")
-                    print(f"✅ Updated address in addresses table: {address_id}")
+                    address_id = response.data[0].get("id")
+                    log.info("address_updated", address_id=address_id)
             else:
-                response = supabase.from_("addresses") \
+                response = await supabase.from_("addresses") \
                     .insert(address_payload) \
-                
+                    .execute()
+
                 if response.data:
-                    address_id = response.data.get("id")
-                    print(f"✅ Created address in addresses table: {address_id}")
+                    address_id = response.data[0].get("id")
+                    log.info("address_created", address_id=address_id)
 
         # ========================================
         # 3. ALWAYS save to customer_profiles (for both guest and logged users)
         # ========================================
-        print("💾 Saving to customer_profiles structured fields")
+        log.debug("address_save_target", target="customer_profiles", profile_id=profile["id"])
 
         profile_update_payload = {
             "shipping_address_line": address_line,
@@ -280,7 +296,7 @@ async def save_address_standardized(
             profile_update_payload["full_name"] = address_data["full_name"]
         
 
-        update_response = supabase.from_("customer_profiles") \
+        update_response = await supabase.from_("customer_profiles") \
             .update(profile_update_payload) \
             .eq("id", profile["id"]) \
             .execute()
@@ -291,18 +307,19 @@ async def save_address_standardized(
                 "message": "Lỗi khi lưu địa chỉ",
             }
 
-        print("✅ Saved address to customer_profiles (structured fields)")
+        log.info("address_saved", profile_id=profile["id"])
 
         # ========================================
         # 4. VERIFY SAVE ✅
         # ========================================
-        # .single() không cần .execute() và trả về data
-        verify_profile = supabase.from_("customer_profiles") \
+        verify_resp = await supabase.from_("customer_profiles") \
             .select("shipping_address_line, shipping_city, phone") \
             .eq("id", profile["id"]) \
-            .single()
+            .single() \
+            .execute()
+        verify_profile = verify_resp.data
 
-        print(f"🔍 Verify saved data: {verify_profile}")
+        log.debug("address_save_verified", profile_id=profile["id"], saved=verify_profile)
 
         return {
             "success": True,
@@ -311,7 +328,7 @@ async def save_address_standardized(
         }
 
     except Exception as error:
-        print(f"❌ Error saving address: {error}")
+        log.error("address_save_failed", conversation_id=conversation_id, error=str(error))
         return {
             "success": False,
             "message": str(error) or "Lỗi khi lưu địa chỉ",
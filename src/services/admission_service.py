@@ -0,0 +1,171 @@
+# ============================================
+# services/admission_service.py
+# Admission control trước LLM pipeline (run_bewo_agent):
+# - Tối đa N turn LLM chạy đồng thời
+# - Hàng chờ có giới hạn + timeout, ưu tiên khách có giỏ hàng / địa chỉ
+# - Hàng chờ đầy / chờ quá lâu → shed (caller trả lời "đang bận" ngay)
+# ============================================
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from ..utils.structured_logger import get_logger
+
+log = get_logger("admission")
+
+# Priority: số nhỏ hơn = ưu tiên hơn
+PRIORITY_HIGH = 0      # Có giỏ hàng hoặc địa chỉ đã lưu (sắp chốt đơn)
+PRIORITY_NORMAL = 1
+
+
+class AdmissionStats(TypedDict):
+    max_concurrent: int
+    in_flight: int
+    queued: int
+    admitted: int
+    admitted_after_wait: int
+    shed_queue_full: int
+    shed_timeout: int
+    evicted: int
+    wait_ms_avg: float
+    wait_ms_max: float
+    admitted_by_priority: Dict[str, int]
+    shed_by_priority: Dict[str, int]
+
+
+class AdmissionController:
+    """
+    Semaphore có priority + hàng chờ giới hạn.
+    Khi hàng chờ đầy, tin ưu tiên cao đẩy tin ưu tiên thấp nhất (mới nhất) ra khỏi hàng.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, wait_timeout: float, name: str = "agent"):
+        self._max_concurrent = max_concurrent
+        self._max_queue = max_queue
+        self._wait_timeout = wait_timeout
+        self._name = name
+
+        self._in_flight = 0
+        self._seq = 0
+        # (priority, seq, future) - future nhận True (được vào) / False (bị đẩy ra)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+
+        # Metrics
+        self._admitted = 0
+        self._admitted_after_wait = 0
+        self._shed_queue_full = 0
+        self._shed_timeout = 0
+        self._evicted = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        self._admitted_by_priority: Dict[str, int] = {}
+        self._shed_by_priority: Dict[str, int] = {}
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> bool:
+        """
+        Xin một slot. Returns True nếu được chạy (PHẢI gọi release() sau đó),
+        False nếu bị shed (hàng chờ đầy, bị đẩy ra, hoặc chờ quá timeout).
+        """
+        if self._in_flight < self._max_concurrent and not self._waiters:
+            self._in_flight += 1
+            self._record_admit(priority, 0.0)
+            return True
+
+        if len(self._waiters) >= self._max_queue:
+            worst = max(self._waiters)
+            if worst[0] <= priority:
+                self._shed_queue_full += 1
+                self._record_shed(priority)
+                return False
+            # Đẩy tin ưu tiên thấp nhất ra để nhường chỗ
+            self._waiters.remove(worst)
+            self._evicted += 1
+            self._record_shed(worst[0])
+            worst[2].set_result(False)
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        entry = (priority, self._seq, future)
+        self._waiters.append(entry)
+        started = time.monotonic()
+        try:
+            admitted = await asyncio.wait_for(future, timeout=self._wait_timeout)
+        except asyncio.TimeoutError:
+            if not self._granted(future):
+                self._shed_timeout += 1
+                self._record_shed(priority)
+                return False
+            # Slot được cấp đúng lúc hết timeout → vẫn chạy
+            admitted = True
+        except asyncio.CancelledError:
+            # Caller bị hủy sau khi đã được cấp slot → trả slot lại
+            if self._granted(future):
+                self.release()
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+
+        if admitted:
+            self._admitted_after_wait += 1
+            self._record_admit(priority, (time.monotonic() - started) * 1000)
+        return admitted
+
+    @staticmethod
+    def _granted(future: asyncio.Future) -> bool:
+        return future.done() and not future.cancelled() and future.result() is True
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        while self._waiters and self._in_flight < self._max_concurrent:
+            entry = min(self._waiters)
+            self._waiters.remove(entry)
+            future = entry[2]
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(True)
+
+    def _record_admit(self, priority: int, wait_ms: float) -> None:
+        self._admitted += 1
+        self._wait_ms_total += wait_ms
+        self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+        label = str(priority)
+        self._admitted_by_priority[label] = self._admitted_by_priority.get(label, 0) + 1
+
+    def _record_shed(self, priority: int) -> None:
+        label = str(priority)
+        self._shed_by_priority[label] = self._shed_by_priority.get(label, 0) + 1
+        log.warning("turn_shed", controller=self._name, priority=priority, in_flight=self._in_flight, queued=len(self._waiters))
+
+    def stats(self) -> AdmissionStats:
+        return {
+            "max_concurrent": self._max_concurrent,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "admitted": self._admitted,
+            "admitted_after_wait": self._admitted_after_wait,
+            "shed_queue_full": self._shed_queue_full,
+            "shed_timeout": self._shed_timeout,
+            "evicted": self._evicted,
+            "wait_ms_avg": round(self._wait_ms_total / self._admitted, 2) if self._admitted else 0.0,
+            "wait_ms_max": round(self._wait_ms_max, 2),
+            "admitted_by_priority": dict(self._admitted_by_priority),
+            "shed_by_priority": dict(self._shed_by_priority),
+        }
+
+
+def turn_priority(context: Optional[dict]) -> int:
+    """Khách đã có giỏ hàng hoặc địa chỉ giao hàng → ưu tiên (gần chốt đơn)"""
+    if context and (context.get("cart") or context.get("saved_address")):
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+agent_admission = AdmissionController(
+    max_concurrent=settings.AGENT_MAX_CONCURRENT_TURNS,
+    max_queue=settings.AGENT_ADMISSION_QUEUE_SIZE,
+    wait_timeout=settings.AGENT_ADMISSION_TIMEOUT,
+)
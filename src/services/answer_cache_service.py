@@ -0,0 +1,332 @@
+# ============================================
+# services/answer_cache_service.py
+# Cache câu trả lời của agent cho câu hỏi kiểu FAQ (phí ship, đổi trả,
+# "có size XL không", giờ làm việc...) → không gọi Gemini lại
+# - Key = tin nhắn đã chuẩn hóa + hash các phần context ảnh hưởng câu trả lời
+#   (catalog sản phẩm trong context, STORE_INFO, catalog version)
+# - Khớp chính xác (tập từ) hoặc gần giống (trigram Jaccard >= ANSWER_CACHE_SIMILARITY)
+# - TTL + LRU; catalog đổi (giá/tồn kho/sản phẩm) → hash đổi → entry cũ không khớp;
+#   invalidate_catalog() khi chính app cập nhật tồn kho
+# - KHÔNG cache nội dung cá nhân: tin tham chiếu ngữ cảnh ("mẫu này"), giỏ hàng
+#   đang có hàng, khách có hồ sơ / memory, vừa xem sản phẩm, function call,
+#   câu trả lời chứa tên/SĐT/địa chỉ
+# ============================================
+
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple, TypedDict
+
+from ..config.env import settings
+from ..utils.json_fast import dumps
+from ..utils.prompts import STORE_INFO
+from ..utils.structured_logger import get_logger
+from .metrics_service import ANSWER_CACHE_LOOKUPS, ANSWER_CACHE_TOKENS_SAVED
+
+log = get_logger("answer_cache")
+
+_NON_WORD = re.compile(r"[\W_]+")
+# Từ đệm / xưng hô không đổi nghĩa câu hỏi
+_FILLER_WORDS = frozenset([
+    "ạ", "à", "ơi", "shop", "em", "chị", "anh", "bạn", "ad", "admin", "mình", "vậy", "thế",
+    "nhé", "nha", "với", "cho", "hỏi", "xin", "dạ", "vâng", "ạh", "luôn", "đi", "ấy", "hả", "là", "thì",
+])
+# Viết tắt / không dấu hay gặp → cùng một từ
+_ABBREVIATIONS = {
+    "ko": "không", "k": "không", "hok": "không", "hông": "không", "khong": "không", "kh": "không",
+    "dc": "được", "đc": "được", "duoc": "được", "sz": "size",
+    "bn": "bao nhiêu", "bnhieu": "bao nhiêu", "sp": "sản phẩm", "sip": "ship",
+}
+# Tin tham chiếu ngữ cảnh / cá nhân → không dùng cache
+_CONTEXTUAL_PATTERN = re.compile(
+    r"\b(?:này|đó|kia|vừa\s*rồi|vừa\s*nãy|trên|ở\s*trên|của\s*em|của\s*mình|đơn\s*hàng|giỏ|địa\s*chỉ)\b"
+    r"|\d{5,}"
+)
+_STORE_INFO_HASH = hashlib.sha1(dumps(STORE_INFO).encode("utf-8")).hexdigest()[:12]
+
+CacheKey = Tuple[str, FrozenSet[str]]
+
+
+class CachedAnswer:
+    __slots__ = ("text", "products", "type", "tokens", "expires_at", "trigrams", "normalized", "hits")
+
+    def __init__(self, llm_result: Dict[str, Any], normalized: str, trigrams: FrozenSet[str], expires_at: float):
+        self.text = llm_result["text"]
+        self.products = llm_result.get("products", [])
+        self.type = llm_result.get("type", "conversational")
+        self.tokens = llm_result.get("tokens", 0)
+        self.normalized = normalized
+        self.trigrams = trigrams
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class AnswerCacheStats(TypedDict):
+    enabled: bool
+    entries: int
+    lookups: int
+    hits: int
+    similar_hits: int
+    skipped: int
+    stores: int
+    hit_rate: float
+    tokens_saved: int
+    catalog_version: int
+
+
+def _tokens(normalized: str) -> List[str]:
+    words = " ".join(_ABBREVIATIONS.get(word, word) for word in normalized.split()).split()
+    return [word for word in words if word not in _FILLER_WORDS]
+
+
+def _fold(text: str) -> str:
+    """Bỏ dấu tiếng Việt ("phí ship" ~ "phi ship") cho so khớp gần giống"""
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _trigrams(text: str) -> FrozenSet[str]:
+    padded = f"  {_fold(text)} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class AnswerCache:
+    def __init__(self, ttl_seconds: float, max_entries: int, similarity: float, max_chars: int):
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._similarity = similarity
+        self._max_chars = max_chars
+        self._entries: "OrderedDict[CacheKey, CachedAnswer]" = OrderedDict()
+        # context hash → từ → keys (tìm ứng viên near-duplicate không phải quét hết)
+        self._index: Dict[str, Dict[str, Set[CacheKey]]] = {}
+        self._catalog_version = 0
+
+        self._lookups = 0
+        self._hits = 0
+        self._similar_hits = 0
+        self._skipped = 0
+        self._stores = 0
+        self._tokens_saved = 0
+
+    # ---------- key ----------
+
+    def _context_hash(self, context: Dict[str, Any]) -> str:
+        catalog = [
+            (p.get("id"), p.get("name"), p.get("price"), p.get("stock"))
+            for p in context.get("products") or []
+        ]
+        raw = dumps([self._catalog_version, _STORE_INFO_HASH, catalog])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _cacheable_turn(self, message_text: str, context: Dict[str, Any]) -> Optional[str]:
+        """Tin đã chuẩn hóa nếu turn dùng được cache, ngược lại None"""
+        if not settings.ANSWER_CACHE_ENABLED or len(message_text) > self._max_chars:
+            return None
+        normalized = " ".join(_NON_WORD.sub(" ", message_text.lower()).split())
+        if not normalized or _CONTEXTUAL_PATTERN.search(normalized):
+            return None
+        # Giỏ có hàng → "bao nhiêu tiền" / "ship mất bao lâu" là hỏi về giỏ của khách
+        # (context["cart"] nạp từ chatbot_conversations.context trong build_context)
+        if context.get("cart"):
+            return None
+        # Khách có hồ sơ / memory (usual_size, style_preference, facts...) → agent cá nhân hóa
+        # câu trả lời theo đó; cache lại sẽ đưa nội dung của khách này cho khách khác
+        if context.get("profile") or context.get("memory_facts") or context.get("interests"):
+            return None
+        # Khách vừa xem sản phẩm → "có size XL không" là hỏi về mẫu đó
+        for message in reversed(context.get("history") or []):
+            if message.get("sender_type") == "bot":
+                if (message.get("content") or {}).get("products"):
+                    return None
+                break
+        return " ".join(_tokens(normalized)) or None
+
+    @staticmethod
+    def _personal(text: str, context: Dict[str, Any]) -> bool:
+        profile = context.get("profile") or {}
+        address = context.get("saved_address") or {}
+        values = [
+            profile.get("preferred_name"), profile.get("full_name"), profile.get("phone"),
+            address.get("address_line"), address.get("phone"), address.get("full_name"),
+        ]
+        lowered = text.lower()
+        return any(value and str(value).lower() in lowered for value in values)
+
+    # ---------- API ----------
+
+    def lookup(self, message_text: str, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Kết quả cùng format run_bewo_agent (+ "cache": "exact"|"similar") hoặc None"""
+        normalized = self._cacheable_turn(message_text, context)
+        if normalized is None:
+            self._skipped += 1
+            ANSWER_CACHE_LOOKUPS.inc("skip")
+            return None
+        self._lookups += 1
+        context_hash = self._context_hash(context)
+        words = frozenset(normalized.split())
+        now = time.monotonic()
+
+        match = "exact"
+        similarity = 1.0
+        key = (context_hash, words)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            match = "similar"
+            similarity, key, entry = self._find_similar(context_hash, normalized, words, now)
+        if entry is None:
+            ANSWER_CACHE_LOOKUPS.inc("miss")
+            return None
+
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self._hits += 1
+        if match == "similar":
+            self._similar_hits += 1
+        self._tokens_saved += entry.tokens
+        ANSWER_CACHE_LOOKUPS.inc(match)
+        ANSWER_CACHE_TOKENS_SAVED.inc(amount=entry.tokens)
+        log.info(
+            "answer_cache_hit",
+            match=match,
+            similarity=round(similarity, 3),
+            tokens_saved=entry.tokens,
+            tokens_saved_total=self._tokens_saved,
+            hit_rate=self.stats()["hit_rate"],
+        )
+        return {
+            "text": entry.text,
+            "products": entry.products,
+            "tokens": 0,
+            "type": entry.type,
+            "functionCalls": [],
+            "cache": match,
+        }
+
+    def _find_similar(
+        self, context_hash: str, normalized: str, words: FrozenSet[str], now: float
+    ) -> Tuple[float, Optional[CacheKey], Optional[CachedAnswer]]:
+        index = self._index.get(context_hash) or {}
+        folded = {_fold(word) for word in words}
+        # Ứng viên phải chung ít nhất một nửa số từ (đã bỏ dấu)
+        shared: Dict[CacheKey, int] = {}
+        for word in folded:
+            for key in index.get(word, ()):
+                shared[key] = shared.get(key, 0) + 1
+        min_shared = (len(folded) + 1) // 2
+        trigrams = _trigrams(normalized)
+        best: Tuple[float, Optional[CacheKey], Optional[CachedAnswer]] = (0.0, None, None)
+        for key, count in shared.items():
+            if count < min_shared:
+                continue
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                continue
+            # Jaccard >= t cần |A| / |B| nằm trong [t, 1/t]
+            sizes = len(trigrams), len(entry.trigrams)
+            if min(sizes) < self._similarity * max(sizes):
+                continue
+            score = _jaccard(trigrams, entry.trigrams)
+            if score >= self._similarity and score > best[0]:
+                best = (score, key, entry)
+        return best
+
+    @property
+    def catalog_version(self) -> int:
+        return self._catalog_version
+
+    def store(
+        self,
+        message_text: str,
+        context: Dict[str, Any],
+        llm_result: Dict[str, Any],
+        catalog_version: Optional[int] = None,
+    ) -> bool:
+        """
+        Lưu câu trả lời của agent nếu không mang nội dung cá nhân.
+        `catalog_version`: giá trị `catalog_version` lúc agent bắt đầu chạy; catalog bị
+        invalidate trong lúc đó → câu trả lời dựa trên giá / tồn kho cũ, không lưu.
+        """
+        if catalog_version is not None and catalog_version != self._catalog_version:
+            log.debug("answer_cache_store_stale", catalog_version=catalog_version, current=self._catalog_version)
+            return False
+        if (
+            llm_result.get("functionCalls")
+            or not llm_result.get("tokens")  # fallback lỗi / fast path / cache hit
+            or not llm_result.get("text")
+            or self._personal(llm_result["text"], context)
+        ):
+            return False
+        normalized = self._cacheable_turn(message_text, context)
+        if normalized is None:
+            return False
+        context_hash = self._context_hash(context)
+        words = frozenset(normalized.split())
+        key = (context_hash, words)
+        self._remove(key)
+        self._entries[key] = CachedAnswer(
+            llm_result, normalized, _trigrams(normalized), time.monotonic() + self._ttl
+        )
+        index = self._index.setdefault(context_hash, {})
+        for word in words:
+            index.setdefault(_fold(word), set()).add(key)
+        self._stores += 1
+        while len(self._entries) > self._max_entries:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, key: CacheKey) -> None:
+        if self._entries.pop(key, None) is None:
+            return
+        context_hash, words = key
+        index = self._index.get(context_hash)
+        if index is None:
+            return
+        for word in {_fold(word) for word in words}:
+            keys = index.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[word]
+        if not index:
+            del self._index[context_hash]
+
+    def invalidate_catalog(self, reason: str = "") -> None:
+        """Sản phẩm / chính sách đổi → bỏ toàn bộ câu trả lời đã cache"""
+        self._catalog_version += 1
+        dropped = len(self._entries)
+        self._entries.clear()
+        self._index.clear()
+        log.info("answer_cache_invalidated", reason=reason, dropped=dropped, catalog_version=self._catalog_version)
+
+    def stats(self) -> AnswerCacheStats:
+        return {
+            "enabled": settings.ANSWER_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "similar_hits": self._similar_hits,
+            "skipped": self._skipped,
+            "stores": self._stores,
+            "hit_rate": round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+            "tokens_saved": self._tokens_saved,
+            "catalog_version": self._catalog_version,
+        }
+
+
+answer_cache = AnswerCache(
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    similarity=settings.ANSWER_CACHE_SIMILARITY,
+    max_chars=settings.ANSWER_CACHE_MAX_CHARS,
+)
@@ -5,7 +5,10 @@
 import asyncio
 from typing import List, Dict, Optional, Any, TypedDict
 
-from ..utils.connect_supabase import get_supabase_client
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+
+log = get_logger("cart_service")
 
 # Định nghĩa kiểu dữ liệu cho một sản phẩm trong giỏ hàng
 class CartItem(TypedDict, total=False):
@@ -29,11 +32,11 @@ def format_price(price: float) -> str:
         return f"{price} VND"
 
 async def get_or_create_cart(conversation_id: str) -> List[CartItem]:
-    supabase = get_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
         # ✅ FIX: Bỏ .single(), dùng .limit(1)
-        response = supabase.from_("chatbot_conversations") \
+        response = await supabase.from_("chatbot_conversations") \
             .select("context") \
             .eq("id", conversation_id) \
             .limit(1) \
@@ -51,19 +54,19 @@ async def get_or_create_cart(conversation_id: str) -> List[CartItem]:
         return []
 
     except Exception as error:
-        print(f"Error fetching conversation for cart: {error}")
+        log.error("cart_fetch_failed", conversation_id=conversation_id, error=str(error))
         return []
 
 async def save_cart(conversation_id: str, cart: List[CartItem]) -> None:
-    supabase = get_supabase_client()
+    supabase = get_async_supabase_client()
     try:
         # ✅ FIX: .rpc() không cần .select()
-        supabase.rpc("merge_context", {
+        await supabase.rpc("merge_context", {
             "p_conversation_id": conversation_id,
             "p_new_context": {"cart": cart},
         }).execute()
     except Exception as error:
-        print(f"Error saving cart via RPC: {error}")
+        log.error("cart_save_failed", conversation_id=conversation_id, error=str(error))
 
 async def add_to_cart(conversation_id: str, item: CartItem) -> List[CartItem]:
     cart = await get_or_create_cart(conversation_id)
@@ -81,7 +84,7 @@ async def add_to_cart(conversation_id: str, item: CartItem) -> List[CartItem]:
 
     await save_cart(conversation_id, cart)
 
-    print(f"✅ Added to cart: {item.get('name')} x{item.get('quantity')}")
+    log.info("cart_item_added", conversation_id=conversation_id, product_id=item.get("product_id"), quantity=item.get("quantity"))
     return cart
 
 async def remove_from_cart(conversation_id: str, product_id: str) -> ServiceResult:
@@ -92,14 +95,14 @@ async def remove_from_cart(conversation_id: str, product_id: str) -> ServiceResu
 
     if len(new_cart) < initial_length:
         await save_cart(conversation_id, new_cart)
-        print(f"🗑️ Removed product {product_id} from cart.")
+        log.info("cart_item_removed", conversation_id=conversation_id, product_id=product_id)
         return {
             "success": True,
             "message": "Đã xóa sản phẩm khỏi giỏ hàng.",
             "cart": new_cart,
         }
     else:
-        print(f"⚠️ Product {product_id} not found in cart to remove.")
+        log.warning("cart_item_missing", conversation_id=conversation_id, product_id=product_id)
         return {
             "success": False,
             "message": "Không tìm thấy sản phẩm này trong giỏ hàng.",
@@ -147,14 +150,14 @@ async def update_cart_item(conversation_id: str, args: UpdateCartArgs) -> Servic
             cart[item_index]["size"] = size_to_update
         
         await save_cart(conversation_id, cart)
-        print(f"🔄 Updated cart item {product_id_to_update} to quantity {args['quantity']}.")
+        log.info("cart_item_updated", conversation_id=conversation_id, product_id=product_id_to_update, quantity=args["quantity"])
         return {
             "success": True,
             "message": "Đã cập nhật giỏ hàng thành công.",
             "cart": cart,
         }
     else:
-        print(f"⚠️ Item {product_id_to_update} not found to update.")
+        log.warning("cart_item_missing", conversation_id=conversation_id, product_id=product_id_to_update)
         return {
             "success": False,
             "message": "Không tìm thấy sản phẩm này trong giỏ để cập nhật.",
@@ -164,7 +167,7 @@ async def clear_cart(conversation_id: str) -> None:
     cart = await get_or_create_cart(conversation_id)
     if cart:
         await save_cart(conversation_id, [])
-    print("✅ Cart cleared")
+    log.info("cart_cleared", conversation_id=conversation_id)
 
 async def get_cart_summary(conversation_id: str) -> str:
     cart = await get_or_create_cart(conversation_id)
@@ -6,10 +6,15 @@
 import asyncio
 import re
 from typing import List, Dict, Optional, Any, TypedDict
-from supabase import Client
+from supabase import AsyncClient
 
-# Giả định bạn có hàm create_supabase_client trong connect_supabase.py
-from ..utils.connect_supabase import create_supabase_client
+# Dùng chung Supabase AsyncClient (pooled) trong connect_supabase.py
+from ..utils.connect_supabase import get_async_supabase_client
+from .answer_cache_service import answer_cache
+from .product_cache_service import product_cache
+from ..utils.structured_logger import get_logger
+
+log = get_logger("chatbot_order_service")
 
 # ============================================
 # ĐỊNH NGHĨA TYPE (TYPESCRIPT INTERFACES)
@@ -55,9 +60,9 @@ class CreateOrderResult(TypedDict, total=False):
 # ============================================
 
 async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
-    print(f"🛒 Creating chatbot order for: {data.get('customerPhone')}")
+    log.info("chatbot_order_creating", conversation_id=data.get("conversationId"), customer_phone=data.get("customerPhone"))
 
     # ========================================
     # 0. VALIDATION
@@ -70,7 +75,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
     shipping_city = data.get("shippingCity", "").strip()
 
     if not customer_name:
-        print("❌ Missing customer name")
+        log.warning("chatbot_order_invalid", reason="missing_customer_name")
         return {
             "success": False,
             "error": "Thiếu tên khách hàng",
@@ -78,7 +83,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
         }
 
     if not customer_phone or not re.fullmatch(r"^[0+][\d]{9,11}$", customer_phone):
-        print(f"❌ Invalid customer phone: {customer_phone}")
+        log.warning("chatbot_order_invalid", reason="invalid_phone", customer_phone=customer_phone)
         return {
             "success": False,
             "error": "Số điện thoại không hợp lệ",
@@ -86,7 +91,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
         }
 
     if not shipping_address or len(shipping_address) < 5:
-        print(f"❌ Missing or invalid shipping address: {shipping_address}")
+        log.warning("chatbot_order_invalid", reason="invalid_address", shipping_address=shipping_address)
         return {
             "success": False,
             "error": "Địa chỉ giao hàng không hợp lệ",
@@ -94,7 +99,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
         }
 
     if not products:
-        print("❌ No products in order")
+        log.warning("chatbot_order_invalid", reason="no_products")
         return {
             "success": False,
             "error": "Không có sản phẩm trong đơn hàng",
@@ -103,7 +108,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
 
     # Validate shippingCity (should be provided)
     if not shipping_city:
-        print("⚠️ Missing shipping city, attempting to extract from address")
+        log.info("chatbot_order_city_missing", action="extract_from_address")
         # Try to extract city from address
         city_match = re.search(
             r",\s*(Hà Nội|TP\.?HCM|TP\s*Hồ Chí Minh|Đà Nẵng|Hải Phòng|Cần Thơ)$",
@@ -114,14 +119,14 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
             shipping_city = city_match.group(1)
             data["shippingCity"] = shipping_city # Cập nhật lại data
         else:
-            print("❌ Cannot determine shipping city")
+            log.warning("chatbot_order_invalid", reason="missing_city")
             return {
                 "success": False,
                 "error": "Không xác định được thành phố giao hàng",
                 "orderSummary": None,
             }
     
-    print("✅ Validation passed")
+    log.debug("chatbot_order_validated")
 
     try:
         # ========================================
@@ -172,18 +177,19 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
             "notes": data.get("notes", "").strip() or None,
         }
 
-        order_response = supabase.from_("chatbot_orders") \
+        order_response = await supabase.from_("chatbot_orders") \
             .insert(order_payload) \
+            .execute()
 
-        if order_response.data:
-            print(f"❌ Error creating chatbot order: {order_response.data}")
+        if not order_response.data:
+            log.error("chatbot_order_insert_failed", conversation_id=data.get("conversationId"))
             return {
                 "success": False,
                 "orderSummary": None,
             }
 
-        order = order_response.data
-        print(f"✅ Chatbot order created: {order['id']}")
+        order = order_response.data[0]
+        log.info("chatbot_order_created", order_id=order["id"], conversation_id=data.get("conversationId"))
 
         # ========================================
         # 4. UPDATE STOCK - NON-BLOCKING (LOG ERRORS)
@@ -196,9 +202,9 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
                     product.get("size", "One Size"), # Đảm bảo có size
                     product["quantity"],
                 )
-            print("✅ Stock updated for all products")
+            log.debug("chatbot_order_stock_updated", order_id=order["id"])
         except Exception as stock_error:
-            print(f"⚠️ Stock update failed (non-blocking): {stock_error}")
+            log.warning("chatbot_order_stock_update_failed", order_id=order["id"], error=str(stock_error))
             # Order is already created, just log the issue
 
         # ========================================
@@ -206,16 +212,16 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
         # ========================================
         try:
             product_names = ", ".join([p.get("name", "N/A") for p in products])
-            supabase.from_("customer_memory_facts").insert({
+            await supabase.from_("customer_memory_facts").insert({
                 "customer_profile_id": data["profileId"],
                 "fact_type": "special_request",
                 "fact_text": f"Đã đặt hàng: {product_names}",
                 "importance_score": 8,
                 "source_conversation_id": data["conversationId"],
             }).execute()
-            print("✅ Memory fact saved")
+            log.debug("chatbot_order_memory_saved", order_id=order["id"])
         except Exception as memory_error:
-            print(f"⚠️ Memory fact save failed (non-blocking): {memory_error}")
+            log.warning("chatbot_order_memory_save_failed", order_id=order["id"], error=str(memory_error))
 
         # ========================================
         # 6. RETURN SUCCESS
@@ -235,7 +241,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
         }
 
     except Exception as error:
-        print(f"❌ Unexpected error in create_chatbot_order: {error}")
+        log.error("chatbot_order_failed", conversation_id=data.get("conversationId"), error=str(error))
         return {
             "success": False,
             "error": str(error) or "Lỗi không xác định",
@@ -247,7 +253,7 @@ async def create_chatbot_order(data: OrderData) -> CreateOrderResult:
 # ============================================
 
 async def update_product_stock(
-    supabase: Client,
+    supabase: AsyncClient,
     product_id: str,
     size: str,
     quantity: int,
@@ -258,31 +264,31 @@ async def update_product_stock(
     """
     try:
         # Update main product stock
-        product_resp = supabase.from_("products") \
+        product_resp = await supabase.from_("products") \
             .select("stock") \
             .eq("id", product_id) \
             .single() \
             .execute()
 
         if not product_resp.data:
-            print(f"⚠️ Product not found for stock update: {product_id}.")
+            log.warning("stock_update_product_missing", product_id=product_id)
             return # Non-blocking
 
         if product_resp.data:
             current_stock = product_resp.data.get("stock", 0)
             new_stock = max(0, current_stock - quantity)
             
-            update_resp = supabase.from_("products") \
+            update_resp = await supabase.from_("products") \
                 .update({"stock": new_stock}) \
                 .eq("id", product_id) \
                 .execute()
                 
             if update_resp.data:
-                print(f"❌ Failed to update product stock: {update_resp.data}")
+                log.error("stock_update_failed", product_id=product_id)
 
         # Update size-specific stock
         if size and size != "One Size":
-            size_resp = supabase.from_("product_sizes") \
+            size_resp = await supabase.from_("product_sizes") \
                 .select("stock") \
                 .eq("product_id", product_id) \
                 .eq("size", size) \
@@ -293,15 +299,18 @@ async def update_product_stock(
                 current_size_stock = size_resp.data.get("stock", 0)
                 new_size_stock = max(0, current_size_stock - quantity)
                 
-                supabase.from_("product_sizes") \
+                await supabase.from_("product_sizes") \
                     .update({"stock": new_size_stock}) \
                     .eq("product_id", product_id) \
                     .eq("size", size) \
                     .execute()
             elif size_resp.data:
-                 print(f"⚠️ Product size not found for stock update: {product_id} (Size: {size})")
+                 log.warning("stock_update_size_missing", product_id=product_id, size=size)
 
+        # Tồn kho đổi → câu trả lời / kết quả tool đã cache ("còn size M không") có thể sai
+        answer_cache.invalidate_catalog(f"stock_update:{product_id}")
+        product_cache.invalidate(product_id, reason="stock_update")
 
     except Exception as error:
-        print(f"❌ Error in update_product_stock: {error}")
+        log.error("stock_update_failed", product_id=product_id, error=str(error))
         # Don't throw - this is non-blocking
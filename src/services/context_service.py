@@ -3,12 +3,16 @@
 # ============================================
 
 from typing import Dict, Any, Optional, List
-from ..utils.connect_supabase import get_supabase_client
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+from .stage_graph import StageGraph
 
 # Import services (sẽ cần implement)
 from .memory_service import load_customer_memory
 from .address_service import get_standardized_address
 
+log = get_logger("context_service")
+
 
 # ========================================
 # STUB FUNCTIONS (Bạn thay bằng code thật)
@@ -63,137 +67,134 @@ async def build_context(
         "saved_address": {...},
         "history": [...],
         "products": [...],
+        "cart": [...],
         "memory_facts": [...],
         "previous_summary": str
     }
     """
     context: Dict[str, Any] = {}
 
+    # Các bước 1-5 không phụ thuộc nhau → chạy song song (mỗi bước ghi key riêng của context)
+
     # ========================================
-    # 1. GET CONVERSATION INFO
+    # 1. GET CONVERSATION INFO + CART
+    # (giỏ hàng nằm trong chatbot_conversations.context, xem cart_service)
     # ========================================
-    conv_resp = supabase.from_("chatbot_conversations") \
-        .select("*") \
-        .eq("id", conversation_id) \
-        .limit(1) \
-        .execute()
-
-    if conv_resp.data and len(conv_resp.data) > 0:
-        conv = conv_resp.data[0]
-        context["customer"] = {
-            "name": conv.get("customer_name") or "Guest",
-            "phone": conv.get("customer_phone") or ""
-        }
-    else:
-        context["customer"] = {"name": "Guest", "phone": ""}
+    async def load_conversation(_: Dict[str, Any]) -> None:
+        conv_resp = await supabase.from_("chatbot_conversations") \
+            .select("*") \
+            .eq("id", conversation_id) \
+            .limit(1) \
+            .execute()
+
+        if conv_resp.data and len(conv_resp.data) > 0:
+            conv = conv_resp.data[0]
+            context["customer"] = {
+                "name": conv.get("customer_name") or "Guest",
+                "phone": conv.get("customer_phone") or ""
+            }
+            conv_context = conv.get("context")
+            cart = conv_context.get("cart", []) if isinstance(conv_context, dict) else []
+            context["cart"] = cart if isinstance(cart, list) else []
+        else:
+            context["customer"] = {"name": "Guest", "phone": ""}
+            context["cart"] = []
 
     # ========================================
     # 2. LOAD LONG-TERM MEMORY
     # ========================================
-    memory = await load_customer_memory(conversation_id)
-
-    if memory:
-        context["profile"] = memory.get("profile",{})
-        context["interests"] = memory.get("interests", [])
-        context["memory_facts"] = memory.get("facts", [])
-        
-        summary = memory.get("summary")
-        if summary:
-            context["previous_summary"] = summary.get("summary_text")
-            context["key_points"] = summary.get("key_points", [])
-    else:
-        context["profile"] = {}
-        context["interests"] = []
-        context["memory_facts"] = []
-        context["previous_summary"] = {}
-        context["key_points"] = []
+    async def load_memory(_: Dict[str, Any]) -> None:
+        memory = await load_customer_memory(conversation_id)
+
+        if memory:
+            context["profile"] = memory.get("profile",{})
+            context["interests"] = memory.get("interests", [])
+            context["memory_facts"] = memory.get("facts", [])
+            
+            summary = memory.get("summary")
+            if summary:
+                context["previous_summary"] = summary.get("summary_text")
+                context["key_points"] = summary.get("key_points", [])
+        else:
+            context["profile"] = {}
+            context["interests"] = []
+            context["memory_facts"] = []
+            context["previous_summary"] = {}
+            context["key_points"] = []
 
     # ========================================
     # 3. LOAD SAVED ADDRESS - ✅ FIXED
     # ========================================
-    saved_address = await get_standardized_address(conversation_id)
+    async def load_address(_: Dict[str, Any]) -> None:
+        saved_address = await get_standardized_address(conversation_id)
 
-    if saved_address:
-        context["saved_address"] = saved_address
-        print(f"📍 Loaded address from customer_profiles (structured): {saved_address.get('address_line')}")
-    else:
-        context["saved_address"] = {}
-        print("⚠️ No saved address found")
+        if saved_address:
+            context["saved_address"] = saved_address
+            log.debug("saved_address_loaded", conversation_id=conversation_id, address_line=saved_address.get("address_line"))
+        else:
+            context["saved_address"] = {}
+            log.debug("saved_address_missing", conversation_id=conversation_id)
 
     # ========================================
     # 4. GET RECENT MESSAGES (10 tin cuối)
     # ========================================
-    msg_resp = supabase.from_("chatbot_messages") \
-        .select("sender_type, content, created_at") \
-        .eq("conversation_id", conversation_id) \
-        .order("created_at", desc=False) \
-        .limit(10) \
-        .execute()
+    async def load_history(_: Dict[str, Any]) -> None:
+        msg_resp = await supabase.from_("chatbot_messages") \
+            .select("sender_type, content, created_at") \
+            .eq("conversation_id", conversation_id) \
+            .order("created_at", desc=False) \
+            .limit(10) \
+            .execute()
 
-    context["history"] = msg_resp.data or []
+        context["history"] = msg_resp.data or []
 
     # ========================================
     # 5. GET PRODUCTS
     # ========================================
-    prod_resp = supabase.from_("products") \
-        .select("""
-            id, name, price, stock, slug, description,
-            images:product_images(image_url, is_primary, display_order)
-        """) \
-        .eq("is_active", True) \
-        .order("created_at", desc=True) \
-        .limit(20) \
-        .execute()
-
-    products = prod_resp.data or []
-
-    # Sort images: primary first, then by display_order
-    for p in products:
-        if p.get("images"):
-            p["images"].sort(key=lambda img: (
-                not img.get("is_primary", False),
-                img.get("display_order", 999)
-            ))
-
-    context["products"] = products
-
-    # # ========================================
-    # # 6. GET CART (if exists)
-    # # ========================================
-    # cart_resp = supabase.from_("cart_items") \
-    #     .select("""
-    #         id, product_id, quantity, size,
-    #         product:products(name, price)
-    #     """) \
-    #     .eq("conversation_id", conversation_id) \
-    #     .execute()
-
-    # if cart_resp.data:
-    #     context["cart"] = [
-    #         {
-    #             "id": item["id"],
-    #             "product_id": item["product_id"],
-    #             "name": item.get("product", {}).get("name", "Unknown"),
-    #             "price": item.get("product", {}).get("price", 0),
-    #             "quantity": item["quantity"],
-    #             "size": item.get("size")
-    #         }
-    #         for item in cart_resp.data
-    #     ]
-    # else:
-    #     context["cart"] = []
+    async def load_products(_: Dict[str, Any]) -> None:
+        prod_resp = await supabase.from_("products") \
+            .select("""
+                id, name, price, stock, slug, description,
+                images:product_images(image_url, is_primary, display_order)
+            """) \
+            .eq("is_active", True) \
+            .order("created_at", desc=True) \
+            .limit(20) \
+            .execute()
+
+        products = prod_resp.data or []
+
+        # Sort images: primary first, then by display_order
+        for p in products:
+            if p.get("images"):
+                p["images"].sort(key=lambda img: (
+                    not img.get("is_primary", False),
+                    img.get("display_order", 999)
+                ))
+
+        context["products"] = products
+
+    graph = StageGraph()
+    graph.add("context.conversation", load_conversation)
+    graph.add("context.memory", load_memory)
+    graph.add("context.address", load_address)
+    graph.add("context.history", load_history)
+    graph.add("context.products", load_products)
+    await graph.run()
 
     # ========================================
-    # 7. DEBUG LOG
+    # 6. DEBUG LOG
     # ========================================
-    print("📊 Context Summary:", {
-        "hasProfile": bool(context.get("profile")),
-        "hasSavedAddress": bool(context.get("saved_address")),
-        "addressLine": context.get("saved_address", {}).get("address_line", "none"),
-        "historyCount": len(context.get("history", [])),
-        "productCount": len(context.get("products", [])),
-        "cartCount": len(context.get("cart", [])),
-        "memoryFactsCount": len(context.get("memory_facts", []))
-    })
+    log.debug(
+        "context_summary",
+        conversation_id=conversation_id,
+        has_profile=bool(context.get("profile")),
+        has_saved_address=bool(context.get("saved_address")),
+        address_line=context.get("saved_address", {}).get("address_line"),
+        history_count=len(context.get("history", [])),
+        product_count=len(context.get("products", [])),
+        cart_count=len(context.get("cart", [])),
+        memory_facts_count=len(context.get("memory_facts", [])),
+    )
 
     return context
\ No newline at end of file
@@ -4,10 +4,13 @@
 
 from datetime import datetime, timezone
 from typing import List, Dict, Optional, Any, TypedDict
-from supabase import Client
+from supabase import AsyncClient
 
-# Giả định bạn có hàm create_supabase_client trong connect_supabase.py
-from ..utils.connect_supabase import create_supabase_client
+# Dùng chung Supabase AsyncClient (pooled) trong connect_supabase.py
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+
+log = get_logger("customer_profile_service")
 
 # ============================================
 # ĐỊNH NGHĨA TYPE (TYPESCRIPT INTERFACES)
@@ -69,18 +72,18 @@ async def save_customer_profile(
     data: CustomerProfileData,
 ) -> SaveProfileResult:
     
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
         # Get profile
-        profile_resp = supabase.from_("customer_profiles") \
+        profile_resp = await supabase.from_("customer_profiles") \
             .select("id, full_name, phone") \
             .eq("conversation_id", conversation_id) \
             .single() \
             .execute()
 
         if not profile_resp.data:
-            print(f"❌ Error fetching profile")
+            log.error("profile_fetch_failed", conversation_id=conversation_id)
             return {
                 "success": False,
                 "message": "Không tìm thấy profile khách hàng",
@@ -110,7 +113,7 @@ async def save_customer_profile(
             updates["style_preference"] = data["style_preference"]
 
         # Update profile
-        update_resp = supabase.from_("customer_profiles") \
+        update_resp = await supabase.from_("customer_profiles") \
             .update(updates) \
             .eq("id", profile["id"]) \
             .execute()
@@ -121,7 +124,7 @@ async def save_customer_profile(
         # Save as memory fact
         fact_text = _build_fact_text(data)
         if fact_text:
-            supabase.from_("customer_memory_facts") \
+            await supabase.from_("customer_memory_facts") \
                 .insert({
                     "customer_profile_id": profile["id"],
                     "fact_type": "personal_info",
@@ -132,7 +135,7 @@ async def save_customer_profile(
                 }) \
                 .execute()
 
-        print(f"✅ Customer profile saved: {updates}")
+        log.info("customer_profile_saved", conversation_id=conversation_id, fields=sorted(updates))
 
         return {
             "success": True,
@@ -140,7 +143,7 @@ async def save_customer_profile(
         }
     
     except Exception as error:
-        print(f"❌ Error saving customer profile: {error}")
+        log.error("customer_profile_save_failed", conversation_id=conversation_id, error=str(error))
         # Đảm bảo message là một chuỗi
         error_message = getattr(error, 'message', str(error))
         return {
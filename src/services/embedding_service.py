@@ -5,11 +5,16 @@
 
 from datetime import datetime, timezone
 from typing import List, Dict, Optional, Any, TypedDict
-from supabase import Client
+from supabase import AsyncClient
 from postgrest.exceptions import APIError
 
-# Giả định bạn có hàm create_supabase_client trong connect_supabase.py
-from ..utils.connect_supabase import create_supabase_client
+# Dùng chung Supabase AsyncClient (pooled) trong connect_supabase.py
+from ..utils.connect_supabase import get_async_supabase_client
+# Insert embedding gom thành bulk insert (write-behind)
+from .write_behind_service import write_behind
+from ..utils.structured_logger import get_logger
+
+log = get_logger("embedding_service")
 
 # ============================================
 # ĐỊNH NGHĨA TYPE (TYPESCRIPT INTERFACES)
@@ -53,11 +58,9 @@ async def create_message_embedding(
     metadata: Dict[str, Any] = {},
 ) -> None:
     try:
-        supabase = create_supabase_client()
-
         # Validate inputs
         if not all([conversation_id, message_id, content]):
-            print("⚠️ Missing required fields for embedding")
+            log.warning("embedding_missing_fields", conversation_id=conversation_id, message_id=message_id)
             return
 
         # Limit content length (prevent huge embeddings)
@@ -70,23 +73,16 @@ async def create_message_embedding(
             "created_at": datetime.now(timezone.utc).isoformat(),
         }
 
-        insert_resp = supabase.from_("conversation_embeddings") \
-            .insert({
-                "conversation_id": conversation_id,
-                "message_id": message_id,
-                "content": trimmed_content,
-                "content_type": "message",
-                "metadata": embedding_metadata,
-            }) \
-            .execute()
-
-        print(f"✅ Created embedding for message {message_id[:8]}...")
+        write_behind.add("conversation_embeddings", {
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "content": trimmed_content,
+            "content_type": "message",
+            "metadata": embedding_metadata,
+        })
     
-    except APIError as api_error:
-        print(f"❌ API Error creating embedding: {api_error}")
-        # Don't throw - embedding creation shouldn't block main flow
     except Exception as error:
-        print(f"❌ create_message_embedding failed: {error}")
+        log.error("message_embedding_failed", conversation_id=conversation_id, error=str(error))
         # Silent fail - don't break the chat flow
 
 """
@@ -99,7 +95,6 @@ async def create_summary_embedding(
     key_points: List[str] = [],
 ) -> None:
     try:
-        supabase = create_supabase_client()
         now_iso = datetime.now(timezone.utc).isoformat()
 
         # Insert summary embedding
@@ -108,19 +103,17 @@ async def create_summary_embedding(
             "created_at": now_iso,
         }
         
-        summary_resp = supabase.from_("conversation_embeddings") \
-            .insert({
-                "conversation_id": conversation_id,
-                "message_id": None,
-                "content": summary_text,
-                "content_type": "summary",
-                "metadata": summary_metadata,
-            }) \
-            .execute()
+        write_behind.add("conversation_embeddings", {
+            "conversation_id": conversation_id,
+            "message_id": None,
+            "content": summary_text,
+            "content_type": "summary",
+            "metadata": summary_metadata,
+        })
 
         # Insert embeddings for each key point
-        if key_points:
-            fact_embeddings = [{
+        for point in key_points:
+            write_behind.add("conversation_embeddings", {
                 "conversation_id": conversation_id,
                 "message_id": None,
                 "content": point,
@@ -129,18 +122,12 @@ async def create_summary_embedding(
                     "source": "summary",
                     "created_at": now_iso,
                 },
-            } for point in key_points]
-
-            supabase.from_("conversation_embeddings") \
-                .insert(fact_embeddings) \
-                .execute()
+            })
 
-        print(f"✅ Created summary embeddings ({len(key_points)} facts)")
+        log.info("summary_embeddings_queued", conversation_id=conversation_id, facts=len(key_points))
     
-    except APIError as api_error:
-        print(f"❌ API Error creating summary embedding: {api_error}")
     except Exception as error:
-        print(f"❌ create_summary_embedding failed: {error}")
+        log.error("summary_embedding_failed", conversation_id=conversation_id, error=str(error))
 
 """
 Search similar messages using embeddings
@@ -152,11 +139,11 @@ async def search_similar_messages(
     limit: int = 5,
 ) -> List[Any]:
     try:
-        supabase = create_supabase_client()
+        supabase = get_async_supabase_client()
 
         # For now, use simple text search
         # TODO: Implement vector similarity search when pgvector is enabled
-        search_resp = supabase.from_("conversation_embeddings") \
+        search_resp = await supabase.from_("conversation_embeddings") \
             .select("*") \
             .eq("conversation_id", conversation_id) \
             .text_search("content", query, {
@@ -170,10 +157,10 @@ async def search_similar_messages(
         return search_resp.data or []
     
     except APIError as api_error:
-        print(f"❌ API Error searching embeddings: {api_error}")
+        log.error("embedding_search_failed", error=str(api_error))
         return []
     except Exception as error:
-        print(f"❌ search_similar_messages failed: {error}")
+        log.error("embedding_search_failed", error=str(error))
         return []
 
 """
@@ -185,9 +172,9 @@ async def get_recent_context(
     limit: int = 10,
 ) -> str:
     try:
-        supabase = create_supabase_client()
+        supabase = get_async_supabase_client()
 
-        context_resp = supabase.from_("conversation_embeddings") \
+        context_resp = await supabase.from_("conversation_embeddings") \
             .select("content, content_type, created_at, metadata") \
             .eq("conversation_id", conversation_id) \
             .order("created_at", desc=True) \
@@ -216,10 +203,10 @@ async def get_recent_context(
         return "\n".join(context_parts)
     
     except APIError as api_error:
-        print(f"❌ API Error getting recent context: {api_error}")
+        log.error("recent_context_failed", error=str(api_error))
         return ""
     except Exception as error:
-        print(f"❌ get_recent_context failed: {error}")
+        log.error("recent_context_failed", error=str(error))
         return ""
 
 """
@@ -245,5 +232,5 @@ async def batch_create_embeddings(
         except Exception:
             failed += 1
 
-    print(f"✅ Batch embeddings: {success} success, {failed} failed")
+    log.info("batch_embeddings_done", success=success, failed=failed)
     return {"success": success, "failed": failed}
\ No newline at end of file
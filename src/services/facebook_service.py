@@ -1,6 +1,9 @@
 import requests
 import time
 from typing import Optional, List, Dict, Any
+from ..utils.structured_logger import get_logger
+
+log = get_logger("facebook_service")
 
 
 def format_price(price: float) -> str:
@@ -73,10 +76,10 @@ def send_facebook_image(
                 json=text_payload
             )
         
-        print("✅ Facebook image sent successfully")
+        log.info("facebook_image_sent", recipient_id=recipient_id)
         
     except Exception as error:
-        print(f"❌ Facebook image send error: {error}")
+        log.error("facebook_image_send_failed", recipient_id=recipient_id, error=str(error))
         raise
 
 
@@ -159,4 +162,4 @@ def send_facebook_message(
         json=text_payload
     )
     
-    print("Sent to Facebook Messenger")
+    log.info("facebook_message_sent", recipient_id=recipient_id)
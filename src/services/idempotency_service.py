@@ -0,0 +1,263 @@
+# ============================================
+# services/idempotency_service.py
+# Chống xử lý trùng tin nhắn (Facebook redelivery, website double-submit)
+# - Index in-memory có TTL (key → kết quả đã xử lý)
+# - Tùy chọn lưu bền vào bảng `chatbot_processed_messages` (nhiều process)
+#
+# Bảng cần có khi bật IDEMPOTENCY_PERSIST:
+#   create table chatbot_processed_messages (
+#     idempotency_key text primary key,
+#     result jsonb,
+#     created_at timestamptz default now()
+#   );
+# ============================================
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple, TypedDict
+
+from postgrest.exceptions import APIError
+
+from ..config.env import settings
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.structured_logger import get_logger
+
+log = get_logger("idempotency")
+
+PROCESSED_MESSAGES_TABLE = "chatbot_processed_messages"
+
+
+class DedupeStats(TypedDict):
+    keys: int
+    lookups: int
+    hits: int
+    memory_hits: int
+    persisted_hits: int
+    in_flight_joins: int
+    hit_rate: float
+
+
+class DedupeClaim:
+    """Kết quả IdempotencyIndex.claim() cho một key"""
+
+    def __init__(
+        self,
+        index: "IdempotencyIndex",
+        key: str,
+        aliases: Sequence[str],
+        future: asyncio.Future,
+        owner: bool,
+        result: Optional[Dict[str, Any]] = None,
+    ):
+        self._index = index
+        self.key = key
+        self.aliases = tuple(aliases)
+        self.future = future
+        self.owner = owner
+        self.result = result
+
+    async def complete(self, result: Dict[str, Any]) -> None:
+        """Lưu kết quả: tin trùng sau đó nhận kết quả này"""
+        await self._index._complete(self, result)
+
+    async def fail(self, error: BaseException) -> None:
+        """Bỏ claim: tin gửi lại được xử lý như tin mới"""
+        await self._index._fail(self, error)
+
+
+class IdempotencyIndex:
+    """
+    Index TTL: key → Future của lần xử lý đầu tiên.
+    - Lần đầu: chạy `fn`, lưu kết quả
+    - Trùng khi đang xử lý: chờ chung Future, trả cùng kết quả
+    - Trùng sau khi xong: trả kết quả đã cache, KHÔNG chạy lại
+    - Lỗi: xóa key để lần gửi lại được xử lý bình thường
+    """
+
+    def __init__(self, ttl_seconds: float, max_keys: int, persist: bool = False):
+        self._ttl = ttl_seconds
+        self._max_keys = max_keys
+        self._persist = persist
+        self._entries: "OrderedDict[str, Tuple[float, asyncio.Future]]" = OrderedDict()
+
+        self._lookups = 0
+        self._memory_hits = 0
+        self._persisted_hits = 0
+        self._in_flight_joins = 0
+
+    def _purge(self) -> None:
+        # Entries được thêm theo thứ tự thời gian và TTL cố định → chỉ cần cắt đầu
+        now = time.monotonic()
+        while self._entries:
+            key, (created_at, _) = next(iter(self._entries.items()))
+            if now - created_at < self._ttl and len(self._entries) <= self._max_keys:
+                break
+            self._entries.popitem(last=False)
+
+    async def run_once(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]],
+        duplicate_result: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]],
+        aliases: Sequence[str] = (),
+    ) -> Dict[str, Any]:
+        """
+        Chạy `fn` đúng một lần cho mỗi `key` trong khoảng TTL.
+        `aliases`: key của các tin đã gộp vào cùng turn (chỉ lưu in-memory).
+        """
+        claim = await self.claim(key, aliases)
+        if not claim.owner:
+            return duplicate_result(claim.result)
+        try:
+            result = await fn()
+        except BaseException as e:
+            await claim.fail(e)
+            raise
+        await claim.complete(result)
+        return result
+
+    async def claim(self, key: str, aliases: Sequence[str] = ()) -> "DedupeClaim":
+        """
+        Giữ `key` cho lần xử lý đầu tiên (dùng khi kết quả không đến từ một coroutine,
+        vd: turn stream). `claim.owner` → caller phải gọi complete() hoặc fail();
+        ngược lại `claim.result` là kết quả của lần xử lý trước.
+        """
+        self._purge()
+        self._lookups += 1
+
+        entry = self._entries.get(key)
+        if entry:
+            future = entry[1]
+            if future.done():
+                self._memory_hits += 1
+                log.info("dedupe_hit", key=key, source="memory")
+                return DedupeClaim(self, key, aliases, future, owner=False, result=future.result())
+            self._in_flight_joins += 1
+            log.info("dedupe_hit", key=key, source="in_flight")
+            result = await asyncio.shield(future)
+            return DedupeClaim(self, key, aliases, future, owner=False, result=result)
+
+        future = asyncio.get_running_loop().create_future()
+        created_at = time.monotonic()
+        for k in (key, *aliases):
+            self._entries[k] = (created_at, future)
+
+        if self._persist:
+            claimed, cached = await self._claim_persisted(key)
+            if not claimed:
+                self._persisted_hits += 1
+                log.info("dedupe_hit", key=key, source="persisted")
+                future.set_result(cached)
+                return DedupeClaim(self, key, aliases, future, owner=False, result=cached)
+        return DedupeClaim(self, key, aliases, future, owner=True)
+
+    async def _complete(self, claim: "DedupeClaim", result: Dict[str, Any]) -> None:
+        if not claim.future.done():
+            claim.future.set_result(result)
+        if self._persist:
+            await self._store_persisted(claim.key, result)
+
+    async def _fail(self, claim: "DedupeClaim", error: BaseException) -> None:
+        # Xóa key để lần gửi lại được xử lý bình thường
+        for k in (claim.key, *claim.aliases):
+            if self._entries.get(k, (0.0, None))[1] is claim.future:
+                self._entries.pop(k, None)
+        if self._persist:
+            await self._release_persisted(claim.key)
+        if not claim.future.done():
+            if isinstance(error, Exception):
+                claim.future.set_exception(error)
+                # Tránh warning "exception was never retrieved" khi không ai join
+                claim.future.exception()
+            else:
+                # CancelledError / GeneratorExit (client ngắt stream)
+                claim.future.cancel()
+
+    def seen(self, key: str) -> bool:
+        """Key đã/đang được xử lý trong khoảng TTL (chỉ kiểm tra in-memory)"""
+        self._purge()
+        return key in self._entries
+
+    # ========================================
+    # PERSISTENCE (tùy chọn)
+    # ========================================
+
+    async def _claim_persisted(self, key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Insert key; unique violation → đã có process khác xử lý"""
+        supabase = get_async_supabase_client()
+        try:
+            await supabase.from_(PROCESSED_MESSAGES_TABLE) \
+                .insert({"idempotency_key": key}) \
+                .execute()
+            return True, None
+        except APIError as e:
+            if e.code != "23505":
+                log.warning("dedupe_persist_claim_failed", key=key, error=str(e))
+                return True, None
+        try:
+            resp = await supabase.from_(PROCESSED_MESSAGES_TABLE) \
+                .select("result") \
+                .eq("idempotency_key", key) \
+                .limit(1) \
+                .execute()
+            return False, (resp.data[0].get("result") if resp.data else None)
+        except Exception as e:
+            log.warning("dedupe_persist_lookup_failed", key=key, error=str(e))
+            return False, None
+
+    async def _store_persisted(self, key: str, result: Dict[str, Any]) -> None:
+        try:
+            await get_async_supabase_client().from_(PROCESSED_MESSAGES_TABLE) \
+                .update({"result": result}) \
+                .eq("idempotency_key", key) \
+                .execute()
+        except Exception as e:
+            log.warning("dedupe_persist_store_failed", key=key, error=str(e))
+
+    async def _release_persisted(self, key: str) -> None:
+        try:
+            await get_async_supabase_client().from_(PROCESSED_MESSAGES_TABLE) \
+                .delete() \
+                .eq("idempotency_key", key) \
+                .execute()
+        except Exception as e:
+            log.warning("dedupe_persist_release_failed", key=key, error=str(e))
+
+    # ========================================
+    # METRICS
+    # ========================================
+
+    def stats(self) -> DedupeStats:
+        hits = self._memory_hits + self._persisted_hits + self._in_flight_joins
+        return {
+            "keys": len(self._entries),
+            "lookups": self._lookups,
+            "hits": hits,
+            "memory_hits": self._memory_hits,
+            "persisted_hits": self._persisted_hits,
+            "in_flight_joins": self._in_flight_joins,
+            "hit_rate": round(hits / self._lookups, 4) if self._lookups else 0.0,
+        }
+
+
+def build_idempotency_key(body: Dict[str, Any]) -> Optional[str]:
+    """
+    Facebook `mid` là duy nhất toàn cục; client message id của website
+    chỉ duy nhất trong phạm vi một conversation/phone/session.
+    """
+    message_id = body.get("message_id")
+    if not message_id:
+        return None
+    platform = body.get("platform")
+    if platform == "facebook":
+        return f"facebook:{message_id}"
+    scope = body.get("conversation_id") or body.get("customer_phone") or body.get("session_id") or ""
+    return f"{platform}:{scope}:{message_id}"
+
+
+message_dedupe = IdempotencyIndex(
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    max_keys=settings.IDEMPOTENCY_MAX_KEYS,
+    persist=settings.IDEMPOTENCY_PERSIST,
+)
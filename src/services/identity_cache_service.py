@@ -0,0 +1,110 @@
+# ============================================
+# services/identity_cache_service.py
+# Cache LRU + TTL cho ánh xạ định danh (không đổi khi khách đang hoạt động):
+#   (platform, fb_id / phone / user_id / session_id) → conversation_id
+#   conversation_id → customer profile_id
+# - Bỏ RPC get_or_create_conversation mỗi turn và get_or_create_customer_profile
+#   ở memory path
+# - Chỉ cache kết quả thành công (id khác rỗng) của RPC get-or-create
+# - Single-flight: nhiều turn cùng miss một key → chung MỘT lần RPC
+# - forget_conversation(): conversation bị xóa / FK lỗi → bỏ ánh xạ
+# ============================================
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from ..utils.lru_ttl import LruTtlCache
+from ..utils.structured_logger import get_logger
+
+log = get_logger("identity_cache")
+
+# (platform, customer_fb_id, customer_phone, user_id, session_id)
+IdentityKey = Tuple[Optional[str], ...]
+
+
+class IdentityCacheStats(TypedDict):
+    conversations: int
+    profiles: int
+    conversation_hits: int
+    conversation_misses: int
+    profile_hits: int
+    profile_misses: int
+    single_flight_joins: int
+    rpc_saved: int
+
+
+class IdentityCache:
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self._conversations: LruTtlCache[IdentityKey, str] = LruTtlCache(ttl_seconds, max_keys)
+        self._profiles: LruTtlCache[str, str] = LruTtlCache(ttl_seconds, max_keys)
+        # conversation_id → identity key (để forget_conversation không phải quét)
+        self._identity_of: "OrderedDict[str, IdentityKey]" = OrderedDict()
+        self._max_keys = max_keys
+
+    @staticmethod
+    def identity_key(body: Dict[str, Any]) -> Optional[IdentityKey]:
+        """None nếu không có định danh (khách ẩn danh → không cache)"""
+        key = (
+            body.get("platform"),
+            body.get("customer_fb_id"),
+            body.get("customer_phone"),
+            body.get("user_id"),
+            body.get("session_id"),
+        )
+        return key if any(key[1:]) else None
+
+    async def resolve_conversation(
+        self,
+        key: Optional[IdentityKey],
+        loader: Callable[[], Awaitable[Optional[str]]],
+    ) -> Optional[str]:
+        if key is None or settings.IDENTITY_CACHE_TTL_SECONDS <= 0:
+            return await loader()
+        conversation_id = await self._conversations.get_or_load(key, loader)
+        if conversation_id:
+            self._identity_of[conversation_id] = key
+            self._identity_of.move_to_end(conversation_id)
+            while len(self._identity_of) > self._max_keys:
+                self._identity_of.popitem(last=False)
+        return conversation_id
+
+    async def resolve_profile(
+        self,
+        conversation_id: str,
+        loader: Callable[[], Awaitable[Optional[str]]],
+    ) -> Optional[str]:
+        if settings.IDENTITY_CACHE_TTL_SECONDS <= 0:
+            return await loader()
+        return await self._profiles.get_or_load(conversation_id, loader)
+
+    def remember_profile(self, conversation_id: str, profile_id: Optional[str]) -> None:
+        """Profile đọc được ở chỗ khác (vd: load_customer_memory) → điền sẵn cache"""
+        if conversation_id and profile_id and settings.IDENTITY_CACHE_TTL_SECONDS > 0:
+            self._profiles.put(conversation_id, str(profile_id))
+
+    def forget_conversation(self, conversation_id: str) -> None:
+        key = self._identity_of.pop(conversation_id, None)
+        if key is not None:
+            self._conversations.pop(key)
+        self._profiles.pop(conversation_id)
+        log.info("identity_forgotten", conversation_id=conversation_id)
+
+    def stats(self) -> IdentityCacheStats:
+        conversations, profiles = self._conversations, self._profiles
+        return {
+            "conversations": len(conversations),
+            "profiles": len(profiles),
+            "conversation_hits": conversations.hits,
+            "conversation_misses": conversations.misses,
+            "profile_hits": profiles.hits,
+            "profile_misses": profiles.misses,
+            "single_flight_joins": conversations.joins + profiles.joins,
+            "rpc_saved": conversations.hits + profiles.hits + conversations.joins + profiles.joins,
+        }
+
+
+identity_cache = IdentityCache(
+    ttl_seconds=settings.IDENTITY_CACHE_TTL_SECONDS,
+    max_keys=settings.IDENTITY_CACHE_MAX_KEYS,
+)
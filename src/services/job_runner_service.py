@@ -0,0 +1,248 @@
+# ============================================
+# services/job_runner_service.py
+# Background job runner thay cho asyncio.create_task "bắn rồi quên":
+# - Hàng đợi có priority + giới hạn, N worker (bounded concurrency)
+# - Nhường live turn: khi agent đang đầy slot / có turn chờ admission,
+#   job được hoãn (tối đa JOB_MAX_DEFER_SECONDS)
+# - Retry với exponential backoff + jitter
+# - Drain khi shutdown (SIGTERM → uvicorn shutdown event → drain())
+# - Stats cho /metrics: queue depth, in-flight, retry, lỗi
+#
+# Dùng:
+#   job_runner.submit("extract_memory", lambda: extract_and_save_memory(...), priority=JOB_PRIORITY_NORMAL)
+# (truyền FACTORY trả về coroutine để có thể retry)
+# ============================================
+
+import asyncio
+import contextvars
+import itertools
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from .admission_service import agent_admission
+from .metrics_service import BACKGROUND_TASKS
+from .tracing_service import start_span
+from ..utils.structured_logger import get_logger
+
+log = get_logger("job_runner")
+
+# Priority: số nhỏ hơn = chạy trước
+JOB_PRIORITY_HIGH = 0      # Ảnh hưởng turn kế tiếp (vd: địa chỉ vừa nhắn)
+JOB_PRIORITY_NORMAL = 1    # Memory, summary
+JOB_PRIORITY_LOW = 2       # Embedding
+
+JobFactory = Callable[[], Awaitable[Any]]
+
+
+class Job:
+    __slots__ = ("name", "factory", "priority", "attempt", "context", "submitted_at")
+
+    def __init__(self, name: str, factory: JobFactory, priority: int, context: contextvars.Context):
+        self.name = name
+        self.factory = factory
+        self.priority = priority
+        self.attempt = 0
+        # Giữ contextvars lúc submit (trace id của turn)
+        self.context = context
+        self.submitted_at = time.monotonic()
+
+
+class JobRunnerStats(TypedDict):
+    workers: int
+    queued: int
+    in_flight: int
+    scheduled_retries: int
+    submitted: int
+    succeeded: int
+    failed: int
+    retried: int
+    dropped: int
+    deferred: int
+    queue_wait_ms_avg: float
+    draining: bool
+
+
+class JobRunner:
+    def __init__(
+        self,
+        workers: int,
+        max_queue: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        max_defer: float,
+        name: str = "background",
+    ):
+        self._workers = workers
+        self._max_queue = max_queue
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_defer = max_defer
+        self._name = name
+
+        self._queue: Optional["asyncio.PriorityQueue[Tuple[int, int, Job]]"] = None
+        self._tasks: List[asyncio.Task] = []
+        # key → (timer, job) của các job đang chờ backoff để retry
+        self._retry_handles: Dict[int, Tuple[asyncio.TimerHandle, Job]] = {}
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._draining = False
+
+        # Metrics
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+        self._retried = 0
+        self._dropped = 0
+        self._deferred = 0
+        self._wait_total = 0.0
+        self._started_jobs = 0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._draining = False
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self._name}-job-worker-{i}")
+            for i in range(self._workers)
+        ]
+        log.info("job_runner_started", runner=self._name, workers=self._workers, max_queue=self._max_queue)
+
+    def submit(self, name: str, factory: JobFactory, priority: int = JOB_PRIORITY_NORMAL) -> bool:
+        """Đưa job vào hàng đợi. False nếu bị bỏ (hàng đợi đầy / đang shutdown)."""
+        if self._queue is None and not self._draining:
+            # Chưa start (vd: chạy script ngoài FastAPI) → start lazily trong loop hiện tại
+            self.start()
+        if self._draining or self._queue.qsize() >= self._max_queue:
+            self._dropped += 1
+            BACKGROUND_TASKS.inc(name, "dropped")
+            log.warning("job_dropped", job=name, queued=self.stats()["queued"], draining=self._draining)
+            return False
+        self._submitted += 1
+        self._put(Job(name, factory, priority, contextvars.copy_context()))
+        return True
+
+    def _put(self, job: Job) -> None:
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._yield_to_live_turns()
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _yield_to_live_turns(self) -> None:
+        """LLM slot đang đầy / có turn chờ → hoãn job (không tranh DB + event loop với khách)"""
+        if self._draining:
+            return
+        deadline = time.monotonic() + self._max_defer
+        deferred = False
+        while time.monotonic() < deadline:
+            stats = agent_admission.stats()
+            if stats["queued"] == 0 and stats["in_flight"] < stats["max_concurrent"]:
+                break
+            deferred = True
+            await asyncio.sleep(0.05)
+        if deferred:
+            self._deferred += 1
+
+    async def _run(self, job: Job) -> None:
+        job.attempt += 1
+        if job.attempt == 1:
+            self._started_jobs += 1
+            self._wait_total += time.monotonic() - job.submitted_at
+            BACKGROUND_TASKS.inc(job.name, "started")
+        self._in_flight += 1
+        try:
+            # Chạy trong context lúc submit → span con của trace của turn
+            await asyncio.create_task(self._execute(job), context=job.context)
+        except Exception as e:
+            if job.attempt <= self._max_retries:
+                self._schedule_retry(job, e)
+            else:
+                self._failed += 1
+                BACKGROUND_TASKS.inc(job.name, "failed")
+                log.error("job_failed", job=job.name, attempts=job.attempt, error=str(e))
+            return
+        finally:
+            self._in_flight -= 1
+        self._succeeded += 1
+        BACKGROUND_TASKS.inc(job.name, "succeeded")
+
+    async def _execute(self, job: Job) -> Any:
+        with start_span(f"background.{job.name}", {"job.attempt": job.attempt}):
+            return await job.factory()
+
+    def _schedule_retry(self, job: Job, error: Exception) -> None:
+        delay = min(self._backoff_max, self._backoff_base * (2 ** (job.attempt - 1)))
+        delay *= random.uniform(0.5, 1.0)
+        self._retried += 1
+        BACKGROUND_TASKS.inc(job.name, "retried")
+        log.warning("job_retry", job=job.name, attempt=job.attempt, delay_s=round(delay, 2), error=str(error))
+        if self._draining:
+            # Đang drain: queue.join() không chờ timer → retry ngay (vẫn trong drain timeout)
+            self._put(job)
+            return
+        key = next(self._seq)
+
+        def requeue() -> None:
+            self._retry_handles.pop(key, None)
+            self._put(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retry_handles[key] = (handle, job)
+
+    async def drain(self, timeout: float) -> None:
+        """Ngừng nhận job mới, chạy nốt job trong hàng đợi (tối đa `timeout` giây), rồi dừng worker"""
+        if not self._tasks:
+            return
+        self._draining = True
+        # Retry đang chờ backoff → đưa vào hàng đợi ngay
+        for handle, job in self._retry_handles.values():
+            handle.cancel()
+            self._put(job)
+        self._retry_handles.clear()
+        pending = self._queue.qsize() + self._in_flight
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            log.info("job_runner_drained", runner=self._name, jobs=pending)
+        except asyncio.TimeoutError:
+            log.warning("job_runner_drain_timeout", runner=self._name, remaining=self._queue.qsize() + self._in_flight)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def stats(self) -> JobRunnerStats:
+        return {
+            "workers": self._workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self._in_flight,
+            "scheduled_retries": len(self._retry_handles),
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "retried": self._retried,
+            "dropped": self._dropped,
+            "deferred": self._deferred,
+            "queue_wait_ms_avg": round(self._wait_total / self._started_jobs * 1000, 2) if self._started_jobs else 0.0,
+            "draining": self._draining,
+        }
+
+
+job_runner = JobRunner(
+    workers=settings.JOB_WORKERS,
+    max_queue=settings.JOB_QUEUE_MAX_SIZE,
+    max_retries=settings.JOB_MAX_RETRIES,
+    backoff_base=settings.JOB_RETRY_BACKOFF_SECONDS,
+    backoff_max=settings.JOB_RETRY_BACKOFF_MAX_SECONDS,
+    max_defer=settings.JOB_MAX_DEFER_SECONDS,
+)
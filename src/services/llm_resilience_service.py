@@ -0,0 +1,262 @@
+# ============================================
+# services/llm_resilience_service.py
+# Bọc mọi lần chạy agent (Runner.run / run_streamed):
+# - Deadline LLM_RUN_TIMEOUT_SECONDS → không giữ request / worker webhook vô hạn
+# - Hedge: chưa xong sau max(p95 gần đây, LLM_HEDGE_MIN_DELAY_SECONDS) → gửi request
+#   thứ hai, lấy kết quả về trước, hủy cái còn lại. An toàn vì tool của agent
+#   không ghi DB (message_handler mới thực thi functionCalls của run thắng)
+# - Circuit breaker: LLM_BREAKER_FAILURES lỗi / timeout liên tiếp → OPEN, trả
+#   fallback ngay trong LLM_BREAKER_RESET_SECONDS; sau đó HALF_OPEN cho MỘT
+#   request thử: thành công → CLOSED, lỗi → OPEN lại
+# ============================================
+
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypedDict, TypeVar
+
+from ..config.env import settings
+from ..utils.structured_logger import get_logger
+from .metrics_service import LLM_BREAKER_TRANSITIONS, LLM_RESILIENCE_EVENTS
+
+log = get_logger("llm_resilience")
+
+T = TypeVar("T")
+
+STATE_CLOSED = "closed"
+STATE_HALF_OPEN = "half_open"
+STATE_OPEN = "open"
+# Gauge: 0 = closed, 1 = half_open, 2 = open
+_STATE_CODES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+# Số duration gần nhất (mỗi loại call) để tính p95
+_LATENCY_WINDOW = 200
+
+
+class LlmCircuitOpenError(Exception):
+    """Provider đang lỗi (breaker OPEN) → caller trả fallback ngay, không gọi LLM"""
+
+
+class LlmResilienceStats(TypedDict):
+    state: str
+    state_code: int
+    consecutive_failures: int
+    open_for_s: float
+    calls: int
+    failures: int
+    timeouts: int
+    short_circuits: int
+    hedges: int
+    hedges_won: int
+    p95_ms: Dict[str, float]
+
+
+class LlmResilience:
+    def __init__(
+        self,
+        timeout: float,
+        hedge_enabled: bool,
+        hedge_min_delay: float,
+        hedge_min_samples: int,
+        failure_threshold: int,
+        reset_seconds: float,
+    ):
+        self._timeout = timeout
+        self._hedge_enabled = hedge_enabled
+        self._hedge_min_delay = hedge_min_delay
+        self._hedge_min_samples = hedge_min_samples
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+        self._durations: Dict[str, Deque[float]] = {}
+
+        # Metrics
+        self._calls = 0
+        self._failures = 0
+        self._timeouts = 0
+        self._short_circuits = 0
+        self._hedges = 0
+        self._hedges_won = 0
+
+    # ============================================
+    # CIRCUIT BREAKER
+    # ============================================
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        log.warning("llm_breaker_transition", previous=self._state, state=state, failures=self._consecutive_failures)
+        self._state = state
+        LLM_BREAKER_TRANSITIONS.inc(state)
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+
+    def _acquire(self, kind: str) -> bool:
+        """Được phép gọi LLM? (True kèm cờ probe khi HALF_OPEN)"""
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self._reset_seconds:
+            self._transition(STATE_HALF_OPEN)
+        if self._state == STATE_OPEN or (self._state == STATE_HALF_OPEN and self._probe_in_flight):
+            self._short_circuits += 1
+            LLM_RESILIENCE_EVENTS.inc(kind, "short_circuit")
+            raise LlmCircuitOpenError(f"LLM circuit {self._state}")
+        probe = self._state == STATE_HALF_OPEN
+        if probe:
+            self._probe_in_flight = True
+        return probe
+
+    def _on_success(self, kind: str, duration: float, probe: bool) -> None:
+        self._calls += 1
+        self._consecutive_failures = 0
+        if probe:
+            self._probe_in_flight = False
+        self._transition(STATE_CLOSED)
+        self._durations.setdefault(kind, deque(maxlen=_LATENCY_WINDOW)).append(duration)
+
+    def _on_failure(self, kind: str, event: str, probe: bool) -> None:
+        self._calls += 1
+        self._failures += 1
+        self._consecutive_failures += 1
+        LLM_RESILIENCE_EVENTS.inc(kind, event)
+        if probe:
+            self._probe_in_flight = False
+            self._transition(STATE_OPEN)
+        elif self._consecutive_failures >= self._failure_threshold:
+            self._transition(STATE_OPEN)
+
+    # ============================================
+    # HEDGING
+    # ============================================
+
+    def p95(self, kind: str) -> Optional[float]:
+        durations = self._durations.get(kind)
+        if not durations or len(durations) < self._hedge_min_samples:
+            return None
+        ordered = sorted(durations)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _hedge_delay(self, kind: str, probe: bool) -> Optional[float]:
+        if not self._hedge_enabled or probe:
+            return None
+        p95 = self.p95(kind)
+        return None if p95 is None else max(p95, self._hedge_min_delay)
+
+    async def _hedged(self, kind: str, factory: Callable[[], Awaitable[T]], delay: Optional[float]) -> T:
+        tasks = {asyncio.ensure_future(factory())}
+        primary = next(iter(tasks))
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self._hedges += 1
+                    LLM_RESILIENCE_EVENTS.inc(kind, "hedge")
+                    log.info("llm_hedge_started", kind=kind, delay_s=round(delay, 3))
+                    tasks.add(asyncio.ensure_future(factory()))
+            last_error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._hedges_won += 1
+                            LLM_RESILIENCE_EVENTS.inc(kind, "hedge_won")
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            # Deadline / request kia đã thắng → hủy request còn chạy
+            for task in tasks:
+                task.cancel()
+
+    # ============================================
+    # PUBLIC
+    # ============================================
+
+    async def run(self, kind: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Chạy `factory()` (một lần Runner.run) với deadline + hedge + breaker.
+        Raises: LlmCircuitOpenError (breaker OPEN), TimeoutError (quá deadline), lỗi của LLM
+        """
+        probe = self._acquire(kind)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._hedged(kind, factory, self._hedge_delay(kind, probe)), self._timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            self._on_failure(kind, "timeout", probe)
+            log.error("llm_run_timeout", kind=kind, timeout_s=self._timeout)
+            raise
+        except asyncio.CancelledError:
+            if probe:
+                self._probe_in_flight = False
+            raise
+        except Exception:
+            self._on_failure(kind, "error", probe)
+            raise
+        self._on_success(kind, time.perf_counter() - started, probe)
+        return result
+
+    async def stream(self, kind: str, events: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        Stream event với deadline cho cả stream + breaker (không hedge: token đã gửi cho client).
+        Breaker được kiểm tra ở lần lấy event đầu tiên.
+        """
+        probe = self._acquire(kind)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        deadline = loop.time() + self._timeout
+        iterator = events.__aiter__()
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    event = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                yield event
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            self._on_failure(kind, "timeout", probe)
+            log.error("llm_run_timeout", kind=kind, timeout_s=self._timeout, streamed=True)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            if probe:
+                self._probe_in_flight = False
+            raise
+        except Exception:
+            self._on_failure(kind, "error", probe)
+            raise
+        self._on_success(kind, time.perf_counter() - started, probe)
+
+    def stats(self) -> LlmResilienceStats:
+        open_for = 0.0
+        if self._state == STATE_OPEN:
+            open_for = max(self._reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+        return {
+            "state": self._state,
+            "state_code": _STATE_CODES[self._state],
+            "consecutive_failures": self._consecutive_failures,
+            "open_for_s": round(open_for, 1),
+            "calls": self._calls,
+            "failures": self._failures,
+            "timeouts": self._timeouts,
+            "short_circuits": self._short_circuits,
+            "hedges": self._hedges,
+            "hedges_won": self._hedges_won,
+            "p95_ms": {kind: round(p95 * 1000, 1) for kind in self._durations if (p95 := self.p95(kind)) is not None},
+        }
+
+
+llm_resilience = LlmResilience(
+    timeout=settings.LLM_RUN_TIMEOUT_SECONDS,
+    hedge_enabled=settings.LLM_HEDGE_ENABLED,
+    hedge_min_delay=settings.LLM_HEDGE_MIN_DELAY_SECONDS,
+    hedge_min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+    failure_threshold=settings.LLM_BREAKER_FAILURES,
+    reset_seconds=settings.LLM_BREAKER_RESET_SECONDS,
+)
@@ -7,11 +7,18 @@
 import asyncio
 import re
 from typing import List, Dict, Optional, Any, TypedDict
-from supabase import Client
+from supabase import AsyncClient
 from datetime import datetime, timezone, timedelta
 
-# Giả định bạn có hàm create_supabase_client trong connect_supabase.py
-from ..utils.connect_supabase import create_supabase_client
+# Dùng chung Supabase AsyncClient (pooled) trong connect_supabase.py
+from ..utils.connect_supabase import get_async_supabase_client
+# Insert memory fact gom thành bulk insert (write-behind)
+from .write_behind_service import write_behind
+# conversation_id → profile_id không đổi → cache, bỏ RPC mỗi turn
+from .identity_cache_service import identity_cache
+from ..utils.structured_logger import get_logger
+
+log = get_logger("memory_service")
 
 # ============================================
 # ĐỊNH NGHĨA TYPE (TYPESCRIPT INTERFACES)
@@ -57,10 +64,17 @@ class MemoryFact(TypedDict, total=False):
 Get or create customer profile
 """
 async def get_or_create_profile(conversation_id: str) -> Optional[str]:
-    supabase = create_supabase_client()
+    return await identity_cache.resolve_profile(
+        conversation_id,
+        lambda: _get_or_create_profile(conversation_id),
+    )
+
+
+async def _get_or_create_profile(conversation_id: str) -> Optional[str]:
+    supabase = get_async_supabase_client()
 
     try:
-        response = supabase.rpc("get_or_create_customer_profile", {
+        response = await supabase.rpc("get_or_create_customer_profile", {
             "p_conversation_id": conversation_id,
         }).execute()
 
@@ -80,7 +94,7 @@ async def get_or_create_profile(conversation_id: str) -> Optional[str]:
         return None
 
     except Exception as e:
-        print(f"Exception in get_or_create_profile: {e}")
+        log.error("profile_resolve_failed", conversation_id=conversation_id, error=str(e))
         return None
 
 
@@ -93,12 +107,12 @@ async def extract_and_save_memory(
     message_text: str,
     ai_response: AIResponse,
 ) -> None:
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
     # Get profile ID
     profile_id = await get_or_create_profile(conversation_id)
     if not profile_id:
-        print("Failed to get profile ID, skipping memory save.")
+        log.warning("memory_save_skipped", conversation_id=conversation_id, reason="no_profile")
         return
 
     # ⚠️ CHỈ extract preferences và interests
@@ -110,11 +124,11 @@ async def extract_and_save_memory(
 
     # Update engagement
     try:
-        supabase.rpc("update_customer_engagement", {
+        await supabase.rpc("update_customer_engagement", {
             "p_profile_id": profile_id,
         }).execute()
     except Exception as e:
-        print(f"Error updating engagement: {e}")
+        log.error("engagement_update_failed", conversation_id=conversation_id, error=str(e))
 
 """
 ❌ REMOVED: extractPersonalInfo
@@ -127,7 +141,7 @@ Extract preferences (style, color, price)
 CHỈ lưu vào customer_profiles.style_preference, color_preference (jsonb)
 """
 async def extract_preferences(
-    supabase: Client,
+    supabase: AsyncClient,
     profile_id: str,
     text: str,
 ) -> None:
@@ -136,14 +150,14 @@ async def extract_preferences(
 
     try:
         # Get current profile
-        profile_resp = supabase.from_("customer_profiles") \
+        profile_resp = await supabase.from_("customer_profiles") \
             .select("style_preference, color_preference, material_preference") \
             .eq("id", profile_id) \
             .single() \
             .execute()
 
         if not profile_resp.data:
-            print(f"Failed to get profile for preferences: {profile_resp}")
+            log.warning("preferences_profile_missing", profile_id=profile_id)
             return
 
         profile = profile_resp.data
@@ -187,27 +201,27 @@ async def extract_preferences(
 
         # Update if found anything
         if updates:
-            print(f"✅ Extracted preferences: {updates}")
-            supabase.from_("customer_profiles") \
+            log.info("preferences_extracted", profile_id=profile_id, fields=sorted(updates))
+            await supabase.from_("customer_profiles") \
                 .update(updates) \
                 .eq("id", profile_id) \
                 .execute()
 
     except Exception as e:
-        print(f"Error extracting preferences: {e}")
+        log.error("preferences_extract_failed", profile_id=profile_id, error=str(e))
 
 """
 Save product interests
 """
 async def extract_interests(
-    supabase: Client,
+    supabase: AsyncClient,
     profile_id: str,
     products: List[AIResponseProduct],
 ) -> None:
     if not products:
         return
 
-    print(f"💡 Saving {len(products)} product interests")
+    log.info("product_interests_saving", profile_id=profile_id, products=len(products))
     
     now_iso = datetime.now(timezone.utc).isoformat()
 
@@ -218,7 +232,7 @@ async def extract_interests(
                 continue
 
             # Check if interest exists
-            existing_resp = supabase.from_("customer_interests") \
+            existing_resp = await supabase.from_("customer_interests") \
                 .select("*") \
                 .eq("customer_profile_id", profile_id) \
                 .eq("product_id", product_id) \
@@ -226,11 +240,11 @@ async def extract_interests(
                 .maybe_single() \
                 .execute()
             
-            existing = existing_resp.data
+            existing = existing_resp.data if existing_resp else None
 
             if existing:
                 # Increment view count
-                supabase.from_("customer_interests") \
+                await supabase.from_("customer_interests") \
                     .update({
                         "view_count": existing.get("view_count", 0) + 1,
                         "last_viewed_at": now_iso,
@@ -239,7 +253,7 @@ async def extract_interests(
                     .execute()
             else:
                 # Create new interest
-                supabase.from_("customer_interests") \
+                await supabase.from_("customer_interests") \
                     .insert({
                         "customer_profile_id": profile_id,
                         "product_id": product_id,
@@ -249,7 +263,7 @@ async def extract_interests(
                     }) \
                     .execute()
         except Exception as e:
-            print(f"Error saving interest for product {product.get('id')}: {e}")
+            log.error("product_interest_save_failed", profile_id=profile_id, product_id=product.get("id"), error=str(e))
 
 
 """
@@ -261,7 +275,6 @@ async def extract_memory_facts(
     message_text: str,
     conversation_id: str,
 ) -> None:
-    supabase = create_supabase_client()
     text_lower = message_text.lower()
     facts: List[MemoryFact] = []
 
@@ -415,39 +428,62 @@ async def extract_memory_facts(
         # ========================================
         
         if facts:
-            print(f"✅ Saving {len(facts)} memory facts (insights only)")
+            log.info("memory_facts_saving", conversation_id=conversation_id, facts=len(facts))
 
-            # Deactivate duplicate facts
+            # Deactivate fact trùng + insert: chạy lúc flush (_deactivate_duplicate_facts)
             for fact in facts:
-                supabase.from_("customer_memory_facts") \
-                    .update({"is_active": False}) \
-                    .eq("customer_profile_id", profile_id) \
-                    .eq("fact_type", fact["fact_type"]) \
-                    .eq("fact_text", fact["fact_text"]) \
-                    .execute()
-            
-            # Insert new facts
-            supabase.from_("customer_memory_facts").insert(facts).execute()
+                write_behind.add("customer_memory_facts", fact)
 
     except Exception as e:
-        print(f"Error extracting memory facts: {e}")
+        log.error("memory_facts_extract_failed", conversation_id=conversation_id, error=str(e))
+
+"""
+Trước bulk insert customer_memory_facts (write-behind flush):
+bỏ fact trùng trong batch, deactivate fact cũ cùng (profile, type, text)
+→ một UPDATE cho mỗi (profile, fact_type) thay vì mỗi fact
+"""
+async def _deactivate_duplicate_facts(
+    supabase: AsyncClient,
+    facts: List[MemoryFact],
+) -> List[MemoryFact]:
+    unique: Dict[tuple, MemoryFact] = {}
+    for fact in facts:
+        unique[(fact["customer_profile_id"], fact["fact_type"], fact["fact_text"])] = fact
+
+    texts_by_type: Dict[tuple, List[str]] = {}
+    for profile_id, fact_type, fact_text in unique:
+        texts_by_type.setdefault((profile_id, fact_type), []).append(fact_text)
+
+    await asyncio.gather(*(
+        supabase.from_("customer_memory_facts")
+            .update({"is_active": False})
+            .eq("customer_profile_id", profile_id)
+            .eq("fact_type", fact_type)
+            .in_("fact_text", texts)
+            .execute()
+        for (profile_id, fact_type), texts in texts_by_type.items()
+    ))
+    return list(unique.values())
+
+
+write_behind.register_before_flush("customer_memory_facts", _deactivate_duplicate_facts)
 
 """
 Create conversation summary
 """
 async def create_conversation_summary(conversation_id: str) -> None:
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
         # Get all messages
-        messages_resp = supabase.from_("chatbot_messages") \
+        messages_resp = await supabase.from_("chatbot_messages") \
             .select("content, sender_type, created_at") \
             .eq("conversation_id", conversation_id) \
             .order("created_at", ascending=True) \
             .execute()
 
         if  not messages_resp.data or len(messages_resp.data) < 5:
-            print("Not enough messages to summarize.")
+            log.debug("summary_skipped", conversation_id=conversation_id, reason="not_enough_messages")
             return
 
         messages: List[Message] = messages_resp.data
@@ -512,7 +548,7 @@ async def create_conversation_summary(conversation_id: str) -> None:
         summary = f"Khách đã trao đổi {len(messages)} tin nhắn. {', '.join(key_points)}."
 
         # Save summary
-        supabase.from_("conversation_summaries").insert({
+        await supabase.from_("conversation_summaries").insert({
             "conversation_id": conversation_id,
             "summary_text": summary,
             "key_points": key_points,
@@ -525,33 +561,34 @@ async def create_conversation_summary(conversation_id: str) -> None:
             "outcome": outcome,
         }).execute()
 
-        print("✅ Conversation summary created")
+        log.info("conversation_summary_created", conversation_id=conversation_id)
 
     except Exception as e:
-        print(f"Error creating summary: {e}")
+        log.error("conversation_summary_failed", conversation_id=conversation_id, error=str(e))
 
 """
 Load customer memory for context
 """
 async def load_customer_memory(conversation_id: str) -> Optional[Dict[str, Any]]:
-    supabase = create_supabase_client()
+    supabase = get_async_supabase_client()
 
     try:
         # Get profile
-        profile_resp = supabase.from_("customer_profiles") \
+        profile_resp = await supabase.from_("customer_profiles") \
             .select("*") \
             .eq("conversation_id", conversation_id) \
             .maybe_single() \
             .execute()
 
-        if not profile_resp.data:
-            print("No profile found for memory load.")
+        if not profile_resp or not profile_resp.data:
+            log.debug("memory_load_skipped", conversation_id=conversation_id, reason="no_profile")
             return None
         
         profile = profile_resp.data
+        identity_cache.remember_profile(conversation_id, profile.get("id"))
 
         # Get interests
-        interests_resp = supabase.from_("customer_interests") \
+        interests_resp = await supabase.from_("customer_interests") \
             .select("""
                 product_id,
                 interest_type,
@@ -565,7 +602,7 @@ async def load_customer_memory(conversation_id: str) -> Optional[Dict[str, Any]]
             .execute()
 
         # Get memory facts (CHỈ insights, không có structured data)
-        facts_resp = supabase.from_("customer_memory_facts") \
+        facts_resp = await supabase.from_("customer_memory_facts") \
             .select("fact_text, fact_type, importance_score") \
             .eq("customer_profile_id", profile["id"]) \
             .eq("is_active", True) \
@@ -574,7 +611,7 @@ async def load_customer_memory(conversation_id: str) -> Optional[Dict[str, Any]]
             .execute()
 
         # Get summary
-        summary_resp = supabase.from_("conversation_summaries") \
+        summary_resp = await supabase.from_("conversation_summaries") \
             .select("summary_text, key_points, customer_intent, sentiment") \
             .eq("conversation_id", conversation_id) \
             .order("summary_created_at", ascending=False) \
@@ -586,9 +623,9 @@ async def load_customer_memory(conversation_id: str) -> Optional[Dict[str, Any]]
             "profile": profile,
             "interests": interests_resp.data or [],
             "facts": facts_resp.data or [],
-            "summary": summary_resp.data or None,
+            "summary": (summary_resp.data if summary_resp else None) or None,
         }
 
     except Exception as e:
-        print(f"Error loading customer memory: {e}")
+        log.error("customer_memory_load_failed", conversation_id=conversation_id, error=str(e))
         return None
@@ -0,0 +1,299 @@
+# ============================================
+# services/metrics_service.py
+# Metrics dạng Prometheus (text exposition format 0.0.4) cho GET /metrics
+# - Histogram latency theo từng stage của handle_message
+# - Counter: LLM calls, tool calls, DB round trips, background tasks, lỗi theo stage
+# - Collector: export các stats() sẵn có (queue, admission, rate limit...) thành gauge
+#
+# Không phụ thuộc prometheus_client: registry nhỏ trong process, đủ cho scrape.
+# ============================================
+
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Sequence, Tuple
+
+from .tracing_service import start_span
+from ..utils.structured_logger import get_logger
+
+log = get_logger("metrics")
+
+# Bucket (giây): DB ~ms, LLM ~giây
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelValues = Tuple[str, ...]
+_INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = tuple(str(label) for label in labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(tuple(str(label) for label in labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._buckets = tuple(sorted(buckets))
+        # labels → (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = tuple(str(label) for label in labels)
+        counts, total, count = self._values.get(key) or ([0] * len(self._buckets), 0.0, 0)
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                counts[i] += 1
+        self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, bucket_count in zip(self._buckets, counts):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, _INF_LABEL)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str):
+        self._namespace = namespace
+        self._metrics: List[Any] = []
+        # name → hàm trả về dict stats (numeric field → gauge)
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(f"{self._namespace}_{name}", documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(f"{self._namespace}_{name}", documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, component: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        """Export các field số của `collect()` thành gauge `<namespace>_<component>_<field>`"""
+        self._collectors[component] = collect
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for component, collect in self._collectors.items():
+            try:
+                stats = collect()
+            except Exception as e:
+                log.warning("metrics_collector_failed", component=component, error=str(e))
+                continue
+            for field, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{self._namespace}_{component}_{field}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# ============================================
+# METRICS CỦA CHATBOT
+# ============================================
+
+registry = MetricsRegistry("bewo")
+
+STAGE_LATENCY = registry.histogram(
+    "stage_duration_seconds",
+    "Latency từng stage của handle_message",
+    ["stage"],
+)
+STAGE_ERRORS = registry.counter(
+    "stage_errors_total",
+    "Số lỗi theo stage",
+    ["stage"],
+)
+TURNS = registry.counter(
+    "turns_total",
+    "Số turn đã xử lý theo platform và kết quả",
+    ["platform", "outcome"],
+)
+LLM_CALLS = registry.counter(
+    "llm_calls_total",
+    "Số lần gọi LLM (Runner.run) theo loại call",
+    ["kind"],
+)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total",
+    "Tổng token LLM theo loại call",
+    ["kind"],
+)
+LLM_INPUT_TOKENS = registry.counter(
+    "llm_input_tokens_total",
+    "Input token LLM theo loại call, tách phần hit prompt cache của provider (cached / uncached)",
+    ["kind", "cache"],
+)
+LLM_MODEL_LATENCY = registry.histogram(
+    "llm_model_request_duration_seconds",
+    "Latency từng request LLM theo model và tier",
+    ["model", "tier"],
+)
+LLM_MODEL_TOKENS = registry.counter(
+    "llm_model_tokens_total",
+    "Token LLM theo model (input / cached_input / output)",
+    ["model", "direction"],
+)
+LLM_MODEL_DOWNGRADES = registry.counter(
+    "llm_model_downgrades_total",
+    "Số lần tier chuyển sang model nhanh vì vượt latency budget",
+    ["tier"],
+)
+LLM_RESILIENCE_EVENTS = registry.counter(
+    "llm_resilience_events_total",
+    "Sự kiện quanh lần chạy agent: timeout / error / hedge / hedge_won / short_circuit",
+    ["kind", "event"],
+)
+LLM_BREAKER_TRANSITIONS = registry.counter(
+    "llm_breaker_transitions_total",
+    "Số lần circuit breaker LLM chuyển trạng thái (closed / half_open / open)",
+    ["state"],
+)
+LLM_ERRORS = registry.counter(
+    "llm_errors_total",
+    "Số lần gọi LLM lỗi (đã fallback) theo loại call",
+    ["kind"],
+)
+INTENT_ROUTES = registry.counter(
+    "intent_routes_total",
+    "Agent bắt đầu turn do intent router chọn (triage = fallback) theo nguồn quyết định",
+    ["agent", "source"],
+)
+INTENT_ROUTE_CHECKS = registry.counter(
+    "intent_route_checks_total",
+    "Kiểm tra route: shadow qua triage (correct / wrong) hoặc specialist phải handoff tiếp (rerouted)",
+    ["result"],
+)
+FAST_PATH_RESULTS = registry.counter(
+    "fast_path_total",
+    "Kết quả fast path không gọi LLM theo intent (miss = chuyển cho agent)",
+    ["intent"],
+)
+ANSWER_CACHE_LOOKUPS = registry.counter(
+    "answer_cache_lookups_total",
+    "Tra cứu answer cache theo kết quả (exact / similar / miss / skip)",
+    ["result"],
+)
+ANSWER_CACHE_TOKENS_SAVED = registry.counter(
+    "answer_cache_tokens_saved_total",
+    "Token LLM tiết kiệm nhờ answer cache (token của lần trả lời gốc)",
+)
+PRODUCT_CACHE_LOOKUPS = registry.counter(
+    "product_cache_lookups_total",
+    "Tra cứu cache kết quả tool sản phẩm theo loại (search / details) và kết quả (hit / miss)",
+    ["kind", "result"],
+)
+FUNCTION_CONTINUATIONS = registry.counter(
+    "function_continuations_total",
+    "Continuation sau function call theo cách tạo response (template / llm)",
+    ["mode"],
+)
+TOOL_CALLS = registry.counter(
+    "tool_calls_total",
+    "Số tool/function call của agent theo tên",
+    ["tool"],
+)
+DB_REQUESTS = registry.counter(
+    "db_requests_total",
+    "Số round trip tới Supabase (PostgREST) theo method và bảng/RPC",
+    ["method", "target"],
+)
+DB_LATENCY = registry.histogram(
+    "db_request_duration_seconds",
+    "Latency round trip tới Supabase",
+    ["method"],
+)
+DB_ERRORS = registry.counter(
+    "db_errors_total",
+    "Số response lỗi (status >= 400) từ Supabase",
+    ["method", "target"],
+)
+CRITICAL_PATH_LATENCY = registry.histogram(
+    "turn_critical_path_seconds",
+    "Latency critical path của một turn (các stage song song chỉ tính nhánh dài nhất)",
+    ["platform"],
+)
+CRITICAL_PATH_STAGES = registry.counter(
+    "critical_path_stage_total",
+    "Số lần mỗi stage nằm trên critical path của turn",
+    ["stage"],
+)
+BACKGROUND_TASKS = registry.counter(
+    "background_tasks_total",
+    "Background job theo tên và trạng thái (started/succeeded/failed/retried/dropped)",
+    ["task", "status"],
+)
+
+
+@asynccontextmanager
+async def observe_stage(stage: str) -> AsyncIterator[None]:
+    """`async with observe_stage("build_context"): ...` → histogram + counter lỗi + span"""
+    started = time.perf_counter()
+    with start_span(stage):
+        try:
+            yield
+        except BaseException:
+            STAGE_ERRORS.inc(stage)
+            raise
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage)
+
@@ -0,0 +1,250 @@
+# ============================================
+# services/product_cache_service.py
+# Cache dùng chung toàn process cho kết quả tool search_products / get_product_details
+# (hàng trăm cuộc trò chuyện cùng tìm "váy linen", cùng xem một product id):
+# - Key: (query đã chuẩn hóa, limit) và product id; TTL + LRU giới hạn số entry;
+#   single-flight: nhiều turn cùng miss → chung MỘT query Supabase
+# - Invalidate: update_product_stock (app tự đổi tồn kho) và watcher poll
+#   fingerprint catalog (sản phẩm đổi từ admin / dashboard) → bỏ cache + answer cache
+# - Pre-warm: đếm độ phổ biến query, lưu ra PRODUCT_CACHE_WARM_PATH khi shutdown;
+#   start() và mỗi lần invalidate nạp lại top PRODUCT_CACHE_WARM_TOP query (job nền LOW)
+# - Kết quả trả ra là bản copy (caller sửa dict không làm bẩn cache)
+# ============================================
+
+import asyncio
+import copy
+import functools
+import hashlib
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.json_fast import dumps, loads
+from ..utils.lru_ttl import LruTtlCache
+from ..utils.structured_logger import get_logger
+from .answer_cache_service import answer_cache
+from .job_runner_service import JOB_PRIORITY_LOW, job_runner
+from .metrics_service import PRODUCT_CACHE_LOOKUPS
+
+log = get_logger("product_cache")
+
+SearchKey = Tuple[str, int]
+SearchLoader = Callable[[str, int], Awaitable[List[Dict[str, Any]]]]
+DetailsLoader = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[\W_]+|[\W_]+$")
+# Giữ top query phổ biến, bỏ đuôi dài để bộ đếm không phình
+_POPULARITY_MAX_KEYS = 5000
+
+
+def normalize_query(query: str) -> str:
+    """ "  Váy  LINEN!! " → "váy linen" (giữ dấu: text_search của Postgres phân biệt)"""
+    text = unicodedata.normalize("NFC", query or "").lower().strip()
+    return _EDGE_PUNCTUATION.sub("", _SPACES.sub(" ", text))
+
+
+class ProductCacheStats(TypedDict):
+    searches: int
+    details: int
+    search_hits: int
+    search_misses: int
+    details_hits: int
+    details_misses: int
+    single_flight_joins: int
+    hit_rate: float
+    invalidations: int
+    warmed_queries: int
+    tracked_queries: int
+
+
+class ProductCache:
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        warm_top: int,
+        warm_path: str = "",
+        watch_interval: float = 0.0,
+    ):
+        self._searches: LruTtlCache[SearchKey, List[Dict[str, Any]]] = LruTtlCache(ttl_seconds, max_entries)
+        self._details: LruTtlCache[str, Dict[str, Any]] = LruTtlCache(ttl_seconds, max_entries)
+        self._enabled = ttl_seconds > 0
+        self._warm_top = warm_top
+        self._warm_path = warm_path
+        self._watch_interval = watch_interval
+        self._popularity: Counter = Counter()
+        self._search_loader: Optional[SearchLoader] = None
+        self._details_loader: Optional[DetailsLoader] = None
+        self._catalog_fingerprint: Optional[str] = None
+        self._watch_task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self._invalidations = 0
+        self._warmed = 0
+
+    def register_loaders(self, search: SearchLoader, details: DetailsLoader) -> None:
+        """Query Supabase thật (agent_service) → dùng cho miss và pre-warm"""
+        self._search_loader = search
+        self._details_loader = details
+
+    # ============================================
+    # LOOKUP
+    # ============================================
+
+    async def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        key = (normalize_query(query), limit)
+        self._track(key)
+        if not self._enabled:
+            return await self._search_loader(query, limit)
+        cached = self._searches.get(key)
+        if cached is not None:
+            self._searches.hits += 1
+            PRODUCT_CACHE_LOOKUPS.inc("search", "hit")
+            return copy.deepcopy(cached)
+        PRODUCT_CACHE_LOOKUPS.inc("search", "miss")
+        products = await self._searches.get_or_load(key, lambda: self._search_loader(query, limit))
+        return copy.deepcopy(products or [])
+
+    async def details(self, product_id: str) -> Optional[Dict[str, Any]]:
+        if not self._enabled:
+            return await self._details_loader(product_id)
+        cached = self._details.get(product_id)
+        if cached is not None:
+            self._details.hits += 1
+            PRODUCT_CACHE_LOOKUPS.inc("details", "hit")
+            return copy.deepcopy(cached)
+        PRODUCT_CACHE_LOOKUPS.inc("details", "miss")
+        product = await self._details.get_or_load(product_id, lambda: self._details_loader(product_id))
+        return copy.deepcopy(product)
+
+    def _track(self, key: SearchKey) -> None:
+        if not key[0]:
+            return
+        self._popularity[key] += 1
+        if len(self._popularity) > _POPULARITY_MAX_KEYS:
+            self._popularity = Counter(dict(self._popularity.most_common(_POPULARITY_MAX_KEYS // 2)))
+
+    # ============================================
+    # INVALIDATION
+    # ============================================
+
+    def invalidate(self, product_id: Optional[str] = None, reason: str = "") -> None:
+        """
+        product_id: bỏ chi tiết sản phẩm đó + mọi kết quả search (có giá / tồn kho);
+        None: bỏ toàn bộ. Sau đó nạp lại query phổ biến ở job nền.
+        """
+        if product_id:
+            dropped = int(self._details.pop(product_id) is not None) + self._searches.clear()
+        else:
+            dropped = self._searches.clear() + self._details.clear()
+        self._invalidations += 1
+        log.info("product_cache_invalidated", reason=reason, product_id=product_id, dropped=dropped)
+        self._schedule_warm()
+
+    async def _watch_catalog(self) -> None:
+        """Sản phẩm đổi ngoài app (admin) → fingerprint (id, tên, giá, tồn kho, active) đổi"""
+        while True:
+            await asyncio.sleep(self._watch_interval)
+            try:
+                resp = await get_async_supabase_client().from_("products") \
+                    .select("id, name, price, stock, is_active") \
+                    .order("id") \
+                    .execute()
+                fingerprint = hashlib.sha1(dumps(resp.data or []).encode("utf-8")).hexdigest()
+            except Exception as e:
+                log.warning("product_catalog_watch_failed", error=str(e))
+                continue
+            if self._catalog_fingerprint is not None and fingerprint != self._catalog_fingerprint:
+                self.invalidate(reason="catalog_changed")
+                answer_cache.invalidate_catalog("catalog_changed")
+            self._catalog_fingerprint = fingerprint
+
+    # ============================================
+    # PRE-WARM
+    # ============================================
+
+    def _schedule_warm(self) -> None:
+        if self._enabled and self._warm_top > 0 and self._popularity and self._search_loader is not None:
+            job_runner.submit("product_cache_warm", self._warm, priority=JOB_PRIORITY_LOW)
+
+    async def _warm(self) -> None:
+        warmed = 0
+        for (query, limit), _ in self._popularity.most_common(self._warm_top):
+            if self._searches.get((query, limit)) is not None:
+                continue
+            await self._searches.get_or_load((query, limit), functools.partial(self._search_loader, query, limit))
+            warmed += 1
+        self._warmed += warmed
+        log.info("product_cache_warmed", queries=warmed)
+
+    def _load_popularity(self) -> None:
+        if not self._warm_path or not os.path.exists(self._warm_path):
+            return
+        try:
+            with open(self._warm_path, "r", encoding="utf-8") as f:
+                entries = loads(f.read())
+            self._popularity.update({(query, int(limit)): count for query, limit, count in entries})
+        except Exception as e:
+            log.warning("product_cache_popularity_load_failed", path=self._warm_path, error=str(e))
+
+    def _save_popularity(self) -> None:
+        if not self._warm_path:
+            return
+        entries = [[query, limit, count] for (query, limit), count in self._popularity.most_common(self._warm_top * 10)]
+        tmp_path = f"{self._warm_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(dumps(entries))
+            os.replace(tmp_path, self._warm_path)
+        except OSError as e:
+            log.warning("product_cache_popularity_save_failed", path=self._warm_path, error=str(e))
+
+    # ============================================
+    # LIFECYCLE
+    # ============================================
+
+    def start(self) -> None:
+        """Startup (sau job_runner.start()): nạp độ phổ biến, pre-warm, bật watcher"""
+        self._load_popularity()
+        self._schedule_warm()
+        if self._enabled and self._watch_interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_catalog(), name="product-catalog-watch")
+
+    async def stop(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+        self._save_popularity()
+
+    def stats(self) -> ProductCacheStats:
+        searches, details = self._searches, self._details
+        hits = searches.hits + details.hits
+        lookups = hits + searches.misses + details.misses + searches.joins + details.joins
+        return {
+            "searches": len(searches),
+            "details": len(details),
+            "search_hits": searches.hits,
+            "search_misses": searches.misses,
+            "details_hits": details.hits,
+            "details_misses": details.misses,
+            "single_flight_joins": searches.joins + details.joins,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self._invalidations,
+            "warmed_queries": self._warmed,
+            "tracked_queries": len(self._popularity),
+        }
+
+
+product_cache = ProductCache(
+    ttl_seconds=settings.PRODUCT_CACHE_TTL_SECONDS,
+    max_entries=settings.PRODUCT_CACHE_MAX_ENTRIES,
+    warm_top=settings.PRODUCT_CACHE_WARM_TOP,
+    warm_path=settings.PRODUCT_CACHE_WARM_PATH,
+    watch_interval=settings.PRODUCT_CACHE_WATCH_SECONDS,
+)
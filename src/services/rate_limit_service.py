@@ -0,0 +1,190 @@
+# ============================================
+# services/rate_limit_service.py
+# Chặn tin nhắn rẻ tiền TRƯỚC mọi thao tác DB / LLM:
+# - Token bucket theo sender (PSID / session / phone), page và IP
+# - Bộ lọc spam/empty local (attachment không có text, flood,
+#   lặp ký tự, nhiều link, từ khóa bị chặn); sticker đi tiếp tới fast path
+# ============================================
+
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+from ..config.env import settings
+from ..utils.structured_logger import get_logger
+
+log = get_logger("rate_limit")
+
+_URL_PATTERN = re.compile(r"(https?://|www\.)\S+", re.IGNORECASE)
+_REPEATED_CHAR_PATTERN = re.compile(r"(.)\1{29,}", re.DOTALL)
+
+
+class LimiterStats(TypedDict):
+    keys: int
+    allowed: int
+    limited: int
+
+
+class InboundFilterStats(TypedDict):
+    enabled: bool
+    allowed: int
+    blocked: int
+    rate_limited: Dict[str, LimiterStats]
+    filtered: Dict[str, int]
+
+
+class TokenBucketLimiter:
+    """Token bucket theo key, giới hạn số key bằng LRU (key cũ nhất bị bỏ)"""
+
+    def __init__(self, rate_per_second: float, burst: float, max_keys: int):
+        self._rate = rate_per_second
+        self._burst = burst
+        self._max_keys = max_keys
+        # key → (tokens, last_refill)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._allowed = 0
+        self._limited = 0
+
+    def _refilled(self, key: str, now: float) -> float:
+        tokens, last = self._buckets.get(key, (self._burst, now))
+        return min(self._burst, tokens + (now - last) * self._rate)
+
+    def has_tokens(self, key: str, cost: float = 1.0) -> bool:
+        """Còn đủ token? (không trừ token; bucket thiếu → tính là limited)"""
+        if self._refilled(key, time.monotonic()) >= cost:
+            return True
+        self._limited += 1
+        return False
+
+    def consume(self, key: str, cost: float = 1.0) -> None:
+        """Trừ token (gọi sau has_tokens() của mọi bucket liên quan)"""
+        now = time.monotonic()
+        tokens = self._refilled(key, now)
+        self._buckets.pop(key, None)
+        self._buckets[key] = (max(0.0, tokens - cost), now)
+        self._allowed += 1
+        if len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+
+    def allow(self, key: str, cost: float = 1.0) -> bool:
+        if not self.has_tokens(key, cost):
+            return False
+        self.consume(key, cost)
+        return True
+
+    def stats(self) -> LimiterStats:
+        return {
+            "keys": len(self._buckets),
+            "allowed": self._allowed,
+            "limited": self._limited,
+        }
+
+
+class InboundFilter:
+    """
+    check() trả về lý do chặn (vd: "rate_limited:sender", "empty", "flood")
+    hoặc None nếu tin được xử lý.
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, TokenBucketLimiter] = {
+            "sender": TokenBucketLimiter(
+                settings.RATE_LIMIT_SENDER_PER_SECOND,
+                settings.RATE_LIMIT_SENDER_BURST,
+                settings.RATE_LIMIT_MAX_KEYS,
+            ),
+            "page": TokenBucketLimiter(
+                settings.RATE_LIMIT_PAGE_PER_SECOND,
+                settings.RATE_LIMIT_PAGE_BURST,
+                settings.RATE_LIMIT_MAX_KEYS,
+            ),
+            "ip": TokenBucketLimiter(
+                settings.RATE_LIMIT_IP_PER_SECOND,
+                settings.RATE_LIMIT_IP_BURST,
+                settings.RATE_LIMIT_MAX_KEYS,
+            ),
+        }
+        self._blocked_keywords: List[str] = [
+            k.strip().lower() for k in settings.SPAM_BLOCKED_KEYWORDS.split(",") if k.strip()
+        ]
+        # sender → (tin cuối đã chuẩn hóa, số lần lặp liên tiếp, lúc nhận tin cuối)
+        self._last_texts: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+
+        self._allowed = 0
+        self._filtered: Dict[str, int] = {}
+
+    def check(
+        self,
+        sender: str,
+        message_text: str,
+        page_id: Optional[str] = None,
+        client_ip: Optional[str] = None,
+    ) -> Optional[str]:
+        if not settings.RATE_LIMIT_ENABLED:
+            return None
+
+        # 1. Spam/empty: không tốn token của sender
+        reason = self._detect_spam(sender, message_text or "")
+
+        # 2. Token bucket: sender → page → IP. Kiểm tra đủ cả ba rồi mới trừ token
+        # → tin bị chặn ở page/IP không làm cạn bucket của sender
+        if reason is None:
+            buckets = [
+                (scope, key) for scope, key in (("sender", sender), ("page", page_id), ("ip", client_ip)) if key
+            ]
+            for scope, key in buckets:
+                if not self._limiters[scope].has_tokens(key):
+                    reason = f"rate_limited:{scope}"
+                    break
+            else:
+                for scope, key in buckets:
+                    self._limiters[scope].consume(key)
+
+        if reason is None:
+            self._allowed += 1
+            return None
+        self._filtered[reason] = self._filtered.get(reason, 0) + 1
+        # sender có thể chứa SĐT (website:customer_phone:...) → logger che khi redact
+        log.info("inbound_blocked", sender=sender, reason=reason, page_id=page_id)
+        return reason
+
+    def _detect_spam(self, sender: str, text: str) -> Optional[str]:
+        stripped = text.strip()
+        if not stripped:
+            return "empty"
+        if len(stripped) > settings.SPAM_MAX_MESSAGE_CHARS:
+            return "too_long"
+        if _REPEATED_CHAR_PATTERN.search(stripped):
+            return "repeated_chars"
+        if len(_URL_PATTERN.findall(stripped)) >= settings.SPAM_MAX_LINKS:
+            return "links"
+        lowered = stripped.lower()
+        if any(keyword in lowered for keyword in self._blocked_keywords):
+            return "blocked_keyword"
+
+        # Cùng một nội dung gửi dồn dập (trong SPAM_REPEAT_WINDOW_SECONDS) → flood;
+        # "ok" / "vâng" lặp lại rải rác trong ngày vẫn là tin bình thường
+        normalized = " ".join(lowered.split())
+        now = time.monotonic()
+        last_text, repeats, last_at = self._last_texts.pop(sender, ("", 0, now))
+        in_window = now - last_at <= settings.SPAM_REPEAT_WINDOW_SECONDS
+        repeats = repeats + 1 if normalized == last_text and in_window else 1
+        self._last_texts[sender] = (normalized, repeats, now)
+        if len(self._last_texts) > settings.RATE_LIMIT_MAX_KEYS:
+            self._last_texts.popitem(last=False)
+        if repeats > settings.SPAM_MAX_REPEATS:
+            return "flood"
+        return None
+
+    def stats(self) -> InboundFilterStats:
+        return {
+            "enabled": settings.RATE_LIMIT_ENABLED,
+            "allowed": self._allowed,
+            "blocked": sum(self._filtered.values()),
+            "rate_limited": {scope: limiter.stats() for scope, limiter in self._limiters.items()},
+            "filtered": dict(self._filtered),
+        }
+
+
+inbound_filter = InboundFilter()
@@ -0,0 +1,121 @@
+# ============================================
+# services/stage_graph.py
+# Chạy các stage của một turn theo đồ thị phụ thuộc (DAG):
+# - Mỗi stage khai báo `after=[...]`, chạy NGAY khi các stage nó phụ thuộc xong
+# - Stage độc lập chạy song song (vd: lưu tin khách ‖ build context)
+# - Ghi thời gian từng stage → critical path (chuỗi stage quyết định latency)
+#
+# Dùng:
+#   graph = StageGraph()
+#   graph.add("conversation", get_conversation)
+#   graph.add("save_customer_message", save_message, after=["conversation"])
+#   graph.add("build_context", load_context, after=["conversation"])
+#   results = await graph.run()          # {"conversation": ..., ...}
+#   graph.critical_path()                # [("conversation", 0.02), ("build_context", 0.11)]
+# ============================================
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .metrics_service import CRITICAL_PATH_LATENCY, CRITICAL_PATH_STAGES, observe_stage
+from ..utils.structured_logger import get_logger
+
+log = get_logger("stage_graph")
+
+# (stage, giây)
+CriticalPath = List[Tuple[str, float]]
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class StageGraph:
+    def __init__(self):
+        # name → (fn, deps, observe)
+        self._stages: Dict[str, Tuple[StageFn, Tuple[str, ...], bool]] = {}
+        # name → (start, end) tính từ lúc run() bắt đầu
+        self._timings: Dict[str, Tuple[float, float]] = {}
+
+    def add(self, name: str, fn: StageFn, after: Sequence[str] = (), observe: bool = True) -> None:
+        """
+        `fn(results)` nhận dict kết quả của các stage đã xong.
+        Stage phụ thuộc phải được add trước → đồ thị luôn không có chu trình.
+        `observe=False`: không ghi histogram stage (stage rất nhỏ / đã tự đo).
+        """
+        missing = [dep for dep in after if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' phụ thuộc stage chưa khai báo: {missing}")
+        self._stages[name] = (fn, tuple(after), observe)
+
+    async def run(self) -> Dict[str, Any]:
+        """Chạy toàn bộ đồ thị. Stage lỗi → hủy các stage còn lại và raise lỗi đó."""
+        results: Dict[str, Any] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        origin = time.perf_counter()
+
+        async def run_stage(name: str) -> None:
+            fn, deps, observe = self._stages[name]
+            if deps:
+                await asyncio.gather(*(tasks[dep] for dep in deps))
+            started = time.perf_counter()
+            if observe:
+                async with observe_stage(name):
+                    results[name] = await fn(results)
+            else:
+                results[name] = await fn(results)
+            self._timings[name] = (started - origin, time.perf_counter() - origin)
+
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(run_stage(name), name=f"stage-{name}")
+
+        try:
+            done, pending = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return results
+
+    def critical_path(self) -> CriticalPath:
+        """Đi ngược từ stage kết thúc muộn nhất, mỗi bước chọn dependency kết thúc muộn nhất"""
+        if not self._timings:
+            return []
+        path: CriticalPath = []
+        current: Optional[str] = max(self._timings, key=lambda n: self._timings[n][1])
+        while current is not None:
+            start, end = self._timings[current]
+            deps = [dep for dep in self._stages[current][1] if dep in self._timings]
+            previous = max(deps, key=lambda n: self._timings[n][1]) if deps else None
+            # Thời gian trên critical path = từ lúc dependency cuối xong tới lúc stage xong
+            path.append((current, end - (self._timings[previous][1] if previous else 0.0)))
+            current = previous
+        path.reverse()
+        return path
+
+
+@asynccontextmanager
+async def sequential_stage(path: CriticalPath, stage: str) -> AsyncIterator[None]:
+    """Stage tuần tự (nằm chắc chắn trên critical path): observe_stage + nối vào `path`"""
+    started = time.perf_counter()
+    async with observe_stage(stage):
+        yield
+    path.append((stage, time.perf_counter() - started))
+
+
+def report_critical_path(path: CriticalPath, platform: Optional[str], wall_seconds: float) -> None:
+    """Histogram latency critical path + đếm stage nằm trên critical path + log"""
+    total = sum(seconds for _, seconds in path)
+    CRITICAL_PATH_LATENCY.observe(total, platform or "unknown")
+    for stage, _ in path:
+        CRITICAL_PATH_STAGES.inc(stage)
+    log.info(
+        "turn_critical_path",
+        platform=platform,
+        path=" > ".join(stage for stage, _ in path),
+        critical_path_ms=round(total * 1000, 2),
+        wall_ms=round(wall_seconds * 1000, 2),
+        stages_ms={stage: round(seconds * 1000, 2) for stage, seconds in path},
+    )
@@ -0,0 +1,336 @@
+# ============================================
+# services/tracing_service.py
+# Tracing end-to-end cho một turn:
+# - trace id tạo ở routes (chat / facebook), đi theo contextvars vào mọi service
+#   và background task (asyncio.create_task / to_thread tự copy context)
+# - Qua hàng đợi (worker task khác) → mang theo bằng body["trace"]
+# - Span export dạng OTLP/JSON: ghi file JSONL và/hoặc POST tới collector
+#   (`{TRACING_OTLP_ENDPOINT}/v1/traces`), bằng thread riêng, không block event loop
+# ============================================
+
+import functools
+import inspect
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypedDict
+
+import httpx
+
+from ..config.env import settings
+
+SERVICE_NAME = "bewo-chatbot"
+
+# OTLP span kind / status code
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class TraceContext(TypedDict):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+class TracingStats(TypedDict):
+    enabled: bool
+    spans_started: int
+    spans_exported: int
+    spans_dropped: int
+    export_errors: int
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_span_id", "name", "kind",
+        "start_ns", "end_ns", "attributes", "status_code", "status_message", "sampled",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        sampled: bool,
+        kind: int = SPAN_KIND_INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+        start_ns: Optional[int] = None,
+    ):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status_code = STATUS_OK
+        self.status_message = ""
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status_code = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.sampled:
+            exporter.submit(self)
+
+    def context(self) -> TraceContext:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "sampled": self.sampled}
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": self.status_code, "message": self.status_message},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# ============================================
+# EXPORTER (thread nền, batch)
+# ============================================
+
+class SpanExporter:
+    def __init__(self, file_path: str, otlp_endpoint: str, max_queue: int, batch_size: int, flush_interval: float):
+        self._file_path = file_path
+        self._otlp_endpoint = otlp_endpoint.rstrip("/")
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.spans_started = 0
+        self.spans_exported = 0
+        self.spans_dropped = 0
+        self.export_errors = 0
+
+    def submit(self, span: Span) -> None:
+        # Không cấu hình đích export → chỉ dùng trace id (log, body["trace"])
+        if not self._file_path and not self._otlp_endpoint:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.spans_dropped += 1
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """Flush span còn lại (gọi khi shutdown server)"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        client = httpx.Client(timeout=5.0) if self._otlp_endpoint else None
+        batch: List[Span] = []
+        deadline = time.monotonic() + self._flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if span is None:
+                    stopping = True
+                else:
+                    batch.append(span)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self._batch_size or time.monotonic() >= deadline):
+                self._export(batch, client)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self._flush_interval
+        if client is not None:
+            client.close()
+
+    def _export(self, batch: List[Span], client: Optional[httpx.Client]) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "bewo.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }],
+        }
+        # Import muộn: json_fast nằm trong utils (tránh vòng import khi khởi động)
+        from ..utils.json_fast import dumps
+        line = dumps(payload)
+        try:
+            if self._file_path:
+                with open(self._file_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            if client is not None:
+                client.post(
+                    f"{self._otlp_endpoint}/v1/traces",
+                    content=line,
+                    headers={"Content-Type": "application/json"},
+                ).raise_for_status()
+            self.spans_exported += len(batch)
+        except Exception as e:
+            self.export_errors += 1
+            # Import muộn: structured_logger import tracing_service (trace_id cho mỗi record)
+            from ..utils.structured_logger import get_logger
+            get_logger("tracing").warning("trace_export_failed", spans=len(batch), error=str(e))
+
+
+exporter = SpanExporter(
+    file_path=settings.TRACING_FILE_PATH,
+    otlp_endpoint=settings.TRACING_OTLP_ENDPOINT,
+    max_queue=settings.TRACING_MAX_QUEUE,
+    batch_size=settings.TRACING_BATCH_SIZE,
+    flush_interval=settings.TRACING_FLUSH_INTERVAL,
+)
+
+
+# ============================================
+# API
+# ============================================
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("bewo_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def current_trace_context() -> Optional[TraceContext]:
+    """Context để mang trace qua hàng đợi (body["trace"])"""
+    span = _current_span.get()
+    return span.context() if span else None
+
+
+@contextmanager
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: int = SPAN_KIND_INTERNAL,
+    parent: Optional[TraceContext] = None,
+    new_trace: bool = False,
+) -> Iterator[Span]:
+    """
+    Mở span con của span hiện tại (contextvars).
+    `parent`: tiếp tục trace từ context đã mang qua hàng đợi.
+    `new_trace`: tạo trace mới (điểm vào: route, WebSocket message, batch item).
+    """
+    current = None if new_trace else _current_span.get()
+    if parent:
+        trace_id, parent_span_id, sampled = parent["trace_id"], parent["span_id"], parent.get("sampled", True)
+    elif current:
+        trace_id, parent_span_id, sampled = current.trace_id, current.span_id, current.sampled
+    else:
+        trace_id, parent_span_id = os.urandom(16).hex(), None
+        sampled = settings.TRACING_ENABLED and random.random() < settings.TRACING_SAMPLE_RATE
+
+    span = Span(name, trace_id, parent_span_id, sampled, kind, attributes)
+    if sampled:
+        exporter.spans_started += 1
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Async generator bị đóng từ context khác (client ngắt stream)
+            _current_span.set(current)
+        span.end()
+
+
+def record_span(
+    name: str,
+    start_ns: int,
+    end_ns: int,
+    attributes: Optional[Dict[str, Any]] = None,
+    kind: int = SPAN_KIND_INTERNAL,
+    error: Optional[str] = None,
+) -> None:
+    """Ghi một span đã kết thúc (vd: DB request từ httpx hook, span của agents SDK)"""
+    current = _current_span.get()
+    if current is None or not current.sampled:
+        return
+    span = Span(name, current.trace_id, current.span_id, True, kind, attributes, start_ns=start_ns)
+    if error:
+        span.status_code = STATUS_ERROR
+        span.status_message = error
+    exporter.spans_started += 1
+    span.end(end_ns)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator: bọc hàm (async hoặc sync) trong một span"""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args, **kwargs):
+            with start_span(span_name):
+                return fn(*args, **kwargs)
+        return sync_wrapper
+    return decorator
+
+
+def stats() -> TracingStats:
+    return {
+        "enabled": settings.TRACING_ENABLED,
+        "spans_started": exporter.spans_started,
+        "spans_exported": exporter.spans_exported,
+        "spans_dropped": exporter.spans_dropped,
+        "export_errors": exporter.export_errors,
+    }
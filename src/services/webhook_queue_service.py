@@ -0,0 +1,364 @@
+# ============================================
+# services/webhook_queue_service.py
+# Hàng đợi xử lý tin nhắn trong process (mailbox theo từng cuộc trò chuyện):
+# - Webhook enqueue rồi trả 200 ngay cho Facebook
+# - N worker xử lý song song giữa các sender
+# - Tin nhắn của CÙNG một sender luôn xử lý tuần tự, đúng thứ tự
+# - Debounce: gom các tin gửi liên tiếp ("chị ơi", "mẫu này", "còn size M không")
+#   thành MỘT turn của agent
+# - exclusive(): turn stream (SSE / WebSocket) giữ lượt trong cùng mailbox
+#   → không chạy song song với turn POST của cùng cuộc trò chuyện
+# ============================================
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple, TypedDict
+
+from ..config.env import settings
+from .tracing_service import start_span
+from ..utils.structured_logger import get_logger
+
+log = get_logger("webhook_queue")
+
+
+class QueueStats(TypedDict):
+    workers: int
+    depth: int
+    active_senders: int
+    in_flight: int
+    enqueued: int
+    processed: int
+    failed: int
+    rejected: int
+    turns: int
+    coalesced: int
+    wait_ms_avg: float
+    wait_ms_max: float
+    wait_ms_last: float
+
+
+class QueueFullError(Exception):
+    """Hàng đợi đầy (caller nên trả 503)"""
+
+
+class SenderOrderedQueue:
+    """
+    Work queue với thứ tự theo từng sender.
+
+    Mỗi sender có một deque riêng; `_ready` chỉ chứa mỗi sender tối đa một lần,
+    nên tại một thời điểm chỉ có một worker xử lý một sender → giữ đúng thứ tự.
+    Sau mỗi turn, sender được đưa lại cuối `_ready` (round-robin giữa các sender).
+
+    `handler` nhận list item của một turn (tối đa `max_batch` item, gom trong
+    cửa sổ debounce) và trả về list kết quả tương ứng từng item (hoặc None).
+    Debounce tính từ tin cuối cùng, tối đa `max_wait_seconds` từ tin đầu tiên;
+    sender đang chờ debounce không chiếm worker.
+
+    Lượt giữ bằng `exclusive()` (turn chạy ngoài handler) không bị gộp: tới lượt
+    thì worker trao quyền cho caller rồi làm việc khác, sender chỉ được xếp lại
+    khi caller thoát khỏi block.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Dict[str, Any]]], Awaitable[Optional[List[Any]]]],
+        workers: int,
+        max_size: int,
+        name: str = "webhook",
+        debounce_seconds: float = 0.0,
+        max_wait_seconds: float = 0.0,
+        max_batch: int = 1,
+    ):
+        self._handler = handler
+        self._worker_count = workers
+        self._max_size = max_size
+        self._name = name
+        self._debounce = debounce_seconds
+        self._max_wait = max(max_wait_seconds, debounce_seconds)
+        self._max_batch = max(1, max_batch)
+
+        # key → [(thời điểm enqueue, item, future kết quả, future release của exclusive())]
+        self._pending: Dict[str, Deque[Tuple[float, Optional[Dict[str, Any]], Optional[asyncio.Future], Optional[asyncio.Future]]]] = {}
+        self._last_arrival: Dict[str, float] = {}
+        self._scheduled: Set[str] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._depth = 0
+        self._in_flight = 0
+
+        # Metrics
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._turns = 0
+        self._coalesced = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        self._wait_ms_last = 0.0
+
+    # ========================================
+    # LIFECYCLE
+    # ========================================
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"{self._name}-worker-{i}")
+            for i in range(self._worker_count)
+        ]
+        log.info("queue_started", queue=self._name, workers=self._worker_count, max_size=self._max_size)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Chờ xử lý hết tin đang chờ (tối đa `timeout` giây) rồi dừng worker"""
+        if not self._workers:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._depth > 0 or self._in_flight > 0) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._depth > 0:
+            log.warning("queue_stopped_with_pending", queue=self._name, depth=self._depth)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # ========================================
+    # PRODUCER
+    # ========================================
+
+    def submit(self, key: str, item: Dict[str, Any]) -> bool:
+        """
+        Đưa một tin vào hàng đợi của sender `key` (không chờ kết quả).
+        Returns False nếu hàng đợi đã đầy (caller nên trả 503 để Facebook gửi lại).
+        """
+        return self._enqueue(key, item, None)
+
+    async def call(self, key: str, item: Dict[str, Any]) -> Any:
+        """Enqueue và chờ kết quả của item (raise QueueFullError nếu đầy)"""
+        future = asyncio.get_running_loop().create_future()
+        if not self._enqueue(key, item, future):
+            raise QueueFullError(f"{self._name} queue full")
+        return await future
+
+    @asynccontextmanager
+    async def exclusive(self, key: str) -> AsyncIterator[None]:
+        """
+        Giữ lượt của `key` cho turn chạy ngoài handler (stream SSE / WebSocket):
+        chờ các tin trước của `key` xử lý xong; tin đến sau chờ tới khi thoát block.
+        Raises: QueueFullError nếu hàng đợi đầy
+        """
+        loop = asyncio.get_running_loop()
+        granted, release = loop.create_future(), loop.create_future()
+        if not self._enqueue(key, None, granted, release):
+            raise QueueFullError(f"{self._name} queue full")
+        try:
+            await granted
+            yield
+        finally:
+            if not release.done():
+                release.set_result(None)
+
+    def _enqueue(
+        self,
+        key: str,
+        item: Optional[Dict[str, Any]],
+        future: Optional[asyncio.Future],
+        release: Optional[asyncio.Future] = None,
+    ) -> bool:
+        if self._depth >= self._max_size:
+            self._rejected += 1
+            log.warning("queue_full", queue=self._name, depth=self._depth, sender=key)
+            return False
+
+        self.start()
+        now = time.monotonic()
+        self._pending.setdefault(key, deque()).append((now, item, future, release))
+        self._depth += 1
+        self._enqueued += 1
+        if release is None:
+            # Lượt exclusive không gộp với tin khác → không kéo dài debounce
+            self._last_arrival[key] = now
+
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._schedule(key, self._debounce if release is None else 0.0)
+        return True
+
+    def _schedule(self, key: str, delay: float) -> None:
+        if delay <= 0:
+            self._ready.put_nowait(key)
+        else:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, key)
+
+    def _debounce_remaining(self, key: str, queue: Deque) -> float:
+        """Số giây còn phải chờ trước khi gom turn cho `key` (0 = chạy ngay)"""
+        if self._debounce <= 0:
+            return 0.0
+        now = time.monotonic()
+        quiet_left = self._last_arrival.get(key, 0.0) + self._debounce - now
+        max_wait_left = queue[0][0] + self._max_wait - now
+        return max(0.0, min(quiet_left, max_wait_left))
+
+    # ========================================
+    # CONSUMER
+    # ========================================
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._pending.get(key)
+            if not queue:
+                self._scheduled.discard(key)
+                continue
+
+            if queue[0][3] is not None:
+                self._grant(key, queue)
+                continue
+
+            # Khách vẫn đang gõ → hẹn lại, không giữ worker
+            remaining = self._debounce_remaining(key, queue)
+            if remaining > 0:
+                self._schedule(key, remaining)
+                continue
+
+            # Gom tới max_batch tin, dừng ở lượt exclusive (giữ thứ tự)
+            batch = []
+            while queue and len(batch) < self._max_batch and queue[0][3] is None:
+                batch.append(queue.popleft())
+            self._depth -= len(batch)
+            self._in_flight += 1
+            self._turns += 1
+            self._coalesced += len(batch) - 1
+
+            self._record_wait(batch)
+
+            futures = [future for _, _, future, _ in batch]
+            try:
+                results = await self._handler([item for _, item, _, _ in batch])
+                self._processed += len(batch)
+                for i, future in enumerate(futures):
+                    if future and not future.done():
+                        future.set_result(results[i] if results else None)
+            except asyncio.CancelledError:
+                for future in futures:
+                    if future and not future.done():
+                        future.cancel()
+                if asyncio.current_task().cancelling():
+                    # stop() hủy chính worker
+                    raise
+                # CancelledError đến từ handler (vd: join dedupe của một turn đã bị hủy)
+                # → chỉ turn này hỏng, worker vẫn phục vụ các tin sau của sender
+                self._failed += len(batch)
+                log.warning("queue_turn_cancelled", queue=self._name, worker=index, sender=key)
+            except Exception as e:
+                self._failed += len(batch)
+                log.error("queue_turn_failed", queue=self._name, worker=index, sender=key, error=str(e))
+                for future in futures:
+                    if future and not future.done():
+                        future.set_exception(e)
+            finally:
+                self._finish_turn(key)
+
+    def _grant(self, key: str, queue: Deque) -> None:
+        """Tới lượt exclusive(): trao quyền cho caller, xếp lại sender khi caller release"""
+        entry = queue.popleft()
+        _, _, granted, release = entry
+        self._depth -= 1
+        self._in_flight += 1
+        self._turns += 1
+        self._record_wait([entry])
+        if not granted.done():
+            granted.set_result(None)
+
+        def released(_: asyncio.Future) -> None:
+            self._processed += 1
+            self._finish_turn(key)
+
+        release.add_done_callback(released)
+
+    def _finish_turn(self, key: str) -> None:
+        self._in_flight -= 1
+        queue = self._pending.get(key)
+        if queue:
+            # Còn tin của sender này → xếp lại (giữ thứ tự trong sender)
+            self._schedule(key, 0.0 if queue[0][3] is not None else self._debounce_remaining(key, queue))
+        else:
+            self._pending.pop(key, None)
+            self._last_arrival.pop(key, None)
+            self._scheduled.discard(key)
+
+    def _record_wait(self, batch: List[Tuple]) -> None:
+        now = time.monotonic()
+        for enqueued_at, _, _, _ in batch:
+            wait_ms = (now - enqueued_at) * 1000
+            self._wait_ms_last = wait_ms
+            self._wait_ms_total += wait_ms
+            self._wait_ms_max = max(self._wait_ms_max, wait_ms)
+
+    # ========================================
+    # METRICS
+    # ========================================
+
+    def stats(self) -> QueueStats:
+        started = self._processed + self._failed + self._in_flight
+        return {
+            "workers": len(self._workers),
+            "depth": self._depth,
+            "active_senders": len(self._scheduled),
+            "in_flight": self._in_flight,
+            "enqueued": self._enqueued,
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "turns": self._turns,
+            "coalesced": self._coalesced,
+            "wait_ms_avg": round(self._wait_ms_total / started, 2) if started else 0.0,
+            "wait_ms_max": round(self._wait_ms_max, 2),
+            "wait_ms_last": round(self._wait_ms_last, 2),
+        }
+
+
+# ============================================
+# SINGLETONS: FACEBOOK WEBHOOK + WEBSITE CHAT
+# ============================================
+
+async def _handle_queued_messages(bodies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Import muộn để tránh vòng import (message_handler → services)
+    from ..handlers.message_handler import handle_message_batch
+
+    # Worker là task riêng (không mang contextvars của route) → nối lại trace
+    # từ body["trace"] của tin mới nhất; trace của các tin bị gộp ghi vào attribute
+    traces = [body["trace"] for body in bodies if body.get("trace")]
+    attributes = {
+        "messaging.batch.message_count": len(bodies),
+        "coalesced_trace_ids": ",".join(t["trace_id"] for t in traces[:-1]) or None,
+    }
+    with start_span("queue.process", attributes, parent=traces[-1] if traces else None):
+        return await handle_message_batch(bodies)
+
+
+webhook_queue = SenderOrderedQueue(
+    _handle_queued_messages,
+    workers=settings.WEBHOOK_WORKERS,
+    max_size=settings.WEBHOOK_QUEUE_MAX_SIZE,
+    name="facebook",
+    debounce_seconds=settings.MESSENGER_DEBOUNCE_SECONDS,
+    max_wait_seconds=settings.COALESCE_MAX_WAIT_SECONDS,
+    max_batch=settings.COALESCE_MAX_MESSAGES,
+)
+
+# Website POST /chat/: mỗi request chờ kết quả của chính nó (queue.call)
+website_queue = SenderOrderedQueue(
+    _handle_queued_messages,
+    workers=settings.WEBSITE_WORKERS,
+    max_size=settings.WEBSITE_QUEUE_MAX_SIZE,
+    name="website",
+    debounce_seconds=settings.WEBSITE_DEBOUNCE_SECONDS,
+    max_wait_seconds=settings.COALESCE_MAX_WAIT_SECONDS,
+    max_batch=settings.COALESCE_MAX_MESSAGES,
+)
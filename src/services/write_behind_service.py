@@ -0,0 +1,327 @@
+# ============================================
+# services/write_behind_service.py
+# Write-behind buffer cho các bản ghi không cần cho câu trả lời:
+# conversation_embeddings, chatbot_usage_logs, customer_memory_facts
+# - add(table, row): chỉ đưa vào buffer (không round trip)
+# - Flush thành bulk insert khi buffer của bảng đủ WRITE_BEHIND_BATCH_SIZE
+#   hoặc row cũ nhất quá WRITE_BEHIND_MAX_AGE_SECONDS
+# - Journal JSONL (WRITE_BEHIND_JOURNAL_PATH): add() chỉ xếp dòng journal vào
+#   hàng chờ, task nền ghi theo lô qua asyncio.to_thread (không IO trên event loop);
+#   start() replay journal → crash chỉ mất tối đa một cửa sổ max age
+#   (không bật journal) hoặc các row chưa kịp ghi journal (có journal)
+# - Lỗi mạng → giữ lại retry ở lần flush sau; PostgREST từ chối batch
+#   → insert lẻ từng row để một row lỗi không kéo cả batch
+# ============================================
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypedDict
+
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from supabase import AsyncClient
+
+from ..config.env import settings
+from ..utils.connect_supabase import get_async_supabase_client
+from ..utils.json_fast import dumps, loads
+from ..utils.structured_logger import get_logger
+
+log = get_logger("write_behind")
+
+Row = Dict[str, Any]
+# Hook chạy ngay trước bulk insert của một bảng (vd: dedupe / deactivate bản ghi cũ)
+BeforeFlushHook = Callable[[AsyncClient, List[Row]], Awaitable[List[Row]]]
+
+
+class WriteBehindStats(TypedDict):
+    buffered: int
+    oldest_age_ms: float
+    added: int
+    flushed_rows: int
+    flush_requests: int
+    failed_requests: int
+    dropped_rows: int
+    replayed_rows: int
+    journal_enabled: bool
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        batch_size: int,
+        max_age: float,
+        max_rows: int,
+        journal_path: str = "",
+    ):
+        self._batch_size = batch_size
+        self._max_age = max_age
+        self._max_rows = max_rows
+        self._journal_path = journal_path
+
+        # table → [(thời điểm add, row)]
+        self._buffers: Dict[str, List[Tuple[float, Row]]] = {}
+        self._hooks: Dict[str, BeforeFlushHook] = {}
+        self._journal = None
+        # Dòng journal chờ ghi + lock giữa append và rewrite (ghi trong thread)
+        self._journal_pending: List[str] = []
+        self._journal_wakeup: Optional[asyncio.Event] = None
+        self._journal_lock: Optional[asyncio.Lock] = None
+        self._journal_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        # Metrics
+        self._added = 0
+        self._flushed_rows = 0
+        self._flush_requests = 0
+        self._failed_requests = 0
+        self._dropped_rows = 0
+        self._replayed_rows = 0
+
+    def register_before_flush(self, table: str, hook: BeforeFlushHook) -> None:
+        self._hooks[table] = hook
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        if self._journal_path:
+            # Startup: IO đồng bộ một lần (chưa có request)
+            self._replay_journal()
+            self._replace_journal(self._journal_snapshot())
+            self._journal_wakeup = asyncio.Event()
+            self._journal_lock = asyncio.Lock()
+            self._journal_task = asyncio.create_task(self._journal_loop(), name="write-behind-journal")
+        self._task = asyncio.create_task(self._flush_loop(), name="write-behind-flush")
+        log.info(
+            "write_behind_started",
+            batch_size=self._batch_size,
+            max_age_s=self._max_age,
+            journal=bool(self._journal_path),
+            replayed=self._replayed_rows,
+        )
+
+    def add(self, table: str, row: Row) -> None:
+        """Đưa row vào buffer. Không await, không round trip, không IO file."""
+        if self._task is None:
+            # Chưa start (vd: chạy script ngoài FastAPI) → start lazily trong loop hiện tại
+            self.start()
+        if self._buffered() >= self._max_rows:
+            # DB chết lâu → bỏ row cũ nhất của bảng đang add thay vì tràn RAM
+            buffer = self._buffers.get(table)
+            if buffer:
+                buffer.pop(0)
+            self._dropped_rows += 1
+            log.warning("write_behind_row_dropped", table=table, buffered=self._buffered())
+        self._buffers.setdefault(table, []).append((time.monotonic(), row))
+        self._added += 1
+        if self._journal is not None:
+            self._journal_pending.append(dumps({"table": table, "row": row}) + "\n")
+            self._journal_wakeup.set()
+        if len(self._buffers[table]) >= self._batch_size:
+            self._wakeup.set()
+
+    async def flush(self, force: bool = False) -> None:
+        """Flush các bảng đủ size/age (`force=True`: flush hết)"""
+        async with self._flush_lock:
+            now = time.monotonic()
+            due = [
+                table for table, buffer in self._buffers.items()
+                if buffer and (
+                    force
+                    or len(buffer) >= self._batch_size
+                    or now - buffer[0][0] >= self._max_age
+                )
+            ]
+            if not due:
+                return
+            supabase = get_async_supabase_client()
+            for table in due:
+                await self._flush_table(supabase, table)
+                # Shutdown: flush tới khi hết (hoặc lỗi mạng → dừng, row còn trong journal)
+                while force and self._buffers[table]:
+                    before = len(self._buffers[table])
+                    await self._flush_table(supabase, table)
+                    if len(self._buffers[table]) >= before:
+                        break
+            if self._journal is not None:
+                await self._rewrite_journal()
+
+    async def stop(self) -> None:
+        """Flush nốt buffer (shutdown, trước khi đóng connection pool Supabase)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush(force=True)
+        if self._journal is not None:
+            self._journal_task.cancel()
+            await asyncio.gather(self._journal_task, return_exceptions=True)
+            self._journal_task = None
+            await self._write_journal_pending()
+            self._journal.close()
+            self._journal = None
+        log.info("write_behind_stopped", remaining=self._buffered())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_deadline())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("write_behind_flush_failed", error=str(e))
+
+    def _next_deadline(self) -> float:
+        oldest = [buffer[0][0] for buffer in self._buffers.values() if buffer]
+        if not oldest:
+            return self._max_age
+        return max(0.01, min(oldest) + self._max_age - time.monotonic())
+
+    async def _flush_table(self, supabase: AsyncClient, table: str) -> None:
+        buffer = self._buffers.get(table) or []
+        batch, self._buffers[table] = buffer[:self._batch_size], buffer[self._batch_size:]
+        rows = [row for _, row in batch]
+        hook = self._hooks.get(table)
+        try:
+            if hook is not None:
+                rows = await hook(supabase, rows)
+        except Exception as e:
+            self._requeue(table, batch, e)
+            return
+        # PostgREST bulk insert cần mọi object cùng tập key → chia theo key set
+        groups: Dict[Tuple[str, ...], List[Row]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        pending = list(groups.values())
+        while pending:
+            group = pending[0]
+            try:
+                await self._insert(supabase, table, group)
+            except APIError as e:
+                # Một row sai (vd: FK) làm hỏng cả batch → insert lẻ, bỏ row lỗi
+                log.warning("write_behind_batch_rejected", table=table, rows=len(group), error=str(e))
+                await self._insert_individually(supabase, table, group)
+            except Exception as e:
+                # Lỗi mạng / timeout → các group chưa insert về đầu buffer, flush lần sau
+                now = time.monotonic()
+                self._requeue(table, [(now, row) for remaining in pending for row in remaining], e)
+                return
+            pending.pop(0)
+        if len(self._buffers[table]) >= self._batch_size:
+            self._wakeup.set()
+
+    def _requeue(self, table: str, batch: List[Tuple[float, Row]], error: Exception) -> None:
+        self._failed_requests += 1
+        self._buffers[table] = batch + self._buffers[table]
+        log.error("write_behind_insert_failed", table=table, rows=len(batch), error=str(error))
+
+    async def _insert(self, supabase: AsyncClient, table: str, rows: List[Row]) -> None:
+        self._flush_requests += 1
+        await supabase.from_(table).insert(rows, returning=ReturnMethod.minimal).execute()
+        self._flushed_rows += len(rows)
+
+    async def _insert_individually(self, supabase: AsyncClient, table: str, rows: List[Row]) -> None:
+        for row in rows:
+            try:
+                await self._insert(supabase, table, [row])
+            except Exception as e:
+                self._failed_requests += 1
+                self._dropped_rows += 1
+                log.error("write_behind_row_rejected", table=table, error=str(e))
+
+    def _buffered(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def _replay_journal(self) -> None:
+        if not os.path.exists(self._journal_path):
+            return
+        now = time.monotonic()
+        with open(self._journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    # Dòng cuối ghi dở lúc crash
+                    continue
+                self._buffers.setdefault(entry["table"], []).append((now, entry["row"]))
+                self._replayed_rows += 1
+
+    # ============================================
+    # JOURNAL (IO trong thread, không chặn event loop)
+    # ============================================
+
+    async def _journal_loop(self) -> None:
+        while True:
+            await self._journal_wakeup.wait()
+            self._journal_wakeup.clear()
+            await self._write_journal_pending()
+
+    async def _write_journal_pending(self) -> None:
+        """Ghi mọi dòng đang chờ bằng MỘT lần write + flush"""
+        async with self._journal_lock:
+            lines, self._journal_pending = self._journal_pending, []
+            if not lines:
+                return
+            try:
+                await asyncio.to_thread(self._append_journal, "".join(lines))
+            except Exception as e:
+                log.error("write_behind_journal_append_failed", rows=len(lines), error=str(e))
+
+    def _append_journal(self, data: str) -> None:
+        self._journal.write(data)
+        self._journal.flush()
+
+    async def _rewrite_journal(self) -> None:
+        """Journal = các row còn trong buffer (row đã insert được bỏ khỏi journal)"""
+        async with self._journal_lock:
+            # Snapshot buffer đã gồm mọi row đang chờ ghi → bỏ hàng chờ (cùng một bước trên loop)
+            self._journal_pending = []
+            entries = self._journal_snapshot()
+            try:
+                await asyncio.to_thread(self._replace_journal, entries)
+            except Exception as e:
+                log.error("write_behind_journal_rewrite_failed", rows=len(entries), error=str(e))
+
+    def _journal_snapshot(self) -> List[Tuple[str, Row]]:
+        return [(table, row) for table, buffer in self._buffers.items() for _, row in buffer]
+
+    def _replace_journal(self, entries: List[Tuple[str, Row]]) -> None:
+        tmp_path = f"{self._journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(dumps({"table": table, "row": row}) + "\n" for table, row in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+    def stats(self) -> WriteBehindStats:
+        oldest = [buffer[0][0] for buffer in self._buffers.values() if buffer]
+        return {
+            "buffered": self._buffered(),
+            "oldest_age_ms": round((time.monotonic() - min(oldest)) * 1000, 2) if oldest else 0.0,
+            "added": self._added,
+            "flushed_rows": self._flushed_rows,
+            "flush_requests": self._flush_requests,
+            "failed_requests": self._failed_requests,
+            "dropped_rows": self._dropped_rows,
+            "replayed_rows": self._replayed_rows,
+            "journal_enabled": self._journal is not None,
+        }
+
+
+write_behind = WriteBehindBuffer(
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    max_age=settings.WRITE_BEHIND_MAX_AGE_SECONDS,
+    max_rows=settings.WRITE_BEHIND_MAX_ROWS,
+    journal_path=settings.WRITE_BEHIND_JOURNAL_PATH,
+)
@@ -0,0 +1,112 @@
+# test_admission.py
+# Admission control: giới hạn đồng thời, hàng chờ theo priority, shed khi đầy / quá timeout, hủy khi chờ
+import asyncio
+
+from .services.admission_service import (
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    AdmissionController,
+    turn_priority,
+)
+
+
+def _controller(max_concurrent=1, max_queue=2, wait_timeout=1.0):
+    return AdmissionController(max_concurrent=max_concurrent, max_queue=max_queue, wait_timeout=wait_timeout, name="test")
+
+
+def test_admits_up_to_limit_then_queues_and_releases_fifo():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_queue=2)
+        assert await controller.acquire()
+        first = asyncio.create_task(controller.acquire())
+        second = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 2 and not first.done()
+
+        controller.release()
+        assert await first is True
+        assert not second.done()
+        controller.release()
+        assert await second is True
+        controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight"] == 0
+    assert stats["admitted"] == 3 and stats["admitted_after_wait"] == 2
+
+
+def test_high_priority_jumps_the_queue():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_queue=4)
+        assert await controller.acquire()
+        normal = asyncio.create_task(controller.acquire(PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(controller.acquire(PRIORITY_HIGH))
+        await asyncio.sleep(0)
+
+        controller.release()
+        assert await high is True
+        assert not normal.done()
+        controller.release()
+        assert await normal is True
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds_or_evicts_lower_priority():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_queue=1)
+        assert await controller.acquire()
+        queued = asyncio.create_task(controller.acquire(PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+
+        # Cùng priority, hàng đầy → shed ngay
+        assert await controller.acquire(PRIORITY_NORMAL) is False
+        # Priority cao đẩy tin thường ra khỏi hàng
+        high = asyncio.create_task(controller.acquire(PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        assert await queued is False
+
+        controller.release()
+        assert await high is True
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_queue_full"] == 1 and stats["evicted"] == 1
+    assert stats["shed_by_priority"] == {str(PRIORITY_NORMAL): 2}
+
+
+def test_wait_timeout_sheds():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_queue=2, wait_timeout=0.01)
+        assert await controller.acquire()
+        assert await controller.acquire() is False
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed_timeout"] == 1 and stats["queued"] == 0 and stats["in_flight"] == 1
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_queue=2)
+        assert await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["queued"] == 0
+
+        controller.release()
+        assert controller.stats()["in_flight"] == 0
+        assert await controller.acquire() is True
+
+    asyncio.run(scenario())
+
+
+def test_turn_priority():
+    assert turn_priority({"cart": [{"id": 1}]}) == PRIORITY_HIGH
+    assert turn_priority({"saved_address": {"address": "Q1"}}) == PRIORITY_HIGH
+    assert turn_priority({"cart": [], "saved_address": {}}) == PRIORITY_NORMAL
+    assert turn_priority(None) == PRIORITY_NORMAL
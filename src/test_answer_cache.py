@@ -0,0 +1,120 @@
+# test_answer_cache.py
+# Answer cache: khớp chính xác / gần giống, không cache khi giỏ có hàng
+import asyncio
+
+from .services import context_service
+from .services.answer_cache_service import AnswerCache
+
+FAQ_ANSWER = {"text": "Dạ phí ship 30k, đơn từ 300k freeship ạ", "tokens": 120, "type": "conversational"}
+
+
+def _cache():
+    return AnswerCache(ttl_seconds=60, max_entries=10, similarity=0.8, max_chars=120)
+
+
+def _context(**overrides):
+    context = {"products": [{"id": "p1", "name": "Đầm hoa", "price": 350000, "stock": 5}], "history": [], "cart": []}
+    context.update(overrides)
+    return context
+
+
+def test_exact_and_similar_questions_hit():
+    cache = _cache()
+    assert cache.store("Phí ship bao nhiêu vậy shop?", _context(), FAQ_ANSWER)
+
+    exact = cache.lookup("phí ship bao nhiêu ạ", _context())
+    assert exact is not None and exact["cache"] == "exact"
+    assert exact["text"] == FAQ_ANSWER["text"] and exact["tokens"] == 0
+
+    # Không dấu / viết tắt → vẫn là cùng câu hỏi
+    similar = cache.lookup("phi ship bn", _context())
+    assert similar is not None and similar["cache"] == "similar"
+
+    assert cache.lookup("đổi trả trong bao lâu", _context()) is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_catalog_change_misses():
+    cache = _cache()
+    cache.store("phí ship bao nhiêu", _context(), FAQ_ANSWER)
+    repriced = _context(products=[{"id": "p1", "name": "Đầm hoa", "price": 390000, "stock": 5}])
+    assert cache.lookup("phí ship bao nhiêu", repriced) is None
+
+    cache.invalidate_catalog("test")
+    assert cache.lookup("phí ship bao nhiêu", _context()) is None
+
+
+def test_cart_with_items_skips_cache():
+    cache = _cache()
+    cart = [{"product_id": "p1", "name": "Đầm hoa", "price": 350000, "size": "M", "quantity": 1}]
+    assert not cache.store("phí ship bao nhiêu", _context(cart=cart), FAQ_ANSWER)
+
+    cache.store("phí ship bao nhiêu", _context(), FAQ_ANSWER)
+    assert cache.lookup("phí ship bao nhiêu", _context(cart=cart)) is None
+    assert cache.stats()["skipped"] == 1
+
+
+def test_personal_answers_are_not_stored():
+    cache = _cache()
+    context = _context(profile={"full_name": "Nguyễn Lan"})
+    answer = {**FAQ_ANSWER, "text": "Dạ chị Nguyễn Lan ơi phí ship 30k ạ"}
+    assert not cache.store("phí ship bao nhiêu", context, answer)
+    assert not cache.store("mẫu này còn size M không", _context(), FAQ_ANSWER)
+
+
+class _Query:
+    """Chuỗi query Supabase giả: mọi bộ lọc trả về chính nó, execute() trả data của bảng"""
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        return type("Response", (), {"data": self._data})()
+
+
+class _Supabase:
+    def __init__(self, tables):
+        self._tables = tables
+
+    def from_(self, table):
+        return _Query(self._tables.get(table, []))
+
+
+def test_build_context_loads_cart_so_guard_applies():
+    cart = [{"product_id": "p1", "name": "Đầm hoa", "price": 350000, "size": "M", "quantity": 1}]
+    supabase = _Supabase({
+        "chatbot_conversations": [{"id": "c1", "customer_name": "Lan", "context": {"cart": cart}}],
+    })
+    context = asyncio.run(context_service.build_context(supabase, "c1", "phí ship bao nhiêu"))
+    assert context["cart"] == cart
+    assert _cache()._cacheable_turn("phí ship bao nhiêu", context) is None
+
+    empty = asyncio.run(context_service.build_context(_Supabase({}), "c2", "hi"))
+    assert empty["cart"] == []
+
+
+def test_answer_from_before_catalog_invalidation_is_not_stored():
+    cache = _cache()
+    version = cache.catalog_version
+    # Tồn kho đổi trong lúc agent đang trả lời
+    cache.invalidate_catalog("stock_update:p1")
+    assert not cache.store("phí ship bao nhiêu", _context(), FAQ_ANSWER, catalog_version=version)
+    assert cache.store("phí ship bao nhiêu", _context(), FAQ_ANSWER, catalog_version=cache.catalog_version)
+
+
+def test_customers_with_profile_or_memory_skip_cache():
+    cache = _cache()
+    cache.store("phí ship bao nhiêu", _context(), FAQ_ANSWER)
+    personalized = [
+        _context(profile={"usual_size": "M", "style_preference": "thanh lịch"}),
+        _context(memory_facts=[{"fact_text": "Ở Đà Nẵng, hay mua váy linen"}]),
+        _context(interests=[{"interest": "váy linen"}]),
+    ]
+    for context in personalized:
+        assert cache.lookup("phí ship bao nhiêu", context) is None
+        assert not cache.store("phí ship bao nhiêu", context, FAQ_ANSWER)
+    # Khách mới (hồ sơ rỗng như build_context trả về) vẫn dùng cache
+    assert cache.lookup("phí ship bao nhiêu", _context(profile={}, memory_facts=[], interests=[])) is not None
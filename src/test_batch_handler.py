@@ -0,0 +1,55 @@
+# test_batch_handler.py
+# /chat/batch: gom theo cuộc trò chuyện từ chính từng tin, đi qua website_queue
+# (không chạy xen với turn /chat/stream đang giữ cùng cuộc trò chuyện)
+import asyncio
+
+from .handlers import batch_handler
+from .handlers.message_handler import conversation_key
+from .models.types import BatchChatItem
+from .routes.chat import _build_message_body
+from .services.webhook_queue_service import SenderOrderedQueue
+
+
+def _body(text, session_id):
+    return {"platform": "website", "session_id": session_id, "message_text": text}
+
+
+def test_batch_waits_for_a_stream_holding_the_conversation(monkeypatch):
+    events = []
+
+    async def handler(bodies):
+        events.extend(("batch", body["message_text"]) for body in bodies)
+        return [{"success": True, "response": body["message_text"]} for body in bodies]
+
+    queue = SenderOrderedQueue(handler, workers=2, max_size=10, name="test")
+    monkeypatch.setattr(batch_handler, "website_queue", queue)
+
+    async def stream_turn():
+        async with queue.exclusive(conversation_key(_body("", "s1"))):
+            events.append(("stream", "start"))
+            await asyncio.sleep(0.05)
+            events.append(("stream", "end"))
+
+    async def scenario():
+        stream = asyncio.create_task(stream_turn())
+        await asyncio.sleep(0)
+        bodies = [_body("a", "s1"), _body("b", "s1"), _body("x", "s2")]
+        items = [item async for item in batch_handler.process_batch(bodies, concurrency=4)]
+        await stream
+        await queue.stop()
+        return items
+
+    items = asyncio.run(scenario())
+    assert all(item["success"] for item in items)
+    s1 = [event for event in events if event != ("batch", "x")]
+    assert s1 == [("stream", "start"), ("stream", "end"), ("batch", "a"), ("batch", "b")]
+    # Cuộc trò chuyện khác không phải chờ stream
+    assert events.index(("batch", "x")) < events.index(("stream", "end"))
+
+
+def test_items_without_ids_do_not_share_a_conversation():
+    first = _build_message_body(BatchChatItem(message="hi"), None)
+    second = _build_message_body(BatchChatItem(message="hi"), None)
+    assert first["session_id"] != second["session_id"]
+    tagged = _build_message_body(BatchChatItem(message="hi", sessionId="s1"), "s1")
+    assert tagged["session_id"] == "s1"
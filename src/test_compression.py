@@ -0,0 +1,75 @@
+# test_compression.py
+# Gzip: nén response JSON lớn, NDJSON / SSE stream gửi từng dòng ngay (không buffer tới cuối)
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from .utils.json_fast import FastJSONResponse, StreamingSafeGZipMiddleware
+
+
+async def _products(request):
+    return FastJSONResponse({"products": [{"name": "Đầm hoa nhí", "price": 350000}] * 100})
+
+
+def _stream(media_type):
+    async def endpoint(request):
+        async def lines():
+            for i in range(3):
+                yield f'{{"index":{i},"text":"{"x" * 600}"}}\n'
+                await asyncio.sleep(0.01)
+        return StreamingResponse(lines(), media_type=media_type)
+    return endpoint
+
+
+def _client():
+    app = Starlette(routes=[
+        Route("/products", _products),
+        Route("/batch", _stream("application/x-ndjson")),
+        Route("/stream", _stream("text/event-stream")),
+    ])
+    app.add_middleware(StreamingSafeGZipMiddleware, minimum_size=500)
+    return TestClient(app)
+
+
+def test_large_json_is_gzipped():
+    response = _client().get("/products", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()["products"]) == 100
+
+
+def _body_messages(app, path):
+    """Gọi ASGI trực tiếp (TestClient gộp body) → danh sách http.response.body đã gửi"""
+    sent = []
+    requested = []
+
+    async def receive():
+        if requested:
+            # Client vẫn kết nối tới khi stream xong
+            await asyncio.Event().wait()
+        requested.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"accept-encoding", b"gzip")], "client": ("test", 1), "server": ("test", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    start = next(message for message in sent if message["type"] == "http.response.start")
+    return dict(start["headers"]), [m["body"] for m in sent if m["type"] == "http.response.body" and m.get("body")]
+
+
+def test_ndjson_and_sse_are_sent_uncompressed_chunk_by_chunk():
+    app = _client().app
+    for path in ("/batch", "/stream"):
+        headers, bodies = _body_messages(app, path)
+        assert b"content-encoding" not in headers
+        # Mỗi dòng là một chunk riêng (GZipResponder gộp thành một khối khi stream kết thúc)
+        assert len(bodies) == 3
+        assert bodies[0].startswith(b'{"index":0')
@@ -0,0 +1,124 @@
+# test_fast_path.py
+# Fast path: rules trả lời không cần LLM, các trường hợp phải nhường agent, guard chủ đơn khi tra cứu đơn
+import asyncio
+
+from .agent import agent_service
+from .handlers import fast_path_handler
+from .handlers.fast_path_handler import try_fast_path
+
+
+def _turn(text, history=None, sticker_id=None, phone=None, conversation_id="conv-1"):
+    return {
+        "message_text": text,
+        "sticker_id": sticker_id,
+        "conversation_id": conversation_id,
+        "context": {
+            "history": history or [],
+            "profile": {"preferred_name": "Lan"},
+            "customer": {"phone": phone} if phone else {},
+        },
+    }
+
+
+def _bot(text):
+    return {"sender_type": "bot", "content": {"text": text}}
+
+
+def _intent(turn):
+    result = asyncio.run(try_fast_path(turn))
+    return result and result["fast_path"]
+
+
+def test_rules_table(monkeypatch):
+    async def no_order(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(fast_path_handler, "fetch_order_status", no_order)
+    cases = [
+        (_turn("Chào shop ạ!!"), "greeting"),
+        (_turn("shop ơi"), "greeting"),
+        (_turn("Ok ạ 😊"), "ack"),
+        (_turn("cảm ơn shop nhiều"), "thanks"),
+        (_turn("phí ship bao nhiêu vậy shop?"), "policy"),
+        (_turn("có được kiểm tra hàng không"), "policy"),
+        (_turn("", sticker_id="369239263222822"), "sticker"),
+        # Không phải câu hỏi → agent xử lý ("đổi size M sang L giúp em")
+        (_turn("đổi size M sang L giúp em"), None),
+        # Ý định đặt hàng luôn đi agent
+        (_turn("chào shop, em muốn đặt hàng"), None),
+        # "ok" trả lời câu hỏi của bot → agent
+        (_turn("ok", history=[_bot("Chị lấy size M nhé?")]), None),
+        # Bot đang chờ xác nhận địa chỉ → message_handler xử lý
+        (_turn("vâng", history=[_bot("Em giao về 12 Lê Lợi phải không ạ?")]), None),
+        (_turn("áo linen trắng còn size S không"), None),
+        (_turn("x" * 200), None),
+    ]
+    for turn, expected in cases:
+        assert _intent(turn) == expected, turn["message_text"]
+
+
+def test_greeting_uses_customer_name():
+    result = asyncio.run(try_fast_path(_turn("chào shop")))
+    assert "chị Lan" in result["text"]
+    assert result["tokens"] == 0 and result["products"] == []
+
+
+def test_order_lookup_passes_ownership_scope(monkeypatch):
+    calls = []
+
+    async def fake_fetch(order_id, conversation_id=None, customer_phone=None):
+        calls.append((order_id, conversation_id, customer_phone))
+        return {"id": order_id, "status": "Đang giao", "total": "350.000đ", "createdAt": "2026-10-01T08:00:00Z"}
+
+    monkeypatch.setattr(fast_path_handler, "fetch_order_status", fake_fetch)
+    result = asyncio.run(try_fast_path(_turn("đơn hàng #123 tới đâu rồi", phone="0901234567")))
+
+    assert result["fast_path"] == "order_lookup"
+    assert "#123" in result["text"] and "01/10/2026" in result["text"]
+    assert calls == [("123", "conv-1", "0901234567")]
+
+
+class _Orders:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        return type("Resp", (), {"data": self._rows})()
+
+
+def _orders_db(monkeypatch, order):
+    client = type("Client", (), {"from_": lambda self, table: _Orders([order])})()
+    monkeypatch.setattr(agent_service, "supabase", client)
+
+
+def test_order_ownership_guard(monkeypatch):
+    order = {
+        "id": 123,
+        "status": "shipping",
+        "total_amount": 350000,
+        "created_at": "2026-10-01T08:00:00Z",
+        "conversation_id": "conv-owner",
+        "customer_phone": "090 123 4567",
+    }
+    _orders_db(monkeypatch, order)
+
+    def lookup(**scope):
+        return asyncio.run(agent_service.fetch_order_status("#123", **scope))
+
+    assert lookup(conversation_id="conv-owner")["id"] == "123"
+    # Khác hội thoại nhưng cùng SĐT (chuẩn hóa chữ số) → vẫn là chủ đơn
+    assert lookup(conversation_id="conv-other", customer_phone="0901234567")["id"] == "123"
+    # Dò mã đơn của người khác → coi như không tìm thấy
+    assert lookup(conversation_id="conv-other") is None
+    assert lookup(conversation_id="conv-other", customer_phone="0999999999") is None
+
+
+def test_fast_path_does_not_reveal_foreign_order(monkeypatch):
+    _orders_db(monkeypatch, {"id": 123, "status": "shipping", "conversation_id": "conv-owner", "customer_phone": "0901234567"})
+    monkeypatch.setattr(fast_path_handler, "fetch_order_status", agent_service.fetch_order_status)
+
+    assert _intent(_turn("đơn #123 sao rồi", conversation_id="conv-other", phone="0988888888")) is None
+    assert _intent(_turn("đơn #123 sao rồi", conversation_id="conv-owner")) == "order_lookup"
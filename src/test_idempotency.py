@@ -0,0 +1,225 @@
+# test_idempotency.py
+# Dedupe tin nhắn: chạy đúng một lần, join khi đang xử lý, alias của tin đã gộp,
+# lỗi → nhả key, lưu bền qua chatbot_processed_messages
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from .models.types import ChatRequest
+from .routes.chat import _build_message_body
+from .services import idempotency_service
+from .services.idempotency_service import IdempotencyIndex, build_idempotency_key
+
+
+class ProcessingError(Exception):
+    pass
+
+
+def _duplicate(result):
+    return {"duplicate": True, "result": result}
+
+
+def _index(**kwargs):
+    return IdempotencyIndex(ttl_seconds=60, max_keys=100, **kwargs)
+
+
+def test_run_once_runs_fn_once_per_key():
+    calls = []
+
+    async def handle():
+        calls.append(True)
+        return {"text": "Dạ"}
+
+    async def scenario():
+        index = _index()
+        first = await index.run_once("facebook:m1", handle, _duplicate)
+        second = await index.run_once("facebook:m1", handle, _duplicate)
+        return index, first, second
+
+    index, first, second = asyncio.run(scenario())
+    assert calls == [True]
+    assert first == {"text": "Dạ"}
+    assert second == {"duplicate": True, "result": {"text": "Dạ"}}
+    assert index.stats()["memory_hits"] == 1
+
+
+def test_redelivery_while_in_flight_joins_first_run():
+    async def scenario():
+        index = _index()
+        release = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append(True)
+            await release.wait()
+            return {"text": "Dạ"}
+
+        first = asyncio.ensure_future(index.run_once("facebook:m1", slow, _duplicate))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(index.run_once("facebook:m1", slow, _duplicate))
+        await asyncio.sleep(0)
+        release.set()
+        return index, calls, await first, await second
+
+    index, calls, first, second = asyncio.run(scenario())
+    assert calls == [True]
+    assert first == {"text": "Dạ"}
+    assert second == _duplicate({"text": "Dạ"})
+    assert index.stats()["in_flight_joins"] == 1
+
+
+def test_aliases_share_the_merged_turn():
+    async def handle():
+        return {"text": "merged"}
+
+    async def scenario():
+        index = _index()
+        await index.run_once("website:c1:3", handle, _duplicate, aliases=["website:c1:1", "website:c1:2"])
+        return index, await index.run_once("website:c1:1", handle, _duplicate)
+
+    index, redelivered = asyncio.run(scenario())
+    assert redelivered == _duplicate({"text": "merged"})
+    assert index.seen("website:c1:2")
+
+
+def test_failure_releases_key_and_aliases():
+    calls = []
+
+    async def flaky():
+        calls.append(True)
+        if len(calls) == 1:
+            raise ProcessingError("gemini 503")
+        return {"text": "Dạ"}
+
+    async def scenario():
+        index = _index()
+        with pytest.raises(ProcessingError):
+            await index.run_once("website:c1:2", flaky, _duplicate, aliases=["website:c1:1"])
+        assert not index.seen("website:c1:1")
+        return await index.run_once("website:c1:2", flaky, _duplicate)
+
+    assert asyncio.run(scenario()) == {"text": "Dạ"}
+    assert len(calls) == 2
+
+
+def test_claim_cancelled_stream_lets_redelivery_run():
+    async def scenario():
+        index = _index()
+        claim = await index.claim("website:c1:1")
+        assert claim.owner
+        # Client ngắt stream giữa chừng
+        await claim.fail(GeneratorExit())
+        retry = await index.claim("website:c1:1")
+        assert retry.owner
+        await retry.complete({"text": "Dạ"})
+        duplicate = await index.claim("website:c1:1")
+        assert not duplicate.owner and duplicate.result == {"text": "Dạ"}
+
+    asyncio.run(scenario())
+
+
+def test_persisted_key_from_another_process_is_not_reprocessed(monkeypatch):
+    index = _index(persist=True)
+    stored = {}
+    released = []
+
+    async def claim_persisted(key):
+        if key == "facebook:m-other":
+            return False, {"text": "from worker 2"}
+        return True, None
+
+    async def store_persisted(key, result):
+        stored[key] = result
+
+    async def release_persisted(key):
+        released.append(key)
+
+    monkeypatch.setattr(index, "_claim_persisted", claim_persisted)
+    monkeypatch.setattr(index, "_store_persisted", store_persisted)
+    monkeypatch.setattr(index, "_release_persisted", release_persisted)
+
+    async def handle():
+        return {"text": "Dạ"}
+
+    async def failing():
+        raise ProcessingError("timeout")
+
+    async def scenario():
+        other = await index.run_once("facebook:m-other", handle, _duplicate)
+        mine = await index.run_once("facebook:m1", handle, _duplicate)
+        with pytest.raises(ProcessingError):
+            await index.run_once("facebook:m2", failing, _duplicate)
+        return other, mine
+
+    other, mine = asyncio.run(scenario())
+    assert other == _duplicate({"text": "from worker 2"})
+    assert mine == {"text": "Dạ"}
+    assert stored == {"facebook:m1": {"text": "Dạ"}}
+    assert released == ["facebook:m2"]
+    assert index.stats()["persisted_hits"] == 1
+
+
+class _Query:
+    def __init__(self, client, op):
+        self._client = client
+        self._op = op
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        if self._op == "insert" and self._client.duplicate:
+            raise APIError({"code": "23505", "message": "duplicate key value"})
+        data = [{"result": {"text": "cached"}}] if self._op == "select" else []
+        return type("Response", (), {"data": data})()
+
+
+class _Table:
+    def __init__(self, client):
+        self._client = client
+
+    def insert(self, row):
+        return _Query(self._client, "insert")
+
+    def select(self, columns):
+        return _Query(self._client, "select")
+
+
+class _Supabase:
+    def __init__(self, duplicate):
+        self.duplicate = duplicate
+
+    def from_(self, table):
+        assert table == idempotency_service.PROCESSED_MESSAGES_TABLE
+        return _Table(self)
+
+
+def test_claim_persisted_treats_unique_violation_as_processed(monkeypatch):
+    index = _index(persist=True)
+
+    monkeypatch.setattr(idempotency_service, "get_async_supabase_client", lambda: _Supabase(duplicate=False))
+    assert asyncio.run(index._claim_persisted("facebook:m1")) == (True, None)
+
+    monkeypatch.setattr(idempotency_service, "get_async_supabase_client", lambda: _Supabase(duplicate=True))
+    assert asyncio.run(index._claim_persisted("facebook:m1")) == (False, {"text": "cached"})
+
+
+def test_idempotency_key_scopes_website_ids():
+    assert build_idempotency_key({"platform": "facebook", "message_id": "m.1"}) == "facebook:m.1"
+    assert build_idempotency_key({"platform": "website", "conversation_id": "c1", "message_id": "7"}) == "website:c1:7"
+    assert build_idempotency_key({"platform": "website", "session_id": "s1", "message_id": "7"}) == "website:s1:7"
+    assert build_idempotency_key({"platform": "website"}) is None
+
+
+def test_client_message_id_requires_a_stable_scope():
+    retry = ChatRequest(message="chốt đơn", clientMessageId="c-7")
+    # Không có session / conversation / phone → session uuid4 mới mỗi lần, không dedupe được
+    with pytest.raises(HTTPException) as error:
+        _build_message_body(retry, None)
+    assert error.value.status_code == 400
+
+    first = build_idempotency_key(_build_message_body(retry, "s-1"))
+    assert first == build_idempotency_key(_build_message_body(retry, "s-1")) == "website:s-1:c-7"
+    assert _build_message_body(ChatRequest(message="hi"), None)["session_id"]
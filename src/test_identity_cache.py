@@ -0,0 +1,146 @@
+# test_identity_cache.py
+# Identity cache: hit / single-flight, không cache kết quả rỗng / khách ẩn danh, TTL, forget khi đang load
+import asyncio
+
+from .services import identity_cache_service
+from .services.identity_cache_service import IdentityCache
+from .utils import lru_ttl
+
+BODY = {"platform": "facebook", "customer_fb_id": "fb-1"}
+
+
+class _Loader:
+    """RPC get-or-create giả: đếm số lần gọi, có thể chặn tới khi `release`"""
+
+    def __init__(self, *values, blocked=False):
+        self.values = list(values)
+        self.calls = 0
+        self.release = asyncio.Event()
+        if not blocked:
+            self.release.set()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        return self.values.pop(0) if len(self.values) > 1 else self.values[0]
+
+
+def _cache(monkeypatch, ttl=300.0, max_keys=100):
+    monkeypatch.setattr(identity_cache_service.settings, "IDENTITY_CACHE_TTL_SECONDS", ttl)
+    return IdentityCache(ttl_seconds=ttl, max_keys=max_keys)
+
+
+def test_identity_key_requires_an_identifier():
+    assert IdentityCache.identity_key(BODY) == ("facebook", "fb-1", None, None, None)
+    assert IdentityCache.identity_key({"platform": "website"}) is None
+
+
+def test_resolves_once_then_hits(monkeypatch):
+    cache = _cache(monkeypatch)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        loader = _Loader("conv-1")
+        first = await cache.resolve_conversation(key, loader)
+        second = await cache.resolve_conversation(key, loader)
+        return loader.calls, first, second
+
+    assert asyncio.run(scenario()) == (1, "conv-1", "conv-1")
+    stats = cache.stats()
+    assert stats["conversation_hits"] == 1 and stats["conversation_misses"] == 1 and stats["rpc_saved"] == 1
+
+
+def test_concurrent_misses_share_one_rpc(monkeypatch):
+    cache = _cache(monkeypatch)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        loader = _Loader("conv-1", blocked=True)
+        tasks = [asyncio.create_task(cache.resolve_conversation(key, loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        return loader.calls, await asyncio.gather(*tasks)
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 1 and results == ["conv-1"] * 5
+    assert cache.stats()["single_flight_joins"] == 4
+
+
+def test_empty_result_and_anonymous_are_not_cached(monkeypatch):
+    cache = _cache(monkeypatch)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        failed = _Loader(None)
+        assert await cache.resolve_conversation(key, failed) is None
+        assert await cache.resolve_conversation(key, _Loader("conv-1")) == "conv-1"
+        anonymous = _Loader("conv-2")
+        await cache.resolve_conversation(None, anonymous)
+        await cache.resolve_conversation(None, anonymous)
+        return anonymous.calls
+
+    assert asyncio.run(scenario()) == 2
+    assert cache.stats()["conversations"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lru_ttl.time, "monotonic", lambda: now[0])
+    cache = _cache(monkeypatch, ttl=60.0)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        loader = _Loader("conv-1", "conv-2")
+        await cache.resolve_conversation(key, loader)
+        now[0] += 61
+        return await cache.resolve_conversation(key, loader), loader.calls
+
+    assert asyncio.run(scenario()) == ("conv-2", 2)
+
+
+def test_forget_conversation_drops_both_mappings(monkeypatch):
+    cache = _cache(monkeypatch)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        await cache.resolve_conversation(key, _Loader("conv-1"))
+        cache.remember_profile("conv-1", "profile-1")
+        assert await cache.resolve_profile("conv-1", _Loader("unused")) == "profile-1"
+
+        cache.forget_conversation("conv-1")
+        conversation = await cache.resolve_conversation(key, _Loader("conv-2"))
+        profile = await cache.resolve_profile("conv-1", _Loader("profile-2"))
+        return conversation, profile
+
+    assert asyncio.run(scenario()) == ("conv-2", "profile-2")
+
+
+def test_forget_during_in_flight_load_is_not_cached(monkeypatch):
+    cache = _cache(monkeypatch)
+
+    async def scenario():
+        stale = _Loader("profile-old", blocked=True)
+        pending = asyncio.create_task(cache.resolve_profile("conv-1", stale))
+        await asyncio.sleep(0)
+        # Conversation bị xóa trong lúc RPC cũ còn chạy
+        cache.forget_conversation("conv-1")
+        stale.release.set()
+        assert await pending == "profile-old"
+
+        fresh = _Loader("profile-new")
+        return await cache.resolve_profile("conv-1", fresh), fresh.calls
+
+    assert asyncio.run(scenario()) == ("profile-new", 1)
+
+
+def test_disabled_always_calls_loader(monkeypatch):
+    cache = _cache(monkeypatch, ttl=0)
+    key = IdentityCache.identity_key(BODY)
+
+    async def scenario():
+        loader = _Loader("conv-1")
+        await cache.resolve_conversation(key, loader)
+        await cache.resolve_conversation(key, loader)
+        return loader.calls
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,133 @@
+# test_intent_router.py
+# Intent router: bảng route rules-only (không model), ngữ cảnh bot vừa hỏi, feature train = serve
+import asyncio
+from pathlib import Path
+
+from .agent import intent_router as intent_router_module
+from .utils import connect_supabase
+from .agent.intent_router import (
+    INTENT_ORDER,
+    INTENT_PRODUCT,
+    INTENT_SUPPORT,
+    INTENT_TRIAGE,
+    IntentRouter,
+    extract_features,
+    train_model,
+)
+
+
+def _rules_only_router(shadow_rate=0.0):
+    return IntentRouter(threshold=0.6, shadow_rate=shadow_rate, model_path="/nonexistent/intent_model.json")
+
+
+def _bot_asked(text):
+    return {"history": [
+        {"sender_type": "customer", "content": {"text": "áo linen còn không"}},
+        {"sender_type": "bot", "content": {"text": text}},
+    ]}
+
+
+ROUTING_TABLE = [
+    ("cho em xem mẫu váy linen", INTENT_PRODUCT),
+    ("áo này còn size M không", INTENT_PRODUCT),
+    ("chốt đơn giúp em", INTENT_ORDER),
+    ("áo này size M, chốt đơn luôn", INTENT_ORDER),
+    ("kiểm tra mã đơn giúp em", INTENT_ORDER),
+    ("em muốn đổi trả hàng", INTENT_SUPPORT),
+    ("phí ship bao nhiêu vậy", INTENT_SUPPORT),
+    ("xin chào shop", INTENT_TRIAGE),
+    ("cảm ơn nha", INTENT_TRIAGE),
+    # support + order cùng khớp → không chắc → triage
+    ("đơn hàng của em bị lỗi", INTENT_TRIAGE),
+]
+
+
+def test_rules_only_routing_table(monkeypatch):
+    monkeypatch.setattr(intent_router_module.settings, "INTENT_ROUTER_ENABLED", True)
+    router = _rules_only_router()
+    assert router.stats()["model_loaded"] is False
+    for text, expected in ROUTING_TABLE:
+        route = router.route(text)
+        assert route.intent == expected, text
+        assert route.source == ("rule" if expected != INTENT_TRIAGE else "fallback"), text
+
+
+def test_bot_asked_order_info_routes_reply_to_order(monkeypatch):
+    monkeypatch.setattr(intent_router_module.settings, "INTENT_ROUTER_ENABLED", True)
+    router = _rules_only_router()
+    context = _bot_asked("Chị cho em xin số điện thoại để xác nhận đơn nhé?")
+    assert router.route("ok em", context).intent == INTENT_ORDER
+    # Khiếu nại vẫn thắng ngữ cảnh đơn hàng
+    assert router.route("hàng bị lỗi rồi", context).intent == INTENT_SUPPORT
+
+
+def test_disabled_and_shadow(monkeypatch):
+    monkeypatch.setattr(intent_router_module.settings, "INTENT_ROUTER_ENABLED", False)
+    assert _rules_only_router().route("chốt đơn").source == "disabled"
+
+    monkeypatch.setattr(intent_router_module.settings, "INTENT_ROUTER_ENABLED", True)
+    router = _rules_only_router(shadow_rate=1.0)
+    route = router.route("chốt đơn")
+    assert route.intent == INTENT_TRIAGE and route.predicted == INTENT_ORDER and route.shadow
+    router.record_outcome(route, INTENT_ORDER, duration_s=1.0, llm_requests=2)
+    assert router.stats()["accuracy"] == 1.0
+
+
+def test_context_features_match_between_training_and_serving():
+    context = _bot_asked("Em giao về địa chỉ cũ phải không ạ?")
+    with_context = extract_features("vâng", context)
+    assert with_context != extract_features("vâng")
+    # Giỏ hàng không tái tạo được lúc train → không ảnh hưởng feature
+    assert extract_features("vâng", {**context, "cart": [{"id": 1}]}) == with_context
+
+
+def test_trained_model_roundtrip(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(intent_router_module.settings, "INTENT_ROUTER_ENABLED", True)
+    samples = [(extract_features(text), label) for text, label in [
+        ("cho em xem mẫu mới", INTENT_PRODUCT),
+        ("có mẫu nào đẹp không", INTENT_PRODUCT),
+        ("em lấy cái này nhé", INTENT_ORDER),
+        ("lấy em hai cái", INTENT_ORDER),
+    ] * 5]
+    path = tmp_path / "intent_model.json"
+    train_model(samples).dump(path, samples=len(samples))
+
+    router = IntentRouter(threshold=0.0, shadow_rate=0.0, model_path=str(path))
+    assert router.stats()["model_loaded"] is True
+    intent, _, source = router.predict("em lấy cái kia nhé")
+    assert (intent, source) == (INTENT_ORDER, "model")
+
+
+class _Query:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def range(self, start, end):
+        return _Query(self._rows[start:end + 1])
+
+    async def execute(self):
+        return type("Resp", (), {"data": self._rows})()
+
+
+def test_training_samples_carry_conversation_context(monkeypatch):
+    asked = {"text": "Chị cho em xin số điện thoại để xác nhận đơn nhé?"}
+    rows = [
+        {"conversation_id": "c1", "sender_type": "customer", "content": {"text": "em muốn đặt áo"}},
+        {"conversation_id": "c1", "sender_type": "bot", "content": asked},
+        {"conversation_id": "c1", "sender_type": "customer", "content": {"text": "vâng"}},
+        {"conversation_id": "c1", "sender_type": "bot", "content": {"text": "Em xác nhận đơn hàng rồi ạ"}},
+        # Hội thoại mới: không mang history của c1 sang
+        {"conversation_id": "c2", "sender_type": "customer", "content": {"text": "vâng"}},
+        {"conversation_id": "c2", "sender_type": "bot", "content": {"text": "Em xác nhận đơn hàng rồi ạ"}},
+    ]
+    client = type("Client", (), {"from_": lambda self, table: _Query(rows)})()
+    monkeypatch.setattr(connect_supabase, "get_async_supabase_client", lambda: client)
+
+    samples = asyncio.run(intent_router_module._load_training_samples(100))
+
+    vectors = [vector for vector, label in samples if label == INTENT_ORDER]
+    assert vectors[-2] == extract_features("vâng", {"history": rows[:3]})
+    assert vectors[-1] == extract_features("vâng")
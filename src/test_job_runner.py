@@ -0,0 +1,184 @@
+# test_job_runner.py
+# Job runner: retry + backoff, hết lượt retry, priority, hoãn khi agent đầy slot, drain
+import asyncio
+
+from .services import job_runner_service
+from .services.job_runner_service import JOB_PRIORITY_HIGH, JOB_PRIORITY_LOW, JobRunner
+
+
+class TransientError(Exception):
+    pass
+
+
+class _Admission:
+    """agent_admission giả: `busy` = còn turn đang chờ slot LLM"""
+
+    def __init__(self, busy=False):
+        self.busy = busy
+
+    def stats(self):
+        return {"queued": 1 if self.busy else 0, "in_flight": 0, "max_concurrent": 4}
+
+
+def _runner(monkeypatch, admission=None, workers=1, max_retries=2, max_defer=1.0, max_queue=100):
+    monkeypatch.setattr(job_runner_service, "agent_admission", admission or _Admission())
+    return JobRunner(
+        workers=workers,
+        max_queue=max_queue,
+        max_retries=max_retries,
+        backoff_base=0.01,
+        backoff_max=0.02,
+        max_defer=max_defer,
+        name="test",
+    )
+
+
+async def _wait_for(predicate, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_failed_job_is_retried_until_it_succeeds(monkeypatch):
+    runner = _runner(monkeypatch)
+    attempts = []
+
+    async def flaky():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise TransientError("supabase 503")
+
+    async def scenario():
+        assert runner.submit("extract_memory", flaky)
+        await _wait_for(lambda: runner.stats()["succeeded"] == 1)
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    stats = runner.stats()
+    assert len(attempts) == 3
+    assert stats["retried"] == 2 and stats["failed"] == 0
+
+
+def test_job_fails_after_max_retries(monkeypatch):
+    runner = _runner(monkeypatch, max_retries=1)
+    attempts = []
+
+    async def broken():
+        attempts.append(True)
+        raise TransientError("bad payload")
+
+    async def scenario():
+        runner.submit("embed", broken)
+        await _wait_for(lambda: runner.stats()["failed"] == 1)
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert runner.stats()["retried"] == 1
+
+
+def test_higher_priority_jobs_run_first(monkeypatch):
+    runner = _runner(monkeypatch)
+    order = []
+    release = asyncio.Event()
+
+    def job(name, wait=False):
+        async def run():
+            if wait:
+                await release.wait()
+            order.append(name)
+        return run
+
+    async def scenario():
+        runner.submit("blocker", job("blocker", wait=True))
+        await _wait_for(lambda: runner.stats()["in_flight"] == 1)
+        runner.submit("embedding", job("embedding"), priority=JOB_PRIORITY_LOW)
+        runner.submit("address", job("address"), priority=JOB_PRIORITY_HIGH)
+        release.set()
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert order == ["blocker", "address", "embedding"]
+
+
+def test_jobs_wait_while_live_turns_queue_for_the_agent(monkeypatch):
+    admission = _Admission(busy=True)
+    runner = _runner(monkeypatch, admission=admission)
+    ran = []
+
+    async def job():
+        ran.append(True)
+
+    async def scenario():
+        runner.submit("extract_memory", job)
+        await asyncio.sleep(0.15)
+        assert not ran
+        admission.busy = False
+        await _wait_for(lambda: ran)
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert runner.stats()["deferred"] == 1
+
+
+def test_defer_is_bounded(monkeypatch):
+    runner = _runner(monkeypatch, admission=_Admission(busy=True), max_defer=0.05)
+    ran = []
+
+    async def job():
+        ran.append(True)
+
+    async def scenario():
+        runner.submit("summary", job)
+        await _wait_for(lambda: ran)
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert runner.stats()["deferred"] == 1
+
+
+def test_drain_runs_pending_retries_and_rejects_new_jobs(monkeypatch):
+    runner = _runner(monkeypatch, max_retries=1)
+    runner._backoff_base = runner._backoff_max = 60.0
+    attempts = []
+
+    async def flaky():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise TransientError("timeout")
+
+    async def scenario():
+        runner.submit("sync_main_order", flaky)
+        await _wait_for(lambda: runner.stats()["scheduled_retries"] == 1)
+        # Retry đang chờ backoff 60s → drain chạy ngay, không bỏ job
+        await runner.drain(timeout=1)
+        return runner.submit("late", flaky)
+
+    accepted = asyncio.run(scenario())
+    assert len(attempts) == 2
+    assert runner.stats()["succeeded"] == 1
+    assert not accepted and runner.stats()["dropped"] == 1
+
+
+def test_full_queue_drops_jobs(monkeypatch):
+    runner = _runner(monkeypatch, max_queue=1)
+    release = asyncio.Event()
+
+    async def blocker():
+        await release.wait()
+
+    async def noop():
+        pass
+
+    async def scenario():
+        runner.submit("blocker", blocker)
+        await _wait_for(lambda: runner.stats()["in_flight"] == 1)
+        assert runner.submit("a", noop)
+        assert not runner.submit("b", noop)
+        release.set()
+        await runner.drain(timeout=1)
+
+    asyncio.run(scenario())
+    assert runner.stats()["dropped"] == 1
@@ -0,0 +1,206 @@
+# test_llm_resilience.py
+# Circuit breaker của LLM (closed → open → half_open → closed/open) + dừng run khi stream bị bỏ dở
+import asyncio
+
+import pytest
+from openai.types.responses import ResponseTextDeltaEvent
+
+from .agent import agent_service
+from .services.llm_resilience_service import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    LlmCircuitOpenError,
+    LlmResilience,
+)
+
+
+class ProviderError(Exception):
+    pass
+
+
+def _resilience(timeout=1.0, reset_seconds=60.0):
+    return LlmResilience(
+        timeout=timeout,
+        hedge_enabled=False,
+        hedge_min_delay=0.0,
+        hedge_min_samples=1,
+        failure_threshold=2,
+        reset_seconds=reset_seconds,
+    )
+
+
+async def _ok():
+    return "ok"
+
+
+async def _fail():
+    raise ProviderError("503")
+
+
+async def _call(resilience, factory):
+    try:
+        return await resilience.run("turn", factory)
+    except (ProviderError, asyncio.TimeoutError, LlmCircuitOpenError) as e:
+        return e
+
+
+def _elapse_reset(resilience):
+    """Giả lập đã hết LLM_BREAKER_RESET_SECONDS kể từ lúc OPEN"""
+    resilience._opened_at -= resilience._reset_seconds
+
+
+def test_opens_after_consecutive_failures_and_short_circuits():
+    async def scenario():
+        resilience = _resilience()
+        assert isinstance(await _call(resilience, _fail), ProviderError)
+        assert resilience.stats()["state"] == STATE_CLOSED
+
+        assert isinstance(await _call(resilience, _fail), ProviderError)
+        assert resilience.stats()["state"] == STATE_OPEN
+
+        called = []
+
+        async def tracked():
+            called.append(True)
+            return "ok"
+
+        assert isinstance(await _call(resilience, tracked), LlmCircuitOpenError)
+        assert not called
+        assert resilience.stats()["short_circuits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_success_resets_failure_count():
+    async def scenario():
+        resilience = _resilience()
+        await _call(resilience, _fail)
+        assert await _call(resilience, _ok) == "ok"
+        await _call(resilience, _fail)
+        stats = resilience.stats()
+        assert stats["state"] == STATE_CLOSED
+        assert stats["consecutive_failures"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_success_closes():
+    async def scenario():
+        resilience = _resilience()
+        await _call(resilience, _fail)
+        await _call(resilience, _fail)
+        _elapse_reset(resilience)
+
+        probe_started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_ok():
+            probe_started.set()
+            await release.wait()
+            return "ok"
+
+        probe = asyncio.ensure_future(resilience.run("turn", slow_ok))
+        await probe_started.wait()
+        assert resilience.stats()["state"] == STATE_HALF_OPEN
+        # Chỉ một request thử khi HALF_OPEN
+        assert isinstance(await _call(resilience, _ok), LlmCircuitOpenError)
+
+        release.set()
+        assert await probe == "ok"
+        assert resilience.stats()["state"] == STATE_CLOSED
+        assert await _call(resilience, _ok) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_failure_reopens():
+    async def scenario():
+        resilience = _resilience()
+        await _call(resilience, _fail)
+        await _call(resilience, _fail)
+        _elapse_reset(resilience)
+
+        assert isinstance(await _call(resilience, _fail), ProviderError)
+        assert resilience.stats()["state"] == STATE_OPEN
+        assert isinstance(await _call(resilience, _ok), LlmCircuitOpenError)
+
+    asyncio.run(scenario())
+
+
+def test_timeouts_count_as_failures():
+    async def scenario():
+        resilience = _resilience(timeout=0.01)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        assert isinstance(await _call(resilience, hang), asyncio.TimeoutError)
+        assert isinstance(await _call(resilience, hang), asyncio.TimeoutError)
+        stats = resilience.stats()
+        assert stats["state"] == STATE_OPEN
+        assert stats["timeouts"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_stream_failure_opens_and_abandoned_probe_is_released():
+    async def broken_events():
+        yield "token"
+        raise ProviderError("stream reset")
+
+    async def endless_events():
+        while True:
+            yield "token"
+
+    async def scenario():
+        resilience = _resilience()
+        for _ in range(2):
+            with pytest.raises(ProviderError):
+                async for _ in resilience.stream("turn_streamed", broken_events()):
+                    pass
+        assert resilience.stats()["state"] == STATE_OPEN
+
+        _elapse_reset(resilience)
+        stream = resilience.stream("turn_streamed", endless_events())
+        assert await stream.__anext__() == "token"
+        # Client ngắt giữa chừng → probe được trả lại, request sau thử lại được
+        await stream.aclose()
+        assert resilience.stats()["state"] == STATE_HALF_OPEN
+        assert await _call(resilience, _ok) == "ok"
+        assert resilience.stats()["state"] == STATE_CLOSED
+
+    asyncio.run(scenario())
+
+
+class _StreamedRun:
+    """RunResultStreaming giả: một token rồi treo (model chậm)"""
+
+    def __init__(self):
+        self.cancelled = False
+        self.final_output = ""
+
+    async def stream_events(self):
+        data = ResponseTextDeltaEvent(
+            type="response.output_text.delta", delta="Dạ", item_id="i", output_index=0,
+            content_index=0, sequence_number=0, logprobs=[],
+        )
+        yield type("Event", (), {"type": "raw_response_event", "data": data})()
+        await asyncio.sleep(10)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def test_abandoned_stream_cancels_the_run(monkeypatch):
+    run = _StreamedRun()
+    monkeypatch.setattr(agent_service, "llm_resilience", _resilience())
+    monkeypatch.setattr(agent_service.Runner, "run_streamed", lambda agent, message: run)
+
+    async def scenario():
+        stream = agent_service.run_bewo_agent_streamed("còn size M không")
+        assert await stream.__anext__() == {"type": "token", "delta": "Dạ"}
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert run.cancelled
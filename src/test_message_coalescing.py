@@ -0,0 +1,152 @@
+# test_message_coalescing.py
+# Mailbox debounce (SenderOrderedQueue) + gộp tin (handle_message_batch)
+import asyncio
+
+from .handlers import message_handler
+from .services.idempotency_service import IdempotencyIndex
+from .services.webhook_queue_service import SenderOrderedQueue
+
+
+def _fb_body(text, mid):
+    return {"platform": "facebook", "customer_fb_id": "psid-1", "message_text": text, "message_id": mid}
+
+
+def _patch_turn(monkeypatch):
+    """_process_message giả: ghi lại body, trả câu trả lời theo text đã gộp"""
+    calls = []
+
+    async def fake_process(body):
+        calls.append(body)
+        return {"success": True, "response": f"reply:{body['message_text']}"}
+
+    monkeypatch.setattr(message_handler, "_process_message", fake_process)
+    monkeypatch.setattr(message_handler, "message_dedupe", IdempotencyIndex(ttl_seconds=60, max_keys=100))
+    return calls
+
+
+def test_batch_drops_in_batch_duplicates(monkeypatch):
+    calls = _patch_turn(monkeypatch)
+    bodies = [_fb_body("hi", "m1"), _fb_body("hi", "m1"), _fb_body("còn size M không", "m2")]
+
+    results = asyncio.run(message_handler.handle_message_batch(bodies))
+
+    assert len(calls) == 1
+    assert calls[0]["merged_texts"] == ["hi", "còn size M không"]
+    assert calls[0]["message_text"] == "hi\ncòn size M không"
+    assert results[1]["duplicate"] is True
+    assert results[2] == {"success": True, "response": "reply:hi\ncòn size M không"}
+
+
+def test_every_caller_gets_the_merged_answer(monkeypatch):
+    _patch_turn(monkeypatch)
+    bodies = [_fb_body("chị ơi", "m1"), _fb_body("mẫu này", "m2")]
+
+    results = asyncio.run(message_handler.handle_message_batch(bodies))
+
+    assert results[0]["response"] == results[1]["response"] == "reply:chị ơi\nmẫu này"
+    assert results[0]["coalesced"] is True
+    assert "coalesced" not in results[1]
+
+
+def test_batch_skips_messages_already_processed(monkeypatch):
+    calls = _patch_turn(monkeypatch)
+
+    async def run():
+        await message_handler.handle_message(_fb_body("hi", "m1"))
+        return await message_handler.handle_message_batch([_fb_body("hi", "m1"), _fb_body("mẫu 2", "m2")])
+
+    results = asyncio.run(run())
+
+    assert [c["message_text"] for c in calls] == ["hi", "mẫu 2"]
+    assert results[0]["duplicate"] is True
+    assert results[1]["response"] == "reply:mẫu 2"
+
+
+def test_queue_debounce_coalesces_rapid_messages():
+    batches = []
+
+    async def handler(items):
+        batches.append([item["text"] for item in items])
+        return [len(batches)] * len(items)
+
+    async def run():
+        queue = SenderOrderedQueue(handler, workers=2, max_size=10, name="test",
+                                   debounce_seconds=0.05, max_wait_seconds=0.5, max_batch=5)
+        calls = []
+        for text in ("a", "b", "c"):
+            calls.append(asyncio.create_task(queue.call("k", {"text": text})))
+            await asyncio.sleep(0.01)
+        results = await asyncio.gather(*calls)
+        await queue.stop()
+        return results, queue.stats()
+
+    results, stats = asyncio.run(run())
+
+    assert batches == [["a", "b", "c"]]
+    assert results == [1, 1, 1]
+    assert stats["turns"] == 1 and stats["coalesced"] == 2
+
+
+def test_exclusive_turn_is_ordered_with_queued_messages():
+    events = []
+
+    async def handler(items):
+        events.append(("batch", [item["text"] for item in items]))
+        await asyncio.sleep(0.02)
+        return [None] * len(items)
+
+    async def stream():
+        async with queue.exclusive("k"):
+            events.append(("stream", "start"))
+            await asyncio.sleep(0.05)
+            events.append(("stream", "end"))
+
+    async def run():
+        before = asyncio.create_task(queue.call("k", {"text": "a"}))
+        await asyncio.sleep(0)
+        held = asyncio.create_task(stream())
+        await asyncio.sleep(0)
+        after = [asyncio.create_task(queue.call("k", {"text": t})) for t in ("b", "c")]
+        await asyncio.gather(before, held, *after)
+        await queue.stop()
+
+    queue = SenderOrderedQueue(handler, workers=4, max_size=10, name="test",
+                               debounce_seconds=0.01, max_wait_seconds=0.1, max_batch=5)
+    asyncio.run(run())
+
+    assert events == [
+        ("batch", ["a"]),
+        ("stream", "start"),
+        ("stream", "end"),
+        ("batch", ["b", "c"]),
+    ]
+
+
+def test_worker_survives_cancelled_error_from_handler():
+    handled = []
+
+    async def handler(items):
+        text = items[0]["text"]
+        if text == "joined-cancelled-turn":
+            # Join dedupe của một turn đã bị hủy → CancelledError bay ra từ handler
+            raise asyncio.CancelledError()
+        handled.append(text)
+        return ["ok"]
+
+    async def run():
+        queue = SenderOrderedQueue(handler, workers=1, max_size=10, name="test")
+        first = asyncio.create_task(queue.call("k", {"text": "joined-cancelled-turn"}))
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        second = await asyncio.wait_for(queue.call("k", {"text": "next"}), timeout=1)
+        stats = queue.stats()
+        await queue.stop()
+        return first.cancelled(), second, stats
+
+    first_cancelled, second, stats = asyncio.run(run())
+    assert first_cancelled
+    assert second == "ok"
+    assert handled == ["next"]
+    assert stats["failed"] == 1
@@ -0,0 +1,114 @@
+# test_product_cache.py
+# Product cache: single-flight, invalidate trong lúc đang load không cache giá cũ
+import asyncio
+
+from .services.product_cache_service import ProductCache, normalize_query
+from .utils.lru_ttl import LruTtlCache
+
+
+class _Catalog:
+    """Bảng products giả: search() chờ `gate` (query Supabase đang chạy) rồi trả giá lúc BẮT ĐẦU đọc"""
+
+    def __init__(self):
+        self.price = 100
+        self.queries = 0
+        self.gate = None
+
+    async def search(self, query, limit):
+        self.queries += 1
+        price = self.price
+        if self.gate is not None:
+            await self.gate.wait()
+        return [{"id": "1", "name": "Váy linen", "price": price}]
+
+    async def details(self, product_id):
+        return {"id": product_id, "price": self.price}
+
+
+def _cache(catalog):
+    # warm_top=0: không đẩy job pre-warm vào job_runner dùng chung
+    cache = ProductCache(ttl_seconds=300, max_entries=100, warm_top=0)
+    cache.register_loaders(catalog.search, catalog.details)
+    return cache
+
+
+def test_concurrent_misses_share_one_query():
+    catalog = _Catalog()
+    cache = _cache(catalog)
+
+    async def scenario():
+        catalog.gate = asyncio.Event()
+        pending = [asyncio.ensure_future(cache.search("Váy  LINEN!!", 5)) for _ in range(5)]
+        await asyncio.sleep(0)
+        catalog.gate.set()
+        results = await asyncio.gather(*pending)
+        again = await cache.search("váy linen", 5)
+        return results, again
+
+    results, again = asyncio.run(scenario())
+    assert catalog.queries == 1
+    assert all(result == results[0] for result in results)
+    assert again == results[0]
+    assert cache.stats()["single_flight_joins"] == 4
+
+
+def test_invalidate_during_load_does_not_cache_old_price():
+    catalog = _Catalog()
+    cache = _cache(catalog)
+
+    async def scenario():
+        catalog.gate = asyncio.Event()
+        in_flight = asyncio.ensure_future(cache.search("váy linen", 5))
+        await asyncio.sleep(0)
+        # Admin đổi giá trong lúc query đang chạy
+        catalog.price = 200
+        cache.invalidate("1", reason="stock_update")
+        catalog.gate.set()
+        stale = await in_flight
+        catalog.gate = None
+        return stale, await cache.search("váy linen", 5)
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale[0]["price"] == 100
+    assert fresh[0]["price"] == 200
+    assert catalog.queries == 2
+
+
+def test_callers_after_invalidate_do_not_join_the_old_load():
+    cache: LruTtlCache[str, int] = LruTtlCache(ttl_seconds=60, max_keys=10)
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def old_load():
+            await gate.wait()
+            return 1
+
+        async def new_load():
+            return 2
+
+        first = asyncio.ensure_future(cache.get_or_load("k", old_load))
+        await asyncio.sleep(0)
+        cache.pop("k")
+        second = await cache.get_or_load("k", new_load)
+        gate.set()
+        return await first, second
+
+    assert asyncio.run(scenario()) == (1, 2)
+    assert cache.get("k") == 2
+
+
+def test_results_are_copies():
+    catalog = _Catalog()
+    cache = _cache(catalog)
+
+    async def scenario():
+        first = await cache.search("váy linen", 5)
+        first[0]["price"] = 0
+        return await cache.search("váy linen", 5)
+
+    assert asyncio.run(scenario())[0]["price"] == 100
+
+
+def test_normalize_query():
+    assert normalize_query("  Váy  LINEN!! ") == "váy linen"
@@ -0,0 +1,101 @@
+# test_rate_limit.py
+# Inbound filter: flood chỉ tính trong cửa sổ thời gian, bucket kiểm tra hết rồi mới trừ,
+# batch đi qua cùng bộ lọc
+import asyncio
+
+from .config.env import settings
+from .handlers import batch_handler
+from .services import rate_limit_service
+from .services.rate_limit_service import InboundFilter, TokenBucketLimiter
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limit_service.time, "monotonic", clock)
+    return clock
+
+
+def test_repeated_text_in_quick_succession_is_flood(monkeypatch):
+    clock = _clock(monkeypatch)
+    inbound = InboundFilter()
+    reasons = []
+    for _ in range(settings.SPAM_MAX_REPEATS + 1):
+        reasons.append(inbound.check("facebook:psid-1", "mua ngay"))
+        clock.now += 1
+    assert reasons[:-1] == [None] * settings.SPAM_MAX_REPEATS
+    assert reasons[-1] == "flood"
+
+
+def test_same_short_reply_over_a_day_is_not_flood(monkeypatch):
+    clock = _clock(monkeypatch)
+    inbound = InboundFilter()
+    for _ in range(settings.SPAM_MAX_REPEATS + 3):
+        assert inbound.check("facebook:psid-1", "ok") is None
+        clock.now += settings.SPAM_REPEAT_WINDOW_SECONDS + 60
+
+
+def test_flood_ends_once_window_passes(monkeypatch):
+    clock = _clock(monkeypatch)
+    inbound = InboundFilter()
+    for _ in range(settings.SPAM_MAX_REPEATS + 1):
+        inbound.check("facebook:psid-1", "vâng")
+    assert inbound.check("facebook:psid-1", "vâng") == "flood"
+    clock.now += settings.SPAM_REPEAT_WINDOW_SECONDS + 1
+    assert inbound.check("facebook:psid-1", "vâng") is None
+
+
+def test_sender_bucket_is_not_drained_by_ip_rejections(monkeypatch):
+    _clock(monkeypatch)
+    inbound = InboundFilter()
+    ip_limiter = TokenBucketLimiter(rate_per_second=0.0, burst=1, max_keys=10)
+    sender_limiter = TokenBucketLimiter(rate_per_second=0.0, burst=3, max_keys=10)
+    inbound._limiters["ip"] = ip_limiter
+    inbound._limiters["sender"] = sender_limiter
+
+    assert inbound.check("website:s1", "chào shop", client_ip="1.2.3.4") is None
+    for text in ("còn size M không", "phí ship bao nhiêu", "đổi trả thế nào"):
+        assert inbound.check("website:s1", text, client_ip="1.2.3.4") == "rate_limited:ip"
+    # Bucket sender chỉ bị trừ cho tin đã qua → IP khác vẫn gửi được
+    assert inbound.check("website:s1", "còn size M không", client_ip="5.6.7.8") is None
+    assert sender_limiter.stats()["allowed"] == 2
+
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    clock = _clock(monkeypatch)
+    limiter = TokenBucketLimiter(rate_per_second=1.0, burst=2, max_keys=10)
+    assert limiter.allow("k") and limiter.allow("k")
+    assert not limiter.allow("k")
+    clock.now += 1.0
+    assert limiter.allow("k")
+    assert limiter.stats() == {"keys": 1, "allowed": 3, "limited": 1}
+
+
+def test_batch_returns_rejected_items_without_running_them(monkeypatch):
+    handled = []
+
+    class _Queue:
+        async def call(self, key, body):
+            handled.append(body["message_text"])
+            return {"success": True, "response": "Dạ"}
+
+    monkeypatch.setattr(batch_handler, "website_queue", _Queue())
+    bodies = [
+        {"platform": "website", "session_id": "s1", "message_text": "chào shop"},
+        {"platform": "website", "session_id": "s2", "message_text": ""},
+    ]
+
+    async def collect():
+        return [item async for item in batch_handler.process_batch(bodies, rejected={1: "empty"})]
+
+    items = sorted(asyncio.run(collect()), key=lambda item: item["index"])
+    assert handled == ["chào shop"]
+    assert items[0]["success"] is True
+    assert items[1]["success"] is False and items[1]["error"] == "empty"
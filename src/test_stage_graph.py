@@ -0,0 +1,113 @@
+# test_stage_graph.py
+# StageGraph: stage độc lập chạy song song, dependency chờ nhau, lỗi hủy phần còn lại, critical path
+import asyncio
+
+import pytest
+
+from .services.stage_graph import StageGraph, sequential_stage
+
+
+class StageError(Exception):
+    pass
+
+
+def _sleeper(seconds, value=None, log=None, name=None):
+    async def stage(results):
+        if log is not None:
+            log.append(("start", name, sorted(results)))
+        await asyncio.sleep(seconds)
+        if log is not None:
+            log.append(("end", name))
+        return value
+    return stage
+
+
+def test_stage_runs_after_its_dependencies_with_their_results():
+    async def build_context(results):
+        return f"context for {results['conversation']}"
+
+    graph = StageGraph()
+    graph.add("conversation", _sleeper(0.01, "c1"))
+    graph.add("build_context", build_context, after=["conversation"])
+    results = asyncio.run(graph.run())
+    assert results == {"conversation": "c1", "build_context": "context for c1"}
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    graph = StageGraph()
+    graph.add("conversation", _sleeper(0.01, log=log, name="conversation"))
+    graph.add("save_message", _sleeper(0.1, log=log, name="save_message"), after=["conversation"])
+    graph.add("build_context", _sleeper(0.1, log=log, name="build_context"), after=["conversation"])
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await graph.run()
+        return loop.time() - started
+
+    elapsed = asyncio.run(timed())
+    assert elapsed < 0.18
+    starts = [entry for entry in log if entry[0] == "start"]
+    assert starts[0][1] == "conversation"
+    assert {entry[1] for entry in starts[1:]} == {"save_message", "build_context"}
+    assert all(entry[2] == ["conversation"] for entry in starts[1:])
+
+
+def test_undeclared_dependency_is_rejected():
+    graph = StageGraph()
+    with pytest.raises(ValueError):
+        graph.add("build_context", _sleeper(0), after=["conversation"])
+
+
+def test_failed_stage_cancels_the_rest_and_raises():
+    cancelled = []
+
+    async def slow(results):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def broken(results):
+        raise StageError("supabase down")
+
+    ran = []
+
+    async def dependent(results):
+        ran.append(True)
+
+    graph = StageGraph()
+    graph.add("slow", slow)
+    graph.add("broken", broken)
+    graph.add("dependent", dependent, after=["broken"])
+    with pytest.raises(StageError):
+        asyncio.run(graph.run())
+    assert cancelled == [True]
+    assert not ran
+
+
+def test_critical_path_follows_the_slowest_chain():
+    graph = StageGraph()
+    graph.add("conversation", _sleeper(0.02))
+    graph.add("save_message", _sleeper(0.01), after=["conversation"])
+    graph.add("build_context", _sleeper(0.08), after=["conversation"])
+    graph.add("fast_path", _sleeper(0.01), after=["build_context"])
+    asyncio.run(graph.run())
+
+    path = graph.critical_path()
+    assert [stage for stage, _ in path] == ["conversation", "build_context", "fast_path"]
+    assert path[1][1] >= 0.07
+
+
+def test_sequential_stage_appends_to_path():
+    path = [("conversation", 0.01)]
+
+    async def scenario():
+        async with sequential_stage(path, "agent"):
+            await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert [stage for stage, _ in path] == ["conversation", "agent"]
+    assert path[1][1] >= 0.015
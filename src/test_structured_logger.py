@@ -0,0 +1,26 @@
+# test_structured_logger.py
+# Redact PII trong log: SĐT, field địa chỉ / tên, nội dung tin nhắn khách gõ
+from .utils.structured_logger import redact
+
+
+def test_message_text_is_replaced_by_length_and_hash():
+    text = "giao cho Lan ở 12 Nguyễn Trãi, Thanh Xuân nhé"
+    record = redact({"event": "chat_request", "text": text, "conversation_key": "website:s1"})
+    assert "Nguyễn Trãi" not in record["text"]
+    assert record["text"].startswith(f"[redacted chars={len(text)} sha1=")
+    # Cùng nội dung → cùng hash (đối chiếu tin gửi lặp)
+    assert redact({"text": text})["text"] == record["text"]
+    assert record["conversation_key"] == "website:s1"
+
+
+def test_phone_and_address_fields_are_masked():
+    record = redact({
+        "sender": "website:0901234567",
+        "customer_phone": "0901234567",
+        "shipping_address": "12 Nguyễn Trãi",
+        "products": 3,
+    })
+    assert record["sender"] == "website:*******567"
+    assert record["customer_phone"] == "*******567"
+    assert record["shipping_address"] == "[redacted]"
+    assert record["products"] == 3
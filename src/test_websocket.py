@@ -0,0 +1,56 @@
+# test_websocket.py
+# Session WebSocket: lỗi gửi trực tiếp (không task rời), heartbeat chờ các lần gửi xong
+import asyncio
+
+from starlette.websockets import WebSocketState
+
+from .handlers import websocket_handler
+from .handlers.websocket_handler import ChatSession, WebSocketHub
+from .utils.json_fast import loads
+
+
+class _FakeWebSocket:
+    application_state = WebSocketState.CONNECTED
+    client = None
+    headers = {}
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(loads(text))
+
+    async def close(self, code=1000):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def test_rejected_messages_are_answered_before_enqueue_returns():
+    websocket = _FakeWebSocket()
+    session = ChatSession(WebSocketHub(), websocket, {"platform": "website", "session_id": "s1"})
+
+    asyncio.run(session._enqueue({"message": "   ", "clientMessageId": "c1"}))
+
+    assert websocket.sent == [{"type": "error", "error": "Empty message"}]
+    assert not session.busy
+
+
+def test_heartbeat_pings_and_closes_idle_sessions(monkeypatch):
+    monkeypatch.setattr(websocket_handler.settings, "WS_HEARTBEAT_INTERVAL", 0.01)
+    monkeypatch.setattr(websocket_handler.settings, "WS_IDLE_TIMEOUT", 60.0)
+    hub = WebSocketHub()
+    active, idle = _FakeWebSocket(), _FakeWebSocket()
+    active_session = ChatSession(hub, active, {"platform": "website", "session_id": "s1"})
+    idle_session = ChatSession(hub, idle, {"platform": "website", "session_id": "s2"})
+    idle_session.last_seen -= 120
+
+    async def scenario():
+        hub._sessions.update({active_session, idle_session})
+        hub._ensure_heartbeat()
+        await asyncio.sleep(0.03)
+        hub._sessions.clear()
+        await asyncio.wait_for(hub._heartbeat, timeout=1)
+
+    asyncio.run(scenario())
+    assert {"type": "ping"} in active.sent
+    assert idle.application_state == WebSocketState.DISCONNECTED
+    assert hub.stats()["idle_closes"] >= 1
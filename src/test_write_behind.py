@@ -0,0 +1,125 @@
+# test_write_behind.py
+# Journal của write-behind buffer: ghi theo lô, replay sau crash, rewrite sau flush
+import asyncio
+
+from .services import write_behind_service
+from .services.write_behind_service import WriteBehindBuffer
+from .utils.json_fast import loads
+
+
+class NetworkError(Exception):
+    pass
+
+
+def _buffer(path, monkeypatch, fail=False):
+    """Buffer với insert giả (không gọi Supabase); fail=True → lỗi mạng"""
+    monkeypatch.setattr(write_behind_service, "get_async_supabase_client", lambda: object())
+    buffer = WriteBehindBuffer(batch_size=100, max_age=60, max_rows=1000, journal_path=str(path))
+    inserted = []
+
+    async def fake_insert(supabase, table, rows):
+        if fail:
+            raise NetworkError("connection reset")
+        inserted.extend((table, row) for row in rows)
+
+    buffer._insert = fake_insert
+    return buffer, inserted
+
+
+def _journal_rows(path):
+    return [loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+def test_rows_are_journaled_and_replayed_after_crash(tmp_path, monkeypatch):
+    path = tmp_path / "journal.jsonl"
+
+    async def crash_before_flush():
+        buffer, _ = _buffer(path, monkeypatch)
+        buffer.add("chatbot_usage_logs", {"tokens": 1})
+        buffer.add("conversation_embeddings", {"message_id": "m1"})
+        await asyncio.sleep(0.05)
+        # "Crash": bỏ task, không flush / stop
+        buffer._task.cancel()
+        buffer._journal_task.cancel()
+
+    asyncio.run(crash_before_flush())
+    assert _journal_rows(path) == [
+        {"table": "chatbot_usage_logs", "row": {"tokens": 1}},
+        {"table": "conversation_embeddings", "row": {"message_id": "m1"}},
+    ]
+
+    async def restart():
+        buffer, inserted = _buffer(path, monkeypatch)
+        buffer.start()
+        await buffer.stop()
+        return buffer.stats(), inserted
+
+    stats, inserted = asyncio.run(restart())
+    assert stats["replayed_rows"] == 2
+    assert sorted(inserted, key=str) == sorted([
+        ("chatbot_usage_logs", {"tokens": 1}),
+        ("conversation_embeddings", {"message_id": "m1"}),
+    ], key=str)
+    assert _journal_rows(path) == []
+
+
+def test_replay_skips_partially_written_last_line(tmp_path, monkeypatch):
+    path = tmp_path / "journal.jsonl"
+    path.write_text('{"table": "t", "row": {"a": 1}}\n{"table": "t", "ro', encoding="utf-8")
+
+    async def restart():
+        buffer, _ = _buffer(path, monkeypatch, fail=True)
+        buffer.start()
+        stats = buffer.stats()
+        buffer._task.cancel()
+        buffer._journal_task.cancel()
+        return stats
+
+    stats = asyncio.run(restart())
+    assert stats["replayed_rows"] == 1
+    assert stats["buffered"] == 1
+    assert _journal_rows(path) == [{"table": "t", "row": {"a": 1}}]
+
+
+def test_failed_flush_keeps_rows_in_journal(tmp_path, monkeypatch):
+    path = tmp_path / "journal.jsonl"
+
+    async def run():
+        buffer, _ = _buffer(path, monkeypatch, fail=True)
+        buffer.add("chatbot_usage_logs", {"tokens": 1})
+        await buffer.flush(force=True)
+        buffer.add("chatbot_usage_logs", {"tokens": 2})
+        await asyncio.sleep(0.05)
+        stats = buffer.stats()
+        buffer._task.cancel()
+        buffer._journal_task.cancel()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["buffered"] == 2
+    assert stats["failed_requests"] >= 1
+    # Rewrite sau flush lỗi + dòng append sau đó: mỗi row đúng một lần
+    assert _journal_rows(path) == [
+        {"table": "chatbot_usage_logs", "row": {"tokens": 1}},
+        {"table": "chatbot_usage_logs", "row": {"tokens": 2}},
+    ]
+
+
+def test_add_does_not_touch_the_journal_file(tmp_path, monkeypatch):
+    path = tmp_path / "journal.jsonl"
+
+    async def run():
+        buffer, _ = _buffer(path, monkeypatch)
+        buffer.start()
+        for i in range(50):
+            buffer.add("chatbot_usage_logs", {"tokens": i})
+        # Chưa nhường event loop → chưa có dòng nào được ghi
+        before = _journal_rows(path)
+        await asyncio.sleep(0.05)
+        after = _journal_rows(path)
+        await buffer.stop()
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert before == []
+    assert [entry["row"]["tokens"] for entry in after] == list(range(50))
@@ -1,7 +1,13 @@
 # src/utils/connect_supabase.py
 
-from supabase import create_client, Client
+import time
+from typing import Optional
+
+import httpx
+from supabase import create_client, Client, AsyncClient, AsyncClientOptions
 from ..config.env import settings
+from ..services.metrics_service import DB_ERRORS, DB_LATENCY, DB_REQUESTS
+from ..services.tracing_service import SPAN_KIND_CLIENT, record_span
 
 def create_supabase_client() -> Client:
     """
@@ -10,7 +16,7 @@ def create_supabase_client() -> Client:
     """
     print(f"Đang kết nối đến Supabase tại: {settings.SUPABASE_URL[:50]}...")
     client = create_client(
-        settings.SUPABASE_URL, 
+        settings.SUPABASE_URL,
         settings.SUPABASE_SERVICE_KEY
     )
     print("Khởi tạo Supabase client thành công.")
@@ -24,4 +30,88 @@ def get_supabase_client() -> Client:
     global _supabase_client
     if _supabase_client is None:
         _supabase_client = create_supabase_client()
-    return _supabase_client
\ No newline at end of file
+    return _supabase_client
+
+
+# ============================================
+# ASYNC CLIENT (non-blocking, dùng trong message path)
+# ============================================
+
+# Pool HTTP dùng chung: mọi AsyncClient đều đi qua cùng một connection pool
+_async_http_client: Optional[httpx.AsyncClient] = None
+_async_supabase_client: Optional[AsyncClient] = None
+
+def _db_target(request: httpx.Request) -> str:
+    # /rest/v1/chatbot_messages → chatbot_messages, /rest/v1/rpc/get_or_create_conversation → rpc/...
+    path = request.url.path
+    return path.split("/rest/v1/", 1)[1] if "/rest/v1/" in path else path
+
+async def _on_db_request(request: httpx.Request) -> None:
+    request.extensions["bewo_started"] = time.perf_counter()
+    request.extensions["bewo_started_ns"] = time.time_ns()
+    DB_REQUESTS.inc(request.method, _db_target(request))
+
+async def _on_db_response(response: httpx.Response) -> None:
+    request = response.request
+    started = request.extensions.get("bewo_started")
+    if started is not None:
+        DB_LATENCY.observe(time.perf_counter() - started, request.method)
+    if response.status_code >= 400:
+        DB_ERRORS.inc(request.method, _db_target(request))
+    started_ns = request.extensions.get("bewo_started_ns")
+    if started_ns is not None:
+        record_span(
+            f"db {request.method} {_db_target(request)}",
+            started_ns,
+            time.time_ns(),
+            {"db.system": "postgrest", "http.method": request.method, "http.status_code": response.status_code},
+            kind=SPAN_KIND_CLIENT,
+            error=f"HTTP {response.status_code}" if response.status_code >= 400 else None,
+        )
+
+def _get_async_http_client() -> httpx.AsyncClient:
+    """Get or create shared pooled httpx client cho PostgREST"""
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.SUPABASE_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SUPABASE_POOL_MAX_KEEPALIVE,
+            ),
+            timeout=settings.SUPABASE_HTTP_TIMEOUT,
+            # Đếm round trip + latency cho /metrics, span DB cho tracing
+            event_hooks={"request": [_on_db_request], "response": [_on_db_response]},
+        )
+    return _async_http_client
+
+def create_async_supabase_client() -> AsyncClient:
+    """
+    Tạo Supabase AsyncClient dùng chung HTTP pool.
+    Mọi `.execute()` phải được `await` → không block event loop.
+    """
+    print(f"Đang kết nối (async) đến Supabase tại: {settings.SUPABASE_URL[:50]}...")
+    client = AsyncClient(
+        settings.SUPABASE_URL,
+        settings.SUPABASE_SERVICE_KEY,
+        AsyncClientOptions(
+            httpx_client=_get_async_http_client(),
+            postgrest_client_timeout=settings.SUPABASE_HTTP_TIMEOUT,
+        ),
+    )
+    print("Khởi tạo Supabase async client thành công.")
+    return client
+
+def get_async_supabase_client() -> AsyncClient:
+    """Get or create singleton Supabase AsyncClient"""
+    global _async_supabase_client
+    if _async_supabase_client is None:
+        _async_supabase_client = create_async_supabase_client()
+    return _async_supabase_client
+
+async def close_async_supabase_client() -> None:
+    """Đóng HTTP pool khi shutdown server"""
+    global _async_http_client, _async_supabase_client
+    if _async_http_client is not None and not _async_http_client.is_closed:
+        await _async_http_client.aclose()
+    _async_http_client = None
+    _async_supabase_client = None
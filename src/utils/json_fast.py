@@ -0,0 +1,117 @@
+# ============================================
+# utils/json_fast.py - JSON nhanh (orjson, fallback stdlib json)
+# - dumps / dumps_bytes / loads dùng chung cho response, SSE, NDJSON, WebSocket
+# - FastJSONResponse: response class mặc định của app
+# - CharsetMiddleware: pure ASGI, force UTF-8 cho JSON
+# - StreamingSafeGZipMiddleware: gzip response thường, bỏ qua SSE / NDJSON stream
+# ============================================
+
+import json
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson là dependency tùy chọn
+    orjson = None
+
+if orjson is not None:
+    # NON_STR_KEYS: giữ hành vi của json stdlib với dict có key int (vd: size → stock)
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _default(obj: Any) -> Any:
+        # Decimal, UUID lạ... → chuỗi, giống `default=str`
+        return str(obj)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialize bằng orjson, luôn UTF-8 (tiếng Việt không bị escape)"""
+
+    media_type = "application/json; charset=utf-8"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+class CharsetMiddleware:
+    """
+    Force UTF-8 cho JSON (pure ASGI: chỉ sửa header của http.response.start,
+    không bọc body như BaseHTTPMiddleware → không ảnh hưởng SSE/NDJSON streaming)
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_charset(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if headers.get("content-type") == "application/json":
+                    headers["content-type"] = "application/json; charset=utf-8"
+            await send(message)
+
+        await self.app(scope, receive, send_with_charset)
+
+
+# GZipResponder giữ chunk trong buffer gzip tới cuối stream → client nhận mọi dòng cùng lúc.
+# Starlette chỉ bỏ qua text/event-stream; NDJSON (/chat/batch) cũng phải gửi từng dòng ngay.
+STREAMING_MEDIA_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+class _StreamingPassthrough:
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if content_type.startswith(STREAMING_MEDIA_TYPES):
+                self.content_type_is_excluded = True
+
+
+class _StreamingGZipResponder(_StreamingPassthrough, GZipResponder):
+    pass
+
+
+class _StreamingIdentityResponder(_StreamingPassthrough, IdentityResponder):
+    pass
+
+
+class StreamingSafeGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware nhưng không nén (và không buffer) các media type stream"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        responder: ASGIApp
+        if "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _StreamingGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        else:
+            responder = _StreamingIdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
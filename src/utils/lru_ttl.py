@@ -0,0 +1,94 @@
+# ============================================
+# utils/lru_ttl.py - LRU có TTL, giới hạn số key, single-flight cho loader
+# Dùng chung cho identity cache và product cache
+# - get_or_load(): nhiều caller cùng miss một key → chung MỘT lần load
+# - Chỉ cache giá trị khác rỗng (None / [] / "" → lần sau load lại)
+# - pop() / clear() tăng generation: load đang chạy lúc invalidate KHÔNG được put()
+#   (giá trị đọc trước khi dữ liệu đổi, cache lại sẽ sai suốt TTL)
+# ============================================
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LruTtlCache(Generic[K, V]):
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self._ttl = ttl_seconds
+        self._max_keys = max_keys
+        self._entries: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+        self._in_flight: Dict[K, asyncio.Future] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.joins = 0
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_keys:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        self._generation += 1
+        # Caller mới không join load cũ (có thể đã đọc dữ liệu trước khi đổi)
+        self._in_flight.pop(key, None)
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self) -> int:
+        self._generation += 1
+        self._in_flight.clear()
+        dropped = len(self._entries)
+        self._entries.clear()
+        return dropped
+
+    async def get_or_load(self, key: K, loader: Callable[[], Awaitable[Optional[V]]]) -> Optional[V]:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.joins += 1
+            return await asyncio.shield(in_flight)
+
+        self.misses += 1
+        generation = self._generation
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Không ai chờ → tránh "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+        if value and generation == self._generation:
+            self.put(key, value)
+        future.set_result(value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
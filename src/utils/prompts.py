@@ -3,6 +3,7 @@
 # Converted from TypeScript monolithic prompt to Python multi-agent architecture
 # ============================================
 
+import hashlib
 from typing import Dict, Any, List, Optional
 
 # ============================================
@@ -35,13 +36,15 @@ def _format_price(price: Optional[float]) -> str:
 
 
 # ============================================
-# SHARED CONTEXT BUILDER
+# STATIC PREFIX (provider-side prompt caching)
+# Gemini implicit caching / OpenAI prompt caching chỉ hit khi PREFIX của request
+# giống hệt từng byte giữa các turn → phần tĩnh (instructions của agent + thông tin
+# shop + nhân cách bot) nằm trong system instructions, dựng MỘT lần lúc import;
+# phần theo khách (sản phẩm, profile, địa chỉ, giỏ, lịch sử) chỉ nằm cuối tin nhắn.
+# KHÔNG đưa giá trị thay đổi theo turn (giờ, tên khách...) vào phần tĩnh.
 # ============================================
 
-def build_shared_context(context: Dict[str, Any]) -> str:
-    """Build context chung cho tất cả agents"""
-    
-    ctx = f"""
+SHARED_STATIC_CONTEXT = f"""
 ===== THÔNG TIN SHOP =====
 Tên: {STORE_INFO['name']}
 Mô tả: {STORE_INFO['description']}
@@ -59,7 +62,49 @@ Phong cách: {BOT_CONFIG['tone']}
 Emoji: {' '.join(BOT_CONFIG['allowed_emojis'])}
 """
 
-    # 1. CUSTOMER PROFILE
+
+def build_agent_instructions(agent_prompt: str) -> str:
+    """System instructions tĩnh của agent = prompt riêng + thông tin shop / nhân cách bot"""
+    return agent_prompt + "\n" + SHARED_STATIC_CONTEXT
+
+
+def prompt_fingerprint(text: str) -> str:
+    """Hash ngắn của prefix tĩnh (log lúc khởi động để phát hiện prefix bị đổi giữa các bản deploy)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+
+# ============================================
+# SHARED CONTEXT BUILDER
+# ============================================
+
+def build_shared_context(context: Dict[str, Any]) -> str:
+    """Build context chung cho tất cả agents (phần tĩnh + phần theo khách)"""
+    return SHARED_STATIC_CONTEXT + build_customer_context(context)
+
+
+def build_customer_context(context: Dict[str, Any]) -> str:
+    """
+    Phần động theo khách, nằm SAU prefix tĩnh.
+    Thứ tự từ ổn định nhất → thay đổi nhiều nhất (catalog → khách → giỏ → lịch sử)
+    để phần đầu tin nhắn cũng trùng giữa các turn càng dài càng tốt.
+    """
+    ctx = ""
+
+    # 1. PRODUCTS AVAILABLE (catalog, giống nhau giữa các khách)
+    if context.get("products") and len(context["products"]) > 0:
+        ctx += "\n🛍️ DANH SÁCH SẢN PHẨM (10 ĐẦU):\n"
+        for idx, p in enumerate(context["products"][:10], 1):
+            ctx += f"{idx}. {p.get('name')}\n"
+            ctx += f"   Giá: {_format_price(p.get('price'))}"
+            if p.get("stock") is not None:
+                if p["stock"] > 0:
+                    ctx += f" | Còn: {p['stock']} sp"
+                else:
+                    ctx += " | HẾT HÀNG"
+            ctx += f"\n   ID: {p.get('id')}\n"
+        ctx += "\n⚠️ CHỈ GỢI Ý sản phẩm PHÙ HỢP với nhu cầu khách!\n"
+
+    # 2. CUSTOMER PROFILE
     if context.get("profile"):
         ctx += "\n👤 THÔNG TIN KHÁCH HÀNG:\n"
         p = context["profile"]
@@ -76,7 +121,7 @@ Emoji: {' '.join(BOT_CONFIG['allowed_emojis'])}
     else:
         ctx += "\n👤 KHÁCH HÀNG: Khách mới (chưa có profile)\n"
 
-    # 2. SAVED ADDRESS
+    # 3. SAVED ADDRESS
     if context.get("saved_address") and context["saved_address"].get("address_line"):
         addr = context["saved_address"]
         ctx += "\n📍 ĐỊA CHỈ ĐÃ LƯU:\n"
@@ -93,31 +138,7 @@ Emoji: {' '.join(BOT_CONFIG['allowed_emojis'])}
     else:
         ctx += "\n📍 ĐỊA CHỈ: Chưa có → Cần hỏi KHI KHÁCH MUỐN ĐẶT HÀNG\n"
 
-    # 3. CONVERSATION HISTORY
-    if context.get("history") and len(context["history"]) > 0:
-        ctx += "\n📜 LỊCH SỬ HỘI THOẠI (5 TIN CUỐI):\n"
-        for msg in context["history"][-5:]:
-            role = "👤 KHÁCH" if msg.get("sender_type") == "customer" else "🤖 BOT"
-            text = msg.get("content", {}).get("text", "")
-            if text:
-                ctx += f"{role}: {text[:150]}\n"
-        ctx += "\n⚠️ ĐỌC KỸ LỊCH SỬ để hiểu ngữ cảnh và KHÔNG hỏi lại!\n"
-
-    # 4. PRODUCTS AVAILABLE
-    if context.get("products") and len(context["products"]) > 0:
-        ctx += "\n🛍️ DANH SÁCH SẢN PHẨM (10 ĐẦU):\n"
-        for idx, p in enumerate(context["products"][:10], 1):
-            ctx += f"{idx}. {p.get('name')}\n"
-            ctx += f"   Giá: {_format_price(p.get('price'))}"
-            if p.get("stock") is not None:
-                if p["stock"] > 0:
-                    ctx += f" | Còn: {p['stock']} sp"
-                else:
-                    ctx += " | HẾT HÀNG"
-            ctx += f"\n   ID: {p.get('id')}\n"
-        ctx += "\n⚠️ CHỈ GỢI Ý sản phẩm PHÙ HỢP với nhu cầu khách!\n"
-
-    # 5. CART
+    # 4. CART
     if context.get("cart") and len(context["cart"]) > 0:
         ctx += "\n🛒 GIỎ HÀNG HIỆN TẠI:\n"
         total = 0
@@ -126,12 +147,22 @@ Emoji: {' '.join(BOT_CONFIG['allowed_emojis'])}
             total += item.get("price", 0) * item.get("quantity", 1)
         ctx += f"\n💰 Tạm tính: {_format_price(total)}\n"
 
-    # 6. MEMORY FACTS (if any)
+    # 5. MEMORY FACTS (if any)
     if context.get("memory_facts") and len(context["memory_facts"]) > 0:
         ctx += "\n🧠 GHI NHỚ VỀ KHÁCH HÀNG:\n"
         for fact in context["memory_facts"][:5]:
             ctx += f"• {fact.get('fact', '')}\n"
 
+    # 6. CONVERSATION HISTORY (thay đổi mỗi turn → cuối cùng)
+    if context.get("history") and len(context["history"]) > 0:
+        ctx += "\n📜 LỊCH SỬ HỘI THOẠI (5 TIN CUỐI):\n"
+        for msg in context["history"][-5:]:
+            role = "👤 KHÁCH" if msg.get("sender_type") == "customer" else "🤖 BOT"
+            text = msg.get("content", {}).get("text", "")
+            if text:
+                ctx += f"{role}: {text[:150]}\n"
+        ctx += "\n⚠️ ĐỌC KỸ LỊCH SỬ để hiểu ngữ cảnh và KHÔNG hỏi lại!\n"
+
     return ctx
 
 
@@ -671,9 +702,10 @@ async def build_full_prompt_with_context(
     Tương đương với buildFullPrompt() trong TypeScript
     """
     
-    shared_context = build_shared_context(context)
+    # Shop / nhân cách bot đã nằm trong system instructions (prefix tĩnh, xem build_agent_instructions)
+    customer_context = build_customer_context(context)
     
-    prompt = f"""{shared_context}
+    prompt = f"""{customer_context}
 
 👤 TIN NHẮN CỦA KHÁCH: "{user_message}"
 
@@ -717,6 +749,10 @@ __all__ = [
     'get_support_agent_prompt',
     'build_full_prompt_with_context',
     'build_shared_context',
+    'build_customer_context',
+    'build_agent_instructions',
+    'prompt_fingerprint',
+    'SHARED_STATIC_CONTEXT',
     'get_agent_prompt',
     'BOT_CONFIG',
     'STORE_INFO'
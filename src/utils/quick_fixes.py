@@ -5,7 +5,7 @@
 
 from typing import List, Dict, Any, Optional
 import re
-from agent.agent_service import validate_address_function_call
+from .structured_logger import get_logger
 
 # ============================================
 # 1. RESPONSE TYPE CLASSIFICATION (FIX)
@@ -293,7 +293,11 @@ def detect_product_id_from_context(
 # ============================================
 
 class ChatbotLogger:
-    """Structured logging cho chatbot"""
+    """
+    Structured logging cho chatbot.
+    Ghi qua structured_logger: không block (hàng đợi + thread nền), JSON,
+    level + sampling theo event, tự che SĐT / địa chỉ.
+    """
     
     @staticmethod
     def log_message(
@@ -314,18 +318,7 @@ class ChatbotLogger:
             duration_ms=1234
         )
         """
-        import json
-        from datetime import datetime
-        
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "level": level.upper(),
-            "event": event,
-            "conversation_id": conversation_id,
-            **kwargs
-        }
-        
-        print(json.dumps(log_entry, ensure_ascii=False))
+        get_logger("chatbot").log(level, event, conversation_id=conversation_id, **kwargs)
     
     @staticmethod
     def log_function_call(
@@ -454,6 +447,8 @@ def optimize_context_size(
 
 def test_address_validation():
     """Test address validation"""
+    from ..agent.agent_service import validate_address_function_call
+
     test_cases = [
         ("123 Nguyễn Trãi", "Hà Nội", True),
         ("áo vest cao cấp", "Hà Nội", False),
@@ -0,0 +1,235 @@
+# ============================================
+# utils/structured_logger.py - Logger có cấu trúc, không block event loop
+# - log.info("event", key=value, ...) chỉ đưa record vào hàng đợi (put_nowait)
+# - Thread nền redact PII (SĐT, địa chỉ, nội dung tin nhắn), serialize JSON và ghi stdout theo lô
+# - Level (LOG_LEVEL), sampling theo event (LOG_SAMPLE_RATES="tool_call=0.1,...")
+# - Tự gắn trace_id của turn (tracing_service)
+# - Hàng đợi đầy → bỏ record và đếm (không bao giờ chặn request)
+#
+# Dùng:
+#   from ..utils.structured_logger import get_logger
+#   log = get_logger("chat")
+#   log.info("chat_request", conversation_key=key, text=message_text)
+# ============================================
+
+import hashlib
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, TypedDict
+
+from ..config.env import settings
+from ..services.tracing_service import current_trace_id
+from .json_fast import dumps
+
+LEVELS: Dict[str, int] = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+# SĐT Việt Nam: 0xxxxxxxxx, 84xxxxxxxxx, +84 xxx xxx xxx
+_PHONE_PATTERN = re.compile(r"(?<!\d)(?:\+?84|0)(?:[\s.-]?\d){8,10}(?!\d)")
+
+# Field chứa PII → che toàn bộ giá trị (SĐT giữ 3 số cuối để support đối chiếu)
+_PHONE_KEYS = {"phone", "customer_phone", "phone_number", "shipping_phone"}
+_ADDRESS_KEYS = {
+    "address", "address_line", "full_address", "shipping_address", "shipping_address_line", "street",
+    "ward", "shipping_ward", "saved_address", "address_data",
+    "full_name", "customer_name", "shipping_name", "email",
+}
+# Nội dung khách tự gõ (có thể chứa tên, địa chỉ không theo mẫu nào) → chỉ ghi độ dài + hash
+# (hash giống nhau = cùng một tin, đủ để đối chiếu tin gửi lặp / trùng)
+_TEXT_KEYS = {"text", "message_text"}
+_REDACTED = "[redacted]"
+
+
+class LoggerStats(TypedDict):
+    level: str
+    queued: int
+    written: int
+    dropped: int
+    sampled_out: int
+
+
+def _mask_phone(value: str) -> str:
+    digits = re.sub(r"\D", "", value)
+    return "*" * max(0, len(digits) - 3) + digits[-3:] if digits else _REDACTED
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Che PII trong giá trị log (đệ quy dict / list, quét SĐT trong text tự do)"""
+    if key is not None:
+        lowered = key.lower()
+        if lowered in _PHONE_KEYS and value:
+            return _mask_phone(str(value))
+        if lowered in _ADDRESS_KEYS and value:
+            return _REDACTED
+        if lowered in _TEXT_KEYS and isinstance(value, str) and value:
+            digest = hashlib.sha1(value.encode("utf-8")).hexdigest()[:10]
+            return f"[redacted chars={len(value)} sha1={digest}]"
+    if isinstance(value, str):
+        return _PHONE_PATTERN.sub(lambda m: _mask_phone(m.group(0)), value)
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+
+def _parse_sample_rates(raw: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for pair in raw.split(","):
+        if "=" not in pair:
+            continue
+        event, rate = pair.split("=", 1)
+        try:
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class _LogWriter:
+    """Thread nền: lấy record từ hàng đợi, redact + format, ghi stdout theo lô"""
+
+    def __init__(self, max_queue: int, json_format: bool, redact_pii: bool):
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._json_format = json_format
+        self._redact_pii = redact_pii
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.written = 0
+        self.dropped = 0
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            batch: List[Optional[Dict[str, Any]]] = [record]
+            # Gom các record đang chờ → một lần write + flush
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [self._format(r) for r in batch if r is not None]
+            if lines:
+                try:
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
+                    self.written += len(lines)
+                except Exception:
+                    self.dropped += len(lines)
+            if None in batch:
+                return
+
+    def _format(self, record: Dict[str, Any]) -> str:
+        try:
+            if self._redact_pii:
+                record = redact(record)
+            record["timestamp"] = datetime.fromtimestamp(record["timestamp"], timezone.utc).isoformat()
+            if self._json_format:
+                return dumps(record)
+            fields = " ".join(
+                f"{k}={v}" for k, v in record.items()
+                if k not in ("timestamp", "level", "logger", "event") and v is not None
+            )
+            return f"{record['timestamp']} {record['level']:<7} [{record['logger']}] {record['event']} {fields}".rstrip()
+        except Exception as e:
+            # Record chứa object bị sửa đồng thời / không serialize được
+            return f'{{"level":"ERROR","event":"log_format_failed","error":"{type(e).__name__}"}}'
+
+
+class StructuredLogger:
+    def __init__(self, name: str):
+        self.name = name
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self.log("DEBUG", event, **fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self.log("INFO", event, **fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.log("WARNING", event, **fields)
+
+    def error(self, event: str, **fields: Any) -> None:
+        self.log("ERROR", event, **fields)
+
+    def log(self, level: str, event: str, **fields: Any) -> None:
+        level = level.upper()
+        if LEVELS.get(level, 20) < _min_level:
+            return
+        # Sampling chỉ áp dụng cho log dưới WARNING (lỗi luôn được ghi)
+        rate = _sample_rates.get(event)
+        if rate is not None and LEVELS.get(level, 20) < LEVELS["WARNING"] and random.random() >= rate:
+            global _sampled_out
+            _sampled_out += 1
+            return
+
+        record: Dict[str, Any] = {
+            "timestamp": time.time(),
+            "level": level,
+            "logger": self.name,
+            "event": event,
+        }
+        trace_id = current_trace_id()
+        if trace_id:
+            record["trace_id"] = trace_id
+        record.update(fields)
+        _writer.submit(record)
+
+
+_min_level = LEVELS.get(settings.LOG_LEVEL.upper(), LEVELS["INFO"])
+_sample_rates = _parse_sample_rates(settings.LOG_SAMPLE_RATES)
+_sampled_out = 0
+_writer = _LogWriter(
+    max_queue=settings.LOG_QUEUE_MAX_SIZE,
+    json_format=settings.LOG_FORMAT.lower() == "json",
+    redact_pii=settings.LOG_REDACT_PII,
+)
+_loggers: Dict[str, StructuredLogger] = {}
+
+
+def get_logger(name: str) -> StructuredLogger:
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = StructuredLogger(name)
+    return logger
+
+
+def shutdown_logging(timeout: float = 5.0) -> None:
+    """Ghi nốt log còn trong hàng đợi (gọi khi shutdown server)"""
+    _writer.shutdown(timeout)
+
+
+def stats() -> LoggerStats:
+    return {
+        "level": settings.LOG_LEVEL.upper(),
+        "queued": _writer._queue.qsize(),
+        "written": _writer.written,
+        "dropped": _writer.dropped,
+        "sampled_out": _sampled_out,
+    }